@@ -0,0 +1,88 @@
+"""
+Reports the memory used by rows returned by ``dtuple.fetchrows`` and the
+time taken to access their values by index, column name, attribute and
+as a mapping.
+
+Usage: python benchmarks/dtuple_rows.py [row_count]
+
+No database is required - rows are fetched from an in-memory cursor.
+Memory use is measured from the process's resident set size, so is
+only reported on Linux.
+"""
+import datetime
+import gc
+import os
+import sys
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from djangoffice.utils.dtuple import fetchrows
+
+class Cursor:
+    """
+    Provides the DB-API cursor interface used by ``fetchrows`` for rows
+    of Time Entry-like data.
+    """
+    description = [(name, None, None, None, None, None, None) for name in
+                   ('id', 'user', 'job', 'task', 'date', 'hours')]
+
+    def __init__(self, count):
+        self.count = count
+
+    def fetchall(self):
+        date = datetime.date(2007, 7, 23)
+        return [(i, u'User %s' % (i % 20), u'%05d' % (i % 100),
+                 u'Task %s' % (i % 50), date, Decimal('7.5')) \
+                for i in xrange(self.count)]
+
+def get_resident_size():
+    try:
+        statm = open('/proc/self/statm').read().split()
+    except IOError:
+        return None
+    return int(statm[1]) * os.sysconf('SC_PAGE_SIZE')
+
+def time_access(rows, access):
+    start = time.time()
+    for row in rows:
+        access(row)
+    return time.time() - start
+
+def measure(fetch, count):
+    """
+    Returns a two-tuple of the rows fetched by ``fetch`` and the memory
+    used per row in bytes.
+    """
+    gc.collect()
+    before = get_resident_size()
+    rows = fetch()
+    gc.collect()
+    after = get_resident_size()
+    if before is None:
+        return rows, None
+    return rows, float(after - before) / count
+
+def main(count):
+    cursor = Cursor(count)
+    plain_rows, plain_size = measure(cursor.fetchall, count)
+    del plain_rows
+    start = time.time()
+    rows, row_size = measure(lambda: fetchrows(cursor), count)
+    fetch_time = time.time() - start
+
+    print '%s rows' % count
+    print '       fetchrows: %.3fs' % fetch_time
+    if row_size is not None:
+        print '      memory/row: %.0f bytes (%.0f bytes as plain tuples)' % (
+            row_size, plain_size)
+    for name, access in (('index', lambda row: row[5]),
+                         ('column name', lambda row: row['hours']),
+                         ('attribute', lambda row: row.hours),
+                         ('asMapping', lambda row: row.asMapping()),
+                         ('asTuple', lambda row: row.asTuple())):
+        print '%16s: %.3fs' % (name, time_access(rows, access))
+
+if __name__ == '__main__':
+    main(len(sys.argv) > 1 and int(sys.argv[1]) or 100000)
@@ -0,0 +1,110 @@
+"""
+Compares the bulk invoice cost calculation with the per-day calculation
+it replaced, on randomly generated Time Entries.
+
+Usage: python benchmarks/invoice_costs.py [entry_count]
+
+No database is required - rates and Time Entries are generated in
+memory.
+"""
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'djangoffice.settings')
+
+from djangoffice.utils.invoice import (CostCalculation, HoursAndCost,
+    RateNotFound, TimeEntryColumns, from_units)
+from djangoffice.utils.time_entries import weekly_to_daily_entries
+from rate_lookup import GeneratedRateLookup, generate_rates
+
+USERS = 50
+TASKS = 400
+WEEKS = 104
+FIRST_WEEK = date(2006, 1, 2)
+
+class Row:
+    """Stands in for a ``TimeEntry`` instance."""
+    def __init__(self, values):
+        for field, value in zip(TimeEntryColumns.FIELDS, values):
+            setattr(self, field, value)
+
+def generate_rows(count):
+    hour_choices = [0] * 4 + range(50, 850, 50) # Hundredths of an hour
+    rows = []
+    for i in xrange(1, count + 1):
+        task_id = random.randint(1, TASKS)
+        week_commencing = FIRST_WEEK + timedelta(weeks=random.randint(0, WEEKS - 1))
+        hours = [random.choice(hour_choices) for day in xrange(5)] + \
+                [0, 0, random.choice(hour_choices[:8])]
+        rows.append((i, task_id % 20, random.randint(1, USERS), task_id,
+                     task_id % 30, week_commencing) + tuple(hours))
+    return rows
+
+def per_day_calculation(time_entries, rate_lookup):
+    """
+    The per-day calculation previously performed by
+    ``InvoiceTimeCalculation.calculate``.
+    """
+    calculation = CostCalculation()
+    for entry in weekly_to_daily_entries(time_entries):
+        rate = rate_lookup.get_applicable_rate(entry.user_id, entry.date)
+        if rate is None:
+            raise RateNotFound(u'An applicable billing rate could not be found.')
+        rate_amount = entry.overtime and rate.overtime_rate or rate.standard_rate
+        cost = entry.hours * rate_amount
+        calculation.total_hours += entry.hours
+        calculation.total_cost += cost
+        calculation.by_task.setdefault(entry.task_id,
+                                       HoursAndCost()).add(entry.hours, cost)
+        calculation.by_user_and_task.setdefault(entry.user_id, {}) \
+            .setdefault(entry.task_id, HoursAndCost()).add(entry.hours, cost)
+        calculation.by_date_and_user.setdefault(entry.date, {}) \
+            .setdefault(entry.user_id, HoursAndCost()).add(entry.hours, cost)
+    return calculation
+
+def flatten(calculation):
+    """
+    Creates a comparable representation of a calculation's results.
+    """
+    def totals(nested):
+        if isinstance(nested, HoursAndCost):
+            return (nested.hours, nested.cost)
+        return dict([(k, totals(v)) for k, v in nested.iteritems()])
+    return (calculation.total_hours, calculation.total_cost,
+            totals(calculation.by_task), totals(calculation.by_user_and_task),
+            totals(calculation.by_date_and_user))
+
+def main(count):
+    random.seed(count)
+    rate_lookup = GeneratedRateLookup(generate_rates(USERS, FIRST_WEEK, 2))
+    rows = generate_rows(count)
+    # The per-day calculation works with Decimal hours, as loaded with
+    # Time Entry instances.
+    time_entries = [Row(row[:6] + tuple([from_units(hours) \
+                                         for hours in row[6:]])) \
+                    for row in rows]
+
+    start = time.time()
+    per_day = per_day_calculation(time_entries, rate_lookup)
+    per_day_time = time.time() - start
+
+    start = time.time()
+    bulk = CostCalculation()
+    bulk.add(TimeEntryColumns(rows), rate_lookup, u'U')
+    bulk_time = time.time() - start
+
+    print '%s Time Entries, %s hours, cost %s' % (count, bulk.total_hours,
+                                                  bulk.total_cost)
+    print 'Per-day: %.3fs' % per_day_time
+    print 'Bulk:    %.3fs (%.1fx)' % (bulk_time, per_day_time / bulk_time)
+    if flatten(per_day) != flatten(bulk):
+        print 'Results differ!'
+        sys.exit(1)
+    print 'Results are identical.'
+
+if __name__ == '__main__':
+    main(len(sys.argv) > 1 and int(sys.argv[1]) or 100000)
@@ -0,0 +1,72 @@
+"""
+Reports Invoice PDF rendering throughput in pages per second for
+different numbers of worker processes.
+
+Usage: python benchmarks/invoice_pdfs.py [invoice_count]
+
+No database is required - Invoice data is generated in memory.
+"""
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from multiprocessing import cpu_count
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'djangoffice.settings')
+
+from djangoffice.pdf import render_invoices
+
+def generate_invoice_data(number):
+    """
+    Generates data for a month's Invoice for a Job with a few Users
+    booking time against a dozen or so Tasks.
+    """
+    users = [u'User %s' % i for i in xrange(random.randint(2, 6))]
+    tasks = [u'Task %s' % i for i in xrange(random.randint(5, 20))]
+    cost = lambda hours: hours * Decimal('45.00')
+    by_user = [(user, [(task, Decimal(random.randint(1, 40)),
+                        cost(random.randint(1, 40))) \
+                       for task in random.sample(tasks, len(tasks) / 2)]) \
+               for user in users]
+    start = date(2007, 7, 1)
+    by_date = []
+    for day in xrange(31):
+        for user in users:
+            if random.random() < 0.7:
+                hours = Decimal(random.randint(1, 8))
+                by_date.append((start + timedelta(days=day), user, hours,
+                                cost(hours)))
+    total_hours = sum([hours for d, u, hours, c in by_date])
+    return {
+        'company_name': u'Generitech', 'number': u'%05d' % number,
+        'date': date(2007, 8, 1), 'job': u'%05d - Job' % number,
+        'client': u'Client', 'contact': u'Contact', 'currency_symbol': u'\xa3',
+        'start_period': start, 'end_period': date(2007, 7, 31),
+        'by_task': [(task, Decimal(10), cost(10)) for task in tasks],
+        'by_user': by_user,
+        'by_date': by_date,
+        'total_hours': total_hours, 'total_cost': cost(total_hours),
+        'expenses_total': Decimal(0), 'amount': cost(total_hours),
+    }
+
+def main(count):
+    random.seed(count)
+    data = [generate_invoice_data(i) for i in xrange(1, count + 1)]
+    process_counts = [1, 2, 4]
+    if cpu_count() not in process_counts:
+        process_counts.append(cpu_count())
+    print '%s Invoices, %s CPUs' % (count, cpu_count())
+    for processes in process_counts:
+        start = time.time()
+        pages = sum([page_count for content, page_count \
+                     in render_invoices(data, processes)])
+        seconds = time.time() - start
+        print '%2s worker%s: %s pages in %.2fs, %.1f pages/second' % (
+            processes, processes != 1 and 's' or ' ', pages, seconds,
+            pages / seconds)
+
+if __name__ == '__main__':
+    main(len(sys.argv) > 1 and int(sys.argv[1]) or 200)
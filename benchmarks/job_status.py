@@ -0,0 +1,164 @@
+"""
+Compares loading the Job Status report from the maintained Task totals
+with summing each Task's Time Entries in a query per Task, as a report
+built on ``Task.total_time_booked`` would.
+
+Usage: python benchmarks/job_status.py [job_count]
+
+A temporary SQLite database is created holding the given number of live
+Jobs (1,000 by default), each with 20 Tasks and 5 Time Entries per
+Task.
+"""
+import datetime
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'djangoffice.settings')
+
+from django.conf import settings
+
+DATABASE_DIR = tempfile.mkdtemp()
+settings.DATABASES['default'].update({
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': os.path.join(DATABASE_DIR, 'benchmark.db'),
+})
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection, transaction
+
+from djangoffice.models import (Client, Job, Task, TaskTotal, TaskType,
+    TimeEntry, Timesheet, UserRate, time_entry_hours_sql, to_hours)
+from djangoffice.utils.reports import get_job_status
+
+TASKS_PER_JOB = 20
+ENTRIES_PER_TASK = 5
+USERS = 20
+FIRST_WEEK = datetime.date(2007, 1, 1)
+
+def insert_objects(model, objects):
+    """
+    Inserts unsaved model instances in a single statement.
+    """
+    qn = connection.ops.quote_name
+    opts = model._meta
+    fields = [f for f in opts.local_fields if f is not opts.pk]
+    connection.cursor().executemany('INSERT INTO %s (%s) VALUES (%s)' % (
+        qn(opts.db_table), ', '.join([qn(f.column) for f in fields]),
+        ', '.join(['%s'] * len(fields))),
+        [[f.get_db_prep_save(f.pre_save(obj, True), connection=connection) \
+          for f in fields] for obj in objects])
+
+def create_data(job_count):
+    random.seed(job_count)
+    users = [User.objects.create(username='user%s' % i) for i in xrange(USERS)]
+    for user in users:
+        UserRate.objects.create(user=user, effective_from=FIRST_WEEK,
+            standard_rate='%s.00' % random.randint(20, 60),
+            overtime_rate='%s.00' % random.randint(30, 90))
+    task_types = [TaskType.objects.create(name=u'Task Type %s' % i) \
+                  for i in xrange(TASKS_PER_JOB)]
+    timesheets = {}
+    for user in users:
+        for week in xrange(52):
+            week_commencing = FIRST_WEEK + datetime.timedelta(weeks=week)
+            timesheets[user.pk, week_commencing] = Timesheet.objects.create(
+                user=user, week_commencing=week_commencing).pk
+
+    client = Client.objects.create(name=u'Client')
+    now = datetime.datetime.now()
+    insert_objects(Job, [Job(client=client, name=u'Job %s' % i, number=i,
+        status=Job.LIVE_STATUS, director_id=1, project_manager_id=1,
+        architect_id=1, primary_contact_id=1, billing_contact_id=1,
+        fee_currency=Job.GBP_CURRENCY, created_at=now) \
+        for i in xrange(1, job_count + 1)])
+    insert_objects(Task, [Task(job_id=job_id, task_type=task_type,
+        estimate_hours='%s.00' % random.randint(10, 200)) \
+        for job_id in Job.objects.values_list('pk', flat=True) \
+        for task_type in task_types])
+    entries = []
+    for task_id in Task.objects.values_list('pk', flat=True):
+        for i in xrange(ENTRIES_PER_TASK):
+            user = random.choice(users)
+            week_commencing = FIRST_WEEK + \
+                datetime.timedelta(weeks=random.randint(0, 51))
+            hours = ['%s.00' % random.randint(0, 8) for day in xrange(5)]
+            entries.append(TimeEntry(
+                timesheet_id=timesheets[user.pk, week_commencing],
+                user=user, task_id=task_id, week_commencing=week_commencing,
+                mon=hours[0], tue=hours[1], wed=hours[2], thu=hours[3],
+                fri=hours[4], sat='0.00', sun='0.00',
+                overtime='%s.00' % random.randint(0, 2)))
+    insert_objects(TimeEntry, entries)
+    return len(entries)
+create_data = transaction.commit_on_success(create_data)
+
+def per_task_report(jobs):
+    """
+    Sums hours booked with a query per Task.
+    """
+    qn = connection.ops.quote_name
+    opts = TimeEntry._meta
+    query = 'SELECT SUM(%s) FROM %s WHERE %s = %%s' % (
+        time_entry_hours_sql(), qn(opts.db_table),
+        qn(opts.get_field('task').column))
+    cursor = connection.cursor()
+    total = 0
+    for task_id in Task.objects.filter(job__in=jobs) \
+                                .values_list('pk', flat=True):
+        cursor.execute(query, [task_id])
+        total += to_hours(cursor.fetchone()[0])
+    return total
+
+def main(job_count):
+    try:
+        call_command('syncdb', interactive=False, verbosity=0)
+        start = time.time()
+        entry_count = create_data(job_count)
+        print '%s Jobs, %s Tasks, %s Time Entries created in %.1fs' % (
+            job_count, job_count * TASKS_PER_JOB, entry_count,
+            time.time() - start)
+
+        start = time.time()
+        transaction.commit_on_success(TaskTotal.objects.rebuild)()
+        print 'Totals rebuilt in %.2fs' % (time.time() - start)
+
+        jobs = Job.objects.filter(status=Job.LIVE_STATUS)
+        old_debug = settings.DEBUG
+        settings.DEBUG = True
+        try:
+            connection.queries = []
+            start = time.time()
+            per_task_total = per_task_report(jobs)
+            per_task_time = time.time() - start
+            per_task_queries = len(connection.queries)
+
+            connection.queries = []
+            start = time.time()
+            job_statuses, totals = get_job_status(jobs)
+            rollup_time = time.time() - start
+            rollup_queries = len(connection.queries)
+        finally:
+            settings.DEBUG = old_debug
+
+        print 'Per-Task sums: %.3fs, %s queries (hours only)' % (
+            per_task_time, per_task_queries)
+        print 'Task totals:   %.3fs, %s queries (%.1fx)' % (
+            rollup_time, rollup_queries, per_task_time / rollup_time)
+        print '%s hours booked, cost %s' % (totals.booked_hours,
+                                            totals.booked_cost)
+        if per_task_total != totals.booked_hours:
+            print 'Results differ!'
+            sys.exit(1)
+        print 'Results are identical.'
+    finally:
+        connection.close()
+        shutil.rmtree(DATABASE_DIR)
+
+if __name__ == '__main__':
+    main(len(sys.argv) > 1 and int(sys.argv[1]) or 1000)
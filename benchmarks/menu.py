@@ -0,0 +1,55 @@
+"""
+Reports the time taken to render the ``menu`` template tag with cached
+menu items, and with the cache cleared before every render, as it would
+be if it were invalidated on every request.
+
+Usage: python benchmarks/menu.py [render_count]
+
+No database is required - Users and their profiles are created in
+memory.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'djangoffice.settings')
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.template import Context, Template
+
+from djangoffice.menu import clear_menu_cache
+from djangoffice.models import UserProfile
+
+MENU_TEMPLATE = Template('{% load menu %}{% menu "manage" "jobs" %}')
+
+def create_user(role):
+    """
+    Creates a User with the given role, as loaded for a new request.
+    """
+    if role is None:
+        return AnonymousUser()
+    user = User(id=1, username=u'user')
+    user._profile_cache = UserProfile(user=user, role=role)
+    return user
+
+def render_menus(count, cached):
+    roles = [None] + [role for role, label in UserProfile.ROLE_CHOICES]
+    clear_menu_cache()
+    start = time.time()
+    for i in xrange(count):
+        if not cached:
+            clear_menu_cache()
+        MENU_TEMPLATE.render(Context({'user': create_user(roles[i % len(roles)])}))
+    return time.time() - start
+
+def main(count):
+    print '%s menu renders' % count
+    uncached = render_menus(count, False)
+    print '  cleared: %.2fs, %.0f renders/second' % (uncached, count / uncached)
+    cached = render_menus(count, True)
+    print '   cached: %.2fs, %.0f renders/second (%.1fx)' % (cached,
+        count / cached, uncached / cached)
+
+if __name__ == '__main__':
+    main(len(sys.argv) > 1 and int(sys.argv[1]) or 10000)
@@ -0,0 +1,112 @@
+"""
+Compares RateLookup with the linear scan through each object's rates it
+previously performed, over realistic rate histories.
+
+Usage: python benchmarks/rate_lookup.py [lookup_count]
+
+No database is required - rates are generated in memory.
+"""
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'djangoffice.settings')
+
+from djangoffice.models import UserRate
+from djangoffice.utils.rates import RateLookup
+
+USERS = 50
+FIRST_DATE = date(2000, 1, 3)
+YEARS = 10
+
+def generate_rates(users=USERS, first_date=FIRST_DATE, years=YEARS):
+    """
+    Generates rates for each User which change every two to six months,
+    on arbitrary days of the week.
+    """
+    rates = []
+    last_date = first_date + timedelta(days=years * 365)
+    pk = 1
+    for user_id in xrange(1, users + 1):
+        effective_from = first_date
+        while effective_from < last_date:
+            standard_rate = Decimal(random.randint(2000, 9000)) / 100
+            rates.append(UserRate(id=pk, user_id=user_id,
+                effective_from=effective_from, standard_rate=standard_rate,
+                overtime_rate=(standard_rate * Decimal('1.5')).quantize(
+                    Decimal('0.01')),
+                editable=random.random() < 0.5))
+            effective_from += timedelta(days=random.randint(60, 200))
+            pk += 1
+    rates.sort(key=lambda rate: rate.effective_from)
+    return rates
+
+class GeneratedRateLookup(RateLookup):
+    """
+    A lookup for generated User rates.
+    """
+    def __init__(self, rates):
+        self.generated_rates = rates
+        RateLookup.__init__(self, UserRate, 'user')
+
+    def get_rates(self):
+        return self.generated_rates
+
+class ScanningRateLookup(GeneratedRateLookup):
+    """
+    Looks up rates by scanning through every rate for an object.
+    """
+    def get_applicable_rate(self, rated_instance_pk, date):
+        applicable_rate = None
+        for rate in self._lookup.get(rated_instance_pk, ((), ()))[1]:
+            if rate.effective_from > date:
+                break
+            applicable_rate = rate
+        if (applicable_rate is not None and
+            applicable_rate.editable and
+            applicable_rate not in self.editable_rates_used):
+            self.editable_rates_used.append(applicable_rate)
+        return applicable_rate
+
+def generate_lookups(count):
+    """
+    Generates lookups for each day of randomly chosen User weeks, in the
+    order in which they would be made when costing Time Entries.
+    """
+    lookups = []
+    for i in xrange(count / 7):
+        user_id = random.randint(1, USERS)
+        week_commencing = FIRST_DATE + timedelta(weeks=random.randint(0, YEARS * 52 - 1))
+        for day in xrange(7):
+            lookups.append((user_id, week_commencing + timedelta(days=day)))
+    return lookups
+
+def run(rate_lookup, lookups):
+    get_applicable_rate = rate_lookup.get_applicable_rate
+    start = time.time()
+    results = [get_applicable_rate(user_id, date) for user_id, date in lookups]
+    return time.time() - start, results
+
+def main(count):
+    random.seed(count)
+    rates = generate_rates()
+    lookups = generate_lookups(count)
+
+    scanning_time, scanning_results = run(ScanningRateLookup(rates), lookups)
+    bisect_time, bisect_results = run(GeneratedRateLookup(rates), lookups)
+
+    print '%s rates, %s lookups' % (len(rates), len(lookups))
+    print 'Scanning: %.3fs' % scanning_time
+    print 'Bisect:   %.3fs (%.1fx)' % (bisect_time, scanning_time / bisect_time)
+    if [id(rate) for rate in scanning_results] != \
+       [id(rate) for rate in bisect_results]:
+        print 'Results differ!'
+        sys.exit(1)
+    print 'Results are identical.'
+
+if __name__ == '__main__':
+    main(len(sys.argv) > 1 and int(sys.argv[1]) or 70000)
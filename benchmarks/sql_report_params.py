@@ -0,0 +1,108 @@
+"""
+Reports the latency of repeatedly executing a SQL Report with varying
+parameter values, with the values interpolated into the query text as
+they were previously, and bound to the report's compiled query.
+
+Usage: python benchmarks/sql_report_params.py [execution_count]
+
+A temporary SQLite database is created with a table of Time Entry-like
+rows for the report to query.
+"""
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'djangoffice.settings')
+
+from django.conf import settings
+
+DATABASE_DIR = tempfile.mkdtemp()
+settings.DATABASES['default'].update({
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': os.path.join(DATABASE_DIR, 'benchmark.db'),
+})
+
+from django.db import connection
+
+from djangoffice.models import SQLReport
+
+START_DATE = datetime.date(2007, 1, 1)
+
+REPORT = SQLReport(query=u"""
+SELECT e.user_id AS 'User', SUM(e.hours) AS 'Hours'
+FROM benchmark_entry e
+WHERE e.date >= '::FromDate'
+  AND e.date <= '::ToDate'
+  AND e.task_id = ::TaskId
+GROUP BY e.user_id
+ORDER BY e.user_id""")
+
+def create_entries(count):
+    cursor = connection.cursor()
+    cursor.execute("""
+        CREATE TABLE benchmark_entry (
+            id integer NOT NULL PRIMARY KEY,
+            user_id integer NOT NULL,
+            task_id integer NOT NULL,
+            date date NOT NULL,
+            hours decimal NOT NULL
+        )""")
+    cursor.executemany("""
+        INSERT INTO benchmark_entry (user_id, task_id, date, hours)
+        VALUES (%s, %s, %s, %s)""",
+        [(i % 20, i % 50, START_DATE + datetime.timedelta(days=i % 365),
+          '7.5') for i in xrange(count)])
+    cursor.execute('CREATE INDEX benchmark_entry_task_id '
+                   'ON benchmark_entry (task_id, date)')
+    connection._commit()
+
+def get_params(i):
+    from_date = START_DATE + datetime.timedelta(days=i % 300)
+    return {
+        u'FromDate': unicode(from_date),
+        u'ToDate': unicode(from_date + datetime.timedelta(days=30)),
+        u'TaskId': unicode(i % 50),
+    }
+
+def interpolated(cursor, params):
+    query = REPORT.query
+    for param, value in params.items():
+        query = query.replace(u'::%s' % param, value)
+    cursor.execute(query.replace(u'%', u'%%'))
+    return cursor.fetchall()
+
+def bound(cursor, params):
+    query, query_params = REPORT.get_bound_query(params)
+    cursor.execute(query, query_params)
+    return cursor.fetchall()
+
+def time_executions(execute, count):
+    cursor = connection.cursor()
+    timings = []
+    for i in xrange(count):
+        params = get_params(i)
+        start = time.time()
+        execute(cursor, params)
+        timings.append(time.time() - start)
+    timings.sort()
+    return sum(timings), timings[len(timings) / 2]
+
+def main(count):
+    try:
+        create_entries(10000)
+        print '%s executions with varying parameters' % count
+        for name, execute in (('interpolated', interpolated),
+                              ('bound', bound)):
+            total, median = time_executions(execute, count)
+            print '%12s: %.2fs, median %.3fms per execution' % (name, total,
+                median * 1000)
+    finally:
+        connection.close()
+        shutil.rmtree(DATABASE_DIR)
+
+if __name__ == '__main__':
+    main(len(sys.argv) > 1 and int(sys.argv[1]) or 5000)
@@ -0,0 +1,121 @@
+"""
+Compares streaming the Timesheet Status report from a single grouped
+query with opening each User's Timesheet for each week and adding up
+its Time Entries.
+
+Usage: python benchmarks/timesheet_status.py [user_count]
+
+A temporary SQLite database is created (as in ``job_status.py``) holding
+the given number of Users (300 by default), each of whom has a Timesheet
+with five Time Entries for most weeks of a year.
+"""
+import datetime
+import random
+import shutil
+import sys
+import time
+from decimal import Decimal
+
+from job_status import DATABASE_DIR, insert_objects
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection, transaction
+
+from djangoffice.models import (Client, Job, Task, TaskType, TimeEntry,
+    Timesheet)
+from djangoffice.utils.reports import get_timesheet_status
+
+WEEKS = 52
+ENTRIES_PER_TIMESHEET = 5
+FIRST_WEEK = datetime.date(2007, 1, 1)
+HOURS_PER_FULL_WEEK = Decimal('37.50')
+
+def create_data(user_count):
+    random.seed(user_count)
+    now = datetime.datetime.now()
+    insert_objects(User, [User(username='user%s' % i, date_joined=now,
+        last_login=now) for i in xrange(user_count)])
+    user_ids = list(User.objects.values_list('pk', flat=True))
+    client = Client.objects.create(name=u'Client')
+    job = Job.objects.create(client=client, name=u'Job', number=1,
+        status=Job.LIVE_STATUS, director_id=1, project_manager_id=1,
+        architect_id=1, primary_contact_id=1, billing_contact_id=1,
+        fee_currency=Job.GBP_CURRENCY)
+    task = Task.objects.create(job=job, estimate_hours='100.00',
+        task_type=TaskType.objects.create(name=u'Design'))
+    weeks = [FIRST_WEEK + datetime.timedelta(weeks=week) \
+             for week in xrange(WEEKS)]
+    insert_objects(Timesheet, [Timesheet(user_id=user_id, week_commencing=week) \
+                               for user_id in user_ids for week in weeks \
+                               if random.random() > 0.05])
+    entries = []
+    for id, user_id, week in Timesheet.objects.values_list('id', 'user',
+                                                           'week_commencing'):
+        for i in xrange(ENTRIES_PER_TIMESHEET):
+            entries.append(TimeEntry(timesheet_id=id, user_id=user_id,
+                task=task, week_commencing=week,
+                mon='%s.50' % random.randint(0, 2),
+                tue='%s.00' % random.randint(0, 2), wed='1.50', thu='1.50',
+                fri='1.50', sat='0.00', sun='0.00', overtime='0.00'))
+    insert_objects(TimeEntry, entries)
+    return len(entries)
+create_data = transaction.commit_on_success(create_data)
+
+def per_timesheet_status(users, weeks):
+    """
+    Looks up each User's Timesheet for each week, adding up the hours of
+    its Time Entries.
+    """
+    rows = []
+    for user in users.filter(is_active=True) \
+                     .order_by('last_name', 'first_name', 'username'):
+        for week in weeks:
+            try:
+                timesheet = Timesheet.objects.get(user=user,
+                                                  week_commencing=week)
+            except Timesheet.DoesNotExist:
+                rows.append((user.username, week, Decimal('0.00'), 'Missing'))
+                continue
+            hours = sum([entry.hours_booked for entry \
+                         in timesheet.time_entries.all()], Decimal('0.00'))
+            if hours < HOURS_PER_FULL_WEEK:
+                rows.append((user.username, week, hours, 'Incomplete'))
+    return rows
+
+def main(user_count):
+    try:
+        call_command('syncdb', interactive=False, verbosity=0)
+        start = time.time()
+        entry_count = create_data(user_count)
+        print '%s Users, %s Time Entries over %s weeks created in %.1fs' % (
+            user_count, entry_count, WEEKS, time.time() - start)
+
+        users = User.objects.all()
+        weeks = [FIRST_WEEK + datetime.timedelta(weeks=week) \
+                 for week in xrange(WEEKS)]
+        start = time.time()
+        per_timesheet = per_timesheet_status(users, weeks)
+        per_timesheet_time = time.time() - start
+
+        start = time.time()
+        stream = get_timesheet_status(users, weeks[0], weeks[-1],
+                                      HOURS_PER_FULL_WEEK).execute()
+        grouped = [(row[0], datetime.date(*map(int, str(row[3]).split('-'))),
+                    row[4], row[5]) for row in stream]
+        grouped_time = time.time() - start
+
+        print 'Per-Timesheet: %.3fs' % per_timesheet_time
+        print 'Grouped query: %.3fs (%.1fx)' % (grouped_time,
+            per_timesheet_time / grouped_time)
+        print '%s incomplete or missing Timesheets' % len(grouped)
+        if per_timesheet != grouped:
+            print 'Results differ!'
+            sys.exit(1)
+        print 'Results are identical.'
+    finally:
+        connection.close()
+        shutil.rmtree(DATABASE_DIR)
+
+if __name__ == '__main__':
+    main(len(sys.argv) > 1 and int(sys.argv[1]) or 300)
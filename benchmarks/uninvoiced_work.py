@@ -0,0 +1,142 @@
+"""
+Compares valuing uninvoiced work for every Job in a single pass with
+performing an ``InvoiceTimeCalculation`` for each Job in turn.
+
+Usage: python benchmarks/uninvoiced_work.py [job_count]
+
+A temporary SQLite database is created (as in ``job_status.py``) holding
+the given number of Jobs (200 by default), each with 10 Tasks, with
+approved time booked against every Task by one of 50 Users each week
+for three years and an Expense for each Job each week.
+"""
+import datetime
+import random
+import shutil
+import sys
+import time
+from decimal import Decimal
+
+from job_status import DATABASE_DIR, insert_objects
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection, transaction
+
+from djangoffice.models import (Client, Expense, ExpenseType, Job, Task,
+    TaskType, TimeEntry, Timesheet, UserRate)
+from djangoffice.utils.invoice import (InvoiceTimeCalculation, RATE_MODELS,
+    RateNotFound)
+from djangoffice.utils.rates import RateLookup
+from djangoffice.utils.reports import get_uninvoiced_work
+
+TASKS_PER_JOB = 10
+USERS = 50
+WEEKS = 156
+FIRST_WEEK = datetime.date(2007, 1, 1)
+
+def create_data(job_count):
+    random.seed(job_count)
+    users = [User.objects.create(username='user%s' % i) for i in xrange(USERS)]
+    for user in users:
+        for year in xrange(3):
+            UserRate.objects.create(user=user,
+                effective_from=datetime.date(2007 + year, 1, 1),
+                standard_rate='%s.00' % random.randint(20, 60),
+                overtime_rate='%s.00' % random.randint(30, 90))
+    approver = users[0]
+    client = Client.objects.create(name=u'Client')
+    expense_type = ExpenseType.objects.create(name=u'Travel')
+    task_types = [TaskType.objects.create(name=u'Task Type %s' % i) \
+                  for i in xrange(TASKS_PER_JOB)]
+    weeks = [FIRST_WEEK + datetime.timedelta(weeks=week) \
+             for week in xrange(WEEKS)]
+    insert_objects(Timesheet, [Timesheet(user=user, week_commencing=week) \
+                               for user in users for week in weeks])
+    timesheets = dict([((user_id, week), id) for id, user_id, week \
+                       in Timesheet.objects.values_list('id', 'user',
+                                                        'week_commencing')])
+
+    now = datetime.datetime.now()
+    insert_objects(Job, [Job(client=client, name=u'Job %s' % i, number=i,
+        status=Job.LIVE_STATUS, director_id=1, project_manager_id=1,
+        architect_id=1, primary_contact_id=1, billing_contact_id=1,
+        fee_currency=Job.GBP_CURRENCY, created_at=now) \
+        for i in xrange(1, job_count + 1)])
+    job_ids = list(Job.objects.values_list('pk', flat=True))
+    insert_objects(Task, [Task(job_id=job_id, task_type=task_type,
+        estimate_hours='100.00') \
+        for job_id in job_ids for task_type in task_types])
+    entries = []
+    for task_id in Task.objects.values_list('pk', flat=True):
+        for week in weeks:
+            user = random.choice(users)
+            hours = ['%s.00' % random.randint(0, 2) for day in xrange(5)]
+            entries.append(TimeEntry(
+                timesheet_id=timesheets[user.pk, week], user=user,
+                task_id=task_id, week_commencing=week, mon=hours[0],
+                tue=hours[1], wed=hours[2], thu=hours[3], fri=hours[4],
+                sat='0.00', sun='0.00', overtime='0.00',
+                approved_by=approver))
+    insert_objects(TimeEntry, entries)
+    insert_objects(Expense, [Expense(timesheet_id=timesheets[approver.pk, week],
+        user=approver, job_id=job_id, type=expense_type, date=week,
+        amount='12.50', approved_by=approver) \
+        for job_id in job_ids for week in weeks])
+    return len(entries)
+create_data = transaction.commit_on_success(create_data)
+
+def per_job_amounts(jobs):
+    """
+    Values each Job's uninvoiced work with its own calculation, rate
+    lookup and queries.
+    """
+    model, related_object_attr = RATE_MODELS[u'U']
+    amounts = {}
+    for job in jobs:
+        calculation = InvoiceTimeCalculation(job)
+        try:
+            calculation.calculate(RateLookup(model, related_object_attr), u'U')
+        except RateNotFound:
+            continue
+        expenses = sum([amount for amount in Expense.objects.filter(job=job,
+            approved_by__isnull=False, invoice__isnull=True) \
+            .values_list('amount', flat=True)], Decimal(0))
+        amount = (calculation.total_cost + expenses).quantize(Decimal('0.01'))
+        if amount:
+            amounts[job.pk] = amount
+    return amounts
+
+def main(job_count):
+    try:
+        call_command('syncdb', interactive=False, verbosity=0)
+        start = time.time()
+        entry_count = create_data(job_count)
+        print '%s Jobs, %s Time Entries over %s weeks created in %.1fs' % (
+            job_count, entry_count, WEEKS, time.time() - start)
+
+        jobs = Job.objects.all()
+        start = time.time()
+        per_job = per_job_amounts(jobs)
+        per_job_time = time.time() - start
+
+        start = time.time()
+        clients, totals = get_uninvoiced_work(jobs)
+        single_pass_time = time.time() - start
+        single_pass = dict([(result.job.pk, result.amount) \
+                            for client in clients \
+                            for result in client.results])
+
+        print 'Per-Job:     %.3fs' % per_job_time
+        print 'Single pass: %.3fs (%.1fx)' % (single_pass_time,
+                                              per_job_time / single_pass_time)
+        print 'Total: %s' % totals
+        if per_job != single_pass:
+            print 'Results differ!'
+            sys.exit(1)
+        print 'Results are identical.'
+    finally:
+        connection.close()
+        shutil.rmtree(DATABASE_DIR)
+
+if __name__ == '__main__':
+    main(len(sys.argv) > 1 and int(sys.argv[1]) or 200)
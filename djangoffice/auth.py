@@ -14,6 +14,9 @@ follows, as implemented in the ``user_can_access_user`` and
   setting is enabled; otherwise, they can access their managed users.
 * PMs can access their managed users.
 * Users can only access their own details.
+
+The details these rules depend on are loaded once per User as a
+``Principal``.
 """
 from urllib import quote
 
@@ -25,13 +28,106 @@ from django.http import HttpResponseRedirect
 from djangoffice import models
 from djangoffice.models import UserProfile
 
+class Principal(object):
+    """
+    The role-based authorisation details of a User - their profile, role
+    and the ids of the Users they manage - loaded once and then used for
+    every permission check made against them.
+
+    Use ``get_principal`` to retrieve the ``Principal`` for a User, or
+    ``request.principal`` when ``PrincipalMiddleware`` is installed.
+    """
+    def __init__(self, user):
+        self.user = user
+        if user.is_authenticated():
+            self.profile = user.get_profile()
+            self.role = self.profile.role
+        else:
+            self.profile = None
+            self.role = None
+        self._managed_user_ids = None
+        self._test_results = {}
+
+    def has_role(self, roles):
+        return self.role is not None and self.role in roles
+
+    def is_admin(self):
+        return self.role == UserProfile.ADMINISTRATOR_ROLE
+
+    def is_manager(self):
+        return self.role == UserProfile.MANAGER_ROLE
+
+    def is_pm(self):
+        return self.role == UserProfile.PM_ROLE
+
+    def is_user(self):
+        return self.role == UserProfile.USER_ROLE
+
+    @property
+    def managed_user_ids(self):
+        """
+        A set of the ids of Users managed by this User.
+        """
+        if self._managed_user_ids is None:
+            self._managed_user_ids = set(
+                self.profile.managed_users.values_list('pk', flat=True))
+        return self._managed_user_ids
+
+    def passes(self, test_func):
+        """
+        Determines if this User passes the given permission test
+        function, only performing each test once.
+        """
+        if not self._test_results.has_key(test_func):
+            self._test_results[test_func] = test_func(self.user)
+        return self._test_results[test_func]
+
+    def can_access_user(self, user):
+        """
+        Determines if this User has permission to access another user's
+        details.
+        """
+        if self.user.pk == user.pk:
+            return True
+        elif self.is_admin():
+            return True
+        elif self.is_manager():
+            return models.access.managers_view_all_users or \
+                   user.pk in self.managed_user_ids
+        elif self.is_pm():
+            return user.pk in self.managed_user_ids
+        return False
+
+    def get_accessible_users(self):
+        """
+        Returns a ``QuerySet`` of users accessible by this User, which
+        will include this User.
+        """
+        if self.is_admin():
+            return User.objects.all()
+        elif self.is_manager() and models.access.managers_view_all_users:
+            return User.objects.exclude(userprofile__role=UserProfile.ADMINISTRATOR_ROLE)
+        elif self.is_manager() or self.is_pm():
+            return User.objects.filter(
+                pk__in=list(self.managed_user_ids | set([self.user.pk])))
+        return User.objects.filter(pk=self.user.pk)
+
+def get_principal(user):
+    """
+    Retrieves the ``Principal`` for the given User, which is cached on
+    the User object so it's only loaded once per request.
+    """
+    if not hasattr(user, '_principal'):
+        user._principal = Principal(user)
+    return user._principal
+
 def user_has_role(roles):
     """
     Creates a function which validates that a given user has one of the
     given roles.
     """
     def _check_role(user):
-        return user.is_authenticated() and user.get_profile().role in roles
+        return get_principal(user).has_role(roles)
     return _check_role
 
 # Authentication and permission test functions
@@ -49,49 +145,14 @@ def user_can_access_user(logged_in_user, user):
     Determines if the given logged-in user has permission to access
     another user's details.
     """
-    if logged_in_user.pk == user.pk:
-        return True
-
-    profile = logged_in_user.get_profile()
-    if profile.is_user():
-        return False
-    elif profile.is_admin():
-        return True
-    elif profile.is_manager():
-        if models.access.managers_view_all_users:
-            return True
-        else:
-            try:
-                profile.managed_users.get(pk=user.pk)
-                return True
-            except User.DoesNotExist:
-                return False
-    elif profile.is_pm():
-        try:
-            profile.managed_users.get(pk=user.pk)
-            return True
-        except User.DoesNotExist:
-            return False
+    return get_principal(logged_in_user).can_access_user(user)
 
 def get_accessible_users(logged_in_user):
     """
     Returns a ``QuerySet`` of users accessible by the logged-in user. This
     will also include the logged-in user themselves.
     """
-    profile = logged_in_user.get_profile()
-    if profile.is_user():
-        return User.objects.filter(pk=logged_in_user.pk)
-    elif profile.is_admin():
-        return User.objects.all()
-    elif profile.is_manager():
-        if models.access.managers_view_all_users:
-            return User.objects.exclude(userprofile__role=UserProfile.ADMINISTRATOR_ROLE)
-        else:
-            return User.objects.filter(pk=logged_in_user.pk) | \
-                profile.managed_users.all()
-    elif profile.is_pm():
-        return User.objects.filter(pk=logged_in_user.pk) | \
-            profile.managed_users.all()
+    return get_principal(logged_in_user).get_accessible_users()
 
 def user_has_permission(test_func):
     """
@@ -88,6 +88,7 @@ class InvoiceCriteriaForm(HiddenBaseForm, forms.Form):
            self.cleaned_data['start_period'] is None:
             raise forms.ValidationError('Required if invoice type is %s.' \
                                         % dict(Invoice.TYPE_CHOICES)[Invoice.DATE_RESTRICTED_TYPE])
+        return self.cleaned_data['start_period']
 
     def clean_end_period(self):
         if 'type' in self.cleaned_data and \
@@ -95,6 +96,7 @@ class InvoiceCriteriaForm(HiddenBaseForm, forms.Form):
            self.cleaned_data['end_period'] is None:
             raise forms.ValidationError('Required if invoice type is %s.' \
                                         % dict(Invoice.TYPE_CHOICES)[Invoice.DATE_RESTRICTED_TYPE])
+        return self.cleaned_data['end_period']
 
     def clean_additional_hours_cost(self):
         if self.cleaned_data['additional_hours'] is not None and \
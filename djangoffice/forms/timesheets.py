@@ -4,7 +4,7 @@ from django import forms
 
 from djangoffice.forms.widgets import DateInput, HourInput, MoneyInput
 from djangoffice.models import Expense, ExpenseType, Task, TimeEntry
-from djangoffice.utils.dates import week_ending_date
+from djangoffice.utils.dates import week_commencing_date, week_ending_date
 
 class BulkApprovalForm(forms.Form):
     """
@@ -22,6 +22,34 @@ class BulkApprovalForm(forms.Form):
                     u'Must be later than or equal to Start Date.')
         return self.cleaned_data['end_date']
 
+class TimesheetStatusReportForm(forms.Form):
+    """
+    Form for selecting the range of weeks covered by the Timesheet
+    Status report. Dates are moved back to the commencing date of their
+    week.
+    """
+    start_date = forms.DateField(widget=DateInput())
+    end_date   = forms.DateField(widget=DateInput())
+
+    def __init__(self, max_weeks, *args, **kwargs):
+        super(TimesheetStatusReportForm, self).__init__(*args, **kwargs)
+        self.max_weeks = max_weeks
+
+    def clean_start_date(self):
+        return week_commencing_date(self.cleaned_data['start_date'])
+
+    def clean_end_date(self):
+        end_date = week_commencing_date(self.cleaned_data['end_date'])
+        start_date = self.cleaned_data.get('start_date')
+        if start_date:
+            if not end_date >= start_date:
+                raise forms.ValidationError(
+                    u'Must be later than or equal to Start Date.')
+            if (end_date - start_date).days / 7 >= self.max_weeks:
+                raise forms.ValidationError(
+                    u'At most %s weeks may be reported on.' % self.max_weeks)
+        return end_date
+
 ################
 # Time Entries #
 ################
@@ -1,6 +1,8 @@
 from decimal import Decimal
 
 from dbsettings.utils import set_defaults
+from django.db import connections, transaction
+from django.db.models import signals
 
 from djangoffice import models as djangoffice_app
 
@@ -24,3 +26,19 @@ set_defaults(djangoffice_app,
     ('Invoice',   'exchange_rate',                 Decimal('1.5')),
     ('Timesheet', 'hours_per_full_week',           Decimal('37.5')),
 )
+
+def create_composite_indexes(sender, created_models, verbosity=1, db=None,
+                             **kwargs):
+    """
+    Creates composite indexes for the models whose tables have just been
+    created.
+    """
+    connection = connections[db]
+    for index in djangoffice_app.COMPOSITE_INDEXES:
+        if index.model in created_models:
+            if verbosity >= 1:
+                print 'Creating composite index %s' % index.get_name(connection)
+            index.create(connection)
+    transaction.commit_unless_managed(using=db)
+
+signals.post_syncdb.connect(create_composite_indexes, sender=djangoffice_app)
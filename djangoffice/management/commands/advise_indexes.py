@@ -0,0 +1,60 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+class Command(NoArgsCommand):
+    help = 'Explains the most frequently executed queries, flagging any which scan whole tables and suggesting indexes to avoid it.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--database', action='store', dest='database',
+            default=DEFAULT_DB_ALIAS,
+            help='Nominates a database to explain queries in. Defaults to the "default" database.'),
+        make_option('--create', action='store_true', dest='create',
+            default=False,
+            help='Create any composite indexes which are missing from the database.'),
+    )
+
+    def handle_noargs(self, **options):
+        from djangoffice.utils.indexes import advise_indexes, missing_indexes
+
+        verbosity = int(options.get('verbosity', 1))
+        using = options.get('database')
+        connection = connections[using]
+        advice = advise_indexes(using)
+        if not [a for a in advice if a.plan]:
+            print "Query plans aren't available for this database."
+        scanning = 0
+        failed = 0
+        for a in advice:
+            if not a.full_scans and a.error is None and verbosity < 2:
+                continue
+            print a.description
+            if a.sql is not None:
+                print '    %s' % a.sql
+            if verbosity >= 2:
+                for line in a.plan:
+                    print '    | %s' % line
+            for table, index in a.full_scans:
+                print '    Full scan of %s' % table
+                if index is not None:
+                    print '    Suggested: %s;' % index.sql_create(connection)
+            if a.full_scans:
+                scanning += 1
+            if a.error is not None:
+                print '    Replay failed: %s: %s' % (a.error.__class__.__name__, a.error)
+                failed += 1
+        if verbosity > 0:
+            print '%s of %s queries scan whole tables.' % (scanning, len([a for a in advice if a.sql is not None]))
+            if failed:
+                print 'Replays which failed, and may be missing queries: %s' % failed
+
+        missing = missing_indexes(using)
+        for index in missing:
+            if options.get('create'):
+                if verbosity > 0:
+                    print 'Creating composite index %s' % index.get_name(connection)
+                index.create(connection)
+            else:
+                print 'Missing composite index: %s;' % index.sql_create(connection)
+        if missing and options.get('create'):
+            transaction.commit_unless_managed(using=using)
@@ -0,0 +1,20 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+class Command(NoArgsCommand):
+    help = 'Rebuilds the records of which Users have access to which Jobs from Task assignments and Job directors and managers.'
+
+    def handle_noargs(self, **options):
+        from djangoffice.models import JobAccess
+
+        verbosity = int(options.get('verbosity', 1))
+        transaction.enter_transaction_management()
+        transaction.managed(True)
+        try:
+            count = JobAccess.objects.rebuild()
+            transaction.commit()
+        finally:
+            transaction.leave_transaction_management()
+        if verbosity > 0:
+            print 'Rebuilt %s Job access record%s.' % (count,
+                                                       count != 1 and 's' or '')
@@ -0,0 +1,39 @@
+from optparse import make_option
+
+from django.core.management.base import CommandError, NoArgsCommand
+from django.db import transaction
+
+class Command(NoArgsCommand):
+    help = 'Rebuilds the booked hours and cost totals held for each Task from its Time Entries, then verifies them.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--verify', action='store_true', dest='verify',
+            default=False,
+            help='Only verify the totals, reporting any which are incorrect.'),
+    )
+
+    def handle_noargs(self, **options):
+        from djangoffice.models import TaskTotal
+
+        verbosity = int(options.get('verbosity', 1))
+        if not options.get('verify'):
+            transaction.enter_transaction_management()
+            transaction.managed(True)
+            try:
+                count = TaskTotal.objects.rebuild()
+                transaction.commit()
+            finally:
+                transaction.leave_transaction_management()
+            if verbosity > 0:
+                print 'Rebuilt totals for %s Task%s.' % (count,
+                                                         count != 1 and 's' or '')
+
+        mismatches = TaskTotal.objects.verify()
+        for task_id, stored, calculated in mismatches:
+            print 'Task %s: stored %s hours (%s approved) costing %s, calculated %s hours (%s approved) costing %s.' % (
+                task_id, stored[0], stored[1], stored[2], calculated[0],
+                calculated[1], calculated[2])
+        if mismatches:
+            raise CommandError('%s Task total%s incorrect.' % (
+                len(mismatches), len(mismatches) != 1 and 's are' or ' is'))
+        if verbosity > 0:
+            print 'All Task totals are correct.'
@@ -0,0 +1,38 @@
+from optparse import make_option
+
+from django.core.management.base import CommandError, NoArgsCommand
+from django.db import transaction
+
+class Command(NoArgsCommand):
+    help = 'Rebuilds the leave taken held for each User and year from Time Entries booked against the vacation Task, then verifies it.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--verify', action='store_true', dest='verify',
+            default=False,
+            help='Only verify the balances, reporting any which are incorrect.'),
+    )
+
+    def handle_noargs(self, **options):
+        from djangoffice.models import VacationBalance
+
+        verbosity = int(options.get('verbosity', 1))
+        if not options.get('verify'):
+            transaction.enter_transaction_management()
+            transaction.managed(True)
+            try:
+                count = VacationBalance.objects.rebuild()
+                transaction.commit()
+            finally:
+                transaction.leave_transaction_management()
+            if verbosity > 0:
+                print 'Rebuilt %s leave balance%s.' % (count,
+                                                      count != 1 and 's' or '')
+
+        mismatches = VacationBalance.objects.verify()
+        for user_id, year, stored, calculated in mismatches:
+            print 'User %s, %s: stored %s hours taken, calculated %s hours taken.' % (
+                user_id, year, stored, calculated)
+        if mismatches:
+            raise CommandError('%s leave balance%s incorrect.' % (
+                len(mismatches), len(mismatches) != 1 and 's are' or ' is'))
+        if verbosity > 0:
+            print 'All leave balances are correct.'
@@ -0,0 +1,16 @@
+from django.core.management.base import NoArgsCommand
+
+class Command(NoArgsCommand):
+    help = 'Resumes bulk approvals of Time Entries and Expenses which were interrupted before they completed.'
+
+    def handle_noargs(self, **options):
+        from djangoffice.models import BulkApproval
+
+        verbosity = int(options.get('verbosity', 1))
+        for bulk_approval in BulkApproval.objects.incomplete().order_by('pk'):
+            bulk_approval.run()
+            if verbosity > 0:
+                print 'Bulk approval %s of %s to %s: %s Time Entries and %s Expenses approved.' % (
+                    bulk_approval.pk, bulk_approval.start_date,
+                    bulk_approval.end_date, bulk_approval.time_entries,
+                    bulk_approval.expenses)
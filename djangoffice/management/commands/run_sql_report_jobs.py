@@ -0,0 +1,38 @@
+import os
+import socket
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+class Command(NoArgsCommand):
+    help = 'Runs a worker which executes queued background SQL Report jobs, fails jobs abandoned by workers which died and removes expired job results.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--once', action='store_true', dest='once',
+            default=False,
+            help='Exit once there are no queued jobs, instead of waiting for more.'),
+        make_option('--interval', type='float', dest='interval', default=5,
+            help='Seconds to wait between checks for queued jobs.'),
+    )
+
+    def handle_noargs(self, **options):
+        from djangoffice.models import SQLReportJob
+        from djangoffice.utils.sql_reports import run_sql_report_job
+
+        verbosity = int(options.get('verbosity', 1))
+        worker = '%s:%s' % (socket.gethostname(), os.getpid())
+        while True:
+            SQLReportJob.objects.fail_abandoned()
+            for job in SQLReportJob.objects.expired():
+                job.delete()
+            job = SQLReportJob.objects.claim_next(worker)
+            if job is not None:
+                run_sql_report_job(job)
+                if verbosity > 0:
+                    print 'SQL Report job %s: %s, %s row%s.' % (job.pk,
+                        job.get_status_display(), job.row_count,
+                        job.row_count != 1 and 's' or '')
+                continue
+            if options.get('once'):
+                break
+            time.sleep(options.get('interval'))
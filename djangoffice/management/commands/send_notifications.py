@@ -0,0 +1,13 @@
+from django.core.management.base import NoArgsCommand
+
+class Command(NoArgsCommand):
+    help = 'Checks for anything to send notification emails about since the last check, queuing the emails for the send_outbox_emails worker.'
+
+    def handle_noargs(self, **options):
+        from djangoffice.utils.notifications import run_notifications
+
+        verbosity = int(options.get('verbosity', 1))
+        for rule, count in run_notifications():
+            if verbosity > 0:
+                print '%s: %s email%s queued.' % (rule, count,
+                                                  count != 1 and 's' or '')
@@ -0,0 +1,32 @@
+import os
+import socket
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+class Command(NoArgsCommand):
+    help = 'Runs a worker which sends queued notification emails in batches.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--once', action='store_true', dest='once',
+            default=False,
+            help='Exit once there are no queued emails, instead of waiting for more.'),
+        make_option('--interval', type='float', dest='interval', default=30,
+            help='Seconds to wait between checks for queued emails.'),
+    )
+
+    def handle_noargs(self, **options):
+        from djangoffice.utils.notifications import send_outbox_emails
+
+        verbosity = int(options.get('verbosity', 1))
+        worker = '%s:%s' % (socket.gethostname(), os.getpid())
+        while True:
+            sent, failed = send_outbox_emails(worker)
+            if (sent or failed) and verbosity > 0:
+                print 'Sent %s email%s, %s failed.' % (sent,
+                    sent != 1 and 's' or '', failed)
+            if sent:
+                continue
+            if options.get('once'):
+                break
+            time.sleep(options.get('interval'))
@@ -1,8 +1,9 @@
-from django.core.urlresolvers import reverse
+from django.core.urlresolvers import (get_resolver, get_script_prefix,
+    get_urlconf, reverse)
 from django.utils.html import escape
 from django.utils.safestring import mark_safe
 
-from djangoffice.auth import (is_admin, is_admin_or_manager,
+from djangoffice.auth import (get_principal, is_admin, is_admin_or_manager,
     is_admin_manager_or_pm, is_authenticated, is_not_authenticated)
 
 # 4-tuples of (section id, label, URL name, user permission test function)
@@ -44,9 +45,41 @@ PAGES = {
         ('invoiced_work_report',   'Invoiced Work',     'invoiced_work_report',   is_admin_or_manager),
         ('uninvoiced_work_report', 'Uninvoiced Work',   'uninvoiced_work_report', is_admin_or_manager),
         ('sql_reports',            'SQL Reports',       'sql_report_list',        is_authenticated),
+        ('query_stats',            'Query Stats',       'query_stats',            is_admin),
     ),
 }
 
+# Cached menu items and the URLs they link to, which are discarded when the
+# URLconf or the menu definitions above are replaced. A new cache is built
+# and swapped in whole, so threads never see one which is half-built.
+_menu_cache = {}
+
+def clear_menu_cache():
+    """
+    Discards all cached menu items and URLs.
+    """
+    global _menu_cache
+    _menu_cache = {}
+
+def _get_menu_cache():
+    global _menu_cache
+    cache = _menu_cache
+    version = (get_resolver(get_urlconf()), get_script_prefix(), SECTIONS,
+               PAGES)
+    if cache.get('version') != version:
+        # URL names are the third item in each menu item definition
+        url_names = [item[2] for item in SECTIONS]
+        for pages in PAGES.values():
+            url_names.extend([item[2] for item in pages])
+        cache = {
+            'version': version,
+            'urls': dict([(url_name, reverse(url_name)) \
+                          for url_name in url_names]),
+            'items': {},
+        }
+        _menu_cache = cache
+    return cache
+
 def build_menu_items(user, active_section_id=None, active_page_id=None,
         item_template='<li %(id)s%(class)s><a href="%(url)s">%(label)s</a></li>',
         item_id_prefix='nav_'):
@@ -72,11 +105,28 @@ def build_menu_items(user, active_section_id=None, active_page_id=None,
 
     item_id_prefix
         A prefix to be applied to all item ``id`` attributes.
+
+    Menu items are cached for each role and authentication state, as
+    the permission test functions in ``SECTIONS`` and ``PAGES`` must
+    only depend on these.
     """
+    cache = _get_menu_cache()
+    principal = get_principal(user)
+    key = (principal.role, user.is_authenticated(), active_section_id,
+           active_page_id, item_template, item_id_prefix)
+    if not cache['items'].has_key(key):
+        cache['items'][key] = _build_menu_items(principal, cache['urls'],
+            active_section_id, active_page_id, item_template,
+            item_id_prefix)
+    section_items, page_items = cache['items'][key]
+    return (list(section_items), list(page_items))
+
+def _build_menu_items(principal, urls, active_section_id, active_page_id,
+                      item_template, item_id_prefix):
     section_items, page_items = [], []
 
     for (section_id, label, url_name, user_permission_test) in SECTIONS:
-        if user_permission_test and not user_permission_test(user):
+        if user_permission_test and not principal.passes(user_permission_test):
             continue
         item_class = ''
         if active_section_id and section_id == active_section_id:
@@ -84,13 +134,13 @@ def build_menu_items(user, active_section_id=None, active_page_id=None,
         section_items.append(item_template % {
             'id': 'id="%s%s"' % (item_id_prefix, section_id),
             'class': item_class,
-            'url': reverse(url_name),
+            'url': urls[url_name],
             'label': escape(label)
         })
 
     if PAGES.has_key(active_section_id):
         for (page_id, label, url_name, user_permission_test) in PAGES[active_section_id]:
-            if user_permission_test and not user_permission_test(user):
+            if user_permission_test and not principal.passes(user_permission_test):
                 continue
             item_class = ''
             if active_page_id and page_id == active_page_id:
@@ -98,7 +148,7 @@ def build_menu_items(user, active_section_id=None, active_page_id=None,
             page_items.append(item_template %  {
                 'id': 'id="%s%s"' % (item_id_prefix, page_id),
                 'class': item_class,
-                'url': reverse(url_name),
+                'url': urls[url_name],
                 'label': escape(label)
             })
 
@@ -0,0 +1,68 @@
+from django.conf import settings
+from django.utils.html import escape
+
+from djangoffice.auth import get_principal
+from djangoffice.utils.query_stats import (get_url_name, query_stats,
+    start_query_trace, stop_query_trace)
+
+class LazyPrincipal(object):
+    def __get__(self, request, obj_type=None):
+        if not hasattr(request, '_cached_principal'):
+            request._cached_principal = get_principal(request.user)
+        return request._cached_principal
+
+class PrincipalMiddleware(object):
+    """
+    Makes the current User's ``Principal`` available as
+    ``request.principal``, loading it the first time it's used.
+    """
+    def process_request(self, request):
+        assert hasattr(request, 'user'), "The principal middleware requires authentication middleware to be installed. Edit your MIDDLEWARE_CLASSES setting to insert 'django.contrib.auth.middleware.AuthenticationMiddleware'."
+        request.__class__.principal = LazyPrincipal()
+        return None
+
+class QueryStatsMiddleware(object):
+    """
+    Records the queries executed while handling each request against
+    the name of the URL pattern it matched.
+
+    Administrators may send an ``X-SQL-Trace`` header with a request to
+    have its query count, time and duplicates returned in response
+    headers and, for HTML responses, each query it executed appended to
+    the page.
+    """
+    def process_request(self, request):
+        request._query_trace = start_query_trace()
+        return None
+
+    def process_response(self, request, response):
+        trace = getattr(request, '_query_trace', None)
+        if trace is None:
+            return response
+        stop_query_trace()
+        name = get_url_name(request.path_info)
+        if name is not None:
+            query_stats.record(name, trace)
+        if 'HTTP_X_SQL_TRACE' in request.META and \
+           hasattr(request, 'user') and request.user.is_authenticated() and \
+           request.principal.is_admin():
+            response['X-SQL-Queries'] = str(trace.count)
+            response['X-SQL-Time'] = '%.1f' % trace.time
+            response['X-SQL-Duplicates'] = str(trace.duplicates)
+            if response.get('Content-Type', '').startswith('text/html'):
+                self.append_trace(request, response, trace)
+        return response
+
+    def append_trace(self, request, response, trace):
+        """
+        Appends the given trace to the body of the given HTML response.
+        """
+        html = (u'<pre id="sql-trace">SQL trace for %s %s: %s</pre>' % (
+            request.method, escape(request.path_info),
+            escape(trace.format()))).encode(settings.DEFAULT_CHARSET)
+        content = response.content
+        body_end = content.lower().rfind('</body>')
+        if body_end == -1:
+            response.content = content + html
+        else:
+            response.content = content[:body_end] + html + content[body_end:]
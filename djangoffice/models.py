@@ -1,4 +1,5 @@
 import datetime
+import os
 import re
 from decimal import Decimal
 
@@ -6,7 +7,9 @@ import dbsettings
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
-from django.db import connection, models
+from django.db import IntegrityError, connection, models, transaction
+from django.db.backends.util import truncate_name
+from django.utils import simplejson
 from django.utils.text import truncate_words
 from django.utils.encoding import smart_unicode
 
@@ -389,24 +392,23 @@ class JobManager(models.Manager):
         """
         Determines the next free Job number.
         """
-        opts = self.model._meta
-        query = """
-        SELECT j1.%(number)s + 1
-        FROM %(job)s AS j1
-        LEFT JOIN %(job)s AS j2
-            ON j2.%(number)s = j1.%(number)s + 1
-        WHERE j2.%(number)s IS NULL
-        ORDER BY j1.%(number)s LIMIT 1""" % {
-            'job': qn(opts.db_table),
-            'number': qn(opts.get_field('number').column),
-        }
-        cursor = connection.cursor()
-        cursor.execute(query)
-        result = cursor.fetchall()
-        try:
-            return result[0][0]
-        except IndexError:
-            return 1
+        return NumberAllocator(self.model).get_next_free_number()
+
+    def _access_reasons(self, user):
+        """
+        Determines which reasons for having access to a Job apply to the
+        given User based on their role, returning ``None`` if they may
+        access all Jobs.
+        """
+        from djangoffice.auth import get_principal
+        principal = get_principal(user)
+        if principal.is_manager() and not access.managers_view_all_jobs:
+            return [JobAccess.TASK_REASON, JobAccess.DIRECTOR_REASON]
+        elif principal.is_pm() and not access.users_view_all_jobs:
+            return [JobAccess.TASK_REASON, JobAccess.PROJECT_MANAGER_REASON]
+        elif principal.is_user() and not access.users_view_all_jobs:
+            return [JobAccess.TASK_REASON]
+        return None
 
     def accessible_to_user(self, user):
         """
@@ -417,49 +419,42 @@ class JobManager(models.Manager):
         appropriate access setting is enabled.
 
         Otherwise, Users may only see Jobs for which they are assigned
-        to work on a Task.
+        to work on a Task, plus Jobs they direct if they are a Manager
+        or manage if they are a PM, as recorded in ``JobAccess``.
 
         Note that the Administration Job should never be visible; this
         Job exists purely to track vacations and other "internal"
         time.
         """
-        profile = user.get_profile()
         qs = super(JobManager, self) \
               .get_query_set() \
                .exclude(pk=settings.ADMIN_JOB_ID)
-        if profile.is_manager() and not access.managers_view_all_jobs or \
-           (profile.is_pm() or profile.is_user()) and not access.users_view_all_jobs:
-            opts = self.model._meta
-            task_opts = Task._meta
-            qs = qs.extra(
-                where=["""
-                %(job)s.%(job_pk)s IN (
-                    SELECT DISTINCT %(task)s.%(job_fk)s
-                    FROM %(task)s
-                    INNER JOIN %(assigned_users)s
-                        ON %(assigned_users)s.%(task_fk)s = %(task)s.%(task_pk)s
-                    WHERE %(assigned_users)s.%(user_fk)s = %%s
-                )""" % {
-                    'job': qn(opts.db_table),
-                    'job_pk': qn(opts.pk.column),
-                    'job_fk': qn(task_opts.get_field('job').column),
-                    'task': qn(task_opts.db_table),
-                    'task_pk': qn(task_opts.pk.column),
-                    'task_fk': qn(task_opts.get_field('assigned_users', True).m2m_column_name()),
-                    'assigned_users': qn(assigned_users_rel.m2m_db_table()),
-                    'user_fk': qn(assigned_users_rel.m2m_reverse_name()),
-                }],
-                params=[user.id],
-            )
-
-            if profile.is_manager():
-                qs = qs | super(JobManager, self).get_query_set() \
-                                                  .filter(director_id=user.pk)
-            elif profile.is_pm():
-                qs = qs | super(JobManager, self).get_query_set() \
-                                                  .filter(project_manager_id=user.pk)
+        reasons = self._access_reasons(user)
+        if reasons is not None:
+            qs = qs.filter(pk__in=JobAccess.objects.filter(user=user,
+                reason__in=reasons).values('job'))
         return qs
 
+    def accessible_job_ids(self, user):
+        """
+        Determines the ids of Jobs the given User may access, returning
+        ``None`` if they may access all Jobs other than the
+        Administration Job.
+
+        The result is cached on the User object - as this is usually
+        ``request.user``, repeated checks while handling a request only
+        hit the database once.
+        """
+        if not hasattr(user, '_accessible_job_ids'):
+            reasons = self._access_reasons(user)
+            if reasons is None:
+                user._accessible_job_ids = None
+            else:
+                user._accessible_job_ids = set(
+                    JobAccess.objects.filter(user=user, reason__in=reasons) \
+                                      .values_list('job', flat=True))
+        return user._accessible_job_ids
+
 class Job(models.Model):
     """
     A Job worked on for a Client.
@@ -503,7 +498,7 @@ class Job(models.Model):
     reference_date     = models.DateField(null=True, blank=True)
     add_reference      = models.CharField(max_length=16, blank=True)
     add_reference_date = models.DateField(null=True, blank=True)
-    status             = models.CharField(max_length=1, choices=STATUS_CHOICES)
+    status             = models.CharField(max_length=1, choices=STATUS_CHOICES, db_index=True)
     notes              = models.TextField(blank=True)
     invoice_notes      = models.TextField(blank=True)
     contingency        = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True)
@@ -581,7 +576,7 @@ class Job(models.Model):
         if not self.id:
             self.created_at = datetime.datetime.now()
         if not self.number:
-            self.number = self._default_manager.get_next_free_number()
+            self.number = NumberAllocator(Job).allocate()[0]
         super(Job, self).save(*args, **kwargs)
 
     @property
@@ -593,10 +588,10 @@ class Job(models.Model):
         Returns ``True`` if this Job may be accessed by the given User,
         ``False`` otherwise.
         """
-        return self._default_manager \
-                    .accessible_to_user(user) \
-                     .filter(pk=self.id) \
-                      .count() > 0
+        if self.id == settings.ADMIN_JOB_ID:
+            return False
+        job_ids = self._default_manager.accessible_job_ids(user)
+        return job_ids is None or self.id in job_ids
 
     def is_deleteable(self):
         """
@@ -652,11 +647,26 @@ class TaskManager(models.Manager):
     def for_user_timesheet(self, user):
         """
         Creates a ``QuerySet`` containing all Tasks to which the given
-        User is assigned, giving each Task an additional
-        ``task_type_name`` attribute containing the name of its Task
-        Type.
+        User is assigned, giving each Task additional ``task_type_name``,
+        ``job_number`` and ``job_name`` attributes containing the name of
+        its Task Type and the number and name of its Job.
         """
-        return self.with_task_type_name().filter(assigned_users=user)
+        opts = self.model._meta
+        job_opts = Job._meta
+        job_table = qn(job_opts.db_table)
+        return self.with_task_type_name().filter(assigned_users=user).extra(
+            select={
+                'job_number': '%s.%s' % (job_table, qn(job_opts.get_field('number').column)),
+                'job_name': '%s.%s' % (job_table, qn(job_opts.get_field('name').column)),
+            },
+            tables=[job_table],
+            where=['%s.%s = %s.%s' % (
+                qn(opts.db_table),
+                qn(opts.get_field('job').column),
+                job_table,
+                qn(job_opts.pk.column),
+            )]
+        )
 
 class Task(models.Model):
     """
@@ -701,6 +711,172 @@ class Task(models.Model):
         # TODO Implement
         pass
 
+class JobAccessManager(models.Manager):
+    def _sources(self):
+        """
+        Creates a dict mapping each reason for having access to a Job to
+        a three-tuple of the tables to select from and the SQL for the
+        User id and Job id columns.
+        """
+        job_opts = Job._meta
+        task_opts = Task._meta
+        assigned_users = task_opts.get_field('assigned_users')
+        job_table = qn(job_opts.db_table)
+        task_table = qn(task_opts.db_table)
+        assigned_table = qn(assigned_users.m2m_db_table())
+        task_tables = '%s INNER JOIN %s ON %s.%s = %s.%s' % (
+            task_table, assigned_table,
+            assigned_table, qn(assigned_users.m2m_column_name()),
+            task_table, qn(task_opts.pk.column))
+        return {
+            JobAccess.TASK_REASON: (task_tables,
+                '%s.%s' % (assigned_table, qn(assigned_users.m2m_reverse_name())),
+                '%s.%s' % (task_table, qn(task_opts.get_field('job').column))),
+            JobAccess.DIRECTOR_REASON: (job_table,
+                qn(job_opts.get_field('director').column),
+                qn(job_opts.pk.column)),
+            JobAccess.PROJECT_MANAGER_REASON: (job_table,
+                qn(job_opts.get_field('project_manager').column),
+                qn(job_opts.pk.column)),
+        }
+
+    def refresh(self, job_ids=None, user_ids=None, reasons=None):
+        """
+        Recalculates access to the Jobs with the given ids, for the
+        Users with the given ids, for the given reasons - any which are
+        ``None`` are not restricted.
+        """
+        if job_ids is not None and not job_ids or \
+           user_ids is not None and not user_ids:
+            return
+        if reasons is None:
+            reasons = [reason for reason, label in JobAccess.REASON_CHOICES]
+        opts = self.model._meta
+        sql_params = {
+            'job_access': qn(opts.db_table),
+            'user_fk': qn(opts.get_field('user').column),
+            'job_fk': qn(opts.get_field('job').column),
+            'reason': qn(opts.get_field('reason').column),
+        }
+        cursor = connection.cursor()
+        sources = self._sources()
+        for reason in reasons:
+            tables, user_column, job_column = sources[reason]
+            delete_where, where, params = [], [], []
+            for access_column, column, ids in \
+                ((sql_params['job_fk'], job_column, job_ids),
+                 (sql_params['user_fk'], user_column, user_ids)):
+                if ids is not None:
+                    placeholders = ', '.join(['%s'] * len(ids))
+                    delete_where.append('AND %s IN (%s)' % (access_column,
+                                                            placeholders))
+                    where.append('%s IN (%s)' % (column, placeholders))
+                    params.extend(ids)
+            sql_params.update({
+                'tables': tables,
+                'user_column': user_column,
+                'job_column': job_column,
+                'delete_where': ' '.join(delete_where),
+                'where': where and 'WHERE %s' % ' AND '.join(where) or '',
+            })
+            cursor.execute("""
+            DELETE FROM %(job_access)s
+            WHERE %(reason)s = %%s %(delete_where)s""" % sql_params,
+                [reason] + params)
+            cursor.execute("""
+            INSERT INTO %(job_access)s (%(user_fk)s, %(job_fk)s, %(reason)s)
+            SELECT DISTINCT %(user_column)s, %(job_column)s, %%s
+            FROM %(tables)s
+            %(where)s""" % sql_params, [reason] + params)
+
+    def rebuild(self):
+        """
+        Replaces all access records with records calculated from Task
+        assignments and Job directors and managers, returning the number
+        of records created.
+        """
+        self.refresh()
+        return super(JobAccessManager, self).get_query_set().count()
+
+class JobAccess(models.Model):
+    """
+    Records a reason a User has access to a Job, maintained as Task
+    assignments and Jobs' directors and managers change so access checks
+    are a single indexed lookup.
+
+    Which reasons confer access depends on the User's role and the
+    access settings, which are applied when Jobs are looked up.
+    """
+    TASK_REASON            = u'T'
+    DIRECTOR_REASON        = u'D'
+    PROJECT_MANAGER_REASON = u'P'
+    REASON_CHOICES = (
+        (TASK_REASON, u'Assigned to a Task'),
+        (DIRECTOR_REASON, u'Director'),
+        (PROJECT_MANAGER_REASON, u'Project Manager'),
+    )
+
+    user   = models.ForeignKey(User, related_name='job_access')
+    job    = models.ForeignKey(Job, related_name='access')
+    reason = models.CharField(max_length=1, choices=REASON_CHOICES)
+
+    objects = JobAccessManager()
+
+    def __unicode__(self):
+        return u'%s: %s (%s)' % (self.user_id, self.job_id,
+                                 self.get_reason_display())
+
+    class Meta:
+        unique_together = (('user', 'job', 'reason'),)
+
+def job_saved(sender, instance, **kwargs):
+    JobAccess.objects.refresh(job_ids=[instance.pk],
+        reasons=[JobAccess.DIRECTOR_REASON, JobAccess.PROJECT_MANAGER_REASON])
+
+def task_pre_save(sender, instance, **kwargs):
+    instance._old_job_id = None
+    if instance.pk is not None:
+        try:
+            instance._old_job_id = Task.objects.filter(
+                pk=instance.pk).values_list('job', flat=True)[0]
+        except IndexError:
+            pass
+
+def task_saved(sender, instance, created, **kwargs):
+    """
+    Moves access given by a Task's assignments when it's moved to
+    another Job.
+    """
+    old_job_id = getattr(instance, '_old_job_id', None)
+    if old_job_id is not None and old_job_id != instance.job_id:
+        JobAccess.objects.refresh(job_ids=[old_job_id, instance.job_id],
+                                  reasons=[JobAccess.TASK_REASON])
+
+def task_deleted(sender, instance, **kwargs):
+    JobAccess.objects.refresh(job_ids=[instance.job_id],
+                              reasons=[JobAccess.TASK_REASON])
+
+def task_assigned_users_changed(sender, instance, action, reverse, **kwargs):
+    """
+    Updates access given by Task assignments, whether they were changed
+    from the Task or the User side.
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        JobAccess.objects.refresh(user_ids=[instance.pk],
+                                  reasons=[JobAccess.TASK_REASON])
+    else:
+        JobAccess.objects.refresh(job_ids=[instance.job_id],
+                                  reasons=[JobAccess.TASK_REASON])
+
+models.signals.post_save.connect(job_saved, sender=Job)
+models.signals.pre_save.connect(task_pre_save, sender=Task)
+models.signals.post_save.connect(task_saved, sender=Task)
+models.signals.post_delete.connect(task_deleted, sender=Task)
+models.signals.m2m_changed.connect(task_assigned_users_changed,
+                                   sender=Task.assigned_users.through)
+
 class ArtifactType(models.Model):
     """
     A type of artifact.
@@ -735,13 +911,14 @@ class ArtifactManager(models.Manager):
         Creates a ``QuerySet`` containing Artifacts accessible by the
         given User based on their role.
         """
-        user_profile = user.get_profile()
+        from djangoffice.auth import get_principal
+        principal = get_principal(user)
         qs = super(ArtifactManager, self).get_query_set()
-        if user_profile.is_manager():
+        if principal.is_manager():
             qs = qs.filter(access__in=[UserProfile.MANAGER_ROLE, UserProfile.PM_ROLE, UserProfile.USER_ROLE])
-        elif user_profile.is_pm():
+        elif principal.is_pm():
             qs = qs.filter(access__in=[UserProfile.PM_ROLE, UserProfile.USER_ROLE])
-        elif user_profile.is_user():
+        elif principal.is_user():
             qs = qs.filter(access=UserProfile.USER_ROLE)
         return qs
 
@@ -847,6 +1024,12 @@ class Activity(models.Model):
     completed    = models.BooleanField()
     completed_at = models.DateTimeField(null=True, blank=True, editable=False)
 
+    # When the Activity was last assigned to a different User or Contact
+    assigned_at = models.DateTimeField(null=True, blank=True, db_index=True, editable=False)
+
+    # Notification
+    assignment_notified = models.BooleanField(default=False, editable=False, verbose_name=u'Notified about assignment')
+
     def __unicode__(self):
         return u'%s - %s' % (self.job, truncate_words(self.description, 50))
 
@@ -885,6 +1068,19 @@ class Activity(models.Model):
         # Users take precedence for assignment
         if self.assigned_to and self.contact:
             self.contact = None
+        assignment = (self.assigned_to_id, self.contact_id)
+        if self.id:
+            previous = Activity.objects.filter(pk=self.id).values_list(
+                'assigned_to', 'contact', 'assignment_notified')[:1]
+            if not previous or previous[0][:2] != assignment:
+                self.assigned_at = datetime.datetime.now()
+                self.assignment_notified = False
+            else:
+                # Notification may have happened since this was loaded
+                self.assignment_notified = previous[0][2]
+        elif assignment != (None, None):
+            self.assigned_at = datetime.datetime.now()
+            self.assignment_notified = False
         self.description = self.description.strip()
         super(Activity, self).save(*args, **kwargs)
 
@@ -961,24 +1157,7 @@ class InvoiceManager(models.Manager):
         """
         Determines the next free Invoice number.
         """
-        opts = self.model._meta
-        query = """
-        SELECT i1.%(number)s + 1
-        FROM %(invoice)s AS i1
-        LEFT JOIN %(invoice)s AS i2
-            ON i2.%(number)s = i1.%(number)s + 1
-        WHERE i2.%(number)s IS NULL
-        ORDER BY i1.%(number)s LIMIT 1""" % {
-            'invoice': qn(opts.db_table),
-            'number': qn(opts.get_field('number').column),
-        }
-        cursor = connection.cursor()
-        cursor.execute(query)
-        result = cursor.fetchall()
-        try:
-            return result[0][0]
-        except IndexError:
-            return 1
+        return NumberAllocator(self.model).get_next_free_number()
 
 class Invoice(models.Model):
     """
@@ -1029,7 +1208,7 @@ class Invoice(models.Model):
             raise ValidationError('Date Restricted invoices must have start and end periods.')
 
     def save(self, *args, **kwargs):
-        if not self.id:
+        if not self.id and self.date is None:
             self.date = datetime.date.today()
         super(Invoice, self).save(*args, **kwargs)
 
@@ -1049,16 +1228,17 @@ class TimesheetOptions(dbsettings.Group):
     hours_per_full_week = dbsettings.DecimalValue()
 
 class TimesheetManager(models.Manager):
-    def bulk_approve(user, start_date, end_date):
+    def bulk_approve(self, user, start_date, end_date):
         """
         Marks all unapproved Timesheet items between the given dates as
-        approved by the given User, returning a two-tuple indicating how
-        many Time Entries and Expenses respectively were marked as
-        approved.
+        approved by the given User, a chunk at a time as described in
+        ``BulkApproval``, returning a two-tuple indicating how many Time
+        Entries and Expenses respectively were marked as approved.
         """
-        approved_time_entries = TimeEntry.objects.bulk_approve(user, start_date, end_date)
-        approved_expenses = Expense.objects.bulk_approve(user, start_date, end_date)
-        return (approved_time_entries, approved_expenses)
+        bulk_approval = BulkApproval.objects.create(approved_by=user,
+            start_date=start_date, end_date=end_date)
+        bulk_approval.run()
+        return (bulk_approval.time_entries, bulk_approval.expenses)
 
 class Timesheet(models.Model):
     """
@@ -1114,6 +1294,10 @@ class Timesheet(models.Model):
             'approved_by': qn(time_entry_opts.get_field('approved_by').column),
             'timesheet_fk': qn(time_entry_opts.get_field('timesheet').column),
         }
+        TaskTotal.objects.add_approved_hours('%s IS NULL AND %s = %%s' % (
+            qn(time_entry_opts.get_field('approved_by').column),
+            qn(time_entry_opts.get_field('timesheet').column),
+        ), [self.id])
         cursor.execute(query, [user.id, self.id])
         approved_time_entries = cursor.rowcount
 
@@ -1132,6 +1316,42 @@ class Timesheet(models.Model):
 
         return (approved_time_entries, approved_expenses)
 
+def time_entry_hours_sql(table=None):
+    """
+    Creates SQL which adds up all the hours held in a Time Entry row,
+    optionally qualifying columns with the given (quoted) table name.
+    """
+    prefix = table is not None and '%s.' % table or ''
+    return '+'.join(['%s%s' % (prefix, qn(TimeEntry._meta.get_field(attr).column)) \
+                     for attr in TimeEntry.TIME_ATTRS])
+
+def count_by_user(rows):
+    """
+    Counts rows of ids and User ids by User, returning a dict mapping
+    User ids to counts.
+    """
+    counts = {}
+    for id, user_id in rows:
+        counts[user_id] = counts.get(user_id, 0) + 1
+    return counts
+
+def to_hours(value):
+    """
+    Converts an hours value retrieved with raw SQL to a ``Decimal`` with
+    two decimal places.
+    """
+    if value is None:
+        return Decimal('0.00')
+    return Decimal(str(value)).quantize(Decimal('0.01'))
+
+def to_cost(value):
+    """
+    Converts a cost to a ``Decimal`` with two decimal places.
+    """
+    if value is None:
+        return Decimal('0.00')
+    return Decimal(str(value)).quantize(Decimal('0.01'))
+
 class TimeEntryManager(models.Manager):
     def for_timesheet(self, timesheet):
         """
@@ -1144,9 +1364,11 @@ class TimeEntryManager(models.Manager):
         task_opts = Task._meta
         task_type_opts = TaskType._meta
         job_opts = Job._meta
+        invoice_opts = Invoice._meta
         task_table = qn(task_opts.db_table)
         task_type_table = qn(task_type_opts.db_table)
         job_table = qn(job_opts.db_table)
+        invoice_table = qn(invoice_opts.db_table)
         return super(TimeEntryManager, self).get_query_set().filter(timesheet=timesheet).extra(
             select={
                 'job_id': '%s.%s' % (task_table, qn(task_opts.get_field('job').column)),
@@ -1155,6 +1377,14 @@ class TimeEntryManager(models.Manager):
                 'task_name': '%s.%s' % (task_type_table, qn(task_type_opts.get_field('name').column)),
                 'task_estimate_hours': '%s.%s' % (task_table, qn(task_opts.get_field('estimate_hours').column)),
                 'task_remaining': '%s.%s' % (task_table, qn(task_opts.get_field('remaining').column)),
+                'invoice_number': 'SELECT %s FROM %s WHERE %s.%s = %s.%s' % (
+                    qn(invoice_opts.get_field('number').column),
+                    invoice_table,
+                    invoice_table,
+                    qn(invoice_opts.pk.column),
+                    qn(opts.db_table),
+                    qn(opts.get_field('invoice').column),
+                ),
             },
             tables=[task_table, task_type_table, job_table],
             where=[
@@ -1183,35 +1413,17 @@ class TimeEntryManager(models.Manager):
         """
         Creates a dictionary mapping Task ids to the total number of
         hours booked by all Users against Tasks with the given ids.
+
+        Totals are read from the ``TaskTotal`` maintained for each Task
+        rather than being calculated from every Time Entry ever booked.
         """
         if len(task_ids) == 0:
             return {}
 
-        opts = self.model._meta
-        task_opts = Task._meta
-        time_entry_table = qn(opts.db_table)
-        query = """
-        SELECT %(task)s.%(task_pk)s, SUM(%(time_columns)s) AS %(booked)s
-        FROM %(time_entry)s
-        INNER JOIN %(task)s ON %(task)s.%(task_pk)s = %(time_entry)s.%(task_fk)s
-        WHERE %(task)s.%(task_pk)s IN (%(task_pks)s)
-        GROUP BY %(task)s.%(task_pk)s""" % {
-            'task': qn(task_opts.db_table),
-            'task_pk': qn(task_opts.pk.column),
-            'time_columns': '+'.join(['%s.%s' \
-                                      % (time_entry_table,
-                                         qn(opts.get_field(attr).column)) \
-                                      for attr in TimeEntry.TIME_ATTRS]),
-            'booked': qn('booked'),
-            'time_entry': time_entry_table,
-            'task_fk': qn(opts.get_field('task').column),
-            'task_pks': ','.join(['%s'] * len(task_ids)),
-        }
-        cursor = connection.cursor()
-        cursor.execute(query, task_ids)
-        results = cursor.fetchall()
-        return dict([(task_id, Decimal(str(booked))) \
-                     for task_id, booked in results])
+        booked = dict([(task_id, Decimal(0)) for task_id in task_ids])
+        booked.update(TaskTotal.objects.filter(task__in=task_ids) \
+                                        .values_list('task', 'hours'))
+        return booked
 
     def for_job(job):
         """
@@ -1223,33 +1435,31 @@ class TimeEntryManager(models.Manager):
                  .filter(task__job=job) \
                   .select_related()
 
-    def bulk_approve(self, user, start_date, end_date):
+    def approve_chunk(self, user, week_commencing, size):
         """
-        Marks all unapproved Time Entries on Timesheets with
-        ``week_commencing`` dates between the given dates as approved by
-        the given User and returns the number of rows updated.
+        Marks up to ``size`` unapproved Time Entries for the week
+        commencing on the given date as approved by the given User,
+        returning a dict mapping the ids of the Users who booked them to
+        the number approved.
         """
-        opts = self.model._meta
-        timesheet_opts = Timesheet._meta
-        query = """
-        UPDATE %(time_entry)s
-        SET %(approved_by)s = %%s
-        WHERE %(approved_by)s IS NULL
-          AND %(timesheet_fk)s IN (
-              SELECT %(timesheet_pk)s
-              FROM %(timesheet)s
-              WHERE %(week_commencing)s >= %%s AND %(week_commencing)s <= %%s
-          )""" % {
-            'time_entry': qn(opts.db_table),
-            'approved_by': qn(opts.get_field('approved_by').column),
-            'timesheet_fk': qn(opts.get_field('timesheet').column),
-            'timesheet_pk': qn(timesheet_opts.pk.column),
-            'timesheet': qn(timesheet_opts.db_table),
-            'week_commencing': qn(timesheet_opts.get_field('week_commencing').column),
-        }
-        cursor = connection.cursor()
-        cursor.execute(query, [user.id, start_date, end_date])
-        return cursor.rowcount
+        ids = list(super(TimeEntryManager, self).get_query_set() \
+            .filter(week_commencing=week_commencing, approved_by__isnull=True) \
+            .order_by('pk').values_list('pk', flat=True)[:size])
+        if not ids:
+            return {}
+        super(TimeEntryManager, self).get_query_set() \
+            .filter(pk__in=ids, approved_by__isnull=True) \
+            .update(approved_by=user)
+        # Other approvals may have approved some of the Time Entries
+        # first, so only those this chunk approved are counted.
+        rows = list(super(TimeEntryManager, self).get_query_set() \
+            .filter(pk__in=ids, approved_by=user).values_list('pk', 'user'))
+        if rows:
+            TaskTotal.objects.add_approved_hours('%s IN (%s)' % (
+                    qn(self.model._meta.pk.column),
+                    ', '.join(['%s'] * len(rows)),
+                ), [row[0] for row in rows])
+        return count_by_user(rows)
 
 class TimeEntry(models.Model):
     """
@@ -1260,7 +1470,7 @@ class TimeEntry(models.Model):
     timesheet       = models.ForeignKey(Timesheet, related_name='time_entries')
     user            = models.ForeignKey(User, related_name='time_entries')
     task            = models.ForeignKey(Task, related_name='time_entries')
-    week_commencing = models.DateField(validators=[isWeekCommencingDate])
+    week_commencing = models.DateField(validators=[isWeekCommencingDate], db_index=True)
     mon             = models.DecimalField(max_digits=4, decimal_places=2, blank=True)
     tue             = models.DecimalField(max_digits=4, decimal_places=2, blank=True)
     wed             = models.DecimalField(max_digits=4, decimal_places=2, blank=True)
@@ -1304,18 +1514,60 @@ class TimeEntry(models.Model):
 
     def save(self, *args, **kwargs):
         """
-        Ensure time fields are not ``None`` before a save is performed.
+        Ensure time fields are not ``None`` before a save is performed
+        and update the booked hours totals for the affected Tasks and
+        the leave balances of the affected Users.
         """
         for attr in self.TIME_ATTRS:
             if getattr(self, attr) is None:
-                setattr(self, attr, 0.0)
+                setattr(self, attr, Decimal('0.00'))
+        previous = None
+        if self.id:
+            try:
+                previous = TimeEntry.objects.values_list('task', 'approved_by',
+                    *TaskTotal.objects.COST_LOOKUPS).get(pk=self.id)
+            except TimeEntry.DoesNotExist:
+                pass
         super(TimeEntry, self).save(*args, **kwargs)
+        rows = [self.get_cost_row()]
+        if previous is not None:
+            rows.append(previous[2:])
+        costs = TaskTotal.objects.calculate_costs(rows)
+        if previous is not None:
+            previous_hours = sum([Decimal(str(h)) for h in previous[5:]])
+            TaskTotal.objects.adjust(previous[0], -previous_hours,
+                previous[1] is not None and -previous_hours or 0, -costs[1])
+        hours = self.hours_booked
+        TaskTotal.objects.adjust(self.task_id, hours,
+            self.approved_by_id is not None and hours or 0, costs[0])
+        if previous is not None:
+            VacationBalance.objects.adjust_for_time_entry(previous[0],
+                previous[2], previous[4], previous[5:12], -1)
+        VacationBalance.objects.adjust_for_time_entry(self.task_id,
+            self.user_id, self.week_commencing,
+            [getattr(self, attr) for attr in VacationBalance.objects.DAY_ATTRS])
+
+    def get_cost_row(self):
+        """
+        Creates a row of this Time Entry's values for each of
+        ``TaskTotalManager.COST_LOOKUPS``.
+        """
+        return (self.user_id, self.task.task_type_id, self.week_commencing) + \
+            tuple([getattr(self, attr) for attr in self.TIME_ATTRS])
 
     @property
     def total_time_booked(self):
         return self.mon + self.tue + self.wed + self.thu + self.fri + \
                self.sat + self.sun
 
+    @property
+    def hours_booked(self):
+        """
+        All hours booked in this Time Entry, including overtime.
+        """
+        return sum([Decimal(str(getattr(self, attr))) \
+                    for attr in self.TIME_ATTRS])
+
     def is_editable(self):
         return self.invoice_id is None and self.approved_by_id is None
 
@@ -1328,6 +1580,503 @@ class TimeEntry(models.Model):
     def is_deleteable(self):
         return self.is_editable()
 
+def time_entry_deleted(sender, instance, **kwargs):
+    """
+    Removes a deleted Time Entry's hours and cost from its Task's totals
+    and any leave it recorded from its User's balance.
+
+    This is a signal handler rather than an overridden ``delete`` so
+    Time Entries deleted along with their Timesheet are also handled.
+    When they're deleted along with their Task or User, its totals or
+    their balances may already have been deleted, in which case there's
+    nothing to remove them from.
+    """
+    hours = instance.hours_booked
+    cost = TaskTotal.objects.calculate_costs([instance.get_cost_row()])[0]
+    TaskTotal.objects.adjust(instance.task_id, -hours,
+        instance.approved_by_id is not None and -hours or 0, -cost,
+        create=False)
+    VacationBalance.objects.adjust_for_time_entry(instance.task_id,
+        instance.user_id, instance.week_commencing,
+        [getattr(instance, attr) for attr in VacationBalance.objects.DAY_ATTRS],
+        -1, create=False)
+
+models.signals.post_delete.connect(time_entry_deleted, sender=TimeEntry)
+
+class TaskTotalManager(models.Manager):
+    # Time Entry lookups for the values needed to calculate the cost of
+    # the hours booked in a Time Entry.
+    COST_LOOKUPS = ('user', 'task__task_type', 'week_commencing') + \
+                   TimeEntry.TIME_ATTRS
+
+    # Maps the ways in which invoicing may be driven to the Time Entry
+    # lookup for the object rates are defined for.
+    RATED_LOOKUPS = {
+        u'U': 'user',
+        u'T': 'task__task_type',
+    }
+
+    # The maximum number of Tasks whose costs are recalculated at once
+    UPDATE_CHUNK_SIZE = 500
+
+    def adjust(self, task_id, hours, approved_hours=0, cost=0, create=True):
+        """
+        Adds the given number of hours, approved hours and cost to the
+        totals for the Task with the given id, creating its totals if
+        they do not exist yet and ``create`` is ``True``.
+
+        If another transaction creates the totals first, they're updated
+        instead.
+        """
+        if not hours and not approved_hours and not cost:
+            return
+        opts = self.model._meta
+        query = """
+        UPDATE %(task_total)s
+        SET %(hours)s = %(hours)s + %%s,
+            %(approved)s = %(approved)s + %%s,
+            %(cost)s = %(cost)s + %%s,
+            %(updated_at)s = %%s
+        WHERE %(task_fk)s = %%s""" % {
+            'task_total': qn(opts.db_table),
+            'hours': qn(opts.get_field('hours').column),
+            'approved': qn(opts.get_field('approved').column),
+            'cost': qn(opts.get_field('cost').column),
+            'updated_at': qn(opts.get_field('updated_at').column),
+            'task_fk': qn(opts.get_field('task').column),
+        }
+        updated_at = datetime.datetime.now()
+        cursor = connection.cursor()
+        for attempt in (1, 2):
+            cursor.execute(query, [hours, approved_hours, cost,
+                connection.ops.value_to_db_datetime(updated_at), task_id])
+            if cursor.rowcount or not create:
+                return
+            # Where savepoints are available, losing a race to create the
+            # totals can be recovered from without aborting the transaction.
+            connection._savepoint('task_total')
+            try:
+                super(TaskTotalManager, self).get_query_set().create(
+                    task_id=task_id, hours=hours, approved=approved_hours,
+                    cost=cost, updated_at=updated_at)
+            except IntegrityError:
+                connection._savepoint_rollback('task_total')
+            else:
+                connection._savepoint_commit('task_total')
+                return
+
+    def calculate_costs(self, rows):
+        """
+        Calculates the cost of the hours booked in Time Entries given as
+        rows of values for ``COST_LOOKUPS``, returning a list of costs.
+
+        Costs are calculated with the rates invoicing is driven by, of
+        which only those for the rated objects in the rows are loaded.
+        """
+        from djangoffice.utils.invoice import RATE_MODELS
+        from djangoffice.utils.rates import RateLookup, calculate_cost
+        if not rows:
+            return []
+        driven_by = Invoice.options.driven_by or u'U'
+        rated_index = self.COST_LOOKUPS.index(self.RATED_LOOKUPS[driven_by])
+        model, related_object_attr = RATE_MODELS[driven_by]
+        rate_lookup = RateLookup(model, related_object_attr,
+                                 set([row[rated_index] for row in rows]))
+        return [to_cost(calculate_cost(rate_lookup, row[rated_index], row[2],
+                    [Decimal(str(h or 0)) for h in row[3:]])) \
+                for row in rows]
+
+    def add_approved_hours(self, where, params):
+        """
+        Adds the hours of the Time Entries which match the given SQL
+        ``WHERE`` clause to the approved hours of their Tasks' totals.
+
+        This is intended for use alongside bulk ``UPDATE``s, so must be
+        called *before* the Time Entries are marked as approved if the
+        clause matches unapproved Time Entries.
+        """
+        opts = self.model._meta
+        time_entry_opts = TimeEntry._meta
+        task_fk = qn(time_entry_opts.get_field('task').column)
+        query = """
+        UPDATE %(task_total)s
+        SET %(approved)s = %(approved)s + (
+            SELECT SUM(%(time_columns)s)
+            FROM %(time_entry)s
+            WHERE %(time_entry)s.%(task_fk)s = %(task_total)s.%(task_pk)s
+              AND %(where)s
+        )
+        WHERE %(task_pk)s IN (
+            SELECT %(task_fk)s FROM %(time_entry)s WHERE %(where)s
+        )""" % {
+            'task_total': qn(opts.db_table),
+            'approved': qn(opts.get_field('approved').column),
+            'time_columns': time_entry_hours_sql(),
+            'time_entry': qn(time_entry_opts.db_table),
+            'task_fk': task_fk,
+            'task_pk': qn(opts.get_field('task').column),
+            'where': where,
+        }
+        cursor = connection.cursor()
+        cursor.execute(query, params + params)
+
+    def calculate(self, task_ids=None):
+        """
+        Calculates totals for every Task from its Time Entries, returning
+        a dict mapping Task ids to three-tuples of hours, approved hours
+        and cost.
+
+        If a list of Task ids is given, only totals for those Tasks are
+        calculated.
+        """
+        task_opts = Task._meta
+        time_entry_opts = TimeEntry._meta
+        time_entry_table = qn(time_entry_opts.db_table)
+        where, params = '', []
+        if task_ids is not None:
+            if not task_ids:
+                return {}
+            where = 'WHERE %s.%s IN (%s)' % (qn(task_opts.db_table),
+                qn(task_opts.pk.column), ', '.join(['%s'] * len(task_ids)))
+            params = list(task_ids)
+        query = """
+        SELECT %(task)s.%(task_pk)s,
+               SUM(%(time_columns)s),
+               SUM(CASE WHEN %(time_entry)s.%(approved_by)s IS NULL
+                        THEN 0 ELSE %(time_columns)s END)
+        FROM %(task)s
+        LEFT JOIN %(time_entry)s
+            ON %(time_entry)s.%(task_fk)s = %(task)s.%(task_pk)s
+        %(where)s
+        GROUP BY %(task)s.%(task_pk)s""" % {
+            'task': qn(task_opts.db_table),
+            'task_pk': qn(task_opts.pk.column),
+            'time_columns': time_entry_hours_sql(time_entry_table),
+            'time_entry': time_entry_table,
+            'approved_by': qn(time_entry_opts.get_field('approved_by').column),
+            'task_fk': qn(time_entry_opts.get_field('task').column),
+            'where': where,
+        }
+        cursor = connection.cursor()
+        cursor.execute(query, params)
+        costs = self.calculate_task_costs(task_ids)
+        return dict([(task_id, (to_hours(hours), to_hours(approved),
+                                costs.get(task_id, Decimal('0.00')))) \
+                     for task_id, hours, approved in cursor.fetchall()])
+
+    def calculate_task_costs(self, task_ids=None):
+        """
+        Calculates the cost of all the hours booked against each Task,
+        returning a dict mapping Task ids to costs.
+
+        If a list of Task ids is given, only costs for those Tasks are
+        calculated.
+        """
+        time_entries = TimeEntry.objects.all()
+        if task_ids is not None:
+            time_entries = time_entries.filter(task__in=list(task_ids))
+        rows = list(time_entries.values_list('task', *self.COST_LOOKUPS))
+        costs = {}
+        for row, cost in zip(rows, self.calculate_costs([row[1:] for row in rows])):
+            costs[row[0]] = costs.get(row[0], Decimal('0.00')) + cost
+        return costs
+
+    def update_costs(self, task_ids):
+        """
+        Recalculates the costs held in the totals for the Tasks with the
+        given ids, returning the number of totals updated.
+        """
+        opts = self.model._meta
+        query = """
+        UPDATE %(task_total)s
+        SET %(cost)s = %%s
+        WHERE %(task_fk)s = %%s""" % {
+            'task_total': qn(opts.db_table),
+            'cost': qn(opts.get_field('cost').column),
+            'task_fk': qn(opts.get_field('task').column),
+        }
+        cursor = connection.cursor()
+        count = 0
+        for i in xrange(0, len(task_ids), self.UPDATE_CHUNK_SIZE):
+            chunk = task_ids[i:i + self.UPDATE_CHUNK_SIZE]
+            costs = self.calculate_task_costs(chunk)
+            for task_id in chunk:
+                cursor.execute(query, [costs.get(task_id, Decimal('0.00')),
+                                       task_id])
+                count += cursor.rowcount
+        return count
+
+    def rate_changed(self, rate, old_effective_from=None):
+        """
+        Recalculates the costs of Tasks with time booked which the given
+        added, changed or deleted rate could apply to.
+
+        If a changed rate's effective date was moved, the date it was
+        previously effective from should also be given, as time booked
+        from then applies to the rate too.
+        """
+        from djangoffice.utils.invoice import RATE_MODELS
+        driven_by = Invoice.options.driven_by or u'U'
+        model, related_object_attr = RATE_MODELS[driven_by]
+        if not isinstance(rate, model):
+            return
+        effective_from = rate.effective_from
+        if old_effective_from is not None:
+            effective_from = min(effective_from, old_effective_from)
+        # Overtime for a week is charged at the rate applicable at its
+        # start, so the week before the rate became effective is affected.
+        task_ids = list(TimeEntry.objects.filter(**{
+                self.RATED_LOOKUPS[driven_by]:
+                    getattr(rate, '%s_id' % related_object_attr),
+                'week_commencing__gt':
+                    effective_from - datetime.timedelta(days=7),
+            }).values_list('task', flat=True).distinct())
+        if task_ids:
+            self.update_costs(task_ids)
+
+    def rebuild(self):
+        """
+        Replaces all Task totals with totals calculated from Time
+        Entries, returning the number of Tasks processed.
+        """
+        totals = self.calculate()
+        super(TaskTotalManager, self).get_query_set().delete()
+        for task_id, (hours, approved, cost) in totals.iteritems():
+            super(TaskTotalManager, self).get_query_set().create(
+                task_id=task_id, hours=hours, approved=approved, cost=cost)
+        return len(totals)
+
+    def verify(self):
+        """
+        Compares the stored Task totals with totals calculated from Time
+        Entries, returning a list of three-tuples of Task id, stored
+        totals and calculated totals for each Task which doesn't match.
+        """
+        stored = dict([(task_id, (to_hours(hours), to_hours(approved),
+                                  to_cost(cost))) \
+                       for task_id, hours, approved, cost in \
+                       super(TaskTotalManager, self).get_query_set() \
+                        .values_list('task', 'hours', 'approved', 'cost')])
+        mismatches = []
+        for task_id, calculated in self.calculate().iteritems():
+            totals = stored.get(task_id, (Decimal('0.00'), Decimal('0.00'),
+                                          Decimal('0.00')))
+            if totals != calculated:
+                mismatches.append((task_id, totals, calculated))
+        return mismatches
+
+class TaskTotal(models.Model):
+    """
+    Running totals of the hours booked against a Task and their cost,
+    maintained as its Time Entries are saved, deleted and approved so
+    they never need to be calculated from the Task's entire booking
+    history.
+
+    Costs are recalculated for the Tasks affected when a rate changes;
+    if the way invoicing is driven changes, totals must be rebuilt.
+
+    ``updated_at`` records when hours were last booked against the Task,
+    so notifications only need to check Tasks booked against since they
+    last ran.
+    """
+    task       = models.OneToOneField(Task, primary_key=True, related_name='total')
+    hours      = models.DecimalField(max_digits=10, decimal_places=2, default='0.00')
+    approved   = models.DecimalField(max_digits=10, decimal_places=2, default='0.00')
+    cost       = models.DecimalField(max_digits=12, decimal_places=2, default='0.00')
+    updated_at = models.DateTimeField(default=datetime.datetime.now, db_index=True, editable=False)
+
+    objects = TaskTotalManager()
+
+    def __unicode__(self):
+        return u'%s: %s hours' % (self.task_id, self.hours)
+
+def rate_pre_save(sender, instance, **kwargs):
+    instance._old_effective_from = None
+    if instance.pk is not None:
+        try:
+            instance._old_effective_from = sender._default_manager.filter(
+                pk=instance.pk).values_list('effective_from', flat=True)[0]
+        except IndexError:
+            pass
+
+def rate_changed(sender, instance, raw=False, **kwargs):
+    """
+    Recalculates the costs held in Task totals which a saved or deleted
+    User or Task Type rate may apply to.
+    """
+    if not raw:
+        TaskTotal.objects.rate_changed(instance,
+            getattr(instance, '_old_effective_from', None))
+
+models.signals.pre_save.connect(rate_pre_save, sender=UserRate)
+models.signals.post_save.connect(rate_changed, sender=UserRate)
+models.signals.post_delete.connect(rate_changed, sender=UserRate)
+models.signals.pre_save.connect(rate_pre_save, sender=TaskTypeRate)
+models.signals.post_save.connect(rate_changed, sender=TaskTypeRate)
+models.signals.post_delete.connect(rate_changed, sender=TaskTypeRate)
+
+def vacation_hours_by_year(week_commencing, day_hours):
+    """
+    Splits the hours booked on each day of the week commencing on the
+    given date between the years the days fall in, returning a dict
+    mapping years to hours.
+    """
+    years = {}
+    for day, hours in enumerate(day_hours):
+        if hours:
+            year = (week_commencing + datetime.timedelta(days=day)).year
+            years[year] = years.get(year, Decimal('0.00')) + \
+                          Decimal(str(hours))
+    return years
+
+class VacationBalanceManager(models.Manager):
+    # Time Entry attributes holding hours of leave - overtime isn't leave
+    DAY_ATTRS = TimeEntry.TIME_ATTRS[:7]
+
+    def adjust(self, user_id, year, hours, create=True):
+        """
+        Adds the given number of hours to the leave taken by the User
+        with the given id in the given year, creating their balance if
+        it does not exist yet and ``create`` is ``True``.
+
+        If another transaction creates the balance first, it's updated
+        instead.
+        """
+        if not hours:
+            return
+        opts = self.model._meta
+        query = """
+        UPDATE %(balance)s
+        SET %(taken)s = %(taken)s + %%s
+        WHERE %(user_fk)s = %%s
+          AND %(year)s = %%s""" % {
+            'balance': qn(opts.db_table),
+            'taken': qn(opts.get_field('taken').column),
+            'user_fk': qn(opts.get_field('user').column),
+            'year': qn(opts.get_field('year').column),
+        }
+        cursor = connection.cursor()
+        for attempt in (1, 2):
+            cursor.execute(query, [hours, user_id, year])
+            if cursor.rowcount or not create:
+                return
+            # Where savepoints are available, losing a race to create the
+            # balance can be recovered from without aborting the transaction.
+            connection._savepoint('vacation_balance')
+            try:
+                super(VacationBalanceManager, self).get_query_set().create(
+                    user_id=user_id, year=year, taken=hours)
+            except IntegrityError:
+                connection._savepoint_rollback('vacation_balance')
+            else:
+                connection._savepoint_commit('vacation_balance')
+                return
+
+    def adjust_for_time_entry(self, task_id, user_id, week_commencing,
+                              day_hours, sign=1, create=True):
+        """
+        Adds (or with a ``sign`` of ``-1``, removes) the hours booked on
+        each day of a Time Entry to the leave its User has taken, if it
+        was booked against the vacation Task, creating their balances if
+        they do not exist yet and ``create`` is ``True``.
+        """
+        vacation_task_id = Task.options.vacation_task_id
+        if not vacation_task_id or task_id != vacation_task_id:
+            return
+        for year, hours in vacation_hours_by_year(week_commencing,
+                                                  day_hours).iteritems():
+            self.adjust(user_id, year, sign * hours, create)
+
+    def calculate(self):
+        """
+        Calculates the leave taken by each User in each year from the
+        Time Entries booked against the vacation Task, returning a dict
+        mapping two-tuples of User id and year to hours.
+        """
+        vacation_task_id = Task.options.vacation_task_id
+        if not vacation_task_id:
+            return {}
+        opts = TimeEntry._meta
+        query = """
+        SELECT %(user_fk)s, %(week_commencing)s, %(day_sums)s
+        FROM %(time_entry)s
+        WHERE %(task_fk)s = %%s
+        GROUP BY %(user_fk)s, %(week_commencing)s""" % {
+            'user_fk': qn(opts.get_field('user').column),
+            'week_commencing': qn(opts.get_field('week_commencing').column),
+            'day_sums': ', '.join(['SUM(%s)' % qn(opts.get_field(attr).column) \
+                                   for attr in self.DAY_ATTRS]),
+            'time_entry': qn(opts.db_table),
+            'task_fk': qn(opts.get_field('task').column),
+        }
+        cursor = connection.cursor()
+        cursor.execute(query, [vacation_task_id])
+        week_commencing_field = opts.get_field('week_commencing')
+        totals = {}
+        for row in cursor.fetchall():
+            week_commencing = week_commencing_field.to_python(row[1])
+            for year, hours in vacation_hours_by_year(week_commencing,
+                                                      row[2:]).iteritems():
+                key = (row[0], year)
+                totals[key] = totals.get(key, Decimal('0.00')) + hours
+        return dict([(key, to_hours(hours)) \
+                     for key, hours in totals.iteritems() if hours])
+
+    def rebuild(self):
+        """
+        Replaces all leave balances with balances calculated from Time
+        Entries, returning the number of balances created.
+        """
+        totals = self.calculate()
+        super(VacationBalanceManager, self).get_query_set().delete()
+        for (user_id, year), taken in totals.iteritems():
+            super(VacationBalanceManager, self).get_query_set().create(
+                user_id=user_id, year=year, taken=taken)
+        return len(totals)
+
+    def verify(self):
+        """
+        Compares the stored leave balances with balances calculated from
+        Time Entries, returning a list of four-tuples of User id, year,
+        stored hours and calculated hours for each balance which doesn't
+        match.
+        """
+        stored = dict([((user_id, year), to_hours(taken)) \
+                       for user_id, year, taken in \
+                       super(VacationBalanceManager, self).get_query_set() \
+                        .values_list('user', 'year', 'taken')])
+        calculated = self.calculate()
+        mismatches = []
+        for key in sorted(set(stored.keys()) | set(calculated.keys())):
+            taken = stored.get(key, Decimal('0.00'))
+            expected = calculated.get(key, Decimal('0.00'))
+            if taken != expected:
+                mismatches.append(key + (taken, expected))
+        return mismatches
+
+class VacationBalance(models.Model):
+    """
+    The hours of leave a User has taken in a year, maintained as Time
+    Entries booked against the vacation Task are saved and deleted so
+    leave can be reported on without reading Time Entries.
+
+    Leave booked in a week which spans the end of a year is split
+    between the years its days fall in. If the vacation Task changes,
+    balances must be rebuilt.
+    """
+    user  = models.ForeignKey(User, related_name='vacation_balances')
+    year  = models.PositiveIntegerField()
+    taken = models.DecimalField(max_digits=7, decimal_places=2, default='0.00')
+
+    objects = VacationBalanceManager()
+
+    def __unicode__(self):
+        return u'%s - %s: %s hours' % (self.year, self.user_id, self.taken)
+
+    class Meta:
+        # One balance per user per year
+        unique_together = (('user', 'year'),)
+
 ############
 # Expenses #
 ############
@@ -1372,13 +2121,23 @@ class ExpenseManager(models.Manager):
         opts = self.model._meta
         job_opts = Job._meta
         expense_type_opts = ExpenseType._meta
+        invoice_opts = Invoice._meta
         job_table = qn(job_opts.db_table)
         expense_type_table = qn(expense_type_opts.db_table)
+        invoice_table = qn(invoice_opts.db_table)
         return super(ExpenseManager, self).get_query_set().filter(timesheet=timesheet).extra(
             select={
                 'job_number': '%s.%s' % (job_table, qn(job_opts.get_field('number').column)),
                 'job_name': '%s.%s' % (job_table, qn(job_opts.get_field('name').column)),
                 'type_name': '%s.%s' % (expense_type_table, qn(expense_type_opts.get_field('name').column)),
+                'invoice_number': 'SELECT %s FROM %s WHERE %s.%s = %s.%s' % (
+                    qn(invoice_opts.get_field('number').column),
+                    invoice_table,
+                    invoice_table,
+                    qn(invoice_opts.pk.column),
+                    qn(opts.db_table),
+                    qn(opts.get_field('invoice').column),
+                ),
             },
             tables=[job_table, expense_type_table],
             where=[
@@ -1397,26 +2156,25 @@ class ExpenseManager(models.Manager):
             ]
         )
 
-    def bulk_approve(self, user, start_date, end_date):
+    def approve_chunk(self, user, start_date, end_date, size):
         """
-        Marks all unapproved Expenses between the given dates as
-        approved by the given User and returns the number of rows
-        updated.
+        Marks up to ``size`` unapproved Expenses between the given dates
+        as approved by the given User, returning a dict mapping the ids
+        of the Users who incurred them to the number approved.
         """
-        opts = self.model._meta
-        query = """
-        UPDATE %(expense)s
-        SET %(approved_by)s = %%s
-        WHERE %(date)s >= %%s
-          AND %(date)s <= %%s
-          AND %(approved_by)s IS NULL""" % {
-            'expense': qn(opts.db_table),
-            'approved_by': qn(opts.get_field('approved_by').column),
-            'date': qn(opts.get_field('date').column),
-        }
-        cursor = connection.cursor()
-        cursor.execute(query, [user.id, start_date, end_date])
-        return cursor.rowcount
+        ids = list(super(ExpenseManager, self).get_query_set() \
+            .filter(date__gte=start_date, date__lte=end_date,
+                    approved_by__isnull=True) \
+            .order_by('pk').values_list('pk', flat=True)[:size])
+        if not ids:
+            return {}
+        super(ExpenseManager, self).get_query_set() \
+            .filter(pk__in=ids, approved_by__isnull=True) \
+            .update(approved_by=user)
+        # Other approvals may have approved some of the Expenses first,
+        # so only those this chunk approved are counted.
+        return count_by_user(super(ExpenseManager, self).get_query_set() \
+            .filter(pk__in=ids, approved_by=user).values_list('pk', 'user'))
 
 class Expense(models.Model):
     """
@@ -1435,6 +2193,9 @@ class Expense(models.Model):
     approved_by = models.ForeignKey(User, null=True, blank=True, related_name='approved_expenses')
     invoice     = models.ForeignKey(Invoice, null=True, blank=True, related_name='expenses')
 
+    # Notification
+    over_limit = models.BooleanField(default=False, verbose_name=u'Notified about being over limit')
+
     objects = ExpenseManager()
 
     def __unicode__(self):
@@ -1462,6 +2223,132 @@ class Expense(models.Model):
     def is_deleteable(self):
         return self.is_editable()
 
+#################
+# Bulk Approval #
+#################
+
+class BulkApprovalManager(models.Manager):
+    def incomplete(self):
+        return self.filter(completed_at__isnull=True)
+
+class BulkApproval(models.Model):
+    """
+    Approval of all unapproved Time Entries and Expenses for a range of
+    weeks.
+
+    Items are approved a week at a time, in chunks of at most
+    ``BULK_APPROVAL_CHUNK_SIZE`` Time Entries and Expenses, with a
+    transaction committed after each chunk, so the Time Entry and
+    Expense tables are never locked for long. Progress is recorded as
+    chunks are committed, so an interrupted approval can be resumed by
+    running it again. Each chunk locks the approval first, so runs of it
+    which overlap, e.g. when it's resumed while it's still running,
+    approve chunks one at a time.
+    """
+    approved_by  = models.ForeignKey(User, related_name='bulk_approvals')
+    start_date   = models.DateField()
+    end_date     = models.DateField()
+    next_week    = models.DateField(editable=False)
+    created_at   = models.DateTimeField(editable=False)
+    completed_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    objects = BulkApprovalManager()
+
+    def __unicode__(self):
+        return u'%s - %s' % (self.start_date, self.end_date)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def save(self, *args, **kwargs):
+        if not self.id:
+            self.created_at = datetime.datetime.now()
+            self.next_week = self.start_date - \
+                datetime.timedelta(days=self.start_date.weekday())
+        super(BulkApproval, self).save(*args, **kwargs)
+
+    def is_complete(self):
+        return self.completed_at is not None
+
+    @property
+    def time_entries(self):
+        return sum([c.time_entries for c in self.user_counts.all()])
+
+    @property
+    def expenses(self):
+        return sum([c.expenses for c in self.user_counts.all()])
+
+    def run(self, chunk_size=None):
+        """
+        Approves items from the next week still to be approved onwards,
+        committing after each chunk.
+        """
+        if chunk_size is None:
+            chunk_size = settings.BULK_APPROVAL_CHUNK_SIZE
+        while not self.is_complete():
+            self.approve_chunk(chunk_size)
+
+    def approve_chunk(self, chunk_size):
+        """
+        Approves a chunk of items for the next week still to be
+        approved, moving on to the following week once there are none
+        left.
+        """
+        self._lock()
+        if self.is_complete():
+            return
+        week_start = max(self.next_week, self.start_date)
+        week_end = min(self.next_week + datetime.timedelta(days=6),
+                       self.end_date)
+        time_entries = TimeEntry.objects.approve_chunk(self.approved_by,
+            self.next_week, chunk_size)
+        expenses = Expense.objects.approve_chunk(self.approved_by,
+            week_start, week_end, chunk_size)
+        for user_id in set(time_entries.keys()) | set(expenses.keys()):
+            self.add_counts(user_id, time_entries.get(user_id, 0),
+                            expenses.get(user_id, 0))
+        if sum(time_entries.values()) < chunk_size and \
+           sum(expenses.values()) < chunk_size:
+            self.next_week += datetime.timedelta(weeks=1)
+            if self.next_week > self.end_date:
+                self.completed_at = datetime.datetime.now()
+            self.save()
+    approve_chunk = transaction.commit_on_success(approve_chunk)
+
+    def _lock(self):
+        """
+        Locks the approval for the rest of the current transaction,
+        reloading the progress made by any other run of it.
+        """
+        approval = BulkApproval.objects.filter(pk=self.pk)
+        approval.update(next_week=models.F('next_week'))
+        self.next_week, self.completed_at = \
+            approval.values_list('next_week', 'completed_at')[0]
+
+    def add_counts(self, user_id, time_entries, expenses):
+        updated = self.user_counts.filter(user=user_id).update(
+            time_entries=models.F('time_entries') + time_entries,
+            expenses=models.F('expenses') + expenses)
+        if not updated:
+            self.user_counts.create(user_id=user_id,
+                time_entries=time_entries, expenses=expenses)
+
+class BulkApprovalUserCount(models.Model):
+    """
+    The number of a User's Time Entries and Expenses approved by a
+    ``BulkApproval``.
+    """
+    bulk_approval = models.ForeignKey(BulkApproval, related_name='user_counts')
+    user          = models.ForeignKey(User, related_name='bulk_approval_counts')
+    time_entries  = models.PositiveIntegerField(default=0)
+    expenses      = models.PositiveIntegerField(default=0)
+
+    def __unicode__(self):
+        return u'%s: %s' % (self.bulk_approval, self.user_id)
+
+    class Meta:
+        unique_together = (('bulk_approval', 'user'),)
+
 ###########
 # Reports #
 ###########
@@ -1472,26 +2359,46 @@ class SQLReportManager(models.Manager):
         Creates a ``QuerySet`` containing SQL Reports the given User may
         access based on their role.
         """
-        user_profile = user.get_profile()
+        from djangoffice.auth import get_principal
+        principal = get_principal(user)
         qs = super(SQLReportManager, self).get_query_set()
-        if user_profile.is_admin():
+        if principal.is_admin():
             pass
-        elif user_profile.is_manager():
+        elif principal.is_manager():
             qs = qs.filter(access__in=['M','U'])
-        elif user_profile.is_user():
+        elif principal.is_user():
             qs = qs.filter(access='U')
         return qs
 
+# Compiled SQL Report queries, keyed by query
+_compiled_queries = {}
+MAX_COMPILED_QUERIES = 100
+
 class SQLReport(models.Model):
     """
     A custom report defined using SQL.
+
+    Queries may contain ``::name`` placeholders for SQL parameters, which
+    are executed as bound parameters - a placeholder which makes up the
+    whole of a quoted string, such as ``'::UpToDate'``, is replaced
+    with its value including the quotes, and one embedded in a quoted
+    string, such as ``'%::Name%'``, is concatenated with the rest of it.
     """
     SQL_PARAM_RE = re.compile(r'::([a-zA-Z]+)')
+    # Matches a quoted string or a placeholder outside quoted strings
+    QUERY_TOKEN_RE = re.compile(r"'(?:[^']|'')*'|::([a-zA-Z]+)")
     HEADING_RE = re.compile(r'AS \'([\sa-zA-Z]+)\'')
 
-    name   = models.CharField(max_length=100, unique=True)
-    access = models.CharField(max_length=1, choices=ACCESS_CHOICES)
-    query  = models.TextField(validators=[isSafeishQuery])
+    name    = models.CharField(max_length=100, unique=True)
+    access  = models.CharField(max_length=1, choices=ACCESS_CHOICES)
+    query   = models.TextField(validators=[isSafeishQuery])
+    timeout = models.PositiveIntegerField(default=60, help_text=u'Maximum time in seconds the query may run for.')
+
+    # Result caching
+    cache_results = models.BooleanField(default=False, help_text=u'Cache results for each combination of parameters and role.')
+    cache_ttl     = models.PositiveIntegerField(default=3600, verbose_name=u'Cache lifetime', help_text=u'In seconds.')
+    cache_hits    = models.PositiveIntegerField(default=0, editable=False)
+    cache_misses  = models.PositiveIntegerField(default=0, editable=False)
 
     objects = SQLReportManager()
 
@@ -1513,11 +2420,675 @@ class SQLReport(models.Model):
     def get_sql_parameters(self):
         return set(self.SQL_PARAM_RE.findall(self.query))
 
-    def get_populated_query(self, params):
-        query = self.query
-        for param, value in params.items():
-            query = query.replace(u'::%s' % param, value)
-        return query
+    def get_compiled_query(self, connection=connection):
+        """
+        Compiles this SQL Report's query for execution with bound
+        parameters on the given connection, returning a two-tuple of:
+
+        * The query, with placeholders replaced by ``%s`` and other ``%``
+          characters escaped. Quoted strings which placeholders are
+          embedded in are replaced with an expression concatenating
+          their text with the bound parameters.
+        * A list of the names of the parameters to be bound, in order.
+
+        Compiled queries are cached by query, so each revision of a
+        report's query is only compiled once for each database.
+        """
+        use_concat = connection.settings_dict['ENGINE'].endswith('mysql')
+        key = (use_concat, self.query)
+        compiled = _compiled_queries.get(key)
+        if compiled is None:
+            bound_names = []
+            def compile_string(token):
+                # Splits the string's text at its placeholders
+                parts = []
+                position = 0
+                for match in self.SQL_PARAM_RE.finditer(token[1:-1]):
+                    text = token[position + 1:match.start() + 1]
+                    if text:
+                        parts.append(u"'%s'" % text.replace(u'%', u'%%'))
+                    parts.append(u'%s')
+                    bound_names.append(match.group(1))
+                    position = match.end()
+                if position < len(token) - 2:
+                    parts.append(u"'%s'" % token[position + 1:-1] \
+                                           .replace(u'%', u'%%'))
+                if use_concat:
+                    return u'CONCAT(%s)' % u', '.join(parts)
+                return u'(%s)' % u' || '.join(parts)
+            def compile_token(match):
+                token = match.group(0)
+                name = match.group(1)
+                if name is None:
+                    placeholder = self.SQL_PARAM_RE.match(token[1:-1])
+                    if placeholder and placeholder.end() == len(token) - 2:
+                        name = placeholder.group(1)
+                    elif self.SQL_PARAM_RE.search(token):
+                        return compile_string(token)
+                    else:
+                        return token.replace(u'%', u'%%')
+                bound_names.append(name)
+                return u'%s'
+            chunks = []
+            position = 0
+            for match in self.QUERY_TOKEN_RE.finditer(self.query):
+                chunks.append(self.query[position:match.start()].replace(u'%', u'%%'))
+                chunks.append(compile_token(match))
+                position = match.end()
+            chunks.append(self.query[position:].replace(u'%', u'%%'))
+            compiled = (u''.join(chunks), bound_names)
+            if len(_compiled_queries) >= MAX_COMPILED_QUERIES:
+                _compiled_queries.clear()
+            _compiled_queries[key] = compiled
+        return compiled
+
+    def get_bound_query(self, params, connection=connection):
+        """
+        Returns a two-tuple of this SQL Report's query compiled for the
+        given connection and a list of the given parameter values to be
+        bound to it.
+        """
+        query, bound_names = self.get_compiled_query(connection)
+        return query, [params[name] for name in bound_names]
 
     def get_headings_from_query(self):
         return self.HEADING_RE.findall(self.query)
+
+    def record_cache_use(self, hit):
+        """
+        Counts a lookup of this SQL Report's cached results as a hit or a
+        miss.
+        """
+        field = hit and 'cache_hits' or 'cache_misses'
+        SQLReport.objects.filter(pk=self.pk).update(
+            **{field: models.F(field) + 1})
+        setattr(self, field, getattr(self, field) + 1)
+
+    def get_cache_hit_rate(self):
+        """
+        Returns the percentage of lookups of this SQL Report's cached
+        results which were hits, or ``None`` if there haven't been any.
+        """
+        lookups = self.cache_hits + self.cache_misses
+        if not lookups:
+            return None
+        return 100 * self.cache_hits / lookups
+
+class SQLReportJobManager(models.Manager):
+    def claim_next(self, worker):
+        """
+        Claims the oldest queued job for the given worker, returning it,
+        or ``None`` if there are no queued jobs.
+
+        A job is claimed by updating its status only if it's still
+        queued, so concurrent workers never claim the same job.
+        """
+        queued = self.filter(status=SQLReportJob.QUEUED_STATUS)
+        for job_id in queued.order_by('pk').values_list('pk', flat=True):
+            claimed = queued.filter(pk=job_id).update(
+                status=SQLReportJob.RUNNING_STATUS, worker=worker,
+                started_at=datetime.datetime.now())
+            if claimed:
+                return self.get(pk=job_id)
+        return None
+
+    def expired(self):
+        """
+        Creates a ``QuerySet`` containing finished jobs whose results are
+        older than ``SQL_REPORT_JOB_LIFETIME`` seconds.
+        """
+        cutoff = datetime.datetime.now() - \
+                 datetime.timedelta(seconds=settings.SQL_REPORT_JOB_LIFETIME)
+        return self.filter(status__in=[SQLReportJob.COMPLETE_STATUS,
+                                       SQLReportJob.FAILED_STATUS],
+                           completed_at__lt=cutoff)
+
+    def fail_abandoned(self):
+        """
+        Marks running jobs which were started more than
+        ``SQL_REPORT_JOB_TIMEOUT`` seconds ago as failed, returning the
+        number failed - their reports would have timed out by now, so
+        the workers running them must have died.
+        """
+        now = datetime.datetime.now()
+        cutoff = now - \
+                 datetime.timedelta(seconds=settings.SQL_REPORT_JOB_TIMEOUT)
+        return self.filter(status=SQLReportJob.RUNNING_STATUS,
+                           started_at__lt=cutoff).update(
+            status=SQLReportJob.FAILED_STATUS, completed_at=now,
+            error=u'The worker running this report stopped before it finished.')
+
+class SQLReportJob(models.Model):
+    """
+    An execution of a SQL Report in the background by a worker process,
+    whose results are stored for later viewing and downloading.
+    """
+    QUEUED_STATUS   = u'Q'
+    RUNNING_STATUS  = u'R'
+    COMPLETE_STATUS = u'C'
+    FAILED_STATUS   = u'F'
+    STATUS_CHOICES = (
+        (QUEUED_STATUS, u'Queued'),
+        (RUNNING_STATUS, u'Running'),
+        (COMPLETE_STATUS, u'Complete'),
+        (FAILED_STATUS, u'Failed'),
+    )
+
+    sql_report   = models.ForeignKey(SQLReport, related_name='jobs')
+    user         = models.ForeignKey(User, related_name='sql_report_jobs')
+    params       = models.TextField(editable=False)
+    status       = models.CharField(max_length=1, choices=STATUS_CHOICES, default=QUEUED_STATUS)
+    worker       = models.CharField(max_length=100, blank=True)
+    created_at   = models.DateTimeField(editable=False)
+    started_at   = models.DateTimeField(null=True, blank=True, editable=False)
+    completed_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    # Results
+    row_count = models.PositiveIntegerField(default=0)
+    truncated = models.BooleanField(default=False)
+    error     = models.TextField(blank=True)
+
+    objects = SQLReportJobManager()
+
+    def __unicode__(self):
+        return u'%s - %s' % (self.sql_report, self.created_at)
+
+    class Meta:
+        verbose_name = u'SQL report job'
+        ordering = ['-created_at']
+
+    def save(self, *args, **kwargs):
+        if not self.id:
+            self.created_at = datetime.datetime.now()
+        super(SQLReportJob, self).save(*args, **kwargs)
+
+    @models.permalink
+    def get_absolute_url(self):
+        return ('sql_report_job_detail', (smart_unicode(self.id),))
+
+    def get_params(self):
+        return simplejson.loads(self.params)
+
+    def set_params(self, params):
+        self.params = simplejson.dumps(params)
+
+    def is_finished(self):
+        return self.status in (self.COMPLETE_STATUS, self.FAILED_STATUS)
+
+    def get_results_path(self):
+        return os.path.join(settings.SQL_REPORT_JOB_RESULTS_DIR,
+                            'job%s.results' % self.pk)
+
+#############
+# Numbering #
+#############
+
+class NumberSequence(models.Model):
+    """
+    A sequence of numbers handed out by a ``NumberAllocator``, named for
+    the table holding the numbers.
+
+    The sequence's row is updated at the start of every allocation,
+    which serialises allocations from concurrent transactions.
+    """
+    name        = models.CharField(max_length=100, primary_key=True)
+    allocations = models.PositiveIntegerField(default=0)
+
+    def __unicode__(self):
+        return self.name
+
+class NumberRange(models.Model):
+    """
+    A range of free numbers in a ``NumberSequence`` - a ``None``
+    ``last_number`` indicates that all numbers from ``first_number``
+    onwards are free.
+    """
+    sequence     = models.ForeignKey(NumberSequence, related_name='free_ranges')
+    first_number = models.PositiveIntegerField()
+    last_number  = models.PositiveIntegerField(null=True, blank=True)
+
+    def __unicode__(self):
+        return u'%s: %s-%s' % (self.sequence_id, self.first_number,
+                               self.last_number or u'')
+
+    class Meta:
+        unique_together = (('sequence', 'first_number'),)
+
+class NumberAllocator(object):
+    """
+    Hands out free numbers for a model's ``number`` field, filling gaps
+    in existing numbering before continuing on from the highest number
+    in use, as the old self-join lookups did. Numbers below the lowest
+    number in use are never handed out, and the first number is 1.
+
+    Free numbers are held as ranges in ``NumberRange``, which is created
+    from the model's table the first time a sequence is used, so
+    allocating a number only touches the lowest free ranges rather than
+    scanning the whole table.
+
+    Every operation begins by updating the sequence's ``NumberSequence``
+    row, taking a lock which is held until the current transaction
+    ends - concurrent transactions allocating from the same sequence
+    wait for each other rather than being handed the same numbers.
+    Numbers are handed out within the current transaction, so they are
+    returned to the sequence if it is rolled back.
+    """
+    def __init__(self, model, connection=None):
+        self.model = model
+        if connection is None:
+            from django.db import connection
+        self.connection = connection
+        qn = self.connection.ops.quote_name
+        opts = model._meta
+        range_opts = NumberRange._meta
+        sequence_opts = NumberSequence._meta
+        self.name = opts.db_table
+        self.sql_params = {
+            'table': qn(opts.db_table),
+            'number': qn(opts.get_field('number').column),
+            'sequence': qn(sequence_opts.db_table),
+            'name': qn(sequence_opts.pk.column),
+            'allocations': qn(sequence_opts.get_field('allocations').column),
+            'range': qn(range_opts.db_table),
+            'id': qn(range_opts.pk.column),
+            'sequence_fk': qn(range_opts.get_field('sequence').column),
+            'first': qn(range_opts.get_field('first_number').column),
+            'last': qn(range_opts.get_field('last_number').column),
+        }
+
+    def _execute(self, cursor, query, params):
+        cursor.execute(query % self.sql_params, params)
+        return cursor
+
+    def _lock(self, cursor):
+        """
+        Locks the sequence for the rest of the current transaction,
+        creating it if it doesn't exist yet.
+        """
+        for attempt in (1, 2):
+            self._execute(cursor, """
+            UPDATE %(sequence)s
+            SET %(allocations)s = %(allocations)s + 1
+            WHERE %(name)s = %%s""", [self.name])
+            if cursor.rowcount:
+                break
+            self._create(cursor)
+
+    def _create(self, cursor):
+        """
+        Creates the sequence and its free ranges from numbers currently
+        in use, unless another transaction has already created it.
+        """
+        # Where savepoints are available, losing a race to create the
+        # sequence can be recovered from without aborting the transaction.
+        self.connection._savepoint('number_sequence')
+        try:
+            self._execute(cursor, """
+            INSERT INTO %(sequence)s (%(name)s, %(allocations)s)
+            SELECT %%s, 0
+            WHERE NOT EXISTS (
+                SELECT 1 FROM %(sequence)s WHERE %(name)s = %%s
+            )""", [self.name, self.name])
+        except IntegrityError:
+            self.connection._savepoint_rollback('number_sequence')
+            return
+        self.connection._savepoint_commit('number_sequence')
+        if not cursor.rowcount:
+            return
+        self._execute(cursor, """
+        INSERT INTO %(range)s (%(sequence_fk)s, %(first)s, %(last)s)
+        SELECT %%s, t1.%(number)s + 1, (
+            SELECT MIN(t3.%(number)s)
+            FROM %(table)s t3
+            WHERE t3.%(number)s > t1.%(number)s) - 1
+        FROM %(table)s t1
+        LEFT JOIN %(table)s t2
+            ON t2.%(number)s = t1.%(number)s + 1
+        WHERE t2.%(number)s IS NULL""", [self.name])
+        if not cursor.rowcount:
+            self._reset_ranges(cursor)
+
+    def _reset_ranges(self, cursor):
+        """
+        Makes every number from 1 onwards free.
+        """
+        self._execute(cursor, """
+        DELETE FROM %(range)s WHERE %(sequence_fk)s = %%s""", [self.name])
+        self._execute(cursor, """
+        INSERT INTO %(range)s (%(sequence_fk)s, %(first)s, %(last)s)
+        VALUES (%%s, 1, NULL)""", [self.name])
+
+    def _find_range(self, cursor, number):
+        """
+        Finds the free range containing the given number, returning a
+        three-tuple of its id, first and last number or ``None``.
+        """
+        self._execute(cursor, """
+        SELECT %(id)s, %(first)s, %(last)s
+        FROM %(range)s
+        WHERE %(sequence_fk)s = %%s
+          AND %(first)s <= %%s
+          AND (%(last)s IS NULL OR %(last)s >= %%s)""",
+            [self.name, number, number])
+        return cursor.fetchone()
+
+    def get_next_free_number(self):
+        """
+        Determines the next free number without handing it out.
+
+        If the sequence hasn't been created yet, the number is found
+        from the numbers in use instead, as creating the sequence would
+        lock it.
+        """
+        cursor = self.connection.cursor()
+        self._execute(cursor, """
+        SELECT MIN(%(first)s) FROM %(range)s
+        WHERE %(sequence_fk)s = %%s""", [self.name])
+        number = cursor.fetchone()[0]
+        if number is not None:
+            return number
+        self._execute(cursor, """
+        SELECT MIN(t1.%(number)s) + 1
+        FROM %(table)s t1
+        LEFT JOIN %(table)s t2
+            ON t2.%(number)s = t1.%(number)s + 1
+        WHERE t2.%(number)s IS NULL""", [])
+        return cursor.fetchone()[0] or 1
+
+    def allocate(self, count=1):
+        """
+        Hands out the given number of free numbers, lowest first.
+        """
+        if count < 1:
+            return []
+        cursor = self.connection.cursor()
+        self._lock(cursor)
+        # Every free range holds at least one number, and the last one
+        # never runs out, so the lowest ``count`` ranges will do.
+        self._execute(cursor, """
+        SELECT %(id)s, %(first)s, %(last)s
+        FROM %(range)s
+        WHERE %(sequence_fk)s = %%s
+        ORDER BY %(first)s
+        LIMIT %%s""", [self.name, count])
+        numbers = []
+        for id, first, last in cursor.fetchall():
+            wanted = count - len(numbers)
+            if last is not None and last - first + 1 <= wanted:
+                numbers.extend(range(first, last + 1))
+                self._execute(cursor, """
+                DELETE FROM %(range)s WHERE %(id)s = %%s""", [id])
+            else:
+                numbers.extend(range(first, first + wanted))
+                self._execute(cursor, """
+                UPDATE %(range)s SET %(first)s = %%s
+                WHERE %(id)s = %%s""", [first + wanted, id])
+            if len(numbers) == count:
+                break
+        return numbers
+
+    def claim(self, number):
+        """
+        Marks a number which is being used without having been allocated
+        as no longer free.
+        """
+        cursor = self.connection.cursor()
+        self._lock(cursor)
+        free_range = self._find_range(cursor, number)
+        if free_range is None:
+            self._claim_lowest(cursor, number)
+            return
+        id, first, last = free_range
+        if first == last:
+            self._execute(cursor, """
+            DELETE FROM %(range)s WHERE %(id)s = %%s""", [id])
+        elif number == first:
+            self._execute(cursor, """
+            UPDATE %(range)s SET %(first)s = %%s
+            WHERE %(id)s = %%s""", [number + 1, id])
+        else:
+            self._execute(cursor, """
+            UPDATE %(range)s SET %(last)s = %%s
+            WHERE %(id)s = %%s""", [number - 1, id])
+            if last is None or number < last:
+                self._execute(cursor, """
+                INSERT INTO %(range)s (%(sequence_fk)s, %(first)s, %(last)s)
+                VALUES (%%s, %%s, %%s)""", [self.name, number + 1, last])
+
+    def _claim_lowest(self, cursor, number):
+        """
+        Numbers below the lowest number in use aren't free, so using one
+        opens up a gap between it and the next number in use - unless
+        the number has already been claimed, which opened the gap.
+        """
+        self._execute(cursor, """
+        SELECT MIN(%(number)s) FROM %(table)s
+        WHERE %(number)s <> %%s""", [number])
+        lowest = cursor.fetchone()[0]
+        if lowest is not None and number + 1 < lowest and \
+           self._find_range(cursor, number + 1) is None:
+            self._execute(cursor, """
+            INSERT INTO %(range)s (%(sequence_fk)s, %(first)s, %(last)s)
+            VALUES (%%s, %%s, %%s)""", [self.name, number + 1, lowest - 1])
+
+    def release(self, number):
+        """
+        Marks a number which is no longer in use as free.
+
+        As before, numbers below the lowest number still in use are not
+        reused.
+        """
+        cursor = self.connection.cursor()
+        self._lock(cursor)
+        self._execute(cursor, """
+        SELECT MIN(%(number)s) FROM %(table)s""", [])
+        lowest = cursor.fetchone()[0]
+        if lowest is None:
+            self._reset_ranges(cursor)
+        elif number < lowest:
+            self._execute(cursor, """
+            DELETE FROM %(range)s
+            WHERE %(sequence_fk)s = %%s
+              AND %(first)s < %%s""", [self.name, lowest])
+        elif number != lowest and self._find_range(cursor, number) is None:
+            self._execute(cursor, """
+            INSERT INTO %(range)s (%(sequence_fk)s, %(first)s, %(last)s)
+            VALUES (%%s, %%s, %%s)""", [self.name, number, number])
+
+    def reset(self):
+        """
+        Discards the sequence, so its free ranges will be recreated from
+        numbers in use the next time it's used.
+        """
+        cursor = self.connection.cursor()
+        self._execute(cursor, """
+        DELETE FROM %(range)s WHERE %(sequence_fk)s = %%s""", [self.name])
+        self._execute(cursor, """
+        DELETE FROM %(sequence)s WHERE %(name)s = %%s""", [self.name])
+
+def numbered_pre_save(sender, instance, **kwargs):
+    instance._old_number = None
+    if instance.pk is not None:
+        try:
+            instance._old_number = sender._default_manager.filter(
+                pk=instance.pk).values_list('number', flat=True)[0]
+        except IndexError:
+            pass
+
+def numbered_post_save(sender, instance, created, **kwargs):
+    """
+    Claims numbers which were given rather than allocated and releases
+    numbers which have been changed.
+    """
+    old_number = getattr(instance, '_old_number', None)
+    if created or old_number != instance.number:
+        allocator = NumberAllocator(sender)
+        allocator.claim(instance.number)
+        if old_number is not None and old_number != instance.number:
+            allocator.release(old_number)
+
+def numbered_post_delete(sender, instance, **kwargs):
+    NumberAllocator(sender).release(instance.number)
+
+for model in (Job, Invoice):
+    models.signals.pre_save.connect(numbered_pre_save, sender=model)
+    models.signals.post_save.connect(numbered_post_save, sender=model)
+    models.signals.post_delete.connect(numbered_post_delete, sender=model)
+
+#################
+# Notifications #
+#################
+
+class NotificationWatermark(models.Model):
+    """
+    How far a notification rule has checked for changes - the last id
+    it checked or the time it checked up until, depending on the rule.
+    """
+    rule          = models.CharField(max_length=50, primary_key=True)
+    last_id       = models.PositiveIntegerField(null=True, blank=True)
+    checked_until = models.DateTimeField(null=True, blank=True)
+
+    def __unicode__(self):
+        return self.rule
+
+class OutboxEmailManager(models.Manager):
+    def claim_batch(self, worker, size, max_attempts, timeout=None):
+        """
+        Claims up to ``size`` of the oldest unsent emails which have been
+        attempted fewer than ``max_attempts`` times for the given worker,
+        returning a list of them.
+
+        Emails are claimed by updating their worker only if they're still
+        unclaimed, so concurrent workers never claim the same email.
+        Emails claimed more than ``timeout`` seconds ago, defaulting to
+        ``OUTBOX_CLAIM_TIMEOUT``, are treated as unclaimed, so emails
+        claimed by a worker which died are retried.
+        """
+        if timeout is None:
+            timeout = settings.OUTBOX_CLAIM_TIMEOUT
+        now = datetime.datetime.now()
+        expired = now - datetime.timedelta(seconds=timeout)
+        unclaimed = self.filter(models.Q(worker='') |
+                                models.Q(claimed_at__lt=expired),
+                                sent_at__isnull=True,
+                                attempts__lt=max_attempts)
+        ids = list(unclaimed.order_by('pk').values_list('pk', flat=True)[:size])
+        if not ids:
+            return []
+        unclaimed.filter(pk__in=ids).update(worker=worker, claimed_at=now)
+        return list(self.filter(pk__in=ids, worker=worker,
+                                sent_at__isnull=True).order_by('pk'))
+
+class OutboxEmail(models.Model):
+    """
+    An email queued for sending by the ``send_outbox_emails`` worker.
+    """
+    rule       = models.CharField(max_length=50)
+    subject    = models.CharField(max_length=255)
+    body       = models.TextField()
+    recipients = models.TextField()
+    created_at = models.DateTimeField(editable=False)
+    worker     = models.CharField(max_length=100, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True, editable=False)
+    attempts   = models.PositiveIntegerField(default=0)
+    error      = models.TextField(blank=True)
+    sent_at    = models.DateTimeField(null=True, blank=True, editable=False)
+
+    objects = OutboxEmailManager()
+
+    def __unicode__(self):
+        return self.subject
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def save(self, *args, **kwargs):
+        if not self.id:
+            self.created_at = datetime.datetime.now()
+        super(OutboxEmail, self).save(*args, **kwargs)
+
+    def get_recipients(self):
+        return self.recipients.split(',')
+
+    def set_recipients(self, recipients):
+        self.recipients = ','.join(recipients)
+
+###########
+# Indexes #
+###########
+
+class CompositeIndex(object):
+    """
+    An index on more than one of a model's fields, which can't be
+    declared on the model itself.
+
+    Composite indexes in ``COMPOSITE_INDEXES`` are created when their
+    model's table is created by ``syncdb`` - the ``advise_indexes``
+    command can create any which are missing from an existing database.
+    """
+    def __init__(self, model, *field_names):
+        self.model = model
+        self.field_names = field_names
+
+    def __unicode__(self):
+        return u'%s (%s)' % (self.model._meta.object_name,
+                             u', '.join(self.field_names))
+
+    @property
+    def table(self):
+        return self.model._meta.db_table
+
+    @property
+    def columns(self):
+        opts = self.model._meta
+        return [opts.get_field(name).column for name in self.field_names]
+
+    def get_name(self, connection=connection):
+        return truncate_name('%s_%s' % (self.table, '_'.join(self.columns)),
+                             connection.ops.max_name_length())
+
+    def sql_create(self, connection=connection):
+        quote_name = connection.ops.quote_name
+        return 'CREATE INDEX %s ON %s (%s)' % (
+            quote_name(self.get_name(connection)),
+            quote_name(self.table),
+            ', '.join([quote_name(column) for column in self.columns]))
+
+    def exists(self, connection=connection):
+        """
+        Returns ``True`` if this index has been created in the given
+        connection's database.
+        """
+        engine = connection.settings_dict['ENGINE']
+        if engine.endswith('sqlite3'):
+            query = """
+            SELECT 1 FROM sqlite_master
+            WHERE type = 'index' AND tbl_name = %s AND name = %s"""
+        elif engine.endswith('mysql'):
+            query = """
+            SELECT 1 FROM information_schema.statistics
+            WHERE table_schema = DATABASE()
+              AND table_name = %s AND index_name = %s"""
+        else:
+            query = """
+            SELECT 1 FROM pg_indexes
+            WHERE tablename = %s AND indexname = %s"""
+        cursor = connection.cursor()
+        cursor.execute(query, [self.table, self.get_name(connection)])
+        return cursor.fetchone() is not None
+
+    def create(self, connection=connection):
+        cursor = connection.cursor()
+        cursor.execute(self.sql_create(connection))
+
+# Indexes for the filters used by the most frequently executed queries
+COMPOSITE_INDEXES = (
+    # Uninvoiced and unapproved work for Tasks
+    CompositeIndex(TimeEntry, 'task', 'invoice', 'approved_by'),
+    # Expenses awaiting approval between dates
+    CompositeIndex(Expense, 'date', 'approved_by'),
+    # Users' outstanding Activities by due date
+    CompositeIndex(Activity, 'assigned_to', 'completed', 'due_date'),
+    # A Job's Artifacts accessible to a role
+    CompositeIndex(Artifact, 'job', 'access'),
+)
@@ -1,98 +1,254 @@
 # -*- coding: utf-8 -*-
-from reportlab.platypus import *
+"""
+Rendering of Invoice PDFs.
+
+Rendering is split into two stages so that it can be spread across
+processes - ``get_invoice_data`` gathers everything needed to render an
+Invoice into plain data, which ``render_invoice`` turns into PDF content
+without touching the database.
+"""
+from cStringIO import StringIO
+from multiprocessing import Pool, cpu_count
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.utils import dateformat
+
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib.units import mm
-from reportlab.rl_config import defaultPageSize
-styles = getSampleStyleSheet()
-PAGE_HEIGHT=defaultPageSize[1]
-PAGE_WIDTH=defaultPageSize[0]
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, \
+    TableStyle
 
-TITLE = 'Invoice'
+from djangoffice.models import Invoice, Job, Task
+from djangoffice.templatetags.money import money as format_money
 
-def firstPage(canvas, doc):
-    canvas.saveState()
-    canvas.setFont('Times-Roman', 14)
-    canvas.drawCentredString(PAGE_WIDTH / 2, PAGE_HEIGHT - 20 * mm, 'Invoice')
-    canvas.setFont('Times-Roman', 9)
-    canvas.drawCentredString(PAGE_WIDTH / 2, 10 * mm, 'Page %d' % doc.page)
-    canvas.restoreState()
+PAGE_WIDTH, PAGE_HEIGHT = A4
+
+CURRENCY_SYMBOLS = {
+    Job.GBP_CURRENCY: u'£',
+    Job.EURO_CURRENCY: u'€',
+}
+
+TABLE_STYLE = TableStyle([
+    ('FONT', (0, 0), (-1, -1), 'Times-Roman', 10),
+    ('FONT', (0, 0), (-1, 0), 'Times-Bold', 10),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+    ('BOX', (0, 0), (-1, -1), 1.5, colors.black),
+    ('LINEBELOW', (0, 0), (-1, 0), 1.5, colors.black),
+    ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
+])
+
+TOTALS_STYLE = TableStyle(TABLE_STYLE.getCommands() + [
+    ('FONT', (0, -1), (-1, -1), 'Times-Bold', 10),
+    ('LINEABOVE', (0, -1), (-1, -1), 1.5, colors.black),
+])
 
-def laterPages(canvas, doc):
+def get_display_names(task_ids, user_ids):
+    """
+    Looks up names for the given Tasks and Users, returning a two-tuple
+    of dicts mapping Task ids and User ids to names.
+    """
+    task_names = dict(Task.objects.filter(pk__in=list(task_ids)) \
+                                  .values_list('id', 'task_type__name'))
+    user_names = {}
+    for id, first_name, last_name, username in \
+        User.objects.filter(pk__in=list(user_ids)) \
+                    .values_list('id', 'first_name', 'last_name', 'username'):
+        user_names[id] = (u'%s %s' % (first_name, last_name)).strip() or username
+    return task_names, user_names
+
+def get_invoice_data(invoice, calculation, expenses_total, task_names,
+                     user_names):
+    """
+    Creates a dict of everything required to render the given Invoice,
+    which must have been retrieved using ``Invoice.with_job_details``.
+
+    calculation
+        The ``InvoiceTimeCalculation`` for time being invoiced.
+
+    expenses_total
+        The total amount for Expenses being invoiced.
+
+    task_names, user_names
+        Display names for Tasks and Users, as returned by
+        ``get_display_names``.
+    """
+    by_task = [(task_names.get(task_id, u''), totals.hours, totals.cost) \
+               for task_id, totals in calculation.by_task.iteritems()]
+    by_task.sort()
+    by_user = []
+    for user_id, tasks in calculation.by_user_and_task.iteritems():
+        rows = [(task_names.get(task_id, u''), totals.hours, totals.cost) \
+                for task_id, totals in tasks.iteritems()]
+        rows.sort()
+        by_user.append((user_names.get(user_id, u''), rows))
+    by_user.sort()
+    by_date = []
+    for date, users in calculation.by_date_and_user.iteritems():
+        for user_id, totals in users.iteritems():
+            by_date.append((date, user_names.get(user_id, u''), totals.hours,
+                            totals.cost))
+    by_date.sort()
+    return {
+        'company_name': settings.COMPANY_NAME,
+        'number': invoice.formatted_number,
+        'date': invoice.date,
+        'job': u'%05d - %s' % (invoice.job_number, invoice.job_name),
+        'client': invoice.client_name,
+        'contact': u'%s %s' % (invoice.primary_contact_first_name,
+                               invoice.primary_contact_last_name),
+        'currency_symbol': CURRENCY_SYMBOLS.get(invoice.job_fee_currency, u''),
+        'start_period': invoice.start_period,
+        'end_period': invoice.end_period,
+        'by_task': by_task,
+        'by_user': by_user,
+        'by_date': by_date,
+        'total_hours': calculation.total_hours,
+        'total_cost': calculation.total_cost,
+        'expenses_total': expenses_total,
+        'amount': invoice.amount_invoiced,
+    }
+
+def _page(canvas, doc):
     canvas.saveState()
     canvas.setFont('Times-Roman', 14)
-    canvas.drawCentredString(PAGE_WIDTH / 2, PAGE_HEIGHT - 20 * mm, 'Invoice')
+    canvas.drawCentredString(PAGE_WIDTH / 2, PAGE_HEIGHT - 20 * mm,
+                             doc.title)
     canvas.setFont('Times-Roman', 9)
     canvas.drawCentredString(PAGE_WIDTH / 2, 10 * mm, 'Page %d' % doc.page)
     canvas.restoreState()
 
-tableStyle = TableStyle([
-    ('FONT', (0, 0), (-1, -1), 'Times-Roman', 12),
-    ('GRID', (0, 0), (-1, -1), 1, colors.black),
-    ('BOX', (0, 0), (-1, -1), 1.5, colors.black),
-    ('LINEBELOW', (0,0), (-1, 0), 1.5, colors.black),
-    ('LINEABOVE', (0,-1), (-1, -1), 1.5, colors.black),
-    ('ALIGN', (0, -1), (0, -1), 'RIGHT'),
-])
+def _format_date(date):
+    return date is not None and dateformat.format(date, 'jS F Y') or u'N/A'
 
-def go():
-    doc = SimpleDocTemplate('invoice.pdf')
+def _table(header, rows, totals=None, col_widths=None):
+    if totals is not None:
+        rows = rows + [totals]
+    return Table([header] + rows, repeatRows=1, colWidths=col_widths,
+                 style=totals is not None and TOTALS_STYLE or TABLE_STYLE)
+
+def render_invoice(data):
+    """
+    Renders an Invoice PDF from data created by ``get_invoice_data``,
+    returning a two-tuple of the PDF content and the number of pages it
+    contains.
+
+    This doesn't use the database, so may be called in any process.
+    """
+    styles = getSampleStyleSheet()
+    money = lambda amount: format_money(amount, data['currency_symbol'])
     elements = [
+        Paragraph(escape(u'%s - Invoice %s' % (data['company_name'],
+                                               data['number'])),
+                  styles['Heading1']),
         Table([
-            ['Task', 'Hours', 'Cost (£)'],
-            ['Test Task 1', 66, 290.00],
-            ['Test Task 2', 40, 1000.00],
-            ['Test Task 1', 66, 1290.00],
-            ['Test Task 2', 40, 1000.00],
-            ['Test Task 1', 66, 1290.00],
-            ['Test Task 2', 40, 1000.00],
-            ['Test Task 1', 66, 1290.00],
-            ['Test Task 2', 40, 1000.00],
-            ['Test Task 1', 66, 1290.00],
-            ['Test Task 2', 40, 1000.00],
-            ['Test Task 1', 66, 1290.00],
-            ['Test Task 2', 40, 1000.00],
-            ['Test Task 1', 66, 1290.00],
-            ['Test Task 2', 40, 1000.00],
-            ['Test Task 1', 66, 1290.00],
-            ['Test Task 2', 40, 1000.00],
-            ['Test Task 1', 66, 1290.00],
-            ['Test Task 2', 40, 1000.00],
-            ['Test Task 1', 66, 1290.00],
-            ['Test Task 2', 40, 1000.00],
-            ['Test Task 1', 66, 1290.00],
-            ['Test Task 2', 40, 1000.00],
-            ['Test Task 1', 66, 1290.00],
-            ['Test Task 2', 40, 1000.00],
-            ['Test Task 1', 66, 1290.00],
-            ['Test Task 2', 40, 1000.00],
-            ['Test Task 1', 66, 1290.00],
-            ['Test Task 2', 40, 1000.00],
-            ['Test Task 1', 66, 1290.00],
-            ['Test Task 2', 40, 1000.00],
-            ['Test Task 1', 66, 1290.00],
-            ['Test Task 2', 40, 1000.00],
-            ['Test Task 1', 66, 1290.00],
-            ['Test Task 2', 40, 1000.00],
-            ['Test Task 1', 66, 1290.00],
-            ['Test Task 2', 40, 1000.00],
-            ['Test Task 1', 66, 1290.00],
-            ['Test Task 2', 40, 1000.00],
-            ['Test Task 1', 66, 1290.00],
-            ['Test Task 2', 40, 1000.00],
-            ['Test Task 1', 66, 1290.00],
-            ['Test Task 2', 40, 1000.00],
-            ['Test Task 1', 66, 1290.00],
-            ['Test Task 2', 40, 1000.00],
-            ['Test Task 1', 66, 1290.00],
-            ['Test Task 2', 40, 1000.00],
-            ['Test Task 1', 66, 1290.00],
-            ['Test Task 2', 40, 1000.00],
-            ['Total', 110, 2290.00],
-        ], repeatRows=1, style=tableStyle,
-        colWidths=(110 * mm, 40 * mm, 40 * mm)),
+            [u'Date', _format_date(data['date'])],
+            [u'Job', data['job']],
+            [u'Client', data['client']],
+            [u'Contact', data['contact']],
+            [u'Invoiced From', _format_date(data['start_period'])],
+            [u'Invoiced To', _format_date(data['end_period'])],
+        ], colWidths=(40 * mm, 130 * mm), hAlign='LEFT'),
+        Spacer(0, 8 * mm),
     ]
-    doc.build(elements, onFirstPage=firstPage, onLaterPages=laterPages)
+    if data['by_task']:
+        elements.extend([
+            Paragraph(u'Tasks', styles['Heading2']),
+            _table([u'Task', u'Hours', u'Cost'],
+                   [[task, hours, money(cost)] \
+                    for task, hours, cost in data['by_task']],
+                   [u'Total', data['total_hours'], money(data['total_cost'])],
+                   (110 * mm, 30 * mm, 40 * mm)),
+        ])
+    for user, rows in data['by_user']:
+        elements.extend([
+            Paragraph(escape(user), styles['Heading3']),
+            _table([u'Task', u'Hours', u'Cost'],
+                   [[task, hours, money(cost)] for task, hours, cost in rows],
+                   col_widths=(110 * mm, 30 * mm, 40 * mm)),
+        ])
+    if data['by_date']:
+        elements.extend([
+            Paragraph(u'Hours Booked by Date', styles['Heading2']),
+            _table([u'Date', u'User', u'Hours', u'Cost'],
+                   [[date.isoformat(), user, hours, money(cost)] \
+                    for date, user, hours, cost in data['by_date']],
+                   col_widths=(30 * mm, 80 * mm, 30 * mm, 40 * mm)),
+        ])
+    elements.extend([
+        Spacer(0, 8 * mm),
+        _table([u'', u'Amount'], [
+            [u'Time', money(data['total_cost'])],
+            [u'Expenses', money(data['expenses_total'])],
+        ], [u'Total', money(data['amount'])], (140 * mm, 40 * mm)),
+    ])
+
+    buffer = StringIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4,
+                            title=u'Invoice %s' % data['number'])
+    doc.build(elements, onFirstPage=_page, onLaterPages=_page)
+    return buffer.getvalue(), doc.page
+
+def render_invoices(data, processes=None):
+    """
+    Renders Invoice PDFs for a list of data created by
+    ``get_invoice_data``, returning a list of the results of
+    ``render_invoice`` in the same order.
+
+    Rendering is spread across a pool of the given number of worker
+    processes, defaulting to the number of CPUs available. Rendering
+    happens in the current process if only one process is to be used or
+    there's only one Invoice to render.
+    """
+    if processes is None:
+        processes = cpu_count()
+    if processes == 1 or len(data) < 2:
+        return map(render_invoice, data)
+    pool = Pool(processes)
+    try:
+        return pool.map(render_invoice, data,
+                        chunksize=max(1, len(data) / (processes * 4)))
+    finally:
+        pool.close()
+        pool.join()
+
+def save_invoice_pdf(invoice, content):
+    """
+    Saves PDF content into the given Invoice's ``pdf`` field.
+    """
+    invoice.pdf.save(u'invoice%s.pdf' % invoice.formatted_number,
+                     ContentFile(content), save=False)
+    Invoice.objects.filter(pk=invoice.pk).update(pdf=invoice.pdf.name)
+
+def create_invoice_pdfs(results, processes=None):
+    """
+    Renders and saves PDFs for the Invoices created for the given
+    ``JobInvoiceResult`` objects, returning the total number of pages
+    rendered.
 
-go()
+    Data is gathered in a fixed number of queries, rendering is spread
+    across worker processes and files are saved in this process.
+    """
+    results = [result for result in results if result.invoice is not None]
+    if not results:
+        return 0
+    invoices = Invoice.objects.with_job_details().in_bulk(
+        [result.invoice.pk for result in results])
+    task_ids, user_ids = set(), set()
+    for result in results:
+        task_ids.update(result.calculation.by_task.keys())
+        user_ids.update(result.calculation.by_user_and_task.keys())
+    task_names, user_names = get_display_names(task_ids, user_ids)
+    data = [get_invoice_data(invoices[result.invoice.pk], result.calculation,
+                             result.expenses_total, task_names, user_names) \
+            for result in results]
+    pages = 0
+    for result, (content, page_count) in zip(results,
+                                             render_invoices(data, processes)):
+        save_invoice_pdf(result.invoice, content)
+        pages += page_count
+    return pages
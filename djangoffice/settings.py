@@ -20,7 +20,17 @@ DATABASES = {
         'PASSWORD': '',                               # Not used with sqlite3.
         'HOST': '',                                   # Set to empty string for localhost. Not used with sqlite3.
         'PORT': '',                                   # Set to empty string for default. Not used with sqlite3.
-    }
+    },
+    # A connection for SQL Reports, as a user which may only SELECT from
+    # the tables reports need - see SQL_REPORT_DATABASE.
+    # 'reports': {
+    #     'ENGINE': 'django.db.backends.postgresql_psycopg2',
+    #     'NAME': 'djangoffice',
+    #     'USER': 'djangoffice_reports',
+    #     'PASSWORD': '',
+    #     'HOST': '',
+    #     'PORT': '',
+    # },
 }
 
 # Local time zone for this installation. Choices can be found here:
@@ -75,6 +85,8 @@ MIDDLEWARE_CLASSES = (
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'djangoffice.middleware.PrincipalMiddleware',
+    'djangoffice.middleware.QueryStatsMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
 )
 
@@ -127,6 +139,83 @@ ITEMS_PER_PAGE = 15
 # Admininstration Job id
 ADMIN_JOB_ID = 1
 
+# Number of worker processes used to render Invoice PDFs outside web
+# requests, e.g. from a command - None uses the number of CPUs
+# available. Invoices created through the site are always rendered in
+# the process handling the request.
+INVOICE_PDF_PROCESSES = 1
+
+# Where draft Invoice PDFs are cached and the maximum size in bytes the
+# cache may grow to before least recently used drafts are removed.
+DRAFT_INVOICE_CACHE_DIR = os.path.join(DIRNAME, 'draft_invoices')
+DRAFT_INVOICE_CACHE_SIZE = 50 * 1024 * 1024
+
+# Maximum number of rows displayed or downloaded when executing a SQL
+# Report - None for no limit.
+SQL_REPORT_MAX_ROWS = 10000
+
+# Database SQL Reports are executed against. Report connections are made
+# read-only for the session, but a report's query could change that
+# back, so in production this should be a dedicated alias, such as the
+# 'reports' example above or a read-only replica, whose user the
+# database only allows to read the tables reports need. 'default' is
+# only suitable for development.
+SQL_REPORT_DATABASE = 'default'
+
+# Maximum number of SQL Reports executed at once across all processes,
+# how long in seconds further executions wait for one to finish and
+# where the lock files used to limit executions are kept.
+SQL_REPORT_MAX_CONCURRENT = 4
+SQL_REPORT_QUEUE_TIMEOUT = 30
+SQL_REPORT_LOCK_DIR = os.path.join(DIRNAME, 'sql_report_locks')
+
+# Maximum cost estimated by the database's EXPLAIN for a SQL Report to be
+# executed - None for no limit. Only PostgreSQL estimates costs.
+SQL_REPORT_MAX_COST = None
+
+# SQL Reports executed in the background by the run_sql_report_jobs
+# command: where their results are stored, how long in seconds results
+# are kept for, the maximum time in seconds a report may run for - jobs
+# left running for longer are failed as abandoned - and the maximum
+# number of rows stored.
+SQL_REPORT_JOB_RESULTS_DIR = os.path.join(DIRNAME, 'sql_report_jobs')
+SQL_REPORT_JOB_LIFETIME = 7 * 24 * 60 * 60
+SQL_REPORT_JOB_TIMEOUT = 30 * 60
+SQL_REPORT_JOB_MAX_ROWS = 1000000
+
+# Where results of SQL Reports which have caching enabled are cached and
+# the maximum size in bytes the cache may grow to before least recently
+# used results are removed.
+SQL_REPORT_CACHE_DIR = os.path.join(DIRNAME, 'sql_report_results')
+SQL_REPORT_CACHE_SIZE = 100 * 1024 * 1024
+
+# Maximum number of Time Entries and Expenses approved in each of the
+# transactions bulk approval is committed in - each Time Entry id is
+# passed twice, so this must keep within SQLite's limit of 999 query
+# parameters.
+BULK_APPROVAL_CHUNK_SIZE = 400
+
+# Emails queued by the send_notifications command are sent by the
+# send_outbox_emails worker: the number sent over each connection to the
+# mail server, the number of attempts made to send each email and the
+# number of seconds after which emails claimed by a worker which hasn't
+# sent them may be claimed by another.
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_CLAIM_TIMEOUT = 10 * 60
+
+# Notification rules recheck changes made in the given number of seconds,
+# or the given number of ids, before where they last checked up to, so
+# rows written by transactions which were still in progress then aren't
+# missed.
+NOTIFICATION_RECHECK_SECONDS = 5 * 60
+NOTIFICATION_RECHECK_IDS = 100
+
+# Queries executed by each view are recorded by QueryStatsMiddleware,
+# which keeps statistics for the given number of most recent requests
+# for each URL name.
+SQL_STATS_WINDOW = 100
+
 # Company Details
 COMPANY_NAME = 'Generitech'
 COMPANY_ADDRESS = {
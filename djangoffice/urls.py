@@ -127,12 +127,18 @@ urlpatterns = patterns('djangoffice.views',
     url(r'^reports/user/$',               'reports.user_report',               name='user_report'),
 
     # SQL Reports
-    url(r'^sql_reports/$',                                'sql_reports.sql_report_list',    name='sql_report_list'),
-    url(r'^sql_reports/add/$',                            'sql_reports.add_sql_report',     name='add_sql_report'),
-    url(r'^sql_reports/(?P<sql_report_id>\d+)/$',         'sql_reports.sql_report_detail',  name='sql_report_detail'),
-    url(r'^sql_reports/(?P<sql_report_id>\d+)/edit/$',    'sql_reports.edit_sql_report',    name='edit_sql_report'),
-    url(r'^sql_reports/(?P<sql_report_id>\d+)/delete/$',  'sql_reports.delete_sql_report',  name='delete_sql_report'),
-    url(r'^sql_reports/(?P<sql_report_id>\d+)/execute/$', 'sql_reports.execute_sql_report', name='execute_sql_report'),
+    url(r'^sql_reports/$',                                'sql_reports.sql_report_list',         name='sql_report_list'),
+    url(r'^sql_reports/add/$',                            'sql_reports.add_sql_report',          name='add_sql_report'),
+    url(r'^sql_reports/(?P<sql_report_id>\d+)/$',         'sql_reports.sql_report_detail',       name='sql_report_detail'),
+    url(r'^sql_reports/(?P<sql_report_id>\d+)/edit/$',    'sql_reports.edit_sql_report',         name='edit_sql_report'),
+    url(r'^sql_reports/(?P<sql_report_id>\d+)/delete/$',  'sql_reports.delete_sql_report',       name='delete_sql_report'),
+    url(r'^sql_reports/(?P<sql_report_id>\d+)/execute/$', 'sql_reports.execute_sql_report',      name='execute_sql_report'),
+    url(r'^sql_reports/jobs/$',                           'sql_reports.sql_report_job_list',     name='sql_report_job_list'),
+    url(r'^sql_reports/jobs/(?P<job_id>\d+)/$',           'sql_reports.sql_report_job_detail',   name='sql_report_job_detail'),
+    url(r'^sql_reports/jobs/(?P<job_id>\d+)/csv/$',       'sql_reports.download_sql_report_job', name='download_sql_report_job'),
+
+    # Query Statistics
+    url(r'^query_stats/$', 'query_stats.query_stats', name='query_stats'),
 )
 
 # Admin and settings applications
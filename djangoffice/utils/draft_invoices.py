@@ -0,0 +1,180 @@
+"""
+Creation and caching of draft Invoice PDFs.
+
+Draft PDFs are cached on disk under a key derived from everything which
+goes into them - the Job, the invoice criteria, the Time Entries,
+Expenses and rates which would be invoiced and the names displayed - so
+previewing the same draft again serves the cached file without
+calculating costs or rendering anything.
+"""
+from hashlib import sha1
+
+from django.conf import settings
+from django.db.models import signals
+
+from djangoffice.models import (Expense, Invoice, Job, Task, TaskTypeRate,
+    TimeEntry, UserRate)
+from djangoffice.utils.file_cache import FileCache
+from djangoffice.utils.invoice import InvoiceBatch, RateNotFound
+
+class DraftInvoiceCache(FileCache):
+    """
+    A size-bounded cache of draft Invoice PDFs, held as files named for
+    their Job and key in a directory.
+    """
+    suffix = '.pdf'
+
+    def get_name(self, job_id, key):
+        return 'job%s-%s' % (job_id, key)
+
+    def get(self, job_id, key):
+        """
+        Returns the filename of a cached draft for the given Job and key,
+        or ``None`` if there isn't one.
+        """
+        return self.get_file(self.get_name(job_id, key))
+
+    def put(self, job_id, key, content):
+        """
+        Caches draft content for the given Job and key, returning the
+        filename it was cached under.
+        """
+        return self.put_file(self.get_name(job_id, key), content)
+
+    def invalidate(self, job_id=None):
+        """
+        Removes cached drafts for the given Job, or for all Jobs.
+        """
+        self.remove_files(job_id is None and 'job' or 'job%s-' % job_id)
+
+cache = DraftInvoiceCache(settings.DRAFT_INVOICE_CACHE_DIR,
+                          settings.DRAFT_INVOICE_CACHE_SIZE)
+
+class DraftInvoice:
+    """
+    A draft Invoice for a single Job, which is only costed and rendered
+    if it isn't already cached.
+    """
+    def __init__(self, job, criteria):
+        """
+        job
+            The Job to create a draft Invoice for.
+
+        criteria
+            A dict of cleaned ``InvoiceCriteriaForm`` data.
+        """
+        self.job = job
+        self.criteria = criteria
+        self.batch = InvoiceBatch([job], criteria['type'], criteria['date'],
+                                  criteria.get('start_period'),
+                                  criteria.get('end_period'))
+        self.cached = False
+
+    def load(self):
+        """
+        Loads everything which would go into the draft and determines
+        its cache key.
+        """
+        from djangoffice.pdf import get_display_names
+        batch = self.batch
+        batch.load_time_entries()
+        batch.load_expenses()
+        batch.load_rates()
+        columns = batch.time_entry_columns
+        self.task_names, self.user_names = get_display_names(
+            set(columns.task_id), set(columns.user_id))
+        self.invoice = self.get_invoice()
+        self.key = self.get_key()
+
+    def get_invoice(self):
+        """
+        Creates an unsaved Invoice with the details
+        ``Invoice.with_job_details`` would give it.
+        """
+        job = Job.objects.select_related('client', 'primary_contact') \
+                         .get(pk=self.job.pk)
+        invoice = Invoice(job=job, number=0, date=self.criteria['date'],
+                          type=self.criteria['type'],
+                          start_period=self.batch.start_period,
+                          end_period=self.batch.end_period)
+        invoice.job_number, invoice.job_name = job.number, job.name
+        invoice.job_fee_currency = job.fee_currency
+        invoice.client_name = job.client.name
+        invoice.primary_contact_first_name = job.primary_contact.first_name
+        invoice.primary_contact_last_name = job.primary_contact.last_name
+        return invoice
+
+    def get_key(self):
+        """
+        Creates a hash of everything which goes into the draft.
+        """
+        batch = self.batch
+        columns = batch.time_entry_columns
+        invoice = self.invoice
+        rates = [(rate.pk, rate.effective_from, rate.standard_rate,
+                  rate.overtime_rate) for rate \
+                 in batch.rate_lookup and batch.rate_lookup.get_loaded_rates() \
+                 or []]
+        rates.sort()
+        parts = [
+            self.job.pk,
+            sorted(self.criteria.items()),
+            batch.driven_by,
+            Invoice.options.exchange_rate,
+            zip(*[getattr(columns, field) for field in columns.FIELDS]),
+            batch.expenses_by_job.get(self.job.pk, []),
+            rates,
+            sorted(self.task_names.items()),
+            sorted(self.user_names.items()),
+            (invoice.job_number, invoice.job_name, invoice.job_fee_currency,
+             invoice.client_name, invoice.primary_contact_first_name,
+             invoice.primary_contact_last_name, settings.COMPANY_NAME),
+        ]
+        return sha1(repr(parts)).hexdigest()
+
+    def get_filename(self):
+        """
+        Returns the filename of the draft PDF, creating it if it isn't
+        already cached.
+        """
+        from djangoffice.pdf import get_invoice_data, render_invoice
+        self.load()
+        filename = cache.get(self.job.pk, self.key)
+        if filename is not None:
+            self.cached = True
+            return filename
+        self.batch.calculate()
+        result = self.batch.results[0]
+        if result.error is not None:
+            raise RateNotFound(result.error)
+        self.invoice.amount_invoiced = result.amount
+        data = get_invoice_data(self.invoice, result.calculation,
+                                result.expenses_total, self.task_names,
+                                self.user_names)
+        data['number'] = u'DRAFT'
+        content, pages = render_invoice(data)
+        return cache.put(self.job.pk, self.key, content)
+
+################
+# Invalidation #
+################
+
+def time_entry_changed(sender, instance, **kwargs):
+    try:
+        job_id = Task.objects.filter(pk=instance.task_id) \
+                             .values_list('job', flat=True)[0]
+    except IndexError:
+        return
+    cache.invalidate(job_id)
+
+def expense_changed(sender, instance, **kwargs):
+    cache.invalidate(instance.job_id)
+
+def rate_changed(sender, instance, **kwargs):
+    cache.invalidate()
+
+for signal in (signals.post_save, signals.post_delete):
+    signal.connect(time_entry_changed, sender=TimeEntry)
+    signal.connect(expense_changed, sender=Expense)
+    signal.connect(rate_changed, sender=UserRate)
+    signal.connect(rate_changed, sender=TaskTypeRate)
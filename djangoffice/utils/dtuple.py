@@ -16,6 +16,12 @@
 # tracking:
 #   $Id: dtuple.py,v 1.1 2000/04/18 20:17:20 gstein Exp $
 #
+# Modified for djangoffice: DatabaseTuple is now a tuple subclass with no
+# per-instance attributes, created from a row class which is shared by
+# all the tuples a TupleDescriptor describes.
+#
+
+from itertools import izip
 
 class TupleDescriptor:
   """Describes a return tuple from a DB-API fetch*() method.
@@ -52,6 +58,7 @@ class TupleDescriptor:
     self.namemap = { }
     for i in range(len(self.names)):
       self.namemap[self.names[i]] = i
+    self._row_class = None
 
   def __len__(self):
     """Returns the number of elements in the data object.
@@ -66,9 +73,28 @@ class TupleDescriptor:
   def __str__(self):
     return str(self.desc)
 
+  def getRowClass(self):
+    """Returns the DatabaseTuple subclass for tuples this describes.
+
+    The class is created when first needed, with a property for each
+    column name which doesn't clash with one of DatabaseTuple's own
+    names, so attribute-based access doesn't require a per-row lookup.
+    """
+    if self._row_class is None:
+      attrs = {'__slots__': (), '_desc_': self, '_names_': self.names,
+               '_namemap_': self.namemap,
+               '__getitem__': _make_getitem(self.namemap)}
+      for name, idx in self.namemap.items():
+        if not isinstance(name, basestring) or name.startswith('_') or \
+           name in _reserved_names:
+          continue
+        attrs[name] = _make_property(idx)
+      self._row_class = type('DatabaseTuple', (DatabaseTuple,), attrs)
+    return self._row_class
 
 
-class DatabaseTuple:
+
+class DatabaseTuple(tuple):
   """Wraps the return data from a DB-API fetch*() method.
 
   Instances of this class are used to represent tuples of information,
@@ -100,135 +126,89 @@ class DatabaseTuple:
   the mapping interface can be used with the column name as the mapping
   key.
 
-  Note that a database tuple acts as a tuple with respect to sub-scripted
-  assignment. TypeError exceptions will be raised for several situations,
-  and AttributeError may be raised for some methods that are intended
-  to mutate the data (list's 'sort' method) as these methods have not
-  been implemented.
+  Note that a database tuple is a tuple, so it can't be modified.
+  Tuples for each TupleDescriptor are instances of a subclass created by
+  TupleDescriptor.getRowClass(), which holds the descriptor, so no
+  per-row storage is needed beyond that of the tuple itself.
   """
 
-  def __init__(self, desc, data):
+  __slots__ = ()
+
+  def __new__(cls, desc, data):
     """DatabaseTuple constructor.
 
     A DatabaseTuple is initialized with a TupleDescriptor and a tuple or
     list specifying the data elements.
     """
-    if len(desc) != len(data):
-      raise ValueError  # descriptor does not seem to describe tuple
     if type(desc) == type(()) or type(desc) == type([]):
       desc = TupleDescriptor(desc)
-    self.__dict__['_desc_'] = desc
-    self.__dict__['_data_'] = tuple(data)
+    if len(desc) != len(data):
+      raise ValueError  # descriptor does not seem to describe tuple
+    return tuple.__new__(desc.getRowClass(), data)
 
   def __str__(self):
-    return str(self._data_)
+    return str(tuple(self))
   def __repr__(self):
-    return '%s(%s,%s)' % (self.__class__.__name__,
+    return '%s(%s,%s)' % (DatabaseTuple.__name__,
                           repr(self._desc_),
-                          repr(self._data_))
-
-  def __cmp__(self, other):
-    if type(self._data_) == type(other):
-      return cmp(self._data_, other)
-    if type(self._data_) == type( {} ):
-      return cmp(self.asMapping(), other)
-    if type(self._data_) == type( () ):
-      return cmp(self.asTuple(), other)
-    if type(self) == type(other):  ### fix this: need to verify equal classes
-      return cmp(self._data_, other._data_)
-    return cmp(self._data_, other)
-
-  def __getattr__(self, name):
-    'Simulate attribute-access via column names'
-    return self._getvalue_(name)
-
-  def __setattr__(self, name, value):
-    'Simulate attribute-access via column names'
-    ### need to redirect into a db update
-    raise TypeError, "can't assign to this subscripted object"
-
-  def __getitem__(self, key):
-    'Simulate indexed (tuple/list) and mapping-style access'
-    if type(key) == type(1):
-      return self._data_[key]
-    return self._getvalue_(key)
-
-  def __setitem__(self, key, value):
-    'Simulate indexed (tuple/list) and mapping-style access'
-    if type(key) == type(1):
-      ### need to redirect into a db update of elem #key
-      raise TypeError, "can't assign to this subscripted object"
-    ### need to redirect into a db update of elem named key
-    raise TypeError, "can't assign to this subscripted object"
+                          repr(tuple(self)))
 
-  def __len__(self):
-    return len(self._data_)
-
-  def __getslice__(self, i, j):
-    'Simulate list/tuple slicing access'
-    return self._data_[i:j]
-
-  def __setslice__(self, i, j, list):
-    'Simulate list/tuple slicing access'
-    ### need to redirect into a db update of elems
-    raise TypeError, "can't assign to this subscripted object"
+  def keys(self):
+    "Simulate mapping's methods"
+    return self._names_
 
-  def _keys_(self):
+  def has_key(self, key):
     "Simulate mapping's methods"
-    return self._desc_.names
+    return key in self._namemap_
 
-  def _has_key_(self, key):
+  def items(self):
     "Simulate mapping's methods"
-    return key in self._desc_.names
+    return zip(self._names_, self)
 
-  def _items_(self):
+  def values(self):
     "Simulate mapping's methods"
-    return self.asMapping().items()
-
-  def _count_(self, item):
-    "Simulate list's methods"
-    return self.asList().count(item)
-
-  def _index_(self, item):
-    "Simulate list's methods"
-    return self.asList().index(item)
-
-  def _getvalue_(self,name):
-    'Internal method for named-based value retrieval'
-    if name not in self._desc_.names:
-      if name == 'keys':
-        return self._keys_
-      if name == 'items':
-        return self._items_
-      if name == 'values':
-        return self.asList
-      if name == 'has_key':
-        return self._has_key_
-      if name == 'count':
-        return self._count_
-      if name == 'index':
-        return self._index_
-      raise AttributeError
-    return self._data_[self._desc_.namemap[name]]
+    return list(self)
 
   def asMapping(self):
-    'Return the "tuple" as a real mapping'
-    value = { }
-    for name, idx in self._desc_.namemap.items():
-      value[name] = self._data_[idx]
-    return value
+    """Return the "tuple" as a real mapping
+
+    A database tuple can be used as a read-only mapping itself, which
+    avoids building a dict.
+    """
+    return dict(izip(self._names_, self))
 
   def asTuple(self):
     'Return the "tuple" as a real tuple'
-    return self._data_
+    return tuple(self)
 
   def asList(self):
     'Return the "list" as a real mapping'
-    return map(None, self._data_)
+    return list(self)
+
+# Names which column name properties mustn't replace
+_reserved_names = set(['asMapping', 'asTuple', 'asList'])
+
+def _make_property(idx):
+  """Creates a property which simulates attribute-access to the column at
+  the given index.
+  """
+  getitem = tuple.__getitem__
+  return property(lambda self: getitem(self, idx))
+
+def _make_getitem(namemap):
+  """Creates a __getitem__ method for a DatabaseTuple subclass, which
+  looks up column names in the given name map and passes anything else
+  on to tuple's own implementation.
+  """
+  def __getitem__(self, key, _getitem=tuple.__getitem__, _namemap=namemap):
+    'Simulate indexed (tuple/list) and mapping-style access'
+    if key in _namemap:
+      key = _namemap[key]
+    return _getitem(self, key)
+  return __getitem__
 
 def fetchrows(cursor):
   rows = cursor.fetchall()
-  desc = TupleDescriptor(cursor.description)
-  for i in range(len(rows)):
-    rows[i] = DatabaseTuple(desc, rows[i])
-  return rows
\ No newline at end of file
+  row_class = TupleDescriptor(cursor.description).getRowClass()
+  new = tuple.__new__
+  return [new(row_class, row) for row in rows]
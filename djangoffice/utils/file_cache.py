@@ -0,0 +1,117 @@
+"""
+Size-bounded caches of files on disk.
+"""
+import os
+import tempfile
+
+class FileCache:
+    """
+    A size-bounded cache of files held in a directory, each named for
+    the key it's cached under plus the cache's ``suffix``.
+
+    Files are evicted in least recently used order, using their
+    modification times, which are updated whenever a file is used.
+    """
+    suffix = ''
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+
+    def get_path(self, name):
+        return os.path.join(self.directory, name + self.suffix)
+
+    def get_file(self, name):
+        """
+        Returns the path of the file cached under the given name, or
+        ``None`` if there isn't one.
+        """
+        path = self.get_path(name)
+        try:
+            os.utime(path, None)
+        except OSError:
+            return None
+        return path
+
+    def create_temp_file(self):
+        """
+        Creates a temporary file in the cache directory to be written
+        before being added to the cache with ``add_file``, returning a
+        two-tuple of an OS-level file handle and its path.
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        return tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+
+    def add_file(self, name, temp_path):
+        """
+        Caches a completely written temporary file under the given name,
+        returning its path.
+
+        Files are renamed into place, so a partially written file is
+        never used.
+        """
+        path = self.get_path(name)
+        os.rename(temp_path, path)
+        self.evict(keep=path)
+        return path
+
+    def put_file(self, name, content):
+        """
+        Caches the given content under the given name, returning the path
+        it was cached at.
+        """
+        fd, temp_path = self.create_temp_file()
+        try:
+            os.write(fd, content)
+        finally:
+            os.close(fd)
+        return self.add_file(name, temp_path)
+
+    def _files(self, prefix=''):
+        """
+        Lists two-tuples of the full path and ``stat`` result for cached
+        files whose names start with the given prefix.
+        """
+        files = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return files
+        for name in names:
+            if name.startswith(prefix) and name.endswith(self.suffix):
+                path = os.path.join(self.directory, name)
+                try:
+                    files.append((path, os.stat(path)))
+                except OSError:
+                    pass # Removed by another process
+        return files
+
+    def evict(self, keep=None):
+        """
+        Removes least recently used files until the cache is within its
+        maximum size, never removing the file at ``keep``.
+        """
+        files = self._files()
+        total_size = sum([stat.st_size for path, stat in files])
+        files.sort(key=lambda (path, stat): stat.st_mtime)
+        for path, stat in files:
+            if total_size <= self.max_size:
+                break
+            if path == keep:
+                continue
+            self.remove_path(path)
+            total_size -= stat.st_size
+
+    def remove_files(self, prefix=''):
+        """
+        Removes cached files whose names start with the given prefix.
+        """
+        for path, stat in self._files(prefix):
+            self.remove_path(path)
+
+    def remove_path(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,304 @@
+"""
+Index advice for the queries executed by the managers in
+``djangoffice.models``.
+
+The most frequently executed queries are replayed with stand-in
+arguments against a recording cursor, which captures the SQL they would
+execute without sending anything to the database - so queries which
+would update data are safe to replay. Each captured query is then
+explained on a connection of its own, and any plan which scans a whole
+table is flagged along with an index which could avoid it: one of the
+``COMPOSITE_INDEXES`` missing from the database, or one on the table's
+columns which the query filters on.
+"""
+import datetime
+import re
+
+from dbsettings.loading import get_app_settings, get_setting_storage
+from django.contrib.auth.models import User
+from django.db import connections, models, DEFAULT_DB_ALIAS
+
+from djangoffice.models import (COMPOSITE_INDEXES, Activity, Artifact,
+    BulkApproval, CompositeIndex, Expense, Job, OutboxEmail, SQLReportJob,
+    TaskTotal, TimeEntry, Timesheet, UserProfile, VacationBalance)
+from djangoffice.utils.dates import week_commencing_date
+from djangoffice.utils.sql_reports import estimate_query, uses_engine
+
+# Matches tables scanned in their entirety in SQLite, PostgreSQL and
+# MySQL query plans.
+SQLITE_SCAN_RE = re.compile(r'\bSCAN (?:TABLE )?["`]?(\w+)')
+PG_SCAN_RE = re.compile(r'\bSeq Scan on "?(\w+)"?')
+MYSQL_SCAN_RE = re.compile(r'\btable: (\w+), .*\btype: ALL\b')
+
+class RecordingCursor:
+    """
+    A cursor which records the queries executed with it instead of
+    executing them, behaving as if every query matched no rows.
+    """
+    rowcount = 0
+    lastrowid = None
+    description = None
+
+    def __init__(self, queries):
+        self.queries = queries
+
+    def execute(self, sql, params=()):
+        self.queries.append((sql, tuple(params or ())))
+
+    def executemany(self, sql, param_list):
+        for params in param_list:
+            self.execute(sql, params)
+
+    def fetchone(self):
+        return None
+
+    def fetchmany(self, size=None):
+        return []
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+    def __iter__(self):
+        return iter([])
+
+def capture_queries(func, using=DEFAULT_DB_ALIAS):
+    """
+    Calls the given function, returning a two-tuple of a list of
+    two-tuples of the SQL and parameters of the queries it would have
+    executed with the given database and the exception it raised, or
+    ``None``.
+
+    Queries are also captured from the default database, as the raw SQL
+    executed by the managers always uses its connection, so nothing is
+    executed with either.
+
+    Functions which fail when their queries don't return the data they
+    expect stop being replayed at that point, keeping the queries they
+    executed before failing.
+    """
+    # Options are loaded from the database, so make sure they're cached
+    # before the database stops returning anything.
+    for value in get_app_settings('djangoffice'):
+        get_setting_storage(*value.key)
+    recording = [connections[alias] \
+                 for alias in set([DEFAULT_DB_ALIAS, using])]
+    queries = []
+    error = None
+    for connection in recording:
+        connection.cursor = lambda: RecordingCursor(queries)
+    try:
+        try:
+            func()
+        except Exception, e:
+            error = e
+    finally:
+        for connection in recording:
+            del connection.cursor
+    return queries, error
+
+def stand_in_user(role=UserProfile.USER_ROLE):
+    """
+    Creates an unsaved User with the given role, whose profile doesn't
+    need to be loaded from the database.
+    """
+    user = User(pk=1, username=u'stand-in')
+    user._profile_cache = UserProfile(user_id=1, role=role)
+    return user
+
+def hot_queries():
+    """
+    Creates a list of two-tuples of descriptions and functions which
+    execute the most frequently executed queries with stand-in
+    arguments.
+    """
+    user = stand_in_user()
+    today = datetime.date.today()
+    week_commencing = week_commencing_date(today)
+    week_ending = week_commencing + datetime.timedelta(days=6)
+    return [
+        (u'Time Entries for a Timesheet',
+         lambda: list(TimeEntry.objects.for_timesheet(Timesheet(pk=1)))),
+        (u'Uninvoiced Time Entries for a Task',
+         lambda: list(TimeEntry.objects.filter(task=1, invoice__isnull=True,
+                                               approved_by__isnull=False))),
+        (u'Unapproved Time Entries for a week',
+         lambda: TimeEntry.objects.approve_chunk(user, week_commencing, 1)),
+        (u'Task totals',
+         lambda: TaskTotal.objects.calculate([1])),
+        (u'Expenses for a Timesheet',
+         lambda: list(Expense.objects.for_timesheet(Timesheet(pk=1)))),
+        (u'Unapproved Expenses between dates',
+         lambda: Expense.objects.approve_chunk(user, week_commencing,
+                                               week_ending, 1)),
+        (u'Live Jobs',
+         lambda: list(Job.objects.filter(status=Job.LIVE_STATUS))),
+        (u'Jobs accessible to a User',
+         lambda: list(Job.objects.accessible_to_user(user))),
+        (u'Outstanding Activities for a User',
+         lambda: list(Activity.objects.filter(assigned_to=1, completed=False,
+                                              due_date__lt=today))),
+        (u'Artifacts for a Job accessible to a User',
+         lambda: list(Artifact.objects.accessible_to_user(user) \
+                                       .filter(job=1))),
+        (u'Leave balances',
+         lambda: VacationBalance.objects.calculate()),
+        (u'Incomplete Bulk Approvals',
+         lambda: list(BulkApproval.objects.incomplete())),
+        (u'Unsent outbox emails',
+         lambda: OutboxEmail.objects.claim_batch(u'advisor', 1, 1)),
+        (u'Queued SQL Report Jobs',
+         lambda: SQLReportJob.objects.claim_next(u'advisor')),
+    ]
+
+def get_table_models():
+    """
+    Creates a dict mapping table names to models.
+    """
+    return dict([(model._meta.db_table, model) \
+                 for model in models.get_models()])
+
+def find_full_scans(plan, connection):
+    """
+    Determines which tables the given query plan scans in their
+    entirety, returning a list of table names.
+    """
+    tables = []
+    for line in plan:
+        if uses_engine(connection, 'sqlite3'):
+            # SQLite also scans every row when it walks an index in
+            # order rather than searching it.
+            match = SQLITE_SCAN_RE.search(line)
+        elif uses_engine(connection, 'postgresql_psycopg2', 'postgresql'):
+            match = PG_SCAN_RE.search(line)
+        else:
+            match = MYSQL_SCAN_RE.search(line)
+        if match is not None and match.group(1) not in tables:
+            tables.append(match.group(1))
+    return tables
+
+def filtered_columns(sql, table, connection):
+    """
+    Determines which of the given table's columns the given query
+    filters on, returning a list of column names with those compared
+    for equality, or with ``NULL``, first.
+    """
+    where = sql.find(' WHERE ')
+    if where == -1:
+        return []
+    column_re = re.compile(
+        r'%s\.["`]?(\w+)["`]?\s*(=|<|>|IN\b|IS NOT\b|IS\b)' % \
+        re.escape(connection.ops.quote_name(table)))
+    equal, other = [], []
+    for column, operator in column_re.findall(sql[where:]):
+        if operator in ('=', 'IN', 'IS'):
+            equal.append(column)
+        else:
+            other.append(column)
+    columns = []
+    for column in equal + other:
+        if column not in columns:
+            columns.append(column)
+    return columns
+
+def suggest_index(sql, model, connection, missing):
+    """
+    Suggests an index which could avoid scanning the given model's
+    whole table when executing the given query, returning a
+    ``CompositeIndex`` or ``None`` if there is nothing to suggest.
+
+    One of the given missing ``COMPOSITE_INDEXES`` for the model is
+    suggested if there is one, otherwise an index on the columns the
+    query filters on.
+    """
+    for index in missing:
+        if index.model is model:
+            return index
+    opts = model._meta
+    field_names = dict([(f.column, f.name) for f in opts.fields \
+                        if not f.primary_key])
+    columns = [column for column in filtered_columns(sql, opts.db_table,
+                                                     connection) \
+               if column in field_names]
+    if not columns:
+        return None
+    return CompositeIndex(model, *[field_names[column] \
+                                   for column in columns])
+
+def missing_indexes(using=DEFAULT_DB_ALIAS):
+    """
+    Creates a list of the ``COMPOSITE_INDEXES`` which haven't been
+    created in the given database.
+    """
+    connection = connections[using]
+    return [index for index in COMPOSITE_INDEXES \
+            if not index.exists(connection)]
+
+class QueryAdvice:
+    """
+    The plan for executing a query, with the following attributes:
+
+    description
+        A description of what the query is for.
+
+    sql, params
+        The query and its parameters.
+
+    plan
+        A list of lines describing the query plan - this is empty if
+        the database's plans aren't available.
+
+    full_scans
+        A list of two-tuples of the names of tables the query scans in
+        their entirety and a ``CompositeIndex`` suggested to avoid it,
+        or ``None``.
+
+    error
+        The exception raised when replaying the queries stopped after
+        this one, or ``None`` - when the replay failed before executing
+        any queries, ``sql`` is ``None``.
+    """
+    def __init__(self, description, sql, params, plan, full_scans,
+                 error=None):
+        self.description = description
+        self.sql = sql
+        self.params = params
+        self.plan = plan
+        self.full_scans = full_scans
+        self.error = error
+
+def advise_indexes(using=DEFAULT_DB_ALIAS, queries=None):
+    """
+    Explains each of the hot queries in the given database, returning a
+    list of ``QueryAdvice``.
+
+    A list of two-tuples of descriptions and functions which execute
+    queries may be given to explain other queries.
+    """
+    if queries is None:
+        queries = hot_queries()
+    connection = connections[using]
+    missing = missing_indexes(using)
+    table_models = get_table_models()
+    advice = []
+    for description, func in queries:
+        captured, error = capture_queries(func, using)
+        if not captured:
+            if error is not None:
+                advice.append(QueryAdvice(description, None, (), [], [],
+                                          error))
+            continue
+        for sql, params in captured:
+            plan = estimate_query(sql, params, using).plan
+            full_scans = []
+            for table in find_full_scans(plan, connection):
+                if table in table_models:
+                    full_scans.append((table, suggest_index(sql,
+                        table_models[table], connection, missing)))
+            advice.append(QueryAdvice(description, sql, params, plan,
+                                      full_scans))
+        # The replay stopped after the last query it captured
+        advice[-1].error = error
+    return advice
@@ -1,13 +1,19 @@
 """
 Invoice time calculations.
 """
-import operator
+import time
+from datetime import timedelta
 from decimal import Decimal
+from operator import itemgetter
 
-from django.db.models.query import Q
+from django.conf import settings
+from django.db import connection
+from django.db.models.query import QuerySet
 
-from djangoffice.models import TimeEntry
-from djangoffice.utils.time_entries import weekly_to_daily_entries
+from djangoffice.models import (Expense, Invoice, Job, NumberAllocator,
+    TaskTypeRate, TimeEntry, UserRate)
+from djangoffice.utils.rates import RateLookup
+from djangoffice.utils.sql_reports import uses_engine
 
 class RateNotFound(Exception):
     """A billing rate could not be found for time which was booked."""
@@ -22,63 +28,603 @@ class HoursAndCost:
         self.hours += hours
         self.cost += cost
 
-class InvoiceTimeCalculation:
+DAY_ATTRS = TimeEntry.TIME_ATTRS[:7]
+
+# Hours and rate amounts are held as integer counts of hundredths while
+# calculating, which keeps arithmetic exact and fast.
+UNITS_PLACES = 2
+
+# Maps the ways in which invoicing may be driven to the column holding
+# the id of the object rates are defined for.
+RATED_ID_COLUMNS = {
+    u'U': 'user_id',
+    u'T': 'task_type_id',
+}
+
+def to_units(value):
+    """
+    Converts a ``Decimal`` with at most two decimal places to an integer
+    count of hundredths.
+    """
+    units = value.scaleb(UNITS_PLACES)
+    if units != units.to_integral_value():
+        raise ValueError(u'%s has more than %s decimal places' % (value,
+                                                                  UNITS_PLACES))
+    return int(units)
+
+def from_units(units, places=UNITS_PLACES):
+    """
+    Converts an integer count of units with the given number of decimal
+    places back to a ``Decimal``.
+    """
+    return Decimal(units).scaleb(-places)
+
+class TimeEntryColumns:
+    """
+    Time Entry data held column-wise, as one sequence per field, for
+    bulk cost calculations.
+
+    Each of the names in ``FIELDS`` is available as an attribute holding
+    a sequence of values, with the values for a given Time Entry sharing
+    the same index in each sequence. Hours are held as integer counts of
+    hundredths of an hour.
+    """
+    FIELDS = ('id', 'job_id', 'user_id', 'task_id', 'task_type_id',
+              'week_commencing') + TimeEntry.TIME_ATTRS
+    LOOKUPS = ('id', 'task__job', 'user', 'task', 'task__task_type',
+               'week_commencing') + tuple(['%s_units' % attr \
+                                           for attr in TimeEntry.TIME_ATTRS])
+
+    def __init__(self, rows=()):
+        """
+        rows
+            Sequences of values for each Time Entry, in ``FIELDS`` order.
+        """
+        rows = list(rows)
+        self.count = len(rows)
+        if rows:
+            columns = zip(*rows)
+        else:
+            columns = [()] * len(self.FIELDS)
+        for field, column in zip(self.FIELDS, columns):
+            setattr(self, field, column)
+
+    def __len__(self):
+        return self.count
+
+    def group_by(self, field):
+        """
+        Splits these columns into a dict mapping values of the given
+        field to ``TimeEntryColumns`` for the Time Entries having them.
+        """
+        indices_by_value = {}
+        for i, value in enumerate(getattr(self, field)):
+            indices_by_value.setdefault(value, []).append(i)
+        columns = [getattr(self, f) for f in self.FIELDS]
+        groups = {}
+        for value, indices in indices_by_value.iteritems():
+            group = groups[value] = TimeEntryColumns()
+            group.count = len(indices)
+            if len(indices) == 1:
+                for f, column in zip(self.FIELDS, columns):
+                    setattr(group, f, (column[indices[0]],))
+            else:
+                get_items = itemgetter(*indices)
+                for f, column in zip(self.FIELDS, columns):
+                    setattr(group, f, get_items(column))
+        return groups
+
+    @classmethod
+    def from_queryset(cls, queryset):
+        """
+        Loads columns for the Time Entries in the given ``QuerySet`` in a
+        single query, having the database convert hours to hundredths.
+        """
+        opts = TimeEntry._meta
+        qn = connection.ops.quote_name
+        # MySQL can only cast to SIGNED rather than INTEGER
+        integer_type = uses_engine(connection, 'mysql') and 'SIGNED' or \
+                       'INTEGER'
+        select = {}
+        for attr in TimeEntry.TIME_ATTRS:
+            select['%s_units' % attr] = 'CAST(ROUND(%s.%s * 100) AS %s)' % (
+                qn(opts.db_table), qn(opts.get_field(attr).column),
+                integer_type)
+        return cls(queryset.extra(select=select).values_list(*cls.LOOKUPS))
+
+class CostCalculation:
+    """
+    Calculates the cost of time booked in Time Entries held in
+    ``TimeEntryColumns``, totalling hours and costs in various ways.
+
+    Rather than expanding every Time Entry into a cost for each day, an
+    applicable rate is resolved once for each rated object and week
+    which falls entirely within a single rate's effective period, and
+    costs are totalled a week and a column at a time using integer
+    arithmetic. Totals are the same ``Decimal`` values calculating each
+    day's cost individually would give.
+
+    Totals by User and Task and by date and User are only calculated if
+    ``detailed`` is ``True``.
+    """
+    detailed = True
+
+    def __init__(self, exchange_rate=None):
+        self.exchange_rate = exchange_rate
+        self.total_hours = Decimal(0)
+        self.total_cost = Decimal(0)
+        self.by_task = {}
+        self.by_user_and_task = {}
+        self.by_date_and_user = {}
+        # Maps rated object ids and weeks to the rates resolved for them,
+        # which may be shared by calculations using the same rate lookup.
+        self.span_rates = {}
+
+    def add(self, columns, rate_lookup, invoice_driven_by):
+        """
+        Adds the hours and costs of time booked in the given columns,
+        using the given rate lookup.
+        """
+        week_rates = self._resolve_rates(columns, rate_lookup,
+                                         RATED_ID_COLUMNS[invoice_driven_by])
+        self._add_entry_totals(columns, week_rates)
+        if self.detailed:
+            self._add_daily_totals(columns, week_rates)
+
+    def _resolve_rates(self, columns, rate_lookup, rated_id_column):
+        """
+        Creates a list holding, for each Time Entry with hours booked, a
+        three-tuple of the standard rate applicable on each day of its
+        week, the applicable overtime rate and the standard rate which
+        applies for the whole week, in hundredths.
+
+        Rates are ``None`` for days on which no rate was looked up or
+        none applies, and the whole week rate is ``None`` if the rate
+        changes during the week.
+        """
+        span_rates = self.span_rates
+        week_rates = [None] * len(columns)
+        rated_ids = getattr(columns, rated_id_column)
+        hour_columns = [getattr(columns, attr) for attr in TimeEntry.TIME_ATTRS]
+        for i in xrange(len(columns)):
+            hours = [column[i] for column in hour_columns]
+            if max(hours) <= 0:
+                continue
+            key = (rated_ids[i], columns.week_commencing[i])
+            if key not in span_rates:
+                first = rate_lookup.get_applicable_rate(key[0], key[1])
+                last = rate_lookup.get_applicable_rate(key[0],
+                                                       key[1] + timedelta(days=6))
+                if first is not None and first is last:
+                    standard_rate = to_units(first.standard_rate)
+                    span_rates[key] = ((standard_rate,) * 7,
+                                       to_units(first.overtime_rate),
+                                       standard_rate)
+                else:
+                    # A rate starts or ends during this week
+                    span_rates[key] = None
+            rates = span_rates[key]
+            if rates is None:
+                rates = self._resolve_daily_rates(rate_lookup, key[0], key[1],
+                                                  hours)
+            week_rates[i] = rates
+        return week_rates
+
+    def _resolve_daily_rates(self, rate_lookup, rated_id, week_commencing,
+                             hours):
+        """
+        Looks up rates for each day on which hours were booked in a week
+        during which the applicable rate changes.
+        """
+        standard_rates = []
+        for day, day_hours in enumerate(hours[:7]):
+            rate = None
+            if day_hours > 0:
+                rate = rate_lookup.get_applicable_rate(rated_id,
+                    week_commencing + timedelta(days=day))
+            standard_rates.append(rate is not None and \
+                                  to_units(rate.standard_rate) or None)
+        overtime_rate = None
+        if hours[7] > 0:
+            rate = rate_lookup.get_applicable_rate(rated_id, week_commencing)
+            overtime_rate = rate is not None and \
+                            to_units(rate.overtime_rate) or None
+        return (tuple(standard_rates), overtime_rate, None)
+
+    def _add_totals(self, totals, key, hour_units, cost_units):
+        """
+        Adds totals of hundredths of an hour and ten-thousandths of
+        currency to the ``HoursAndCost`` held under the given key in the
+        given dict.
+        """
+        hours = from_units(hour_units)
+        cost = from_units(cost_units, UNITS_PLACES * 2)
+        if self.exchange_rate is not None:
+            cost = cost * self.exchange_rate
+        if totals.has_key(key):
+            totals[key].add(hours, cost)
+        else:
+            totals[key] = HoursAndCost()
+            totals[key].hours, totals[key].cost = hours, cost
+
+    def _add_entry_totals(self, columns, week_rates):
+        """
+        Totals hours and costs for each Time Entry, adding them to the
+        overall, by Task and by User and Task totals.
+        """
+        day_columns = [getattr(columns, attr) for attr in DAY_ATTRS]
+        overtime = columns.overtime
+        task_ids, user_ids = columns.task_id, columns.user_id
+        by_task = {}
+        by_user_and_task = {}
+        for i, rates in enumerate(week_rates):
+            if rates is None:
+                continue
+            standard_rates, overtime_rate, week_rate = rates
+            day_hours = [column[i] for column in day_columns]
+            if week_rate is not None:
+                hours = sum(day_hours)
+                cost = hours * week_rate
+            else:
+                hours = cost = 0
+                for h, rate in zip(day_hours, standard_rates):
+                    if h > 0:
+                        if rate is None:
+                            raise RateNotFound(u'An applicable billing rate could not be found.')
+                        hours += h
+                        cost += h * rate
+            if overtime[i] > 0:
+                if overtime_rate is None:
+                    raise RateNotFound(u'An applicable billing rate could not be found.')
+                hours += overtime[i]
+                cost += overtime[i] * overtime_rate
+
+            totals = by_task.setdefault(task_ids[i], [0, 0])
+            totals[0] += hours
+            totals[1] += cost
+            if self.detailed:
+                totals = by_user_and_task.setdefault(
+                    (user_ids[i], task_ids[i]), [0, 0])
+                totals[0] += hours
+                totals[1] += cost
+
+        total_hours = total_cost = 0
+        for task_id, (hours, cost) in by_task.iteritems():
+            self._add_totals(self.by_task, task_id, hours, cost)
+            total_hours += hours
+            total_cost += cost
+        for (user_id, task_id), (hours, cost) in by_user_and_task.iteritems():
+            self._add_totals(self.by_user_and_task.setdefault(user_id, {}),
+                             task_id, hours, cost)
+        totals = {}
+        self._add_totals(totals, None, total_hours, total_cost)
+        self.total_hours += totals[None].hours
+        self.total_cost += totals[None].cost
+
+    def _add_daily_totals(self, columns, week_rates):
+        """
+        Totals hours and costs by date and User, a column at a time.
+
+        Any overtime booked is treated as occurring on the first day of
+        the week.
+        """
+        user_ids = columns.user_id
+        weeks = columns.week_commencing
+        hours_by_day = {}
+        cost_by_day = {}
+        for day, attr in enumerate(TimeEntry.TIME_ATTRS):
+            column = getattr(columns, attr)
+            overtime = attr == 'overtime'
+            offset = not overtime and day or 0
+            for i, hours in enumerate(column):
+                if hours <= 0:
+                    continue
+                if overtime:
+                    rate = week_rates[i][1]
+                else:
+                    rate = week_rates[i][0][day]
+                key = (weeks[i], offset, user_ids[i])
+                hours_by_day[key] = hours_by_day.get(key, 0) + hours
+                cost_by_day[key] = cost_by_day.get(key, 0) + hours * rate
+
+        dates = {}
+        for (week_commencing, offset, user_id), hours in hours_by_day.iteritems():
+            if not dates.has_key((week_commencing, offset)):
+                dates[week_commencing, offset] = \
+                    week_commencing + timedelta(days=offset)
+            self._add_totals(
+                self.by_date_and_user.setdefault(dates[week_commencing, offset],
+                                                 {}),
+                user_id, hours, cost_by_day[week_commencing, offset, user_id])
+
+class InvoiceTimeCalculation(CostCalculation):
     def __init__(self, job, start_period=None, end_period=None, include_invoiced=False):
+        CostCalculation.__init__(self)
         self.job = job
         self.start_period, self.end_period = start_period, end_period
         self.include_invoiced = include_invoiced
-        self.exchange_rate = None
+        self.time_entry_ids = []
 
-        # Calculated attributes
-        self.total_hours = 0.0
-        self.total_cost = 0.0
-        self.by_task = {}
-        self.by_user_and_task = {}
-        self.by_date_and_user = {}
+    def get_time_entries(self):
+        """
+        Creates a ``QuerySet`` containing the approved Time Entries to be
+        included in the invoice.
+        """
+        time_entries = TimeEntry.objects.filter(task__job=self.job,
+                                                approved_by__isnull=False)
+        if self.start_period is not None:
+            time_entries = time_entries.filter(
+                week_commencing__gte=self.start_period)
+        if self.end_period is not None:
+            time_entries = time_entries.filter(
+                week_commencing__lte=self.end_period)
+        if not self.include_invoiced:
+            time_entries = time_entries.filter(invoice__isnull=True)
+        return time_entries
 
-    def calculate(self, rate_lookup, invoice_driven_by):
+    def calculate(self, rate_lookup, invoice_driven_by, columns=None):
         """
         Determines which TimeEntries will be included in the invoice,
         calculates the cost of hours booked using the given rate lookup
         and totals the hours and costs in various ways.
+
+        If the Time Entries to be included have already been loaded,
+        they may be given as ``TimeEntryColumns``.
         """
-        # Retrieve TimeEntries to be included in the invoice
-        filters = [Q(task__job=job), Q(approved=True)]
+        if columns is None:
+            columns = TimeEntryColumns.from_queryset(self.get_time_entries())
+        self.time_entry_ids = list(columns.id)
+        self.add(columns, rate_lookup, invoice_driven_by)
+
+# Maps the ways in which invoicing may be driven to the rate model and
+# related object attribute used to create a ``RateLookup``.
+RATE_MODELS = {
+    u'U': (UserRate, 'user'),
+    u'T': (TaskTypeRate, 'task_type'),
+}
+
+# The maximum number of ids given in a single bulk UPDATE
+UPDATE_CHUNK_SIZE = 500
+
+def chunks(items, size=UPDATE_CHUNK_SIZE):
+    """
+    Splits a list into lists of at most the given size.
+    """
+    return [items[i:i + size] for i in xrange(0, len(items), size)]
+
+class JobInvoiceResult:
+    """
+    The outcome of invoicing a single Job as part of an ``InvoiceBatch``.
+    """
+    def __init__(self, job):
+        self.job = job
+        self.calculation = None
+        self.expense_ids = []
+        self.expenses_total = Decimal(0)
+        self.amount = Decimal(0)
+        self.invoice = None
+        self.error = None
+        self.seconds = 0.0
+
+    @property
+    def time_entry_count(self):
+        return len(self.calculation and self.calculation.time_entry_ids or [])
+
+    @property
+    def expense_count(self):
+        return len(self.expense_ids)
+
+    @property
+    def has_items(self):
+        return self.time_entry_count > 0 or self.expense_count > 0
+
+class InvoiceBatch:
+    """
+    Creates Invoices for uninvoiced, approved Time Entries and Expenses
+    booked against any number of Jobs.
+
+    Rather than working through Jobs one at a time, each step is
+    performed for all Jobs at once:
+
+    1. Time Entries and Expenses for all Jobs are loaded in a single
+       query each.
+    2. Rates needed for all Time Entries are loaded into a single
+       ``RateLookup``.
+    3. Costs are calculated for each Job.
+    4. Invoice numbers for all Jobs without a manually specified number
+       are allocated in a single block.
+    5. Invoices are created and Time Entries and Expenses are linked to
+       them with bulk UPDATEs.
+
+    Once ``run`` has been called, ``results`` holds a
+    ``JobInvoiceResult`` for each Job and ``timings`` holds a list of
+    two-tuples of step descriptions and the number of seconds they
+    took.
+
+    If ``detailed`` is set to ``False``, costs are only totalled for
+    each Job and Task, which is all that's needed to value uninvoiced
+    work without creating Invoices.
+    """
+    detailed = True
+
+    def __init__(self, jobs, invoice_type, date, start_period=None,
+                 end_period=None, numbers=None):
+        """
+        jobs
+            The Jobs to be invoiced. If these are given as a ``QuerySet``,
+            it's used as a subquery when loading items to be invoiced
+            rather than listing every Job's id.
+
+        invoice_type, date, start_period, end_period
+            Details for the Invoices to be created - the start and end
+            period are only used for date restricted Invoices.
+
+        numbers
+            An optional dict mapping Job ids to manually specified
+            Invoice numbers.
+        """
+        self.jobs = list(jobs)
+        if isinstance(jobs, QuerySet):
+            self.job_ids = jobs.values('pk')
+        else:
+            self.job_ids = [job.id for job in self.jobs]
+        self.invoice_type = invoice_type
+        self.date = date
+        if invoice_type == Invoice.DATE_RESTRICTED_TYPE:
+            self.start_period, self.end_period = start_period, end_period
+        else:
+            self.start_period, self.end_period = None, None
+        self.numbers = numbers or {}
+        self.driven_by = Invoice.options.driven_by or u'U'
+        self.results = [JobInvoiceResult(job) for job in self.jobs]
+        self.timings = []
+
+    def run(self):
+        """
+        Creates Invoices for all Jobs.
+        """
+        self._timed(u'Loading Time Entries', self.load_time_entries)
+        self._timed(u'Loading Expenses', self.load_expenses)
+        self._timed(u'Loading rates', self.load_rates)
+        self._timed(u'Calculating costs', self.calculate)
+        self._timed(u'Creating Invoices', self.create_invoices)
+        self._timed(u'Linking Time Entries and Expenses', self.link_items)
+
+    def render_pdfs(self, processes=None):
+        """
+        Renders and saves PDFs for all Invoices created, spreading
+        rendering across the given number of worker processes, defaulting
+        to ``INVOICE_PDF_PROCESSES``.
+        """
+        from djangoffice.pdf import create_invoice_pdfs
+        if processes is None:
+            processes = settings.INVOICE_PDF_PROCESSES
+        self._timed(u'Rendering PDFs',
+                    lambda: create_invoice_pdfs(self.results, processes))
+
+    def _timed(self, description, step):
+        start = time.time()
+        step()
+        self.timings.append((description, time.time() - start))
+
+    @property
+    def invoices(self):
+        return [result.invoice for result in self.results \
+                if result.invoice is not None]
+
+    @property
+    def total_seconds(self):
+        return sum([seconds for description, seconds in self.timings])
+
+    def _restrict(self, queryset, date_field):
+        queryset = queryset.filter(approved_by__isnull=False,
+                                   invoice__isnull=True)
         if self.start_period is not None:
-            filters.append(Q(week_commencing__gte=self.start_date))
+            queryset = queryset.filter(**{
+                '%s__gte' % date_field: self.start_period,
+            })
         if self.end_period is not None:
-            filters.append(Q(week_commencing__lte=self.start_date))
-        if not self.include_invoiced:
-            filters.append(Q(invoice__isnull=False))
-        time_entries = list(TimeEntry.objects.filter(map(operator._and, filters)))
-        self.time_entry_ids = [te.id for te in time_entries]
-
-        # Convert time entries to a daily format
-        day_time_entries = weekly_to_daily_entries(time_entries)
-
-        rate_by_pk_attr = {
-            u'U': 'user_id',
-            u'T': 'task_id',
-        }[invoice_driven_by]
-
-        for entry in day_time_entries:
-            # Calculate the cost of the time entry
-            rate = rate_lookup.get_applicable_rate(
-                getattr(entry, rate_by_pk_attr), entry.date)
-            if rate is None:
-                raise RateNotFound(u'An applicable billing rate could not be found.')
-            rate_amount = entry.overtime and rate.overtime_rate or rate.standard_rate
-            cost = entry.hours * rate_amount
-            if self.exchange_rate is not None:
-                cost = cost * self.exchange_rate
-
-            # Update calculated attributes with the hours and cost for the
-            # time entry.
-            self.total_hours += entry.hours
-            self.total_cost += cost
-            self.by_task.setdefault(entry.task_id,
-                                    HoursAndCost()).add(entry.hours, cost)
-            self.by_user_and_task.setdefault(entry.user_id, {}) \
-                .setdefault(entry.task_id, HoursAndCost()).add(entry.hours, cost)
-            self.by_date_and_user.setdefault(entry.date, {}) \
-                .setdefault(entry.user_id, HoursAndCost()).add(entry.hours, cost)
+            queryset = queryset.filter(**{
+                '%s__lte' % date_field: self.end_period,
+            })
+        return queryset
+
+    def load_time_entries(self):
+        time_entries = self._restrict(TimeEntry.objects.filter(
+            task__job__in=self.job_ids), 'week_commencing')
+        self.time_entry_columns = TimeEntryColumns.from_queryset(time_entries)
+        self.columns_by_job = self.time_entry_columns.group_by('job_id')
+
+    def load_expenses(self):
+        expenses = self._restrict(Expense.objects.filter(
+            job__in=self.job_ids), 'date')
+        self.expenses_by_job = {}
+        for id, job_id, amount in expenses.values_list('id', 'job', 'amount'):
+            self.expenses_by_job.setdefault(job_id, []).append((id, amount))
+
+    def load_rates(self):
+        """
+        Creates a ``RateLookup`` restricted to the rated objects and
+        period covered by all Time Entries being invoiced.
+        """
+        model, related_object_attr = RATE_MODELS[self.driven_by]
+        columns = self.time_entry_columns
+        weeks = columns.week_commencing
+        self.rate_lookup = None
+        # Rates resolved for each rated object and week are shared by
+        # the calculations for every Job.
+        self.span_rates = {}
+        if len(columns):
+            self.rate_lookup = RateLookup(model, related_object_attr,
+                rated_ids=set(getattr(columns,
+                                      RATED_ID_COLUMNS[self.driven_by])),
+                start_date=min(weeks),
+                end_date=max(weeks) + timedelta(days=6))
+
+    def calculate(self):
+        """
+        Calculates the amount to be invoiced for each Job.
+        """
+        exchange_rate = Invoice.options.exchange_rate
+        for result in self.results:
+            start = time.time()
+            job = result.job
+            calculation = InvoiceTimeCalculation(job, self.start_period,
+                                                 self.end_period)
+            calculation.detailed = self.detailed
+            calculation.span_rates = self.span_rates
+            if job.fee_currency == Job.EURO_CURRENCY:
+                calculation.exchange_rate = exchange_rate
+            try:
+                calculation.calculate(self.rate_lookup, self.driven_by,
+                    self.columns_by_job.get(job.id, TimeEntryColumns()))
+            except RateNotFound, e:
+                result.error = unicode(e)
+                continue
+            result.calculation = calculation
+            for id, amount in self.expenses_by_job.get(job.id, []):
+                result.expense_ids.append(id)
+                result.expenses_total += amount
+            if calculation.exchange_rate is not None:
+                result.expenses_total *= calculation.exchange_rate
+            result.amount = (calculation.total_cost + result.expenses_total) \
+                .quantize(Decimal('0.01'))
+            result.seconds = time.time() - start
+
+    def create_invoices(self):
+        """
+        Creates an Invoice for each Job which has something to invoice.
+        """
+        to_invoice = [result for result in self.results \
+                      if result.error is None and result.has_items]
+        manual_numbers = [self.numbers[result.job.id] for result in to_invoice \
+                          if self.numbers.get(result.job.id) is not None]
+        # Manual numbers must be taken out of the sequence before a block
+        # is allocated from it.
+        allocator = NumberAllocator(Invoice)
+        for number in manual_numbers:
+            allocator.claim(number)
+        free_numbers = allocator.allocate(len(to_invoice) - len(manual_numbers))
+        free_numbers.reverse()
+        for result in to_invoice:
+            number = self.numbers.get(result.job.id)
+            if number is None:
+                number = free_numbers.pop()
+            result.invoice = Invoice.objects.create(job=result.job,
+                number=number, date=self.date, type=self.invoice_type,
+                start_period=self.start_period, end_period=self.end_period,
+                amount_invoiced=result.amount)
+
+    def link_items(self):
+        """
+        Links invoiced Time Entries and Expenses to their Invoices.
+        """
+        for result in self.results:
+            if result.invoice is None:
+                continue
+            for ids in chunks(result.calculation.time_entry_ids):
+                TimeEntry.objects.filter(pk__in=ids).update(
+                    invoice=result.invoice)
+            for ids in chunks(result.expense_ids):
+                Expense.objects.filter(pk__in=ids).update(
+                    invoice=result.invoice)
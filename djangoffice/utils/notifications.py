@@ -0,0 +1,382 @@
+"""
+Notification emails for the triggers which may be enabled in
+``EmailOptions``.
+
+The ``send_notifications`` command should be run regularly, e.g. from
+cron. Each time it runs, every rule only checks rows which changed, or
+dates which passed, since the rule last ran, as recorded in its
+``NotificationWatermark`` - so the work done depends on how much has
+happened since the last run rather than how many Jobs, Activities and
+Expenses exist. The first time a rule runs it only records its
+watermark, so existing data doesn't result in a flood of emails. Rules
+which are disabled still move their watermarks on.
+
+Rows may be written by transactions which commit after a rule has
+checked past them, so rules which check changed rows also recheck
+``NOTIFICATION_RECHECK_SECONDS`` or ``NOTIFICATION_RECHECK_IDS`` before
+their watermark, flagging what they've notified about so it's only
+notified about once.
+
+Emails aren't sent while rules are checked, but are queued in the
+``OutboxEmail`` table in the same transaction as the rule's watermark,
+to be sent in batches by the ``send_outbox_emails`` worker.
+"""
+import datetime
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F, Max, Sum
+from django.template.loader import render_to_string
+
+from djangoffice.models import (Activity, Expense, Job, NotificationWatermark,
+    OutboxEmail, Timesheet, UserProfile, email as email_options)
+from djangoffice.utils.dates import week_commencing_date
+from djangoffice.utils.reports import (MAX_TIMESHEET_STATUS_WEEKS,
+    get_timesheet_status)
+
+def queue_email(rule, subject, template, context, recipients):
+    """
+    Queues an email rendered from the given template for sending to
+    the given addresses, returning ``True`` if it was queued - it won't
+    be if there are no addresses.
+    """
+    recipients = [address for address in recipients if address]
+    if not recipients:
+        return False
+    email = OutboxEmail(rule=rule, subject=subject,
+        body=render_to_string('notifications/%s.txt' % template, context))
+    email.set_recipients(recipients)
+    email.save()
+    return True
+
+class NotificationRule:
+    """
+    Checks for something to notify about which has happened since the
+    rule last checked, queuing emails for it.
+
+    Rules whose ``uses_ids`` is ``True`` check rows added since the last
+    id they checked; others check changes, or dates passed, since the
+    time they last checked until.
+    """
+    name = None
+    options = ()
+    uses_ids = False
+
+    def is_enabled(self):
+        for option in self.options:
+            if getattr(email_options, option):
+                return True
+        return False
+
+    def get_last_id(self):
+        """
+        Returns the id of the most recently added row the rule checks.
+        """
+        raise NotImplementedError
+
+    def advance(self, watermark, now):
+        """
+        Moves the given watermark on without checking anything.
+        """
+        if self.uses_ids:
+            watermark.last_id = self.get_last_id() or 0
+        else:
+            watermark.checked_until = now
+
+    def check(self, watermark, now):
+        """
+        Queues emails for anything which has happened since the given
+        watermark, moving it on and returning the number queued.
+        """
+        raise NotImplementedError
+
+class JobOverHoursRule(NotificationRule):
+    """
+    Notifies Project Managers when more hours are booked against a live
+    Job's Tasks than were estimated for them. Only Jobs with Tasks which
+    have been booked against since the last check are checked.
+    """
+    name = 'job_over_hours'
+    options = ('job_over_hours',)
+
+    def check(self, watermark, now):
+        checked_until = watermark.checked_until - \
+            datetime.timedelta(seconds=settings.NOTIFICATION_RECHECK_SECONDS)
+        booked_jobs = Job.objects.filter(status=Job.LIVE_STATUS,
+            over_hours=False,
+            tasks__total__updated_at__gt=checked_until,
+            tasks__total__updated_at__lte=now) \
+            .exclude(pk=settings.ADMIN_JOB_ID).values('pk')
+        jobs = Job.objects.filter(pk__in=booked_jobs) \
+            .annotate(estimate_hours=Sum('tasks__estimate_hours'),
+                      booked_hours=Sum('tasks__total__hours')) \
+            .select_related('project_manager')
+        over_hours = []
+        for job in jobs:
+            if job.estimate_hours and job.booked_hours > job.estimate_hours:
+                queue_email(self.name,
+                    u'Job %s is over hours' % job.formatted_number,
+                    self.name, {'job': job}, [job.project_manager.email])
+                over_hours.append(job.pk)
+        if over_hours:
+            Job.objects.filter(pk__in=over_hours).update(over_hours=True)
+        watermark.checked_until = now
+        return len(over_hours)
+
+class JobMissedEndDateRule(NotificationRule):
+    """
+    Notifies Project Managers when a live Job's expected end date has
+    passed. Only end dates which have passed since the last check are
+    checked.
+    """
+    name = 'job_missed_end_date'
+    options = ('job_missed_end_date',)
+
+    def check(self, watermark, now):
+        jobs = Job.objects.filter(status=Job.LIVE_STATUS,
+            missed_end_date=False,
+            end_date__gte=watermark.checked_until.date(),
+            end_date__lt=now.date()).select_related('project_manager')
+        missed = []
+        for job in jobs:
+            queue_email(self.name,
+                u'Job %s has missed its end date' % job.formatted_number,
+                self.name, {'job': job}, [job.project_manager.email])
+            missed.append(job.pk)
+        if missed:
+            Job.objects.filter(pk__in=missed).update(missed_end_date=True)
+        watermark.checked_until = now
+        return len(missed)
+
+class IncompleteTimesheetRule(NotificationRule):
+    """
+    Notifies Users whose Timesheets are missing or have fewer hours than
+    a full week booked once the week has ended. Only weeks which have
+    ended since the last check are checked, with the Timesheet Status
+    report's query.
+    """
+    name = 'incomplete_timesheet'
+    options = ('incomplete_timesheet',)
+
+    def check(self, watermark, now):
+        start_date = week_commencing_date(watermark.checked_until.date())
+        end_date = week_commencing_date(now.date()) - \
+                   datetime.timedelta(weeks=1)
+        watermark.checked_until = now
+        if end_date < start_date:
+            return 0
+        start_date = max(start_date, end_date - \
+            datetime.timedelta(weeks=MAX_TIMESHEET_STATUS_WEEKS - 1))
+        users = User.objects.exclude(
+            userprofile__role=UserProfile.ADMINISTRATOR_ROLE)
+        weeks = {}
+        stream = get_timesheet_status(users, start_date, end_date,
+            Timesheet.options.hours_per_full_week).execute()
+        for row in stream:
+            weeks.setdefault(row[0], []).append({
+                'week_commencing': row[3],
+                'hours': row[4],
+                'status': row[5],
+            })
+        count = 0
+        for user in users.filter(username__in=weeks.keys()):
+            if queue_email(self.name, u'Incomplete Timesheets', self.name, {
+                    'user': user,
+                    'weeks': weeks[user.username],
+                    'hours_per_full_week': Timesheet.options.hours_per_full_week,
+                }, [user.email]):
+                count += 1
+        return count
+
+class ExpenseOverLimitRule(NotificationRule):
+    """
+    Notifies Project Managers when an Expense over the limit for its
+    type is booked against their Job. Only Expenses added since the last
+    check are checked.
+    """
+    name = 'expense_over_limit'
+    options = ('expense_over_limit',)
+    uses_ids = True
+
+    def get_last_id(self):
+        return Expense.objects.aggregate(last_id=Max('pk'))['last_id']
+
+    def check(self, watermark, now):
+        last_id = self.get_last_id() or 0
+        checked_id = max(watermark.last_id - settings.NOTIFICATION_RECHECK_IDS,
+                         0)
+        expenses = Expense.objects.filter(pk__gt=checked_id,
+            pk__lte=last_id, over_limit=False, amount__gt=F('type__limit')) \
+            .select_related('user', 'type', 'job__project_manager')
+        count = 0
+        over_limit = []
+        for expense in expenses:
+            if queue_email(self.name,
+                    u'Expense over limit for Job %s' % \
+                    expense.job.formatted_number,
+                    self.name, {'expense': expense},
+                    [expense.job.project_manager.email]):
+                count += 1
+            over_limit.append(expense.pk)
+        if over_limit:
+            Expense.objects.filter(pk__in=over_limit).update(over_limit=True)
+        watermark.last_id = last_id
+        return count
+
+class ActivityMissedDueDateRule(NotificationRule):
+    """
+    Notifies Users when an incomplete Activity assigned to them misses
+    its due date. Only due dates which have passed since the last check
+    are checked.
+    """
+    name = 'activity_missed_due_date'
+    options = ('activity_missed_due_date',)
+
+    def check(self, watermark, now):
+        activities = Activity.objects.filter(completed=False,
+            assigned_to__isnull=False,
+            due_date__gte=watermark.checked_until.date(),
+            due_date__lt=now.date()).select_related('assigned_to', 'job')
+        count = 0
+        for activity in activities:
+            if queue_email(self.name,
+                    u'Activity %s has missed its due date' % \
+                    activity.formatted_number,
+                    self.name, {'activity': activity},
+                    [activity.assigned_to.email]):
+                count += 1
+        watermark.checked_until = now
+        return count
+
+class ActivityAssignedRule(NotificationRule):
+    """
+    Notifies Users and Contacts when an incomplete Activity is assigned
+    to them. Only Activities assigned since the last check are checked.
+    """
+    name = 'activity_assigned'
+    options = ('activity_user_assigned', 'activity_contact_assigned')
+
+    def check(self, watermark, now):
+        checked_until = watermark.checked_until - \
+            datetime.timedelta(seconds=settings.NOTIFICATION_RECHECK_SECONDS)
+        activities = Activity.objects.filter(completed=False,
+            assignment_notified=False, assigned_at__gt=checked_until,
+            assigned_at__lte=now) \
+            .select_related('assigned_to', 'contact', 'job')
+        count = 0
+        checked = []
+        for activity in activities:
+            checked.append(activity.pk)
+            if activity.assigned_to_id is not None:
+                if not email_options.activity_user_assigned:
+                    continue
+                address = activity.assigned_to.email
+            elif email_options.activity_contact_assigned:
+                address = activity.contact.email
+            else:
+                continue
+            if queue_email(self.name,
+                    u'Activity %s has been assigned to you' % \
+                    activity.formatted_number,
+                    self.name, {'activity': activity}, [address]):
+                count += 1
+        if checked:
+            Activity.objects.filter(pk__in=checked) \
+                .update(assignment_notified=True)
+        watermark.checked_until = now
+        return count
+
+RULES = (
+    JobOverHoursRule(),
+    JobMissedEndDateRule(),
+    IncompleteTimesheetRule(),
+    ExpenseOverLimitRule(),
+    ActivityMissedDueDateRule(),
+    ActivityAssignedRule(),
+)
+
+def run_rule(rule, now):
+    """
+    Runs a notification rule, returning the number of emails queued.
+    """
+    try:
+        watermark = NotificationWatermark.objects.get(rule=rule.name)
+    except NotificationWatermark.DoesNotExist:
+        watermark = NotificationWatermark(rule=rule.name)
+        rule.advance(watermark, now)
+        watermark.save()
+        return 0
+    count = 0
+    if rule.is_enabled():
+        count = rule.check(watermark, now)
+    else:
+        rule.advance(watermark, now)
+    watermark.save()
+    return count
+run_rule = transaction.commit_on_success(run_rule)
+
+def run_notifications(now=None):
+    """
+    Runs every notification rule, each in its own transaction,
+    returning a list of two-tuples of rule names and the number of
+    emails queued.
+    """
+    if now is None:
+        now = datetime.datetime.now()
+    return [(rule.name, run_rule(rule, now)) for rule in RULES]
+
+def send_outbox_emails(worker, batch_size=None, max_attempts=None):
+    """
+    Claims a batch of queued emails for the given worker and sends them
+    over a single connection to the mail server, returning a two-tuple
+    of the number sent and the number which failed.
+
+    Emails which fail, or can't be sent because the mail server can't
+    be connected to, are released to be retried until they've been
+    attempted ``OUTBOX_MAX_ATTEMPTS`` times. Emails claimed by a worker
+    which dies before sending them are retried once their claim is
+    older than ``OUTBOX_CLAIM_TIMEOUT`` seconds.
+
+    The claim on each email is renewed just before it's sent, so emails
+    another worker has reclaimed since the batch was claimed are skipped.
+    """
+    if batch_size is None:
+        batch_size = settings.OUTBOX_BATCH_SIZE
+    if max_attempts is None:
+        max_attempts = settings.OUTBOX_MAX_ATTEMPTS
+    emails = OutboxEmail.objects.claim_batch(worker, batch_size, max_attempts)
+    if not emails:
+        return 0, 0
+    sent = failed = 0
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception, e:
+        OutboxEmail.objects.filter(pk__in=[email.pk for email in emails],
+                                   worker=worker).update(worker='',
+            attempts=F('attempts') + 1, error=unicode(e))
+        return 0, len(emails)
+    try:
+        for email in emails:
+            claimed = OutboxEmail.objects.filter(pk=email.pk, worker=worker,
+                                                 sent_at__isnull=True)
+            if not claimed.update(claimed_at=datetime.datetime.now()):
+                continue
+            try:
+                EmailMessage(email.subject, email.body,
+                             settings.DEFAULT_FROM_EMAIL,
+                             email.get_recipients(),
+                             connection=connection).send()
+            except Exception, e:
+                claimed.update(worker='', attempts=F('attempts') + 1,
+                               error=unicode(e))
+                failed += 1
+            else:
+                claimed.update(attempts=F('attempts') + 1,
+                               sent_at=datetime.datetime.now())
+                sent += 1
+    finally:
+        connection.close()
+    return sent, failed
@@ -0,0 +1,266 @@
+"""
+Statistics for the queries executed by each view.
+
+``QueryStatsMiddleware`` traces the queries executed while handling each
+request and records them against the name of the URL pattern which was
+matched in ``query_stats``, which keeps statistics for each URL name's
+most recent ``SQL_STATS_WINDOW`` requests in memory. Statistics are kept
+by each process separately and are lost when it exits.
+
+Queries are fingerprinted by replacing their literal values and
+parameters with placeholders, so a view which executes the same query
+for each of a list of objects shows up as repeating a fingerprint.
+"""
+import re
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.urlresolvers import RegexURLResolver, get_resolver
+from django.db import connections, DEFAULT_DB_ALIAS
+
+# Matches string and numeric literals and query parameter placeholders
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%s")
+# Matches lists of placeholders, e.g. for IN
+PLACEHOLDER_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+WHITESPACE_RE = re.compile(r'\s+')
+
+def fingerprint(sql):
+    """
+    Normalises the given query so it's the same whichever values it's
+    executed with.
+    """
+    sql = WHITESPACE_RE.sub(' ', sql.strip())
+    return PLACEHOLDER_LIST_RE.sub('(...)', LITERAL_RE.sub('?', sql))
+
+class QueryTrace:
+    """
+    The queries executed while handling a request, as a list of
+    three-tuples of SQL, parameters and the time taken in seconds.
+    """
+    def __init__(self):
+        self.queries = []
+
+    def add(self, sql, params, duration):
+        self.queries.append((sql, params, duration))
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def time(self):
+        """
+        The total time taken executing queries, in milliseconds.
+        """
+        return sum([duration for sql, params, duration in self.queries]) * 1000
+
+    @property
+    def duplicates(self):
+        """
+        The number of queries which were executed again with the same
+        parameters.
+        """
+        seen = set()
+        duplicates = 0
+        for sql, params, duration in self.queries:
+            key = (sql, repr(params))
+            if key in seen:
+                duplicates += 1
+            else:
+                seen.add(key)
+        return duplicates
+
+    def repeated(self):
+        """
+        Creates a dict mapping fingerprints of queries which were
+        executed more than once to the number of times they were.
+        """
+        counts = {}
+        for sql, params, duration in self.queries:
+            key = fingerprint(sql)
+            counts[key] = counts.get(key, 0) + 1
+        return dict([(key, count) for key, count in counts.items() \
+                     if count > 1])
+
+    def format(self):
+        """
+        Formats the trace for reading, one query per line.
+        """
+        lines = [u'%s queries in %.1fms, %s duplicates' % (self.count,
+                                                         self.time,
+                                                         self.duplicates)]
+        for sql, params, duration in self.queries:
+            lines.append(u'%8.1fms  %s %r' % (duration * 1000,
+                WHITESPACE_RE.sub(' ', sql.strip()), tuple(params or ())))
+        return u'\n'.join(lines)
+
+class TracingCursor(object):
+    """
+    Wraps a database cursor, adding the queries executed with it to a
+    ``QueryTrace``.
+    """
+    def __init__(self, cursor, trace):
+        self.cursor = cursor
+        self.trace = trace
+
+    def execute(self, sql, params=()):
+        start = time.time()
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            self.trace.add(sql, params, time.time() - start)
+
+    def executemany(self, sql, param_list):
+        start = time.time()
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            self.trace.add(sql, (), time.time() - start)
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+def start_query_trace(using=DEFAULT_DB_ALIAS):
+    """
+    Starts tracing the queries executed with the given database
+    connection in the current thread, returning a ``QueryTrace``.
+    """
+    stop_query_trace(using)
+    connection = connections[using]
+    trace = QueryTrace()
+    cursor = connection.cursor
+    connection.cursor = lambda: TracingCursor(cursor(), trace)
+    return trace
+
+def stop_query_trace(using=DEFAULT_DB_ALIAS):
+    """
+    Stops tracing the queries executed with the given database
+    connection in the current thread.
+    """
+    connection = connections[using]
+    if 'cursor' in connection.__dict__:
+        del connection.cursor
+
+def get_url_name(path, urlconf=None):
+    """
+    Determines the name of the URL pattern the given path matches,
+    returning ``None`` if it doesn't match a named pattern.
+    """
+    def _find(resolver, path):
+        match = resolver.regex.search(path)
+        if match is None:
+            return None
+        path = path[match.end():]
+        for pattern in resolver.url_patterns:
+            if isinstance(pattern, RegexURLResolver):
+                name = _find(pattern, path)
+                if name is not None:
+                    return name
+            elif pattern.resolve(path) is not None:
+                return pattern.name
+        return None
+    return _find(get_resolver(urlconf), path)
+
+class ViewQueryStats:
+    """
+    Statistics for the queries executed by the view for a URL name over
+    its most recent requests.
+    """
+    def __init__(self, name, window):
+        self.name = name
+        # Four-tuples of query count, time, duplicates and repeated
+        # fingerprints for each request.
+        self.requests = deque(maxlen=window)
+
+    def add(self, trace):
+        self.requests.append((trace.count, trace.time, trace.duplicates,
+                              trace.repeated()))
+
+    @property
+    def request_count(self):
+        return len(self.requests)
+
+    @property
+    def total_time(self):
+        return sum([r[1] for r in self.requests])
+
+    @property
+    def average_time(self):
+        return self.total_time / len(self.requests)
+
+    @property
+    def average_queries(self):
+        return float(sum([r[0] for r in self.requests])) / len(self.requests)
+
+    @property
+    def max_queries(self):
+        return max([r[0] for r in self.requests])
+
+    @property
+    def average_duplicates(self):
+        return float(sum([r[2] for r in self.requests])) / len(self.requests)
+
+    def repeated(self, limit=5):
+        """
+        Creates a list of two-tuples of the fingerprints of queries which
+        were most often executed more than once per request and the
+        average number of times they were executed per request.
+        """
+        totals = {}
+        for r in self.requests:
+            for key, count in r[3].items():
+                totals[key] = totals.get(key, 0) + count
+        repeated = [(float(count) / len(self.requests), key) \
+                    for key, count in totals.items()]
+        repeated.sort(reverse=True)
+        return [(key, count) for count, key in repeated[:limit]]
+
+class QueryStats:
+    """
+    Query statistics for each URL name, which may be recorded from
+    several threads at once.
+    """
+    def __init__(self, window):
+        self.window = window
+        self.views = {}
+        self.lock = threading.Lock()
+
+    def record(self, name, trace):
+        self.lock.acquire()
+        try:
+            if name not in self.views:
+                self.views[name] = ViewQueryStats(name, self.window)
+            self.views[name].add(trace)
+        finally:
+            self.lock.release()
+
+    def ranking(self):
+        """
+        Creates a list of ``ViewQueryStats`` ordered by the total time
+        spent executing queries, most expensive first.
+        """
+        self.lock.acquire()
+        try:
+            views = []
+            for view in self.views.values():
+                copy = ViewQueryStats(view.name, self.window)
+                copy.requests.extend(view.requests)
+                views.append(copy)
+        finally:
+            self.lock.release()
+        views.sort(key=lambda view: view.total_time, reverse=True)
+        return views
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.views.clear()
+        finally:
+            self.lock.release()
+
+query_stats = QueryStats(settings.SQL_STATS_WINDOW)
@@ -1,8 +1,25 @@
+"""
+Lookup of billing rates applicable on given dates.
+"""
+from bisect import bisect_right
+from datetime import date as date_type, timedelta
+from decimal import Decimal
+
+from django.db import connection
+
 class RateLookup:
     """
     Handles lookups of rates applicable for given dates.
+
+    Rates for each rated object are held in ``effective_from`` order
+    alongside a list of their ``effective_from`` dates, which is
+    bisected to find the rate applicable on a given date. The interval
+    over which the last rate found applies is remembered, so repeated
+    lookups for consecutive days of the same object don't need to search
+    at all.
     """
-    def __init__(self, model, related_object_attr):
+    def __init__(self, model, related_object_attr, rated_ids=None,
+                 start_date=None, end_date=None):
         """
         model
             A model defining rates, which must have an effective_from
@@ -11,9 +28,20 @@ class RateLookup:
         related_object_attr
             The name of the field in the given model which holds the
             relationship to the object the rates are for.
+
+        rated_ids
+            If given, only rates for objects with these ids will be
+            loaded.
+
+        start_date, end_date
+            If given, only rates which apply at some point between these
+            dates will be loaded, and looking up rates for dates outside
+            them is an error.
         """
         self.model = model
         self.related_object_attr = related_object_attr
+        self.rated_ids = rated_ids
+        self.start_date, self.end_date = start_date, end_date
         self.reset(rebuild_lookup=True)
 
     def get_applicable_rate(self, rated_instance_pk, date):
@@ -23,20 +51,75 @@ class RateLookup:
         rate applies.
 
         If an applicable rate is editable, it will be added to this
-        object's ``editable_applicable_rates_used`` list.
-        """
-        applicable_rate = None
-        rates = self.lookup[rated_instance_pk]
-        for rate in rates:
-            if applicable_rate is None or \
-               (rate.effective_from > applicable_rate.effective_from and
-                rate.effective_from <= date):
-                applicable_rate = rate
-        if (applicable_rate is not None and
-            not applicable_rate.editable and
-            applicable_rate not in self.editable_rates_used):
-            self.editable_rates_used.append(applicable_rate)
-        return applicable_rate
+        object's ``editable_rates_used`` list.
+        """
+        pk, start, end, rate = self._last_interval
+        if pk == rated_instance_pk and start <= date < end:
+            return rate
+
+        if (self.start_date is not None and date < self.start_date) or \
+           (self.end_date is not None and date > self.end_date):
+            raise ValueError(u'Rates were not loaded for %s' % date)
+        dates, rates = self._lookup.get(rated_instance_pk, ((), ()))
+        i = bisect_right(dates, date)
+        start = i > 0 and dates[i - 1] or date_type.min
+        end = i < len(dates) and dates[i] or date_type.max
+        rate = i > 0 and rates[i - 1] or None
+        # Lookups for dates outside the loaded window must not be able to
+        # hit the cached interval.
+        if self.start_date is not None:
+            start = max(start, self.start_date)
+        if self.end_date is not None:
+            end = min(end, self.end_date + timedelta(days=1))
+        self._last_interval = (rated_instance_pk, start, end, rate)
+
+        if rate is not None and rate.editable and \
+           rate.pk not in self._editable_rate_pks:
+            self._editable_rate_pks.add(rate.pk)
+            self.editable_rates_used.append(rate)
+        return rate
+
+    def get_loaded_rates(self):
+        """
+        Creates a list of all rates held in the lookup.
+        """
+        loaded_rates = []
+        for dates, rates in self._lookup.itervalues():
+            loaded_rates.extend(rates)
+        return loaded_rates
+
+    def get_rates(self):
+        """
+        Creates a ``QuerySet`` of the rates to be loaded into the lookup,
+        ordered by ``effective_from``.
+        """
+        rates = self.model._default_manager.order_by('effective_from')
+        if self.rated_ids is not None:
+            rates = rates.filter(**{
+                '%s__in' % self.related_object_attr: list(self.rated_ids),
+            })
+        if self.end_date is not None:
+            rates = rates.filter(effective_from__lte=self.end_date)
+        if self.start_date is not None:
+            # Exclude rates which were superseded before the start date
+            opts = self.model._meta
+            qn = connection.ops.quote_name
+            rates = rates.extra(where=["""%(effective_from)s >= COALESCE((
+                SELECT MAX(r.%(effective_from_column)s) FROM %(rate)s r
+                WHERE r.%(related_column)s = %(related)s
+                  AND r.%(effective_from_column)s <= %%s),
+                %(effective_from)s)""" % {
+                    'rate': qn(opts.db_table),
+                    'effective_from': '%s.%s' % (qn(opts.db_table),
+                        qn(opts.get_field('effective_from').column)),
+                    'effective_from_column': qn(
+                        opts.get_field('effective_from').column),
+                    'related': '%s.%s' % (qn(opts.db_table),
+                        qn(opts.get_field(self.related_object_attr).column)),
+                    'related_column': qn(
+                        opts.get_field(self.related_object_attr).column),
+                }], params=[self.start_date])
+        return rates
 
     def reset(self, rebuild_lookup=False):
         """
@@ -44,11 +127,39 @@ class RateLookup:
         the rate lookup.
         """
         self.editable_rates_used = []
+        self._editable_rate_pks = set()
+        self._last_interval = (None, None, None, None)
         if rebuild_lookup:
-            self._lookup = {} # Maps rated object ids to lists of rates
-            related_object_id_attr = '%_id' % self.related_object_attr
-            for rate in self.model._default_manager.order_by('effective_from'):
+            # Maps rated object ids to two-tuples of a list of effective
+            # from dates and a corresponding list of rates.
+            self._lookup = {}
+            related_object_id_attr = '%s_id' % self.related_object_attr
+            for rate in self.get_rates():
                 object_id = getattr(rate, related_object_id_attr)
                 if not self._lookup.has_key(object_id):
-                    self._lookup[object_id] = []
-                self._lookup[object_id].append(rate)
+                    self._lookup[object_id] = ([], [])
+                dates, rates = self._lookup[object_id]
+                dates.append(rate.effective_from)
+                rates.append(rate)
+
+def calculate_cost(rate_lookup, rated_id, week_commencing, hours):
+    """
+    Calculates the cost of hours booked for a week, using rates for the
+    rated object with the given id from the given ``RateLookup``.
+
+    ``hours`` holds the hours for each of ``TimeEntry.TIME_ATTRS``.
+    Overtime is charged at the rate applicable at the start of the week
+    and hours for which no rate applies are not charged for.
+    """
+    cost = Decimal(0)
+    for day, day_hours in enumerate(hours[:7]):
+        if day_hours > 0:
+            rate = rate_lookup.get_applicable_rate(rated_id,
+                week_commencing + timedelta(days=day))
+            if rate is not None:
+                cost += day_hours * rate.standard_rate
+    if hours[7] > 0:
+        rate = rate_lookup.get_applicable_rate(rated_id, week_commencing)
+        if rate is not None:
+            cost += hours[7] * rate.overtime_rate
+    return cost
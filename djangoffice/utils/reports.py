@@ -0,0 +1,434 @@
+"""
+Loading of report contents.
+"""
+import datetime
+from decimal import Decimal
+
+from django.db import connection, connections, DEFAULT_DB_ALIAS
+from django.utils.datastructures import SortedDict
+
+from djangoffice.models import (Invoice, Job, Task, TaskTotal, TimeEntry,
+    Timesheet, Vacation, VacationBalance, time_entry_hours_sql)
+from djangoffice.utils.invoice import InvoiceBatch
+from djangoffice.utils.sql_reports import SQLReportStream, uses_engine
+
+# Hours and amounts are loaded and totalled as integer counts of
+# hundredths, which is much faster than Decimal arithmetic when there
+# are thousands of rows; they're only converted to Decimals for display.
+def from_units(units):
+    """
+    Converts an integer count of hundredths to a ``Decimal``.
+    """
+    return Decimal(units).scaleb(-2)
+
+def units_sql(column, connection=connection):
+    """
+    Creates SQL which converts the given column to an integer count of
+    hundredths on the given connection's database.
+    """
+    # MySQL can only cast to SIGNED rather than INTEGER
+    integer_type = uses_engine(connection, 'mysql') and 'SIGNED' or 'INTEGER'
+    return 'CAST(ROUND(%s * 100) AS %s)' % (column, integer_type)
+
+class HoursStatus:
+    """
+    Estimated, booked and remaining hours and the cost of booked hours.
+    """
+    def __init__(self):
+        self.estimate_units = 0
+        self.booked_units = 0
+        self.remaining_units = 0
+        self.cost_units = 0
+
+    def add(self, status):
+        self.estimate_units += status.estimate_units
+        self.booked_units += status.booked_units
+        self.remaining_units += status.remaining_units
+        self.cost_units += status.cost_units
+
+    @property
+    def estimate_hours(self):
+        return from_units(self.estimate_units)
+
+    @property
+    def booked_hours(self):
+        return from_units(self.booked_units)
+
+    @property
+    def remaining_hours(self):
+        return from_units(self.remaining_units)
+
+    @property
+    def booked_cost(self):
+        return from_units(self.cost_units)
+
+    @property
+    def variance(self):
+        """
+        The number of hours by which booked and remaining hours exceed
+        the estimate - negative if they fall short of it.
+        """
+        return from_units(self.booked_units + self.remaining_units -
+                          self.estimate_units)
+
+class TaskStatus(HoursStatus):
+    def __init__(self, id, task_type_name, estimate_units, booked_units,
+                 cost_units, remaining_units, remaining_overridden):
+        self.id = id
+        self.task_type_name = task_type_name
+        self.estimate_units = estimate_units
+        self.booked_units = booked_units
+        self.cost_units = cost_units
+        self.remaining_overridden = remaining_overridden
+        if remaining_overridden:
+            self.remaining_units = remaining_units or 0
+        else:
+            self.remaining_units = max(0, estimate_units - booked_units)
+
+class JobStatus(HoursStatus):
+    def __init__(self, id, number, name, client_name):
+        HoursStatus.__init__(self)
+        self.id = id
+        self.number = number
+        self.name = name
+        self.client_name = client_name
+        self.tasks = []
+
+    @property
+    def formatted_number(self):
+        return u'%05d' % (self.number,)
+
+    def add_task(self, task):
+        self.tasks.append(task)
+        self.add(task)
+
+def get_job_status(jobs):
+    """
+    Retrieves estimated, booked and remaining hours and booked costs for
+    each Task of the Jobs in the given ``QuerySet`` in a single query,
+    returning a two-tuple of a list of ``JobStatus`` ordered by Job
+    number, each holding its ``TaskStatus``, and a ``HoursStatus``
+    holding overall totals.
+
+    Booked hours and costs are read from the ``TaskTotal`` maintained
+    for each Task, so the number of Time Entries booked makes no
+    difference to the work done.
+    """
+    qn = connection.ops.quote_name
+    task_opts = Task._meta
+    total_opts = TaskTotal._meta
+    task_table = qn(task_opts.db_table)
+    total_select = 'COALESCE((SELECT %%s FROM %s WHERE %s = %s.%s), 0)' % (
+        qn(total_opts.db_table),
+        qn(total_opts.get_field('task').column),
+        task_table,
+        qn(task_opts.pk.column),
+    )
+    rows = Task.objects.filter(job__in=jobs).extra(select={
+            'estimate_units': units_sql('%s.%s' % (task_table,
+                qn(task_opts.get_field('estimate_hours').column))),
+            'booked_units': total_select % units_sql(
+                qn(total_opts.get_field('hours').column)),
+            'cost_units': total_select % units_sql(
+                qn(total_opts.get_field('cost').column)),
+            'remaining_units': units_sql('%s.%s' % (task_table,
+                qn(task_opts.get_field('remaining').column))),
+        }).values_list('job', 'job__number', 'job__name', 'job__client__name',
+                       'id', 'task_type__name', 'estimate_units',
+                       'booked_units', 'cost_units', 'remaining_units',
+                       'remaining_overridden') \
+          .order_by('job__number', 'task_type__name')
+    job_statuses = []
+    totals = HoursStatus()
+    job_status = None
+    for row in rows:
+        if job_status is None or job_status.id != row[0]:
+            job_status = JobStatus(*row[:4])
+            job_statuses.append(job_status)
+        task_status = TaskStatus(*row[4:])
+        job_status.add_task(task_status)
+        totals.add(task_status)
+    return job_statuses, totals
+
+def get_live_job_status(user):
+    """
+    Retrieves status details for each live Job the given User may
+    access, as described in ``get_job_status``.
+    """
+    return get_job_status(Job.objects.accessible_to_user(user) \
+                                      .filter(status=Job.LIVE_STATUS))
+
+class LeaveStatus:
+    """
+    A User's leave entitlement, carry over and leave taken for a year.
+    """
+    def __init__(self, year, entitlement_units=0, carry_over_units=0,
+                 taken_units=0):
+        self.year = year
+        self.entitlement_units = entitlement_units or 0
+        self.carry_over_units = carry_over_units or 0
+        self.taken_units = taken_units or 0
+
+    @property
+    def entitlement(self):
+        return from_units(self.entitlement_units)
+
+    @property
+    def carry_over(self):
+        return from_units(self.carry_over_units)
+
+    @property
+    def taken(self):
+        return from_units(self.taken_units)
+
+    @property
+    def remaining(self):
+        return from_units(self.entitlement_units + self.carry_over_units -
+                          self.taken_units)
+
+class UserLeaveStatus(LeaveStatus):
+    def __init__(self, id, username, first_name, last_name, year, *units):
+        LeaveStatus.__init__(self, year, *units)
+        self.id = id
+        self.username = username
+        self.first_name = first_name
+        self.last_name = last_name
+
+    def get_full_name(self):
+        return (u'%s %s' % (self.first_name, self.last_name)).strip()
+
+def get_annual_leave(users, year):
+    """
+    Retrieves leave entitlement, carry over and leave taken in the given
+    year for each active User in the given ``QuerySet`` in a single
+    query, returning a list of ``UserLeaveStatus`` ordered by name.
+
+    Leave taken is read from each User's ``VacationBalance``, so the
+    Time Entries booked against the vacation Task are never read.
+    """
+    qn = connection.ops.quote_name
+    user_table = qn(users.model._meta.db_table)
+    user_pk = qn(users.model._meta.pk.column)
+    select = SortedDict()
+    select_params = []
+    for name, model, field in (('entitlement_units', Vacation, 'entitlement'),
+                               ('carry_over_units', Vacation, 'carry_over'),
+                               ('taken_units', VacationBalance, 'taken')):
+        opts = model._meta
+        select[name] = 'SELECT %s FROM %s WHERE %s = %s.%s AND %s = %%s' % (
+            units_sql(qn(opts.get_field(field).column)),
+            qn(opts.db_table),
+            qn(opts.get_field('user').column),
+            user_table,
+            user_pk,
+            qn(opts.get_field('year').column),
+        )
+        select_params.append(year)
+    rows = users.filter(is_active=True) \
+        .extra(select=select, select_params=select_params) \
+        .values_list('id', 'username', 'first_name', 'last_name',
+                     *select.keys()) \
+        .order_by('last_name', 'first_name', 'username')
+    return [UserLeaveStatus(*(row[:4] + (year,) + row[4:])) for row in rows]
+
+def get_user_leave(user):
+    """
+    Retrieves leave entitlement, carry over and leave taken for each
+    year the given User has a Vacation record or has taken leave in,
+    returning a list of ``LeaveStatus`` ordered by year.
+    """
+    years = {}
+    for year, entitlement, carry_over in Vacation.objects.filter(user=user) \
+            .values_list('year', 'entitlement', 'carry_over'):
+        years[year] = LeaveStatus(year, int(round(entitlement * 100)),
+                                  int(round(carry_over * 100)))
+    for year, taken in VacationBalance.objects.filter(user=user) \
+            .values_list('year', 'taken'):
+        years.setdefault(year, LeaveStatus(year)).taken_units = \
+            int(round(taken * 100))
+    return [years[year] for year in sorted(years)]
+
+class ClientUninvoicedWork:
+    """
+    Uninvoiced work for a Client's Jobs, totalled in each of the
+    currencies the Jobs are invoiced in.
+    """
+    def __init__(self, client):
+        self.client = client
+        self.results = []
+        self.totals = {}
+
+    def add_result(self, result):
+        self.results.append(result)
+        if result.error is None:
+            add_to_currency_totals(self.totals, result)
+
+    def get_totals(self):
+        return sorted_currency_totals(self.totals)
+
+def add_to_currency_totals(totals, result):
+    """
+    Adds a Job's uninvoiced amount to a dict mapping currencies to
+    amounts.
+    """
+    currency = result.job.fee_currency
+    totals[currency] = totals.get(currency, Decimal('0.00')) + result.amount
+
+def sorted_currency_totals(totals):
+    """
+    Creates a list of two-tuples of currency display names and amounts
+    from a dict mapping currencies to amounts.
+    """
+    names = dict(Job.FEE_CURRENCY_CHOICES)
+    return [(names.get(currency, currency), amount) \
+            for currency, amount in sorted(totals.items())]
+
+def get_uninvoiced_work(jobs):
+    """
+    Values approved, uninvoiced Time Entries and Expenses booked against
+    the Jobs in the given ``QuerySet``, returning a two-tuple of a list
+    of ``ClientUninvoicedWork`` ordered by Client name, each holding a
+    ``JobInvoiceResult`` for each Job which has uninvoiced work, and a
+    list of overall totals by currency.
+
+    The loading and calculation steps of an ``InvoiceBatch`` are used,
+    so all Time Entries and Expenses are loaded in a single query each
+    and costed with one ``RateLookup``, giving the amounts invoicing
+    the Jobs would.
+    """
+    batch = InvoiceBatch(jobs.select_related('client') \
+                             .order_by('client__name', 'number'),
+                         Invoice.WHOLE_JOB_TYPE, None)
+    batch.detailed = False
+    batch.load_time_entries()
+    batch.load_expenses()
+    batch.load_rates()
+    batch.calculate()
+    clients = []
+    totals = {}
+    for result in batch.results:
+        if result.error is None and not result.has_items:
+            continue
+        if not clients or clients[-1].client.pk != result.job.client_id:
+            clients.append(ClientUninvoicedWork(result.job.client))
+        clients[-1].add_result(result)
+        if result.error is None:
+            add_to_currency_totals(totals, result)
+    return clients, sorted_currency_totals(totals)
+
+def get_accessible_uninvoiced_work(user):
+    """
+    Values uninvoiced work for every Job the given User may access, as
+    described in ``get_uninvoiced_work``.
+    """
+    return get_uninvoiced_work(Job.objects.accessible_to_user(user))
+
+# Maximum number of weeks the Timesheet Status report may cover
+MAX_TIMESHEET_STATUS_WEEKS = 260
+
+class TimesheetStatusStream(SQLReportStream):
+    """
+    Streams Timesheet Status report rows, converting hours from integer
+    counts of hundredths as they're iterated over.
+    """
+    def __iter__(self):
+        for row in SQLReportStream.__iter__(self):
+            yield row[:4] + (from_units(row[4] or 0),) + row[5:]
+
+def get_timesheet_status(users, start_date, end_date, hours_per_full_week,
+                         using=DEFAULT_DB_ALIAS, max_rows=None):
+    """
+    Creates a ``TimesheetStatusStream`` of the weeks commencing between
+    the given dates for which each of the active Users in the given
+    ``QuerySet`` has no Timesheet, or has booked fewer than
+    ``hours_per_full_week`` hours, ordered by User name and week.
+
+    Rows hold the User's username, first and last names, the week
+    commencing date, the hours booked and the status, ``Missing`` or
+    ``Incomplete``. Iteration stops after ``max_rows`` rows if given.
+
+    A single query is executed, which left joins each User's hours
+    summed by week against a grid of Users and weeks, so no Timesheet
+    or Time Entry is loaded individually however many weeks and Users
+    are covered.
+    """
+    report_connection = connections[using]
+    qn = report_connection.ops.quote_name
+    user_opts = users.model._meta
+    timesheet_opts = Timesheet._meta
+    entry_opts = TimeEntry._meta
+    weeks = []
+    week = start_date
+    while week <= end_date:
+        weeks.append(report_connection.ops.value_to_db_date(week))
+        week += datetime.timedelta(weeks=1)
+    # SQLite holds dates as text, which other databases won't compare
+    # with untyped parameters.
+    if uses_engine(report_connection, 'sqlite3'):
+        week_sql = '%s'
+    else:
+        week_sql = 'CAST(%s AS DATE)'
+    user_ids_sql, user_ids_params = users.filter(is_active=True) \
+        .values('pk').query.get_compiler(connection=report_connection) \
+        .as_nested_sql()
+    user_id = 'u.%s' % qn(user_opts.pk.column)
+    week_commencing = qn(entry_opts.get_field('week_commencing').column)
+    hours = 'COALESCE(h.%s, 0)' % qn('hours')
+    query = """SELECT u.%(username)s AS %(username_heading)s,
+       u.%(first_name)s AS %(first_name_heading)s,
+       u.%(last_name)s AS %(last_name_heading)s,
+       w.%(week_commencing)s AS %(week_commencing_heading)s,
+       %(hours)s AS %(hours_heading)s,
+       CASE WHEN t.%(timesheet_pk)s IS NULL THEN 'Missing'
+            ELSE 'Incomplete' END AS %(status_heading)s
+FROM %(user_table)s u
+CROSS JOIN (%(weeks)s) w
+LEFT JOIN %(timesheet_table)s t
+  ON t.%(timesheet_user)s = %(user_id)s
+ AND t.%(timesheet_week_commencing)s = w.%(week_commencing)s
+LEFT JOIN (SELECT e.%(entry_user)s AS %(user)s,
+                  e.%(week_commencing)s AS %(week_commencing)s,
+                  %(entry_hours)s AS %(hours_alias)s
+           FROM %(entry_table)s e
+           WHERE e.%(week_commencing)s BETWEEN %%s AND %%s
+           GROUP BY e.%(entry_user)s, e.%(week_commencing)s) h
+  ON h.%(user)s = %(user_id)s
+ AND h.%(week_commencing)s = w.%(week_commencing)s
+WHERE %(user_id)s IN (%(user_ids)s)
+  AND (t.%(timesheet_pk)s IS NULL OR %(hours)s < %%s)
+ORDER BY u.%(last_name)s, u.%(first_name)s, u.%(username)s,
+         w.%(week_commencing)s""" % {
+        'username': qn(user_opts.get_field('username').column),
+        'first_name': qn(user_opts.get_field('first_name').column),
+        'last_name': qn(user_opts.get_field('last_name').column),
+        'username_heading': qn('Username'),
+        'first_name_heading': qn('First Name'),
+        'last_name_heading': qn('Last Name'),
+        'week_commencing_heading': qn('Week Commencing'),
+        'hours_heading': qn('Hours'),
+        'status_heading': qn('Status'),
+        'week_commencing': week_commencing,
+        'hours': hours,
+        'hours_alias': qn('hours'),
+        'user': qn('user_id'),
+        'user_id': user_id,
+        'user_table': qn(user_opts.db_table),
+        'weeks': ' UNION ALL '.join(['SELECT %s AS %s' % (
+            week_sql, week_commencing)] * len(weeks)),
+        'timesheet_pk': qn(timesheet_opts.pk.column),
+        'timesheet_table': qn(timesheet_opts.db_table),
+        'timesheet_user': qn(timesheet_opts.get_field('user').column),
+        'timesheet_week_commencing': qn(
+            timesheet_opts.get_field('week_commencing').column),
+        'entry_user': qn(entry_opts.get_field('user').column),
+        'entry_hours': units_sql('SUM(%s)' % time_entry_hours_sql('e'),
+                                 report_connection),
+        'entry_table': qn(entry_opts.db_table),
+        'user_ids': user_ids_sql,
+    }
+    params = weeks + [report_connection.ops.value_to_db_date(start_date),
+                      report_connection.ops.value_to_db_date(end_date)] + \
+             list(user_ids_params) + \
+             [int((hours_per_full_week or 0) * 100)]
+    return TimesheetStatusStream(query, params, max_rows=max_rows,
+                                 using=using)
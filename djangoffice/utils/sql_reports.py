@@ -0,0 +1,772 @@
+"""
+Execution of SQL Reports, streaming their results a batch of rows at a
+time so memory use doesn't depend on the size of the result.
+
+SQL Reports are executed on a connection of their own to the
+``SQL_REPORT_DATABASE`` database, which is made read-only and limited to
+the report's timeout. At most ``SQL_REPORT_MAX_CONCURRENT`` reports are
+executed at once, across all processes - further executions wait for up
+to ``SQL_REPORT_QUEUE_TIMEOUT`` seconds for another to finish.
+
+Results of SQL Reports which have caching enabled are written to a
+cache on disk as they're streamed, so executing the same query again
+for a User with the same role streams the cached results instead.
+
+SQL Reports can also be executed in the background by queueing a
+``SQLReportJob`` for the ``run_sql_report_jobs`` command's workers, which
+store the results on disk a page at a time for later viewing.
+"""
+import cPickle as pickle
+import csv
+import datetime
+import fcntl
+import os
+import re
+import struct
+import time
+import zlib
+from hashlib import sha1
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.models import signals
+from django.utils.encoding import force_unicode, smart_str
+from django.utils.html import escape
+
+from djangoffice.models import SQLReport, SQLReportJob
+from djangoffice.utils.file_cache import FileCache
+
+# Number of rows fetched from the database at a time
+FETCH_SIZE = 500
+
+class SQLReportRefused(Exception):
+    """
+    Raised when a SQL Report can't be executed at the moment.
+    """
+    pass
+
+def get_report_connection(using=DEFAULT_DB_ALIAS):
+    """
+    Opens a new connection to the given database for executing a SQL
+    Report, returning a two-tuple of the connection and a flag
+    indicating whether the caller owns it and must close it.
+
+    Results are streamed after the request's connection has been closed
+    at the end of the request, so reports need a connection of their
+    own - except with in-memory SQLite databases, which only exist for
+    the connection which created them.
+    """
+    connection = connections[using]
+    settings_dict = connection.settings_dict
+    if settings_dict['ENGINE'].endswith('sqlite3') and \
+       settings_dict['NAME'] in ('', ':memory:'):
+        return connection, False
+    return connection.__class__(settings_dict, using), True
+
+def uses_engine(connection, *engines):
+    engine = connection.settings_dict['ENGINE']
+    for name in engines:
+        if engine.endswith(name):
+            return True
+    return False
+
+def restrict_report_connection(connection, cursor, timeout=None,
+                               read_only=True):
+    """
+    Restricts a SQL Report's connection to reading data for at most
+    ``timeout`` seconds per statement, using the given cursor.
+
+    SQLite connections can only be made read-only at the connection
+    level, so shouldn't be when they're shared with the rest of the
+    application. Their timeouts apply to all statements executed until
+    ``unrestrict_report_connection`` is called.
+    """
+    if uses_engine(connection, 'postgresql_psycopg2', 'postgresql'):
+        if read_only:
+            cursor.execute('SET SESSION CHARACTERISTICS AS TRANSACTION READ ONLY')
+        if timeout is not None:
+            cursor.execute('SET statement_timeout = %s',
+                           [int(timeout * 1000)])
+        # Session settings take effect from the next transaction
+        connection._commit()
+    elif uses_engine(connection, 'mysql'):
+        if read_only:
+            cursor.execute('SET SESSION TRANSACTION READ ONLY')
+        if timeout is not None:
+            cursor.execute('SET SESSION max_execution_time = %s',
+                           [int(timeout * 1000)])
+    elif uses_engine(connection, 'sqlite3'):
+        if read_only:
+            cursor.execute('PRAGMA query_only = 1')
+        if timeout is not None:
+            deadline = time.time() + timeout
+            # A non-zero return value interrupts the current statement
+            connection.connection.set_progress_handler(
+                lambda: time.time() > deadline, 1000)
+
+def unrestrict_report_connection(connection):
+    """
+    Removes restrictions from a shared SQLite connection.
+    """
+    if uses_engine(connection, 'sqlite3') and \
+       connection.connection is not None:
+        connection.connection.set_progress_handler(None, 0)
+
+class SQLReportStream:
+    """
+    Executes a SQL Report's query with the given bound parameters and
+    iterates over its result rows, fetching ``fetch_size`` rows at a
+    time and stopping after ``max_rows`` rows if given. ``%`` characters
+    in the query must be escaped as ``%%``.
+
+    On PostgreSQL a named cursor is used, so rows are held on the server
+    until they're fetched.
+
+    Once executed, the following attributes are available:
+
+    headings
+        Column names, taken from the cursor's description.
+
+    row_count
+        The number of rows iterated over so far.
+
+    truncated
+        ``True`` if iteration stopped because ``max_rows`` was reached.
+    """
+    def __init__(self, query, params=None, max_rows=None,
+                 fetch_size=FETCH_SIZE, timeout=None, using=DEFAULT_DB_ALIAS):
+        self.query = query
+        self.params = params
+        self.max_rows = max_rows
+        self.fetch_size = fetch_size
+        self.timeout = timeout
+        self.connection, self.owns_connection = get_report_connection(using)
+        self.cursor = None
+        self.headings = None
+        self.row_count = 0
+        self.truncated = False
+        self.writer = None
+        self.slot = None
+        self._batch = []
+
+    def execute(self):
+        cursor = self.cursor = self.connection.cursor()
+        try:
+            restrict_report_connection(self.connection, cursor, self.timeout,
+                                       read_only=self.owns_connection)
+            if self.owns_connection and \
+               uses_engine(self.connection, 'postgresql_psycopg2') and \
+               not self.connection.features.uses_autocommit:
+                cursor.close()
+                cursor = self.cursor = \
+                    self.connection.connection.cursor('sql_report')
+            cursor.execute(self.query, self.params or ())
+            # Named cursors only describe their results once rows have
+            # been fetched.
+            self._batch = cursor.fetchmany(self.fetch_size)
+        except:
+            self.close()
+            raise
+        self.headings = [force_unicode(column[0]) \
+                         for column in cursor.description]
+        return self
+
+    def __iter__(self):
+        try:
+            batch = self._batch
+            while batch:
+                if self.max_rows is not None and \
+                   self.row_count + len(batch) > self.max_rows:
+                    batch = batch[:self.max_rows - self.row_count]
+                    self.truncated = True
+                if self.writer is not None:
+                    self.writer.write_rows(batch)
+                for row in batch:
+                    self.row_count += 1
+                    yield row
+                if self.truncated:
+                    break
+                batch = self.cursor.fetchmany(self.fetch_size)
+            if self.writer is not None:
+                self.writer.finish(self.truncated)
+                self.writer = None
+        finally:
+            self._batch = []
+            self.close()
+
+    def close(self):
+        if self.writer is not None:
+            # Results which weren't completely read aren't cached
+            self.writer.abort()
+            self.writer = None
+        if self.cursor is not None:
+            self.cursor.close()
+            self.cursor = None
+        if self.owns_connection:
+            self.connection.close()
+        else:
+            unrestrict_report_connection(self.connection)
+        if self.slot is not None:
+            self.slot.release()
+            self.slot = None
+
+class ExecutionSlot:
+    """
+    A slot for executing a SQL Report, held by locking its file until
+    released.
+    """
+    def __init__(self, file):
+        self.file = file
+
+    def release(self):
+        if self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
+
+class ExecutionSlots:
+    """
+    A fixed number of slots for executing SQL Reports, shared between
+    processes by locking a file for each slot in a directory.
+
+    Locks are released by the operating system if a process dies, so
+    slots can't be leaked.
+    """
+    # Seconds between attempts to acquire a slot when all are in use
+    poll_interval = 0.1
+
+    def __init__(self, directory, count):
+        self.directory = directory
+        self.count = count
+
+    def acquire(self, timeout=0):
+        """
+        Acquires a free slot, waiting for up to ``timeout`` seconds for
+        one to be released if all are in use. Returns an
+        ``ExecutionSlot``, or ``None`` if no slot could be acquired.
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        deadline = time.time() + timeout
+        while True:
+            for i in xrange(self.count):
+                file = open(os.path.join(self.directory, 'slot%s' % i), 'a')
+                try:
+                    fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except IOError:
+                    file.close()
+                else:
+                    return ExecutionSlot(file)
+            if time.time() >= deadline:
+                return None
+            time.sleep(self.poll_interval)
+
+execution_slots = ExecutionSlots(settings.SQL_REPORT_LOCK_DIR,
+                                 settings.SQL_REPORT_MAX_CONCURRENT)
+
+##############
+# Estimation #
+##############
+
+# Matches the total cost and rows estimated by PostgreSQL's EXPLAIN
+PG_ESTIMATE_RE = re.compile(r'cost=[\d.]+\.\.([\d.]+) rows=(\d+)')
+
+class QueryEstimate:
+    """
+    The database's plan for executing a query, with the following
+    attributes:
+
+    plan
+        A list of lines describing the query plan.
+
+    cost
+        The estimated cost of executing the query in the database's own
+        units, or ``None`` if it doesn't estimate costs.
+
+    rows
+        The estimated number of rows the query will return, or ``None``
+        if the database doesn't estimate it.
+    """
+    def __init__(self, plan, cost=None, rows=None):
+        self.plan = plan
+        self.cost = cost
+        self.rows = rows
+
+def estimate_query(query, params=None, using=DEFAULT_DB_ALIAS):
+    """
+    Asks the database to explain how it would execute the given query,
+    returning a ``QueryEstimate``.
+
+    Plans aren't available for in-memory SQLite databases, as they share
+    the application's connection.
+    """
+    connection, owns_connection = get_report_connection(using)
+    if not owns_connection:
+        # The sqlite3 module commits any open transaction before
+        # executing EXPLAIN, which would commit the shared connection's.
+        return QueryEstimate([])
+    cursor = connection.cursor()
+    try:
+        restrict_report_connection(connection, cursor)
+        if uses_engine(connection, 'sqlite3'):
+            cursor.execute('EXPLAIN QUERY PLAN %s' % query, params or ())
+            return QueryEstimate([force_unicode(row[-1]) \
+                                  for row in cursor.fetchall()])
+        cursor.execute('EXPLAIN %s' % query, params or ())
+        rows = cursor.fetchall()
+        if uses_engine(connection, 'postgresql_psycopg2', 'postgresql'):
+            plan = [force_unicode(row[0]) for row in rows]
+            match = PG_ESTIMATE_RE.search(plan[0])
+            if match is None:
+                return QueryEstimate(plan)
+            return QueryEstimate(plan, float(match.group(1)),
+                                 int(match.group(2)))
+        # MySQL - estimate rows from the rows examined for each table
+        names = [column[0] for column in cursor.description]
+        plan = [u', '.join([u'%s: %s' % (name, force_unicode(value)) \
+                            for name, value in zip(names, row)]) \
+                for row in rows]
+        estimated_rows = None
+        if 'rows' in names:
+            estimated_rows = 1
+            for row in rows:
+                estimated_rows *= row[names.index('rows')] or 1
+        return QueryEstimate(plan, rows=estimated_rows)
+    finally:
+        cursor.close()
+        connection.close()
+
+###########
+# Caching #
+###########
+
+class SQLReportResultWriter:
+    """
+    Writes a SQL Report's results to a temporary file as they're
+    streamed, which is added to the cache once all the results have
+    been written.
+
+    Results are written as a sequence of pickles - a dict of details
+    about the results, followed by a ``('rows', rows)`` two-tuple for
+    each batch of rows and a final ``('end', truncated)`` two-tuple.
+    """
+    def __init__(self, cache, name, headings, max_rows):
+        self.cache = cache
+        self.name = name
+        fd, self.temp_path = cache.create_temp_file()
+        self.file = os.fdopen(fd, 'wb')
+        self.dump({'created': time.time(), 'headings': headings,
+                   'max_rows': max_rows})
+
+    def dump(self, obj):
+        pickle.dump(obj, self.file, pickle.HIGHEST_PROTOCOL)
+
+    def write_rows(self, rows):
+        self.dump(('rows', list(rows)))
+
+    def finish(self, truncated):
+        self.dump(('end', truncated))
+        self.file.close()
+        return self.cache.add_file(self.name, self.temp_path)
+
+    def abort(self):
+        self.file.close()
+        self.cache.remove_path(self.temp_path)
+
+class CachedSQLReportStream:
+    """
+    Iterates over a SQL Report's cached results, reading a batch of rows
+    at a time. Provides the same attributes as ``SQLReportStream``, plus:
+
+    created
+        The time the results were cached, in seconds since the epoch.
+    """
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        details = pickle.load(self.file)
+        self.created = details['created']
+        self.headings = details['headings']
+        self.max_rows = details['max_rows']
+        self.fetch_size = FETCH_SIZE
+        self.row_count = 0
+        self.truncated = False
+
+    def __iter__(self):
+        try:
+            while True:
+                kind, value = pickle.load(self.file)
+                if kind == 'end':
+                    self.truncated = value
+                    break
+                for row in value:
+                    self.row_count += 1
+                    yield row
+        finally:
+            self.close()
+
+    def close(self):
+        self.file.close()
+
+class SQLReportResultCache(FileCache):
+    """
+    A size-bounded cache of SQL Report results, held as files named for
+    their SQL Report and key in a directory.
+    """
+    suffix = '.results'
+
+    def get_name(self, sql_report_id, key):
+        return 'report%s-%s' % (sql_report_id, key)
+
+    def get(self, sql_report, key):
+        """
+        Returns a ``CachedSQLReportStream`` for the given SQL Report's
+        cached results for the given key, or ``None`` if there aren't
+        any which are younger than the report's cache lifetime.
+        """
+        path = self.get_file(self.get_name(sql_report.pk, key))
+        if path is None:
+            return None
+        try:
+            stream = CachedSQLReportStream(path)
+        except (IOError, EOFError):
+            return None # Removed or evicted by another process
+        if time.time() - stream.created >= sql_report.cache_ttl:
+            stream.close()
+            self.remove_path(path)
+            return None
+        return stream
+
+    def create_writer(self, sql_report, key, stream):
+        """
+        Creates a ``SQLReportResultWriter`` which will cache the results
+        of the given ``SQLReportStream`` under the given key.
+        """
+        return SQLReportResultWriter(self, self.get_name(sql_report.pk, key),
+                                     stream.headings, stream.max_rows)
+
+    def invalidate(self, sql_report_id=None):
+        """
+        Removes cached results for the given SQL Report, or for all SQL
+        Reports.
+        """
+        self.remove_files(sql_report_id is None and 'report' or \
+                          'report%s-' % sql_report_id)
+
+result_cache = SQLReportResultCache(settings.SQL_REPORT_CACHE_DIR,
+                                    settings.SQL_REPORT_CACHE_SIZE)
+
+def get_cache_key(query, params, role):
+    """
+    Creates a key for caching the results of the given query and
+    parameters when executed by a User with the given role.
+    """
+    return sha1(repr((query, params, role))).hexdigest()
+
+def execute_sql_report(sql_report, params, role, refresh=False):
+    """
+    Executes the given SQL Report with the given parameters, returning a
+    stream of its results.
+
+    If the SQL Report has caching enabled, cached results are used
+    unless ``refresh`` is ``True``, and fresh results are cached as
+    they're read.
+
+    Raises ``SQLReportRefused`` if the query's estimated cost is greater
+    than ``SQL_REPORT_MAX_COST`` or no execution slot becomes free in
+    time.
+    """
+    query, query_params = sql_report.get_bound_query(params,
+        connections[settings.SQL_REPORT_DATABASE])
+    key = None
+    if sql_report.cache_results:
+        key = get_cache_key(query, query_params, role)
+        if not refresh:
+            stream = result_cache.get(sql_report, key)
+            sql_report.record_cache_use(stream is not None)
+            if stream is not None:
+                return stream
+    if settings.SQL_REPORT_MAX_COST is not None:
+        estimate = estimate_query(query, query_params,
+                                  using=settings.SQL_REPORT_DATABASE)
+        if estimate.cost is not None and \
+           estimate.cost > settings.SQL_REPORT_MAX_COST:
+            raise SQLReportRefused(u'The estimated cost of this SQL Report (%.0f) is greater than the maximum allowed (%s).' % (
+                estimate.cost, settings.SQL_REPORT_MAX_COST))
+    slot = execution_slots.acquire(settings.SQL_REPORT_QUEUE_TIMEOUT)
+    if slot is None:
+        raise SQLReportRefused(u'Too many SQL Reports are being executed at the moment - please try again later.')
+    stream = SQLReportStream(query, query_params,
+                             max_rows=settings.SQL_REPORT_MAX_ROWS,
+                             timeout=sql_report.timeout,
+                             using=settings.SQL_REPORT_DATABASE)
+    stream.slot = slot
+    stream.execute()
+    if key is not None:
+        stream.writer = result_cache.create_writer(sql_report, key, stream)
+    return stream
+
+def sql_report_changed(sender, instance, **kwargs):
+    result_cache.invalidate(instance.pk)
+
+signals.post_save.connect(sql_report_changed, sender=SQLReport)
+signals.post_delete.connect(sql_report_changed, sender=SQLReport)
+
+########################
+# Background execution #
+########################
+
+# Number of rows in each page of stored results
+PAGE_SIZE = 100
+
+class StoredResultsWriter:
+    """
+    Writes a SQL Report's results to a file as they're streamed, as a
+    zlib-compressed pickle of each page of rows, followed by a pickled
+    index of details about the results and the position of each page and
+    finally the index's position as an 8 byte integer.
+
+    Results are written to a temporary file which is renamed into place
+    once complete.
+    """
+    def __init__(self, path, headings, max_rows, page_size=PAGE_SIZE):
+        self.path = path
+        self.temp_path = '%s.tmp' % path
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.file = open(self.temp_path, 'wb')
+        self.index = {'headings': headings, 'max_rows': max_rows,
+                      'page_size': page_size, 'row_count': 0, 'pages': []}
+        self.rows = []
+
+    def write_page(self, rows):
+        data = zlib.compress(pickle.dumps(rows, pickle.HIGHEST_PROTOCOL))
+        self.index['pages'].append((self.file.tell(), len(data)))
+        self.file.write(data)
+
+    def write_rows(self, rows):
+        self.rows.extend(rows)
+        self.index['row_count'] += len(rows)
+        page_size = self.index['page_size']
+        while len(self.rows) >= page_size:
+            self.write_page(self.rows[:page_size])
+            self.rows = self.rows[page_size:]
+
+    def finish(self, truncated):
+        if self.rows:
+            self.write_page(self.rows)
+            self.rows = []
+        self.index['truncated'] = truncated
+        index_position = self.file.tell()
+        pickle.dump(self.index, self.file, pickle.HIGHEST_PROTOCOL)
+        self.file.write(struct.pack('>Q', index_position))
+        self.file.close()
+        os.rename(self.temp_path, self.path)
+
+    def abort(self):
+        self.file.close()
+        try:
+            os.remove(self.temp_path)
+        except OSError:
+            pass
+
+class StoredResults:
+    """
+    Reads pages of a SQL Report's results stored by a
+    ``StoredResultsWriter``, with the following attributes:
+
+    headings
+        Column names.
+
+    row_count
+        The total number of rows stored.
+
+    truncated
+        ``True`` if the results were truncated at ``max_rows`` rows.
+
+    page_size, page_count
+        The number of rows in each page and the number of pages.
+    """
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.file.seek(-8, os.SEEK_END)
+        index_position = struct.unpack('>Q', self.file.read(8))[0]
+        self.file.seek(index_position)
+        index = pickle.load(self.file)
+        self.headings = index['headings']
+        self.max_rows = index['max_rows']
+        self.row_count = index['row_count']
+        self.truncated = index['truncated']
+        self.page_size = index['page_size']
+        self.pages = index['pages']
+        self.page_count = len(self.pages)
+
+    def get_page(self, number):
+        """
+        Returns a list of the rows in the given page, numbered from 1.
+        """
+        if number < 1 or number > self.page_count:
+            raise IndexError('Invalid page: %s' % number)
+        position, length = self.pages[number - 1]
+        self.file.seek(position)
+        return pickle.loads(zlib.decompress(self.file.read(length)))
+
+    def stream(self):
+        """
+        Creates a ``StoredResultsStream`` which iterates over all the
+        stored rows.
+        """
+        return StoredResultsStream(self)
+
+    def close(self):
+        self.file.close()
+
+class StoredResultsStream:
+    """
+    Iterates over stored results a page at a time, providing the same
+    attributes as ``SQLReportStream``.
+    """
+    def __init__(self, results):
+        self.results = results
+        self.headings = results.headings
+        self.max_rows = results.max_rows
+        self.truncated = results.truncated
+        self.fetch_size = results.page_size
+        self.row_count = 0
+
+    def __iter__(self):
+        try:
+            for number in xrange(1, self.results.page_count + 1):
+                for row in self.results.get_page(number):
+                    self.row_count += 1
+                    yield row
+        finally:
+            self.close()
+
+    def close(self):
+        self.results.close()
+
+def run_sql_report_job(job):
+    """
+    Executes a claimed ``SQLReportJob``'s SQL Report, storing its results
+    and recording whether it completed or failed.
+
+    Background executions are limited by ``SQL_REPORT_JOB_TIMEOUT`` and
+    ``SQL_REPORT_JOB_MAX_ROWS`` rather than the report's timeout and
+    ``SQL_REPORT_MAX_ROWS``, and don't use execution slots - the number
+    of workers limits how many run at once.
+
+    Jobs which have been given up on as abandoned while they were
+    running aren't updated.
+    """
+    query, query_params = job.sql_report.get_bound_query(job.get_params(),
+        connections[settings.SQL_REPORT_DATABASE])
+    stream = SQLReportStream(query, query_params,
+                             max_rows=settings.SQL_REPORT_JOB_MAX_ROWS,
+                             timeout=settings.SQL_REPORT_JOB_TIMEOUT,
+                             using=settings.SQL_REPORT_DATABASE)
+    try:
+        stream.execute()
+        stream.writer = StoredResultsWriter(job.get_results_path(),
+                                            stream.headings, stream.max_rows)
+        for row in stream:
+            pass
+    except Exception, e:
+        stream.close()
+        job.status = SQLReportJob.FAILED_STATUS
+        job.error = force_unicode(e)
+    else:
+        job.status = SQLReportJob.COMPLETE_STATUS
+        job.row_count = stream.row_count
+        job.truncated = stream.truncated
+    job.completed_at = datetime.datetime.now()
+    SQLReportJob.objects.filter(pk=job.pk, completed_at__isnull=True).update(
+        status=job.status, error=job.error, row_count=job.row_count,
+        truncated=job.truncated, completed_at=job.completed_at)
+    return job
+
+def sql_report_job_deleted(sender, instance, **kwargs):
+    try:
+        os.remove(instance.get_results_path())
+    except OSError:
+        pass
+
+signals.post_delete.connect(sql_report_job_deleted, sender=SQLReportJob)
+
+##########
+# Output #
+##########
+
+class StreamedResults:
+    """
+    Response content generated from a ``SQLReportStream``, which closes
+    the stream when the response is closed, even if the content was
+    never iterated over.
+
+    Content is generated as UTF-8 encoded strings, a batch of rows at a
+    time.
+    """
+    def __init__(self, content, stream):
+        self.content = content
+        self.stream = stream
+
+    def __iter__(self):
+        return iter(self.content)
+
+    def close(self):
+        self.content.close()
+        self.stream.close()
+
+def stream_html_rows(stream, page_head, page_tail):
+    """
+    Generates an HTML page containing a SQL Report's results, as the
+    given head, a table row for each result row and the given tail.
+    """
+    return StreamedResults(_html_rows(stream, page_head, page_tail), stream)
+
+def _html_rows(stream, page_head, page_tail):
+    yield smart_str(page_head)
+    rows = []
+    for row in stream:
+        rows.append(u'<tr class="%s">%s</tr>\n' % (
+            stream.row_count % 2 and u'odd' or u'even',
+            u''.join([u'<td>%s</td>' % escape(force_unicode(value)) \
+                      for value in row])))
+        if len(rows) == stream.fetch_size:
+            yield smart_str(u''.join(rows))
+            rows = []
+    if stream.truncated:
+        rows.append(u'<tr class="truncated"><td colspan="%s">Only the first %s rows are displayed.</td></tr>\n' % (
+            len(stream.headings), stream.max_rows))
+    yield smart_str(u''.join(rows))
+    yield smart_str(page_tail)
+
+class _RowBuffer:
+    def __init__(self):
+        self.data = []
+
+    def write(self, data):
+        self.data.append(data)
+
+    def flush(self):
+        data = ''.join(self.data)
+        self.data = []
+        return data
+
+def stream_csv_rows(stream):
+    """
+    Generates a SQL Report's results in CSV format, with a row of
+    headings first.
+    """
+    return StreamedResults(_csv_rows(stream), stream)
+
+def _csv_rows(stream):
+    buffer = _RowBuffer()
+    writer = csv.writer(buffer)
+    writer.writerow([smart_str(heading) for heading in stream.headings])
+    for row in stream:
+        writer.writerow([value is not None and smart_str(value) or '' \
+                         for value in row])
+        if stream.row_count % stream.fetch_size == 0:
+            yield buffer.flush()
+    yield buffer.flush()
@@ -0,0 +1,82 @@
+"""
+Loading of Timesheet contents for display and editing.
+"""
+from djangoffice.models import (Expense, ExpenseType, Job, Task, TimeEntry,
+    Timesheet)
+
+def get_jobs_and_tasks_for_user(user):
+    """
+    Retrieves Job and Task information for the given User in a single
+    query, returning a two-tuple of a list of Jobs ordered by number and
+    a dict mapping Job ids to lists of Tasks.
+
+    The Jobs returned only have their ``id``, ``number`` and ``name``
+    attributes populated.
+    """
+    jobs = {}
+    tasks_by_job = {}
+    for task in Task.objects.for_user_timesheet(user):
+        if not tasks_by_job.has_key(task.job_id):
+            jobs[task.job_id] = Job(id=task.job_id, number=task.job_number,
+                                    name=task.job_name)
+            tasks_by_job[task.job_id] = [task]
+        else:
+            tasks_by_job[task.job_id].append(task)
+    jobs = jobs.values()
+    jobs.sort(key=lambda job: job.number)
+    return (jobs, tasks_by_job)
+
+class TimesheetSnapshot:
+    """
+    Everything required to display and edit a User's Timesheet for a
+    given week, loaded in a fixed number of queries regardless of the
+    number of Time Entries and Expenses it contains.
+
+    The following attributes are available once loaded:
+
+    timesheet
+        The Timesheet, which will be created if it did not exist.
+
+    jobs, tasks_by_job
+        Jobs and Tasks the User may book time against, as returned by
+        ``get_jobs_and_tasks_for_user``.
+
+    expense_types
+        A list of all Expense Types.
+
+    time_entries
+        A list of the Timesheet's Time Entries, each having the
+        additional attributes given by ``TimeEntryManager.for_timesheet``
+        plus ``task_hours_booked`` and ``job_display``.
+
+    expenses
+        A list of the Timesheet's Expenses, each having the additional
+        attributes given by ``ExpenseManager.for_timesheet`` plus
+        ``job_display``.
+    """
+    def __init__(self, user, week_commencing):
+        self.user = user
+        self.week_commencing = week_commencing
+        self.timesheet, self.created = \
+            Timesheet.objects.get_or_create(user=user,
+                                            week_commencing=week_commencing)
+        self.jobs, self.tasks_by_job = get_jobs_and_tasks_for_user(user)
+        self.expense_types = list(ExpenseType.objects.all())
+
+        if self.created:
+            # A brand new Timesheet can't have anything in it yet
+            self.time_entries, self.expenses = [], []
+            return
+
+        self.time_entries = list(TimeEntry.objects.for_timesheet(self.timesheet))
+        booked = TimeEntry.objects.hours_booked_for_tasks(
+            list(set([te.task_id for te in self.time_entries])))
+        for time_entry in self.time_entries:
+            time_entry.task_hours_booked = booked[time_entry.task_id]
+            time_entry.job_display = u'%05d - %s' % (time_entry.job_number,
+                                                     time_entry.job_name)
+
+        self.expenses = list(Expense.objects.for_timesheet(self.timesheet))
+        for expense in self.expenses:
+            expense.job_display = u'%05d - %s' % (expense.job_number,
+                                                  expense.job_name)
@@ -35,7 +35,6 @@ def artifact_list(request, job_number):
     job = get_object_or_404(Job, number=int(job_number))
     if not job.is_accessible_to_user(request.user):
         return permission_denied(request)
-    user_profile = request.user.get_profile()
     queryset = Artifact.objects.accessible_to_user(request.user).filter(job=job)
     sort_headers = SortHeaders(request, LIST_HEADERS)
     return list_detail.object_list(request,
@@ -1,8 +1,12 @@
+import os
+
 from django import forms
 from django.conf import settings
+from django.core.servers.basehttp import FileWrapper
+from django.core.urlresolvers import reverse
 from django.db import transaction
 from django.http import Http404, HttpResponse
-from django.shortcuts import render_to_response
+from django.shortcuts import get_object_or_404, render_to_response
 from django.template import RequestContext
 from django.views.generic import create_update, list_detail
 
@@ -10,6 +14,8 @@ from djangoffice.auth import is_admin_or_manager, user_has_permission
 from djangoffice.forms.invoices import (InvoiceFilterForm, InvoiceCriteriaForm,
     SelectJobsForInvoiceForm)
 from djangoffice.models import Invoice, Job
+from djangoffice.utils.draft_invoices import DraftInvoice
+from djangoffice.utils.invoice import InvoiceBatch, RateNotFound
 from djangoffice.views import send_file, SortHeaders
 from djangoffice.views.generic import edit_object
 from djangoffice.views.jobs import filter_jobs
@@ -73,11 +79,11 @@ def invoice_wizard(request):
                 criteria_form = InvoiceCriteriaForm(jobs, data=request.POST)
                 if criteria_form.is_valid():
                     if 'create_invoices' in request.POST:
-                        return _create_invoices(job_form, criteria_form)
+                        return _create_invoices(request, criteria_form)
                     else:
                         for job in jobs:
                             if u'draft_invoice%s' % job.id in request.POST:
-                                return _create_draft_invoice(job.id,
+                                return _create_draft_invoice(request, job,
                                                              criteria_form)
             return render_to_response('invoices/select_invoice_criteria.html', {
                     'form': criteria_form,
@@ -95,19 +101,47 @@ def invoice_wizard(request):
         }, RequestContext(request))
 
 @transaction.commit_on_success
-def _create_invoices(job_form, criteria_form):
-    """
-    Creates invoices for the given Jobs using the given Invoice
-    criteria.
-    """
-    raise NotImplementedError
+def _create_invoices(request, criteria_form):
+    """
+    Creates invoices for the Jobs selected in the given Invoice criteria
+    Form, displaying the outcome for each Job.
+    """
+    data = criteria_form.cleaned_data
+    batch = InvoiceBatch(criteria_form.jobs, data['type'], data['date'],
+        data['start_period'], data['end_period'],
+        numbers=dict([(job.id, data['number%s' % job.id]) \
+                      for job in criteria_form.jobs]))
+    batch.run()
+    # Forking worker processes from a server process holding database
+    # connections isn't safe.
+    batch.render_pdfs(processes=1)
+    return render_to_response('invoices/create_invoices.html', {
+            'batch': batch,
+            'results': batch.results,
+        }, RequestContext(request))
 
-def _create_draft_invoice(job_id, criteria_form):
+def _create_draft_invoice(request, job, criteria_form):
     """
     Creates and sends for download a preview of an Invoice PDF for the
     given Job using the given Invoice criteria.
-    """
-    raise NotImplementedError
+
+    Previews are cached, so previewing the same draft again sends the
+    cached PDF.
+    """
+    draft = DraftInvoice(job, criteria_form.cleaned_data)
+    try:
+        filename = draft.get_filename()
+    except RateNotFound, e:
+        return render_to_response('invoices/draft_invoice_error.html', {
+                'job': job,
+                'error': unicode(e),
+            }, RequestContext(request))
+    response = HttpResponse(FileWrapper(open(filename, 'rb')),
+                            content_type='application/pdf')
+    response['Content-Disposition'] = \
+        'attachment; filename=draft-invoice-%s.pdf' % job.formatted_number
+    response['Content-Length'] = os.path.getsize(filename)
+    return response
 
 @user_has_permission(is_admin_or_manager)
 def invoice_detail(request, invoice_number):
@@ -140,7 +174,9 @@ def download_invoice(request, invoice_number):
     Sends the PDF associated with the given Invoice for download.
     """
     invoice = get_object_or_404(Invoice, number=invoice_number)
-    return send_file(invoice.get_pdf_filename())
+    if not invoice.pdf:
+        raise Http404(u'No PDF has been created for this Invoice.')
+    return send_file(invoice.pdf.path)
 
 @user_has_permission(is_admin_or_manager)
 def delete_invoice(request, invoice_number):
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.urlresolvers import reverse
+from django.http import HttpResponseRedirect
+from django.shortcuts import render_to_response
+from django.template import RequestContext
+
+from djangoffice.auth import is_admin, user_has_permission
+from djangoffice.utils.query_stats import query_stats as stats
+
+@user_has_permission(is_admin)
+def query_stats(request):
+    """
+    Ranks views by the time spent executing queries over their most
+    recent requests, with the queries they most often repeat.
+
+    Statistics are only those recorded by the process handling the
+    request.
+    """
+    if request.method == 'POST' and 'clear' in request.POST:
+        stats.clear()
+        return HttpResponseRedirect(reverse('query_stats'))
+    return render_to_response('query_stats/query_stats.html', {
+            'views': stats.ranking(),
+            'window': settings.SQL_STATS_WINDOW,
+        }, RequestContext(request))
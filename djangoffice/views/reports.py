@@ -1,8 +1,24 @@
+import datetime
+
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.http import HttpResponse
 from django.shortcuts import render_to_response
 from django.template import RequestContext
-
-from djangoffice.auth import is_admin_or_manager, user_has_permission
+from django.template.loader import render_to_string
+from django.utils.http import urlencode
+
+from djangoffice.auth import (get_accessible_users, is_admin_or_manager,
+    user_has_permission)
+from djangoffice.forms.timesheets import TimesheetStatusReportForm
+from djangoffice.models import Timesheet
+from djangoffice.utils.dates import week_commencing_date
+from djangoffice.utils.reports import (MAX_TIMESHEET_STATUS_WEEKS,
+    get_accessible_uninvoiced_work, get_annual_leave, get_live_job_status,
+    get_timesheet_status)
+from djangoffice.utils.sql_reports import (execution_slots, stream_csv_rows,
+    stream_html_rows)
+from djangoffice.views.sql_reports import ROWS_MARKER
 
 @login_required
 def report_list(request):
@@ -21,7 +37,15 @@ def timesheet_report_list(request):
 
 @user_has_permission(is_admin_or_manager)
 def job_status_report(request):
-    raise NotImplementedError
+    """
+    Reports estimated, booked and remaining hours and the cost of booked
+    hours for every Task of each live Job.
+    """
+    job_statuses, totals = get_live_job_status(request.user)
+    return render_to_response('reports/job_status_report.html', {
+            'job_statuses': job_statuses,
+            'totals': totals,
+        }, RequestContext(request))
 
 @user_has_permission(is_admin_or_manager)
 def jobs_worked_on_report(request):
@@ -53,7 +77,61 @@ def timesheet_report(request):
 
 @user_has_permission(is_admin_or_manager)
 def timesheet_status_report(request):
-    raise NotImplementedError
+    """
+    Reports the weeks in a range for which each User the current User
+    may access has a missing Timesheet, or has booked fewer than the
+    hours in a full week.
+
+    Results are streamed as they're read, as an HTML page or as CSV if
+    a ``format`` of ``csv`` is given. Like SQL Reports, the report's
+    query is executed in one of the shared execution slots and its
+    results are limited to ``SQL_REPORT_MAX_ROWS`` rows.
+    """
+    if 'start_date' in request.GET:
+        form = TimesheetStatusReportForm(MAX_TIMESHEET_STATUS_WEEKS,
+                                         request.GET)
+    else:
+        end_date = week_commencing_date(datetime.date.today())
+        form = TimesheetStatusReportForm(MAX_TIMESHEET_STATUS_WEEKS,
+            initial={
+                'start_date': end_date - datetime.timedelta(weeks=12),
+                'end_date': end_date,
+            })
+    if not form.is_bound or not form.is_valid():
+        return render_to_response('reports/timesheet_status_report.html', {
+                'form': form,
+            }, RequestContext(request))
+    start_date = form.cleaned_data['start_date']
+    end_date = form.cleaned_data['end_date']
+    hours_per_full_week = Timesheet.options.hours_per_full_week
+    slot = execution_slots.acquire(settings.SQL_REPORT_QUEUE_TIMEOUT)
+    if slot is None:
+        return render_to_response('reports/timesheet_status_report.html', {
+                'form': form,
+                'message': u'Too many reports are being executed at the moment - please try again later.',
+            }, RequestContext(request))
+    stream = get_timesheet_status(get_accessible_users(request.user),
+        start_date, end_date, hours_per_full_week,
+        max_rows=settings.SQL_REPORT_MAX_ROWS)
+    stream.slot = slot
+    stream.execute()
+    if request.GET.get('format') == 'csv':
+        response = HttpResponse(stream_csv_rows(stream), mimetype='text/csv')
+        response['Content-Disposition'] = \
+            'attachment; filename=timesheet_status_%s_%s.csv' % (
+                start_date.strftime('%Y%m%d'), end_date.strftime('%Y%m%d'))
+        return response
+    page = render_to_string('reports/timesheet_status_report.html', {
+            'form': form,
+            'start_date': start_date,
+            'end_date': end_date,
+            'hours_per_full_week': hours_per_full_week,
+            'headings': stream.headings,
+            'rows': ROWS_MARKER,
+            'csv_url': '?%s' % urlencode(dict(request.GET.items(), format='csv')),
+        }, RequestContext(request))
+    page_head, page_tail = page.split(ROWS_MARKER, 1)
+    return HttpResponse(stream_html_rows(stream, page_head, page_tail))
 
 @login_required
 def user_report(request):
@@ -61,7 +139,21 @@ def user_report(request):
 
 @login_required
 def annual_leave_report(request):
-    raise NotImplementedError
+    """
+    Reports leave entitlement, leave taken and leave remaining in a year
+    for every User the current User may access.
+    """
+    try:
+        year = int(request.GET.get('year', ''))
+    except ValueError:
+        year = datetime.date.today().year
+    return render_to_response('reports/annual_leave_report.html', {
+            'year': year,
+            'previous_year': year - 1,
+            'next_year': year + 1,
+            'users': get_annual_leave(get_accessible_users(request.user),
+                                      year),
+        }, RequestContext(request))
 
 @login_required
 def client_report(request):
@@ -73,7 +165,15 @@ def invoiced_work_report(request):
 
 @user_has_permission(is_admin_or_manager)
 def uninvoiced_work_report(request):
-    raise NotImplementedError
+    """
+    Reports the amount approved, uninvoiced time and expenses would be
+    invoiced for, for each Job grouped by Client.
+    """
+    clients, totals = get_accessible_uninvoiced_work(request.user)
+    return render_to_response('reports/uninvoiced_work_report.html', {
+            'clients': clients,
+            'totals': totals,
+        }, RequestContext(request))
 
 @user_has_permission(is_admin_or_manager)
 def developer_progress_report(request):
@@ -1,23 +1,35 @@
+import datetime
+
 from django import forms
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.core.urlresolvers import reverse
-from django.db import connection
+from django.db import DatabaseError, connections
+from django.http import Http404, HttpResponse, HttpResponseRedirect
 from django.shortcuts import get_object_or_404, render_to_response
 from django.template import RequestContext
+from django.template.defaultfilters import slugify
+from django.template.loader import render_to_string
+from django.utils.http import urlencode
+from django.utils.safestring import mark_safe
 from django.views.generic import create_update, list_detail
 
 from djangoffice.auth import is_admin, user_has_permission
 from djangoffice.forms.sql_reports import SQLReportParameterForm
-from djangoffice.models import SQLReport
-from djangoffice.utils import dtuple
-from djangoffice.views import SortHeaders
+from djangoffice.models import SQLReport, SQLReportJob
+from djangoffice.utils.sql_reports import (CachedSQLReportStream,
+    SQLReportRefused, StoredResults, estimate_query,
+    execute_sql_report as execute_report, stream_csv_rows, stream_html_rows)
+from djangoffice.views import SortHeaders, permission_denied
 from djangoffice.views.generic import add_object, edit_object
 
 LIST_HEADERS = (
     (u'SQL Report', 'name'),
 )
 
+# Marks where result rows are streamed into the rendered results page
+ROWS_MARKER = mark_safe(u'<!-- rows -->')
+
 @login_required
 def sql_report_list(request):
     """
@@ -26,7 +38,7 @@ def sql_report_list(request):
     Only list SQL Reports which the logged-in user has access to, based
     on their role and the access type set on each SQL Report.
     """
-    user_profile = request.user.get_profile()
+    user_profile = request.principal.profile
     header_defs = LIST_HEADERS
     if user_profile.is_admin():
         header_defs = LIST_HEADERS + ((u'Access', 'access'),)
@@ -78,6 +90,15 @@ def delete_sql_report(request, sql_report_id):
         object_id=sql_report_id, template_object_name='sql_report',
         template_name='sql_reports/delete_sql_report.html')
 
+def sql_report_not_executed(request, sql_report, message):
+    """
+    Explains why a SQL Report wasn't executed.
+    """
+    return render_to_response('sql_reports/sql_report_not_executed.html', {
+            'sql_report': sql_report,
+            'message': message,
+        }, RequestContext(request))
+
 @login_required
 def execute_sql_report(request, sql_report_id):
     """
@@ -90,7 +111,18 @@ def execute_sql_report(request, sql_report_id):
     each parameter.
 
     If the report requires no SQL parameters or parameters have been
-    provided, execute the report query and display the results.
+    provided, execute the report query and stream the results, as a
+    CSV download if requested. At most ``SQL_REPORT_MAX_ROWS`` rows are
+    returned.
+
+    If the SQL Report has caching enabled, cached results for the given
+    parameters and the user's role are streamed if available, unless a
+    ``refresh`` GET parameter of ``1`` is given.
+
+    If an ``estimate`` parameter is given, the database's plan and cost
+    estimate for the query are displayed instead of executing it. If a
+    ``background`` parameter is given, a job is queued to execute it in
+    the background instead.
     """
     sql_report = get_object_or_404(SQLReport, pk=sql_report_id)
     param_names = sql_report.get_sql_parameters()
@@ -98,10 +130,13 @@ def execute_sql_report(request, sql_report_id):
     if len(param_names) > 0:
         if request.method == 'POST':
             form = SQLReportParameterForm(param_names, request.POST)
-            if form.is_valid():
-                params = form.cleaned_data
+        elif param_names.issubset(request.GET.keys()):
+            # Parameters given in the CSV download link
+            form = SQLReportParameterForm(param_names, request.GET)
         else:
             form = SQLReportParameterForm(param_names)
+        if form.is_bound and form.is_valid():
+            params = form.cleaned_data
         if params is None:
             # We still need some user input
             return render_to_response('sql_reports/execute_sql_report.html', {
@@ -111,21 +146,131 @@ def execute_sql_report(request, sql_report_id):
     else:
         params = {}
 
-    if params is not None:
-        # Execute the report query and display results
-        cursor = connection.cursor()
-        cursor.execute(sql_report.get_populated_query(params))
-        rows = dtuple.fetchrows(cursor)
-        headings = None
-        results = None
-        if len(rows) > 0:
-            headings = sql_report.get_headings_from_query()
-            results = []
-            for row in rows:
-                row_dict = row.asMapping()
-                results.append([row_dict[heading] for heading in headings])
-        return render_to_response('sql_reports/results.html', {
-                'sql_report': sql_report,
-                'headings': headings,
+    if 'background' in request.REQUEST:
+        if request.method != 'POST':
+            # Jobs are only queued on submission of the form
+            return render_to_response('sql_reports/execute_sql_report.html', {
+                    'sql_report': sql_report,
+                    'form': SQLReportParameterForm(param_names, initial=params),
+                }, RequestContext(request))
+        job = SQLReportJob(sql_report=sql_report, user=request.user)
+        job.set_params(params)
+        job.save()
+        return HttpResponseRedirect(job.get_absolute_url())
+
+    try:
+        if 'estimate' in request.REQUEST:
+            query, query_params = sql_report.get_bound_query(params,
+                connections[settings.SQL_REPORT_DATABASE])
+            estimate = estimate_query(query, query_params,
+                                      using=settings.SQL_REPORT_DATABASE)
+            return render_to_response('sql_reports/estimate_sql_report.html', {
+                    'sql_report': sql_report,
+                    'estimate': estimate,
+                    'execute_url': '?%s' % urlencode(params),
+                }, RequestContext(request))
+
+        # Execute the report query, or use its cached results, and stream
+        # its results.
+        refresh = request.GET.get('refresh') == '1'
+        stream = execute_report(sql_report, params,
+                                request.principal.profile.role, refresh)
+    except SQLReportRefused, e:
+        return sql_report_not_executed(request, sql_report, unicode(e))
+    except DatabaseError, e:
+        return sql_report_not_executed(request, sql_report,
+            u'The SQL Report could not be executed: %s' % e)
+    if request.GET.get('format') == 'csv':
+        response = HttpResponse(stream_csv_rows(stream), mimetype='text/csv')
+        response['Content-Disposition'] = \
+            'attachment; filename=%s.csv' % slugify(sql_report.name)
+        return response
+    cached_at = None
+    if isinstance(stream, CachedSQLReportStream):
+        cached_at = datetime.datetime.fromtimestamp(stream.created)
+    page = render_to_string('sql_reports/results.html', {
+            'sql_report': sql_report,
+            'headings': stream.headings,
+            'rows': ROWS_MARKER,
+            'csv_url': '?%s' % urlencode(dict(params, format='csv')),
+            'cached_at': cached_at,
+            'refresh_url': '?%s' % urlencode(dict(params, refresh='1')),
+        }, RequestContext(request))
+    page_head, page_tail = page.split(ROWS_MARKER, 1)
+    return HttpResponse(stream_html_rows(stream, page_head, page_tail))
+
+def get_sql_report_job_or_404(request, job_id):
+    """
+    Retrieves a SQL Report job, returning a two-tuple of the job and
+    ``None`` if the logged-in user may view it, or the job and a
+    response denying permission otherwise.
+    """
+    job = get_object_or_404(SQLReportJob.objects.select_related(),
+                            pk=job_id)
+    if job.user_id != request.user.pk and \
+       not request.principal.is_admin():
+        return job, permission_denied(request)
+    return job, None
+
+def get_stored_results_or_404(job):
+    if job.status != SQLReportJob.COMPLETE_STATUS:
+        raise Http404
+    try:
+        return StoredResults(job.get_results_path())
+    except IOError:
+        raise Http404 # Expired
+
+@login_required
+def sql_report_job_list(request):
+    """
+    Lists the logged-in user's background SQL Report jobs.
+    """
+    return list_detail.object_list(request,
+        SQLReportJob.objects.filter(user=request.user).select_related(),
+        paginate_by=settings.ITEMS_PER_PAGE, allow_empty=True,
+        template_object_name='job',
+        template_name='sql_reports/sql_report_job_list.html')
+
+@login_required
+def sql_report_job_detail(request, job_id):
+    """
+    Displays a background SQL Report job's status, and a page of its
+    results once it has completed.
+    """
+    job, response = get_sql_report_job_or_404(request, job_id)
+    if response is not None:
+        return response
+    context = {'job': job, 'sql_report': job.sql_report}
+    if job.status == SQLReportJob.COMPLETE_STATUS:
+        results = get_stored_results_or_404(job)
+        try:
+            page = int(request.GET.get('page', 1))
+            context.update({
                 'results': results,
-            }, RequestContext(request))
+                'rows': results.page_count and results.get_page(page) or [],
+                'page': page,
+                'previous_page': page > 1 and page - 1 or None,
+                'next_page': page < results.page_count and page + 1 or None,
+            })
+        except (ValueError, IndexError):
+            raise Http404
+        finally:
+            results.close()
+    return render_to_response('sql_reports/sql_report_job_detail.html',
+                              context, RequestContext(request))
+
+@login_required
+def download_sql_report_job(request, job_id):
+    """
+    Downloads a completed background SQL Report job's results in CSV
+    format.
+    """
+    job, response = get_sql_report_job_or_404(request, job_id)
+    if response is not None:
+        return response
+    results = get_stored_results_or_404(job)
+    response = HttpResponse(stream_csv_rows(results.stream()),
+                            mimetype='text/csv')
+    response['Content-Disposition'] = \
+        'attachment; filename=%s.csv' % slugify(job.sql_report.name)
+    return response
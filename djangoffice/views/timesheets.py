@@ -18,10 +18,12 @@ from djangoffice.auth import (is_admin, is_admin_or_manager,
 from djangoffice.forms.timesheets import (BulkApprovalForm, AddTimeEntryForm,
     EditTimeEntryForm, ApprovedTimeEntryForm, AddExpenseForm, EditExpenseForm,
     ApprovedExpenseForm)
-from djangoffice.models import (Expense, ExpenseType, Job, Task, TimeEntry,
-    Timesheet)
+from djangoffice.models import (BulkApproval, Expense, ExpenseType, Job,
+    Task, TimeEntry, Timesheet)
 from djangoffice.utils.dates import (is_week_commencing_date,
     week_commencing_date, week_ending_date)
+from djangoffice.utils.timesheets import (get_jobs_and_tasks_for_user,
+    TimesheetSnapshot)
 from djangoffice.views import permission_denied
 
 #####################
@@ -41,23 +43,6 @@ def week_commencing_date_or_404(year, month, day):
         raise Http404
     return date
 
-def get_jobs_and_tasks_for_user(user):
-    """
-    Retrieves Job and Task information for the given user, returning
-    them as a tuple.
-    """
-    tasks_by_job = {}
-    for task in Task.objects.for_user_timesheet(user):
-        if not tasks_by_job.has_key(task.job_id):
-            tasks_by_job[task.job_id] = [task]
-        else:
-            tasks_by_job[task.job_id].append(task)
-    jobs = [Job(**values) for values in \
-            Job.objects.filter(id__in=tasks_by_job.keys()) \
-             .order_by('number') \
-              .values('id', 'name', 'number')]
-    return (jobs, tasks_by_job)
-
 def create_task_json(tasks_by_job):
     """
     Creates a JSON text representing an object mapping Job ids to Task
@@ -88,30 +73,45 @@ def timesheet_index(request):
                                         week_commencing=week_commencing)
     return HttpResponseRedirect(timesheet.get_absolute_url())
 
-@transaction.commit_on_success
 @user_has_permission(is_admin)
 def bulk_approval(request):
     """
-    Performs bulk approval of Time Entries and Expenses.
+    Performs bulk approval of Time Entries and Expenses, or resumes an
+    interrupted bulk approval.
+
+    This view doesn't run in a transaction of its own, as approval
+    commits a transaction after each chunk of items it approves.
     """
     if request.method == 'POST':
-        form = BulkApprovalForm(request.POST)
-        if form.is_valid():
-            start_date = week_commencing_date(form.cleaned_data['start_date'])
-            end_date = week_ending_date(form.cleaned_data['end_date'])
-            entries, expenses = Timesheet.objects.bulk_approve(request.user,
-                                                               start_date,
-                                                               end_date)
+        if 'resume' in request.POST:
+            bulk_approval = get_object_or_404(BulkApproval.objects.incomplete(),
+                                              pk=request.POST['resume'])
+            form = None
+        else:
+            form = BulkApprovalForm(request.POST)
+            if form.is_valid():
+                bulk_approval = BulkApproval.objects.create(
+                    approved_by=request.user,
+                    start_date=week_commencing_date(form.cleaned_data['start_date']),
+                    end_date=week_ending_date(form.cleaned_data['end_date']))
+                form = None
+        if form is None:
+            bulk_approval.run()
+            user_counts = bulk_approval.user_counts.select_related('user') \
+                .order_by('user__last_name', 'user__first_name')
             return render_to_response('timesheets/bulk_approval.html', {
-                'start_date': start_date,
-                'end_date': end_date,
-                'approved_time_entries': entries,
-                'approved_expenses': expenses,
+                'start_date': bulk_approval.start_date,
+                'end_date': bulk_approval.end_date,
+                'user_counts': user_counts,
+                'approved_time_entries': sum([c.time_entries for c in user_counts]),
+                'approved_expenses': sum([c.expenses for c in user_counts]),
             }, RequestContext(request))
     else:
         form = BulkApprovalForm()
     return render_to_response('timesheets/bulk_approval.html', {
             'form': form,
+            'incomplete': BulkApproval.objects.incomplete() \
+                .select_related('approved_by'),
         }, RequestContext(request))
 
 @transaction.commit_on_success
@@ -120,29 +120,23 @@ def edit_timesheet(request, username, year, month, day):
     """
     Edits a User's complete Timesheet for a particular week.
     """
-    user = get_object_or_404(User, username=username)
+    if username == request.user.username:
+        # Reuse the logged-in User and their already-loaded profile
+        user = request.user
+    else:
+        user = get_object_or_404(User, username=username)
     if not user_can_access_user(request.user, user):
         return permission_denied(request)
     week_commencing = week_commencing_date_or_404(year, month, day)
-    timesheet, created = \
-        Timesheet.objects.get_or_create(user=user,
-                                        week_commencing=week_commencing)
     can_approve = is_admin_or_manager(request.user)
-    jobs, tasks_by_job = get_jobs_and_tasks_for_user(user)
-    expense_types = ExpenseType.objects.all()
 
     # Get Timesheet contents
-    timesheet_time_entries = list(TimeEntry.objects.for_timesheet(timesheet))
-    booked = TimeEntry.objects.hours_booked_for_tasks(
-        [te.task_id for te in timesheet_time_entries])
-    for time_entry in timesheet_time_entries:
-        time_entry.task_hours_booked = booked[time_entry.task_id]
-        time_entry.job_display = u'%05d - %s' % (time_entry.job_number,
-                                                 time_entry.job_name)
-    timesheet_expenses = list(Expense.objects.for_timesheet(timesheet))
-    for expense in timesheet_expenses:
-        expense.job_display = u'%05d - %s' % (expense.job_number,
-                                              expense.job_name)
+    snapshot = TimesheetSnapshot(user, week_commencing)
+    timesheet = snapshot.timesheet
+    jobs, tasks_by_job = snapshot.jobs, snapshot.tasks_by_job
+    expense_types = snapshot.expense_types
+    timesheet_time_entries = snapshot.time_entries
+    timesheet_expenses = snapshot.expenses
 
     # Create forms for timesheet contents, where necessary
     time_entries = []
@@ -6,17 +6,18 @@ from django.contrib.auth.models import User
 from django.contrib.auth import views as auth_views
 from django.core.urlresolvers import reverse
 from django.db import backend, connection, transaction
-from django.db.models import Q
 from django.http import HttpResponseForbidden, HttpResponseRedirect
 from django.shortcuts import get_object_or_404, render_to_response
 from django.template import RequestContext
 from django.views.generic import create_update, list_detail
 
 from djangoffice import models
-from djangoffice.auth import is_admin, is_admin_or_manager, user_has_permission
+from djangoffice.auth import (get_principal, is_admin, is_admin_or_manager,
+    user_has_permission)
 from djangoffice.forms.rates import EditRateForm, UserRateBaseForm
 from djangoffice.forms.users import AdminUserForm, EditUserForm, UserForm
-from djangoffice.models import Job, Task, UserRate, UserProfile
+from djangoffice.models import Job, JobAccess, Task, UserRate, UserProfile
+from djangoffice.utils.reports import get_user_leave
 from djangoffice.views import SortHeaders
 
 #####################
@@ -42,6 +43,8 @@ def assign_user_to_admin_job_tasks(user):
         params.append(user.id)
     cursor = connection.cursor()
     cursor.execute(query, params)
+    JobAccess.objects.refresh(user_ids=[user.id],
+                              reasons=[JobAccess.TASK_REASON])
 
 def users_accessible_to_user(user):
     """
@@ -54,13 +57,14 @@ def users_accessible_to_user(user):
     Otherwise, Managers may only see themselves and their managed Users;
     Users may only see themselves.
     """
-    profile = user.get_profile()
-    if (profile.is_admin()
-        or (profile.is_manager() and models.access.managers_view_all_users)):
+    principal = get_principal(user)
+    if (principal.is_admin()
+        or (principal.is_manager() and models.access.managers_view_all_users)):
         return User.objects.exclude(userprofile__role=UserProfile.ADMINISTRATOR_ROLE)
-    elif profile.is_manager():
-        return User.objects.filter(Q(pk=user.id) | Q(managers=user.id))
-    elif profile.is_user():
+    elif principal.is_manager():
+        return User.objects.filter(pk__in=list(principal.managed_user_ids |
+                                               set([user.id])))
+    elif principal.is_user():
         return User.objects.filter(pk=user.id)
 
 #########
@@ -153,6 +157,7 @@ def user_detail(request, username):
             'profile': user.get_profile(),
             'rates': user.rates.order_by('effective_from'),
             'activities': user.assigned_activities.all(),
+            'leave': get_user_leave(user),
         }, RequestContext(request))
 
 @transaction.commit_on_success
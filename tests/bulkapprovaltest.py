@@ -0,0 +1,137 @@
+import datetime
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from djangoffice.models import (BulkApproval, Expense, ExpenseType, Task,
+    TaskTotal, TaskType, TimeEntry, Timesheet)
+from timesheettest import create_entry, create_job
+
+FIRST_WEEK = datetime.date(2007, 7, 2)
+
+class BulkApprovalTest(TestCase):
+    """
+    Tests for chunked, resumable bulk approval.
+    """
+    fixtures = ['initial_test_data']
+
+    def setUp(self):
+        self.admin = User.objects.get(username='admin')
+        self.user = User.objects.get(username='testuser')
+        self.manager = User.objects.get(username='testmanager')
+        job = create_job(u'Job')
+        self.task = Task.objects.create(job=job,
+            task_type=TaskType.objects.create(name=u'Design'),
+            estimate_hours=Decimal(100))
+        expense_type = ExpenseType.objects.create(name=u'Travel')
+        # Three Time Entries and an Expense for testuser and one Time
+        # Entry for testmanager each week for three weeks.
+        for week in xrange(3):
+            week_commencing = FIRST_WEEK + datetime.timedelta(weeks=week)
+            for user, count in ((self.user, 3), (self.manager, 1)):
+                timesheet = Timesheet.objects.create(user=user,
+                    week_commencing=week_commencing)
+                for i in xrange(count):
+                    create_entry(timesheet, self.task, mon=Decimal(2))
+            Expense.objects.create(timesheet=timesheet, user=self.user,
+                job=job, type=expense_type, amount=Decimal(10),
+                date=week_commencing + datetime.timedelta(days=2))
+
+    def create_bulk_approval(self, weeks=2):
+        return BulkApproval.objects.create(approved_by=self.admin,
+            start_date=FIRST_WEEK,
+            end_date=FIRST_WEEK + datetime.timedelta(weeks=weeks, days=-1))
+
+    def user_counts(self, bulk_approval):
+        return dict([(c.user_id, (c.time_entries, c.expenses)) \
+                     for c in bulk_approval.user_counts.all()])
+
+    def testChunkedApproval(self):
+        bulk_approval = self.create_bulk_approval()
+        bulk_approval.run(chunk_size=2)
+        self.assertTrue(bulk_approval.is_complete())
+        self.assertEquals({self.user.pk: (6, 2), self.manager.pk: (2, 0)},
+                          self.user_counts(bulk_approval))
+        self.assertEquals((8, 2), (bulk_approval.time_entries,
+                                   bulk_approval.expenses))
+        # Weeks outside the range are left alone
+        self.assertEquals(4, TimeEntry.objects.filter(
+            approved_by__isnull=True).count())
+        self.assertEquals(1, Expense.objects.filter(
+            approved_by__isnull=True).count())
+        self.assertEquals(Decimal(16),
+                          TaskTotal.objects.get(task=self.task).approved)
+        self.assertEquals([], TaskTotal.objects.verify())
+
+    def testResume(self):
+        bulk_approval = self.create_bulk_approval()
+        # Interrupted part-way through the first week
+        bulk_approval.approve_chunk(2)
+        bulk_approval = BulkApproval.objects.get(pk=bulk_approval.pk)
+        self.assertEquals(FIRST_WEEK, bulk_approval.next_week)
+        self.assertEquals([bulk_approval],
+                          list(BulkApproval.objects.incomplete()))
+
+        bulk_approval.run(chunk_size=2)
+        self.assertEquals({self.user.pk: (6, 2), self.manager.pk: (2, 0)},
+                          self.user_counts(bulk_approval))
+        self.assertEquals([], list(BulkApproval.objects.incomplete()))
+        self.assertEquals([], TaskTotal.objects.verify())
+
+    def testOverlappingRuns(self):
+        bulk_approval = self.create_bulk_approval()
+        # Resumed while it was still running
+        overlapping = BulkApproval.objects.get(pk=bulk_approval.pk)
+        bulk_approval.run(chunk_size=2)
+        overlapping.approve_chunk(2)
+        self.assertTrue(overlapping.is_complete())
+        self.assertEquals([], list(BulkApproval.objects.incomplete()))
+        self.assertEquals({self.user.pk: (6, 2), self.manager.pk: (2, 0)},
+                          self.user_counts(bulk_approval))
+        self.assertEquals(Decimal(16),
+                          TaskTotal.objects.get(task=self.task).approved)
+
+    def testChunkSizeBoundsEachTransaction(self):
+        bulk_approval = self.create_bulk_approval(weeks=1)
+        bulk_approval.approve_chunk(3)
+        self.assertEquals(3, TimeEntry.objects.filter(
+            approved_by__isnull=False).count())
+
+    def testTimesheetManagerBulkApprove(self):
+        self.assertEquals((12, 3), Timesheet.objects.bulk_approve(self.admin,
+            FIRST_WEEK, FIRST_WEEK + datetime.timedelta(weeks=3, days=-1)))
+
+    def testView(self):
+        self.admin.set_password('admin')
+        self.admin.save()
+        self.client.login(username='admin', password='admin')
+        response = self.client.post(reverse('bulk_approval'), {
+            'start_date': '2007-07-04',
+            'end_date': '2007-07-10',
+        })
+        self.assertEquals(200, response.status_code)
+        self.assertEquals((8, 2), (response.context['approved_time_entries'],
+                                   response.context['approved_expenses']))
+        # Ordered by User name
+        self.assertEquals([(self.manager.pk, 2, 0), (self.user.pk, 6, 2)],
+            [(c.user_id, c.time_entries, c.expenses) \
+             for c in response.context['user_counts']])
+
+    def testResumeView(self):
+        self.admin.set_password('admin')
+        self.admin.save()
+        self.client.login(username='admin', password='admin')
+        bulk_approval = self.create_bulk_approval()
+        bulk_approval.approve_chunk(2)
+        response = self.client.get(reverse('bulk_approval'))
+        self.assertEquals([bulk_approval.pk],
+                          [b.pk for b in response.context['incomplete']])
+        response = self.client.post(reverse('bulk_approval'), {
+            'resume': bulk_approval.pk,
+        })
+        self.assertEquals((8, 2), (response.context['approved_time_entries'],
+                                   response.context['approved_expenses']))
+        self.assertTrue(BulkApproval.objects.get(pk=bulk_approval.pk) \
+                                    .is_complete())
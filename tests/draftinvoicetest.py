@@ -0,0 +1,82 @@
+import datetime
+import os
+import shutil
+import tempfile
+from decimal import Decimal
+
+from django.test import TestCase
+
+from djangoffice.models import Invoice, UserRate
+from djangoffice.utils import draft_invoices
+from djangoffice.utils.draft_invoices import DraftInvoice, DraftInvoiceCache
+from invoicebatchtest import INVOICE_DATE, InvoiceFixtureMixin
+
+class DraftInvoiceTest(InvoiceFixtureMixin, TestCase):
+    """
+    Tests for creation and caching of draft Invoice PDFs.
+    """
+    def setUp(self):
+        InvoiceFixtureMixin.setUp(self)
+        self.directory = tempfile.mkdtemp()
+        self.old_cache = draft_invoices.cache
+        draft_invoices.cache = DraftInvoiceCache(self.directory, 1024 * 1024)
+        self.criteria = {'type': Invoice.WHOLE_JOB_TYPE, 'date': INVOICE_DATE,
+                         'start_period': None, 'end_period': None,
+                         'number%s' % self.jobs[0].pk: None}
+
+    def tearDown(self):
+        draft_invoices.cache = self.old_cache
+        shutil.rmtree(self.directory)
+
+    def create_draft(self, **criteria):
+        draft = DraftInvoice(self.jobs[0], dict(self.criteria, **criteria))
+        return draft, draft.get_filename()
+
+    def testCached(self):
+        entry = self.create_entry(self.tasks[0], mon=Decimal(7))
+        draft, filename = self.create_draft()
+        self.assertFalse(draft.cached)
+        self.assertTrue(open(filename, 'rb').read().startswith('%PDF'))
+
+        draft, cached_filename = self.create_draft()
+        self.assertTrue(draft.cached)
+        self.assertEquals(filename, cached_filename)
+
+        # Different criteria give a different draft
+        draft, other_filename = self.create_draft(date=datetime.date(2007, 9, 1))
+        self.assertFalse(draft.cached)
+        self.assertNotEquals(filename, other_filename)
+
+        # Changing an included Time Entry invalidates the Job's drafts
+        entry.tue = Decimal(1)
+        entry.save()
+        self.assertFalse(os.path.exists(filename))
+        self.assertFalse(os.path.exists(other_filename))
+        draft, filename = self.create_draft()
+        self.assertFalse(draft.cached)
+
+    def testRateChangeInvalidates(self):
+        self.create_entry(self.tasks[0], mon=Decimal(7))
+        draft, filename = self.create_draft()
+        rate = UserRate.objects.get()
+        rate.standard_rate = Decimal('20.00')
+        rate.save()
+        self.assertFalse(os.path.exists(filename))
+        draft, new_filename = self.create_draft()
+        self.assertNotEquals(filename, new_filename)
+
+    def testEviction(self):
+        cache = DraftInvoiceCache(self.directory, 25)
+        first = cache.put(1, 'a', '0123456789')
+        second = cache.put(1, 'b', '0123456789')
+        os.utime(first, (1000, 1000))
+        os.utime(second, (2000, 2000))
+        # Using a draft makes it the most recently used
+        self.assertEquals(first, cache.get(1, 'a'))
+        third = cache.put(2, 'c', '0123456789')
+        self.assertEquals(None, cache.get(1, 'b'))
+        self.assertEquals(first, cache.get(1, 'a'))
+        self.assertEquals(third, cache.get(2, 'c'))
+        cache.invalidate(2)
+        self.assertEquals(None, cache.get(2, 'c'))
+        self.assertEquals(first, cache.get(1, 'a'))
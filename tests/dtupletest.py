@@ -0,0 +1,59 @@
+import unittest
+
+from djangoffice.utils.dtuple import DatabaseTuple, TupleDescriptor, fetchrows
+
+class Cursor:
+    description = [('id',), ('name',), ('Total Hours',), ('count',),
+                   ('asList',)]
+
+    def fetchall(self):
+        return [(1, u'Design', 10, 2, u'a'), (2, u'Build', 20, 3, u'b')]
+
+class DatabaseTupleTest(unittest.TestCase):
+    def setUp(self):
+        self.rows = fetchrows(Cursor())
+
+    def testSharedDescriptor(self):
+        first, second = self.rows
+        self.assertTrue(first._desc_ is second._desc_)
+        self.assertTrue(type(first) is type(second))
+        self.assertFalse(hasattr(first, '__dict__'))
+
+    def testTupleAccess(self):
+        row = self.rows[0]
+        self.assertEquals((1, u'Design', 10, 2, u'a'), row)
+        self.assertEquals(u'Design', row[1])
+        self.assertEquals((1, u'Design'), row[:2])
+        self.assertEquals(5, len(row))
+        self.assertEquals((1, u'Design', 10, 2, u'a'), row.asTuple())
+        self.assertEquals([1, u'Design', 10, 2, u'a'], row.asList())
+
+    def testMappingAccess(self):
+        row = self.rows[1]
+        self.assertEquals(u'Build', row['name'])
+        self.assertEquals(20, row['Total Hours'])
+        self.assertTrue(row.has_key('id'))
+        self.assertFalse(row.has_key('missing'))
+        self.assertEquals(['id', 'name', 'Total Hours', 'count', 'asList'],
+                          row.keys())
+        self.assertEquals({'id': 2, 'name': u'Build', 'Total Hours': 20,
+                           'count': 3, 'asList': u'b'}, row.asMapping())
+
+    def testAttributeAccess(self):
+        row = self.rows[0]
+        self.assertEquals(1, row.id)
+        self.assertEquals(u'Design', row.name)
+        self.assertEquals(10, getattr(row, 'Total Hours'))
+        # Column names take precedence over tuple methods, but not over
+        # DatabaseTuple's own.
+        self.assertEquals(2, row.count)
+        self.assertEquals([1, u'Design', 10, 2, u'a'], row.asList())
+        self.assertRaises(AttributeError, getattr, row, 'missing')
+
+    def testConstructor(self):
+        desc = TupleDescriptor([('id',), ('name',)])
+        row = DatabaseTuple(desc, (1, u'Design'))
+        self.assertEquals(u'Design', row.name)
+        self.assertTrue(type(row) is type(DatabaseTuple(desc, (2, u'Build'))))
+        self.assertEquals(1, DatabaseTuple([('id',), ('name',)], [1, 2]).id)
+        self.assertRaises(ValueError, DatabaseTuple, desc, (1,))
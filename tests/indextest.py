@@ -0,0 +1,123 @@
+import datetime
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from django.contrib.auth.models import User
+from django.db import connection, connections
+from django.test import TestCase
+
+from djangoffice.models import (COMPOSITE_INDEXES, CompositeIndex, Expense,
+    Job)
+from djangoffice.utils.indexes import (advise_indexes, capture_queries,
+    filtered_columns, find_full_scans, missing_indexes)
+
+class CompositeIndexTest(TestCase):
+    """
+    Tests for creating composite indexes and advising on indexes.
+    """
+    fixtures = ['initial_test_data']
+
+    def setUp(self):
+        # A file database, which queries are explained on a connection
+        # of their own to, with Expenses but no composite index for them.
+        self.temp_dir = tempfile.mkdtemp()
+        cursor = connection.cursor()
+        cursor.execute("""
+        SELECT sql FROM sqlite_master
+        WHERE tbl_name IN (%s, %s) AND sql IS NOT NULL""",
+            [User._meta.db_table, Expense._meta.db_table])
+        database = sqlite3.connect(os.path.join(self.temp_dir, 'advice.db'))
+        for sql, in cursor.fetchall():
+            if 'date_approved_by_id' not in sql:
+                database.execute(sql)
+        database.commit()
+        database.close()
+        connections.databases['advice'] = dict(connection.settings_dict,
+            NAME=os.path.join(self.temp_dir, 'advice.db'))
+        self.expense_index = [index for index in COMPOSITE_INDEXES \
+                              if index.model is Expense][0]
+
+    def tearDown(self):
+        connections['advice'].close()
+        del connections.databases['advice']
+        del connections._connections['advice']
+        shutil.rmtree(self.temp_dir)
+
+    def unapproved_expenses(self):
+        user = User.objects.get(username='admin')
+        return [(u'Unapproved Expenses', lambda: Expense.objects.approve_chunk(
+            user, datetime.date(2007, 7, 2), datetime.date(2007, 7, 8), 10))]
+
+    def testIndexesCreatedBySyncdb(self):
+        self.assertEquals([], missing_indexes())
+        self.assertTrue(self.expense_index in missing_indexes('advice'))
+
+    def testCaptureQueriesDoesNotExecute(self):
+        queries, error = capture_queries(lambda: Job.objects.all().update(
+            status=Job.ARCHIVED_STATUS))
+        self.assertEquals(None, error)
+        self.assertEquals(1, len(queries))
+        self.assertTrue(queries[0][0].startswith('UPDATE'))
+        self.assertEquals(0, Job.objects.filter(
+            status=Job.ARCHIVED_STATUS).count())
+
+    def testCaptureQueriesFromGivenDatabase(self):
+        def func():
+            Expense.objects.using('advice').all().update(
+                description=u'Replayed')
+            Job.objects.all().update(status=Job.ARCHIVED_STATUS)
+        queries, error = capture_queries(func, 'advice')
+        self.assertEquals(2, len(queries))
+        self.assertTrue('djangoffice_expense' in queries[0][0])
+        self.assertTrue('djangoffice_job' in queries[1][0])
+        self.assertEquals(0, Job.objects.filter(
+            status=Job.ARCHIVED_STATUS).count())
+
+    def testFindFullScans(self):
+        self.assertEquals(['djangoffice_job', 'djangoffice_expense'],
+            find_full_scans([
+                u'SCAN TABLE djangoffice_job (~100000 rows)',
+                u'SCAN djangoffice_expense USING INDEX x',
+                u'SEARCH djangoffice_activity USING INDEX y (job_id=?)',
+                u'SEARCH djangoffice_task USING INTEGER PRIMARY KEY (rowid=?)',
+            ], connection))
+
+    def testFilteredColumns(self):
+        self.assertEquals(['sent_at', 'worker', 'attempts'], filtered_columns(
+            'SELECT "id" FROM "t" WHERE ("t"."attempts" < %s AND '
+            '"t"."sent_at" IS NULL AND "t"."worker" = %s)', 't', connection))
+
+    def testAdvice(self):
+        advice = advise_indexes('advice', self.unapproved_expenses())
+        self.assertEquals([(Expense._meta.db_table, self.expense_index)],
+                          advice[0].full_scans)
+
+        self.expense_index.create(connections['advice'])
+        advice = advise_indexes('advice', self.unapproved_expenses())
+        self.assertEquals([], advice[0].full_scans)
+        self.assertFalse(self.expense_index in missing_indexes('advice'))
+
+    def testReplayErrorsReported(self):
+        def fails_after_query():
+            Expense.objects.get(pk=1)
+        def fails_before_query():
+            raise ValueError(u'Broken')
+        advice = advise_indexes('advice', [
+            (u'Missing Expense', fails_after_query),
+            (u'Broken', fails_before_query),
+        ])
+        self.assertEquals(2, len(advice))
+        self.assertTrue('djangoffice_expense' in advice[0].sql)
+        self.assertTrue(isinstance(advice[0].error, Expense.DoesNotExist))
+        self.assertEquals(None, advice[1].sql)
+        self.assertTrue(isinstance(advice[1].error, ValueError))
+
+    def testSuggestedIndex(self):
+        self.expense_index.create(connections['advice'])
+        advice = advise_indexes('advice', [(u'Expenses by amount',
+            lambda: list(Expense.objects.filter(amount=10, billable=True)))])
+        index = advice[0].full_scans[0][1]
+        self.assertTrue(isinstance(index, CompositeIndex))
+        self.assertEquals(('amount', 'billable'), index.field_names)
@@ -0,0 +1,123 @@
+import datetime
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from djangoffice.models import (Expense, ExpenseType, Invoice, Task,
+    TaskType, TimeEntry, Timesheet, UserRate)
+from djangoffice.utils.invoice import InvoiceBatch
+from timesheettest import create_entry, create_job
+
+WEEK_COMMENCING = datetime.date(2007, 7, 23)
+INVOICE_DATE = datetime.date(2007, 8, 1)
+
+class InvoiceFixtureMixin:
+    """
+    Creates Jobs which can have time and expenses booked against them
+    for invoicing.
+    """
+    fixtures = ['initial_test_data']
+
+    def setUp(self):
+        self.user = User.objects.get(username='testuser')
+        self.approver = User.objects.get(username='testmanager')
+        UserRate.objects.create(user=self.user,
+            effective_from=datetime.date(2007, 1, 1),
+            standard_rate=Decimal('10.00'), overtime_rate=Decimal('15.00'))
+        self.timesheet = Timesheet.objects.create(user=self.user,
+            week_commencing=WEEK_COMMENCING)
+        self.expense_type = ExpenseType.objects.create(name=u'Travel')
+        self.jobs = [create_job(u'Job %s' % i) for i in xrange(3)]
+        self.tasks = [Task.objects.create(job=job,
+                          task_type=TaskType.objects.create(name=job.name),
+                          estimate_hours=Decimal(40))
+                      for job in self.jobs]
+
+    def create_entry(self, task, approved=True, **hours):
+        return create_entry(self.timesheet, task,
+            approved_by=approved and self.approver or None, **hours)
+
+    def create_expense(self, job, amount):
+        return Expense.objects.create(timesheet=self.timesheet, user=self.user,
+            job=job, type=self.expense_type, date=WEEK_COMMENCING,
+            amount=amount, approved_by=self.approver)
+
+    def create_invoice(self, job, number):
+        return Invoice.objects.create(job=job, number=number,
+            type=Invoice.WHOLE_JOB_TYPE, amount_invoiced=Decimal(0))
+
+class InvoiceBatchTest(InvoiceFixtureMixin, TestCase):
+    """
+    Tests for creation of Invoices for multiple Jobs at once.
+    """
+    def testBatch(self):
+        self.create_invoice(self.jobs[2], 1)
+        entry = self.create_entry(self.tasks[0], mon=Decimal(7), tue=Decimal(2))
+        unapproved = self.create_entry(self.tasks[0], approved=False,
+                                       wed=Decimal(1))
+        expense = self.create_expense(self.jobs[0], Decimal('12.50'))
+        other_expense = self.create_expense(self.jobs[1], Decimal('20.00'))
+
+        batch = InvoiceBatch(self.jobs, Invoice.WHOLE_JOB_TYPE, INVOICE_DATE,
+                             numbers={self.jobs[1].id: 10})
+        batch.run()
+
+        first, second, third = batch.results
+        self.assertEquals(2, first.invoice.number)
+        self.assertEquals(Decimal('102.50'), first.invoice.amount_invoiced)
+        self.assertEquals(INVOICE_DATE, first.invoice.date)
+        self.assertEquals((1, 1), (first.time_entry_count, first.expense_count))
+        self.assertEquals(10, second.invoice.number)
+        self.assertEquals(Decimal('20.00'), second.invoice.amount_invoiced)
+        self.assertEquals(None, third.invoice)
+        self.assertEquals(2, len(batch.invoices))
+        self.assertEquals(6, len(batch.timings))
+
+        self.assertEquals(first.invoice.id,
+                          TimeEntry.objects.get(pk=entry.pk).invoice_id)
+        self.assertEquals(None,
+                          TimeEntry.objects.get(pk=unapproved.pk).invoice_id)
+        self.assertEquals(first.invoice.id,
+                          Expense.objects.get(pk=expense.pk).invoice_id)
+        self.assertEquals(second.invoice.id,
+                          Expense.objects.get(pk=other_expense.pk).invoice_id)
+
+        # Invoiced items aren't invoiced again
+        batch = InvoiceBatch(self.jobs, Invoice.WHOLE_JOB_TYPE, INVOICE_DATE)
+        batch.run()
+        self.assertEquals([], batch.invoices)
+
+    def testManualNumberBelowNumbersInUse(self):
+        self.create_invoice(self.jobs[2], 5)
+        self.create_invoice(self.jobs[2], 6)
+        self.create_entry(self.tasks[0], mon=Decimal(1))
+        self.create_entry(self.tasks[1], mon=Decimal(1))
+
+        batch = InvoiceBatch(self.jobs, Invoice.WHOLE_JOB_TYPE, INVOICE_DATE,
+                             numbers={self.jobs[1].id: 2})
+        batch.run()
+
+        first, second, third = batch.results
+        self.assertEquals(3, first.invoice.number)
+        self.assertEquals(2, second.invoice.number)
+        self.assertEquals(4, Invoice.objects.get_next_free_number())
+
+    def testDateRestricted(self):
+        self.create_entry(self.tasks[0], mon=Decimal(1))
+        batch = InvoiceBatch(self.jobs, Invoice.DATE_RESTRICTED_TYPE,
+                             INVOICE_DATE, datetime.date(2007, 7, 30),
+                             datetime.date(2007, 8, 31))
+        batch.run()
+        self.assertEquals([], batch.invoices)
+
+    def testRateNotFound(self):
+        UserRate.objects.all().delete()
+        self.create_entry(self.tasks[0], mon=Decimal(1))
+        self.create_expense(self.jobs[1], Decimal('20.00'))
+        batch = InvoiceBatch(self.jobs, Invoice.WHOLE_JOB_TYPE, INVOICE_DATE)
+        batch.run()
+        self.assertNotEquals(None, batch.results[0].error)
+        self.assertEquals(None, batch.results[0].invoice)
+        self.assertEquals(Decimal('20.00'),
+                          batch.results[1].invoice.amount_invoiced)
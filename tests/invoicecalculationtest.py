@@ -0,0 +1,114 @@
+import datetime
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from djangoffice.models import (Task, TaskType, TaskTypeRate, TimeEntry,
+    Timesheet, UserRate)
+from djangoffice.utils.invoice import (InvoiceTimeCalculation, RateNotFound,
+    TimeEntryColumns)
+from djangoffice.utils.rates import RateLookup
+from timesheettest import create_entry, create_job
+
+WEEK_COMMENCING = datetime.date(2007, 7, 23)
+
+class InvoiceTimeCalculationTest(TestCase):
+    """
+    Tests for calculation of the cost of time to be invoiced.
+    """
+    fixtures = ['initial_test_data']
+
+    def setUp(self):
+        self.user = User.objects.get(username='testuser')
+        self.approver = User.objects.get(username='testmanager')
+        self.job = create_job(u'Test Job')
+        self.task_type = TaskType.objects.create(name=u'Design')
+        self.task = Task.objects.create(job=self.job, task_type=self.task_type,
+                                        estimate_hours=Decimal(40))
+        self.timesheet = Timesheet.objects.create(user=self.user,
+            week_commencing=WEEK_COMMENCING)
+
+    def create_entry(self, approved=True, **hours):
+        return create_entry(self.timesheet, self.task,
+            approved_by=approved and self.approver or None, **hours)
+
+    def calculate(self, model=UserRate, attr='user', driven_by=u'U'):
+        calculation = InvoiceTimeCalculation(self.job)
+        calculation.calculate(RateLookup(model, attr), driven_by)
+        return calculation
+
+    def testSingleRate(self):
+        UserRate.objects.create(user=self.user,
+            effective_from=datetime.date(2007, 1, 1),
+            standard_rate=Decimal('10.00'), overtime_rate=Decimal('15.00'))
+        entry = self.create_entry(mon=Decimal('7.5'), fri=Decimal(2),
+                                  overtime=Decimal(1))
+        self.create_entry(approved=False, tue=Decimal(8))
+
+        calculation = self.calculate()
+        self.assertEquals([entry.pk], calculation.time_entry_ids)
+        self.assertEquals(Decimal('10.5'), calculation.total_hours)
+        self.assertEquals(Decimal('110.00'), calculation.total_cost)
+        self.assertEquals(Decimal('110.00'),
+                          calculation.by_task[self.task.pk].cost)
+        self.assertEquals(Decimal('10.5'),
+            calculation.by_user_and_task[self.user.pk][self.task.pk].hours)
+        # Overtime is costed on the first day of the week
+        monday = calculation.by_date_and_user[WEEK_COMMENCING][self.user.pk]
+        self.assertEquals((Decimal('8.5'), Decimal('90.00')),
+                          (monday.hours, monday.cost))
+        friday = calculation.by_date_and_user[datetime.date(2007, 7, 27)]
+        self.assertEquals(Decimal('20.00'), friday[self.user.pk].cost)
+        self.assertEquals(2, len(calculation.by_date_and_user))
+
+    def testRateChangeDuringWeek(self):
+        UserRate.objects.create(user=self.user,
+            effective_from=datetime.date(2007, 1, 1),
+            standard_rate=Decimal('10.00'), overtime_rate=Decimal('15.00'))
+        UserRate.objects.create(user=self.user,
+            effective_from=datetime.date(2007, 7, 25),
+            standard_rate=Decimal('20.00'), overtime_rate=Decimal('30.00'))
+        self.create_entry(mon=Decimal(1), tue=Decimal(2), wed=Decimal(3),
+                          sun=Decimal('0.5'), overtime=Decimal(2))
+
+        calculation = self.calculate()
+        self.assertEquals(Decimal('8.5'), calculation.total_hours)
+        # 3 hours at 10, 3.5 hours at 20, overtime at the Monday rate
+        self.assertEquals(Decimal('130.00'), calculation.total_cost)
+        wednesday = calculation.by_date_and_user[datetime.date(2007, 7, 25)]
+        self.assertEquals(Decimal('60.00'), wednesday[self.user.pk].cost)
+
+    def testDrivenByTaskType(self):
+        TaskTypeRate.objects.create(task_type=self.task_type,
+            effective_from=datetime.date(2007, 1, 1),
+            standard_rate=Decimal('12.50'), overtime_rate=Decimal('20.00'))
+        self.create_entry(thu=Decimal(4))
+        calculation = self.calculate(TaskTypeRate, 'task_type', u'T')
+        self.assertEquals(Decimal('50.00'), calculation.total_cost)
+
+    def testExchangeRate(self):
+        UserRate.objects.create(user=self.user,
+            effective_from=datetime.date(2007, 1, 1),
+            standard_rate=Decimal('10.00'), overtime_rate=Decimal('15.00'))
+        self.create_entry(mon=Decimal(2), tue=Decimal(3))
+        calculation = InvoiceTimeCalculation(self.job)
+        calculation.exchange_rate = Decimal('1.5')
+        calculation.calculate(RateLookup(UserRate, 'user'), u'U')
+        self.assertEquals(Decimal('75.000'), calculation.total_cost)
+
+    def testRateNotFound(self):
+        UserRate.objects.create(user=self.user,
+            effective_from=datetime.date(2007, 7, 25),
+            standard_rate=Decimal('10.00'), overtime_rate=Decimal('15.00'))
+        # Time booked only after the rate takes effect can be costed
+        self.create_entry(thu=Decimal(4))
+        self.assertEquals(Decimal('40.00'), self.calculate().total_cost)
+        self.create_entry(mon=Decimal(4))
+        self.assertRaises(RateNotFound, self.calculate)
+
+    def testEmptyColumns(self):
+        columns = TimeEntryColumns.from_queryset(
+            TimeEntry.objects.filter(task__job=self.job))
+        self.assertEquals(0, len(columns))
+        self.assertEquals((), columns.overtime)
@@ -0,0 +1,114 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+
+from djangoffice.models import (access, Job, JobAccess, Task, TaskType,
+    UserProfile)
+from timesheettest import create_job
+
+class JobAccessTest(TestCase):
+    """
+    Tests for maintenance of the Job access index and access checks
+    which use it.
+    """
+    fixtures = ['initial_test_data']
+
+    def setUp(self):
+        # The fixture lets everyone view all Jobs
+        self.old_access = (access.managers_view_all_jobs,
+                           access.users_view_all_jobs)
+        access.managers_view_all_jobs = False
+        access.users_view_all_jobs = False
+        self.user = User.objects.get(username='testuser')
+        self.manager = User.objects.get(username='testmanager')
+        self.pm = User.objects.create(username='testpm')
+        UserProfile.objects.create(user=self.pm, role=UserProfile.PM_ROLE)
+        self.job = create_job(u'Test Job')
+        self.other_job = create_job(u'Other Job', director_id=self.pm.pk,
+                                    project_manager_id=self.pm.pk)
+        self.task = Task.objects.create(job=self.job,
+            task_type=TaskType.objects.create(name=u'Design'),
+            estimate_hours=Decimal(40))
+
+    def tearDown(self):
+        access.managers_view_all_jobs, access.users_view_all_jobs = \
+            self.old_access
+
+    def accessible(self, user):
+        return set(Job.objects.accessible_to_user(User.objects.get(pk=user.pk)) \
+                                .values_list('id', flat=True))
+
+    def testTaskAssignment(self):
+        self.assertEquals(set(), self.accessible(self.user))
+        self.task.assigned_users.add(self.user)
+        self.assertEquals(set([self.job.pk]), self.accessible(self.user))
+        self.task.assigned_users.remove(self.user)
+        self.assertEquals(set(), self.accessible(self.user))
+        # From the User side
+        self.user.tasks.add(self.task)
+        self.assertEquals(set([self.job.pk]), self.accessible(self.user))
+        self.user.tasks.clear()
+        self.assertEquals(set(), self.accessible(self.user))
+        self.task.assigned_users = [self.user]
+        self.task.delete()
+        self.assertEquals(set(), self.accessible(self.user))
+
+    def testMovingTask(self):
+        self.task.assigned_users.add(self.user)
+        self.task.job = self.other_job
+        self.task.save()
+        self.assertEquals(set([self.other_job.pk]), self.accessible(self.user))
+
+    def testDirectorsAndManagers(self):
+        # The fixture's manager directs and manages both Jobs
+        self.assertEquals(set([self.job.pk]), self.accessible(self.manager))
+        self.assertEquals(set([self.other_job.pk]), self.accessible(self.pm))
+        self.job.director = self.pm
+        self.job.save()
+        self.assertEquals(set(), self.accessible(self.manager))
+        # Directing a Job doesn't give PMs access to it
+        self.assertEquals(set([self.other_job.pk]), self.accessible(self.pm))
+        self.job.project_manager = self.pm
+        self.job.save()
+        self.assertEquals(set([self.job.pk, self.other_job.pk]),
+                          self.accessible(self.pm))
+
+    def testAccessSettings(self):
+        all_jobs = set([self.job.pk, self.other_job.pk])
+        admin = User.objects.get(username='admin')
+        self.assertEquals(all_jobs, self.accessible(admin))
+        access.users_view_all_jobs = True
+        self.assertEquals(all_jobs, self.accessible(self.user))
+        self.assertEquals(all_jobs, self.accessible(self.pm))
+        self.assertEquals(set([self.job.pk]), self.accessible(self.manager))
+        access.managers_view_all_jobs = True
+        self.assertEquals(all_jobs, self.accessible(self.manager))
+
+    def testIsAccessibleCachedPerUser(self):
+        self.task.assigned_users.add(self.user)
+        user = User.objects.get(pk=self.user.pk)
+        admin_job = Job.objects.get(pk=settings.ADMIN_JOB_ID)
+        old_debug = settings.DEBUG
+        settings.DEBUG = True
+        connection.queries = []
+        try:
+            self.assertTrue(self.job.is_accessible_to_user(user))
+            first_check_queries = len(connection.queries)
+            self.assertFalse(self.other_job.is_accessible_to_user(user))
+            self.assertTrue(self.job.is_accessible_to_user(user))
+            self.assertFalse(admin_job.is_accessible_to_user(user))
+            queries = len(connection.queries)
+        finally:
+            settings.DEBUG = old_debug
+        self.assertEquals(first_check_queries, queries)
+
+    def testRebuild(self):
+        self.task.assigned_users.add(self.user)
+        expected = set(JobAccess.objects.values_list('user', 'job', 'reason'))
+        JobAccess.objects.all().delete()
+        self.assertEquals(len(expected), JobAccess.objects.rebuild())
+        self.assertEquals(expected,
+            set(JobAccess.objects.values_list('user', 'job', 'reason')))
@@ -0,0 +1,62 @@
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.urlresolvers import clear_url_caches
+from django.test import TestCase
+
+from djangoffice import menu
+from djangoffice.auth import get_principal
+from djangoffice.menu import build_menu_items, clear_menu_cache
+
+class MenuCacheTest(TestCase):
+    """
+    Tests for caching of menu items.
+    """
+    fixtures = ['initial_test_data']
+
+    def setUp(self):
+        self.sections = menu.SECTIONS
+        clear_menu_cache()
+
+    def tearDown(self):
+        menu.SECTIONS = self.sections
+        clear_menu_cache()
+
+    def testCachedByRole(self):
+        manager = User.objects.get(username='testmanager')
+        user = User.objects.get(username='testuser')
+        section_items, page_items = build_menu_items(manager, 'invoices')
+        self.assertTrue(u'id="nav_invoices"' in u''.join(section_items))
+        self.assertEquals(2, len(page_items))
+        section_items, page_items = build_menu_items(user, 'invoices')
+        self.assertFalse(u'id="nav_invoices"' in u''.join(section_items))
+        self.assertEquals(0, len(page_items))
+        self.assertEquals(1, len(build_menu_items(AnonymousUser())[0]))
+
+        # Other Users with the same role don't need their permissions
+        # tested.
+        other_manager = User.objects.get(pk=manager.pk)
+        get_principal(other_manager).passes = lambda test: self.fail()
+        self.assertEquals(build_menu_items(manager, 'invoices'),
+                          build_menu_items(other_manager, 'invoices'))
+
+    def testInvalidation(self):
+        user = User.objects.get(username='testuser')
+        build_menu_items(user)
+        menu.SECTIONS = menu.SECTIONS[:2]
+        self.assertEquals(1, len(build_menu_items(user)[0]))
+
+        items = menu._menu_cache['items']
+        clear_url_caches()
+        build_menu_items(user)
+        self.assertFalse(items is menu._menu_cache['items'])
+
+    def testRebuildLeavesOldCacheIntact(self):
+        user = User.objects.get(username='testuser')
+        build_menu_items(user)
+        # Another thread may still be using the cache being replaced
+        old_cache = menu._menu_cache
+        old_urls = dict(old_cache['urls'])
+        clear_url_caches()
+        build_menu_items(user)
+        self.assertFalse(old_cache is menu._menu_cache)
+        self.assertEquals(old_urls, old_cache['urls'])
+        self.assertTrue(old_cache['items'])
@@ -0,0 +1,263 @@
+import datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.test import TestCase
+
+from djangoffice.models import (Activity, Expense, ExpenseType, Job,
+    NotificationWatermark, OutboxEmail, Task, TaskType, Timesheet,
+    email as email_options)
+from djangoffice.utils.notifications import (RULES, run_notifications,
+    send_outbox_emails)
+from timesheettest import create_entry, create_job
+
+class UnavailableEmailBackend(EmailBackend):
+    def open(self):
+        raise IOError('Connection refused')
+
+class SlowEmailBackend(EmailBackend):
+    """
+    Sends so slowly that the rest of the batch is reclaimed by another
+    worker once the first email has been sent.
+    """
+    def send_messages(self, messages):
+        OutboxEmail.objects.filter(worker='test').exclude(
+            subject=messages[0].subject).update(worker='other')
+        return super(SlowEmailBackend, self).send_messages(messages)
+
+class NotificationTest(TestCase):
+    """
+    Tests for queuing and sending notification emails.
+    """
+    fixtures = ['initial_test_data']
+
+    def setUp(self):
+        self.user = User.objects.get(username='testuser')
+        self.manager = User.objects.get(username='testmanager')
+        for rule in RULES:
+            for option in rule.options:
+                setattr(email_options, option, True)
+        Timesheet.options.hours_per_full_week = Decimal('37.50')
+        self.now = datetime.datetime.now()
+        self.today = self.now.date()
+        # The first run only records watermarks
+        run_notifications(self.now - datetime.timedelta(seconds=1))
+
+    def run_and_send(self, now=None):
+        counts = dict(run_notifications(now))
+        send_outbox_emails('test')
+        return counts
+
+    def recipients(self):
+        return [message.to for message in mail.outbox]
+
+    def book_hours(self, job, estimate_hours, hours):
+        task_type, created = TaskType.objects.get_or_create(name=u'Design')
+        task, created = Task.objects.get_or_create(job=job,
+            task_type=task_type, defaults={'estimate_hours': estimate_hours})
+        timesheet, created = Timesheet.objects.get_or_create(user=self.user,
+            week_commencing=datetime.date(2007, 7, 23))
+        create_entry(timesheet, task, mon=hours)
+        return task
+
+    def create_activity(self, **kwargs):
+        fields = dict(job=create_job(u'Job'), created_by=self.manager,
+                      description=u'Call the client', priority=u'M')
+        fields.update(kwargs)
+        return Activity.objects.create(**fields)
+
+    def testFirstRunOnlyRecordsWatermarks(self):
+        NotificationWatermark.objects.all().delete()
+        self.book_hours(create_job(u'Job'), Decimal(10), Decimal(12))
+        self.assertEquals(0, sum(self.run_and_send().values()))
+        self.assertEquals([], mail.outbox)
+
+    def testJobOverHours(self):
+        job = create_job(u'Over')
+        self.book_hours(job, Decimal(10), Decimal(12))
+        self.book_hours(create_job(u'Under'), Decimal(10), Decimal(8))
+        self.assertEquals(1, self.run_and_send()['job_over_hours'])
+        self.assertEquals([[u'tm@tm.com']], self.recipients())
+        self.assertTrue(Job.objects.get(pk=job.pk).over_hours)
+
+        # Jobs are only notified about once
+        self.book_hours(job, Decimal(10), Decimal(12))
+        self.assertEquals(0, self.run_and_send()['job_over_hours'])
+
+    def testUnchangedJobsNotChecked(self):
+        job = create_job(u'Over')
+        self.book_hours(job, Decimal(10), Decimal(12))
+        Job.objects.filter(pk=job.pk).update(status=Job.COMPLETED_STATUS)
+        later = datetime.datetime.now() + datetime.timedelta(
+            seconds=settings.NOTIFICATION_RECHECK_SECONDS + 1)
+        self.run_and_send(later)
+        # The Job isn't checked again until it's booked against
+        Job.objects.filter(pk=job.pk).update(status=Job.LIVE_STATUS)
+        self.assertEquals(0, self.run_and_send(
+            later + datetime.timedelta(seconds=1))['job_over_hours'])
+
+    def testJobBookedBeforeWatermarkRechecked(self):
+        self.book_hours(create_job(u'Over'), Decimal(10), Decimal(12))
+        # Hours booked in a transaction which committed after the rule
+        # last checked up to when they were booked.
+        NotificationWatermark.objects.filter(rule='job_over_hours').update(
+            checked_until=datetime.datetime.now())
+        self.assertEquals(1, self.run_and_send()['job_over_hours'])
+        self.assertEquals(0, self.run_and_send()['job_over_hours'])
+
+    def testJobMissedEndDate(self):
+        job = create_job(u'Late', end_date=self.today)
+        create_job(u'Not late', end_date=self.today + datetime.timedelta(days=2))
+        tomorrow = self.now + datetime.timedelta(days=1)
+        self.assertEquals(1, self.run_and_send(tomorrow)['job_missed_end_date'])
+        self.assertEquals([[u'tm@tm.com']], self.recipients())
+        self.assertTrue(Job.objects.get(pk=job.pk).missed_end_date)
+        self.assertEquals(0, self.run_and_send(
+            tomorrow + datetime.timedelta(days=1))['job_missed_end_date'])
+
+    def testIncompleteTimesheet(self):
+        next_week = self.now + datetime.timedelta(weeks=1)
+        self.assertEquals(2,
+            self.run_and_send(next_week)['incomplete_timesheet'])
+        self.assertEquals([[u'tm@tm.com'], [u'tu@tu.com']],
+                          sorted(self.recipients()))
+        self.assertTrue('no Timesheet' in mail.outbox[0].body)
+        # The week has been checked
+        self.assertEquals(0, self.run_and_send(
+            next_week + datetime.timedelta(days=1))['incomplete_timesheet'])
+
+    def testExpenseOverLimit(self):
+        expense_type = ExpenseType.objects.create(name=u'Travel',
+                                                  limit=Decimal(50))
+        timesheet = Timesheet.objects.create(user=self.user,
+            week_commencing=datetime.date(2007, 7, 23))
+        job = create_job(u'Job')
+        for amount in (Decimal(60), Decimal(40)):
+            Expense.objects.create(timesheet=timesheet, user=self.user,
+                job=job, type=expense_type, date=timesheet.week_commencing,
+                amount=amount)
+        self.assertEquals(1, self.run_and_send()['expense_over_limit'])
+        self.assertEquals([[u'tm@tm.com']], self.recipients())
+        self.assertEquals(0, self.run_and_send()['expense_over_limit'])
+
+    def testExpenseAddedBeforeWatermarkRechecked(self):
+        expense_type = ExpenseType.objects.create(name=u'Travel',
+                                                  limit=Decimal(50))
+        timesheet = Timesheet.objects.create(user=self.user,
+            week_commencing=datetime.date(2007, 7, 23))
+        expense = Expense.objects.create(timesheet=timesheet, user=self.user,
+            job=create_job(u'Job'), type=expense_type,
+            date=timesheet.week_commencing, amount=Decimal(60))
+        # An Expense added in a transaction which committed after one
+        # which added a later Expense had been checked.
+        NotificationWatermark.objects.filter(rule='expense_over_limit') \
+            .update(last_id=expense.pk)
+        self.assertEquals(1, self.run_and_send()['expense_over_limit'])
+        self.assertTrue(Expense.objects.get(pk=expense.pk).over_limit)
+        self.assertEquals(0, self.run_and_send()['expense_over_limit'])
+
+    def testActivityMissedDueDate(self):
+        self.create_activity(assigned_to=self.user, due_date=self.today)
+        self.create_activity(assigned_to=self.user, due_date=self.today,
+                             completed=True)
+        tomorrow = self.now + datetime.timedelta(days=1)
+        self.assertEquals(1,
+            self.run_and_send(tomorrow)['activity_missed_due_date'])
+        self.assertTrue([u'tu@tu.com'] in self.recipients())
+
+    def testActivityAssigned(self):
+        activity = self.create_activity(assigned_to=self.user)
+        self.create_activity(contact_id=1)
+        self.assertEquals(2, self.run_and_send()['activity_assigned'])
+        self.assertEquals([[u'info@generitech.co.uk'], [u'tu@tu.com']],
+                          sorted(self.recipients()))
+
+        # Saving without reassigning doesn't notify again
+        activity.description = u'Call the client again'
+        activity.save()
+        self.assertEquals(0, self.run_and_send()['activity_assigned'])
+        activity.assigned_to = self.manager
+        activity.save()
+        self.assertEquals(1, self.run_and_send()['activity_assigned'])
+
+    def testDisabledRulesMoveOn(self):
+        email_options.activity_user_assigned = False
+        email_options.activity_contact_assigned = False
+        self.create_activity(assigned_to=self.user)
+        later = datetime.datetime.now() + datetime.timedelta(
+            seconds=settings.NOTIFICATION_RECHECK_SECONDS + 1)
+        self.assertEquals(0, self.run_and_send(later)['activity_assigned'])
+        email_options.activity_user_assigned = True
+        self.assertEquals(0, self.run_and_send(
+            later + datetime.timedelta(seconds=1))['activity_assigned'])
+        self.assertEquals([], mail.outbox)
+
+    def testActivityAssignedBeforeWatermarkRechecked(self):
+        activity = self.create_activity(assigned_to=self.user)
+        # Assigned in a transaction which committed after the rule last
+        # checked up to when it was assigned.
+        NotificationWatermark.objects.filter(rule='activity_assigned').update(
+            checked_until=datetime.datetime.now())
+        self.assertEquals(1, self.run_and_send()['activity_assigned'])
+        self.assertTrue(
+            Activity.objects.get(pk=activity.pk).assignment_notified)
+        self.assertEquals(0, self.run_and_send()['activity_assigned'])
+
+    def testSendOutboxInBatches(self):
+        for i in xrange(3):
+            self.create_activity(assigned_to=self.user)
+        run_notifications()
+        self.assertEquals((2, 0), send_outbox_emails('test', batch_size=2))
+        self.assertEquals((1, 0), send_outbox_emails('test', batch_size=2))
+        self.assertEquals((0, 0), send_outbox_emails('test', batch_size=2))
+        self.assertEquals(3, len(mail.outbox))
+        self.assertEquals(0, OutboxEmail.objects.filter(
+            sent_at__isnull=True).count())
+
+    def testClaimedEmailsNotSentByOtherWorkers(self):
+        self.create_activity(assigned_to=self.user)
+        run_notifications()
+        OutboxEmail.objects.update(worker='other')
+        self.assertEquals((0, 0), send_outbox_emails('test'))
+        self.assertEquals([], mail.outbox)
+
+    def testStaleClaimsReclaimed(self):
+        self.create_activity(assigned_to=self.user)
+        run_notifications()
+        OutboxEmail.objects.update(worker='other',
+            claimed_at=datetime.datetime.now() - datetime.timedelta(
+                seconds=settings.OUTBOX_CLAIM_TIMEOUT + 1))
+        self.assertEquals((1, 0), send_outbox_emails('test'))
+        self.assertEquals(1, len(mail.outbox))
+
+    def testEmailsReleasedWhenConnectionFails(self):
+        self.create_activity(assigned_to=self.user)
+        run_notifications()
+        old_backend = settings.EMAIL_BACKEND
+        settings.EMAIL_BACKEND = '%s.UnavailableEmailBackend' % __name__
+        try:
+            self.assertEquals((0, 1), send_outbox_emails('test'))
+        finally:
+            settings.EMAIL_BACKEND = old_backend
+        email = OutboxEmail.objects.get()
+        self.assertEquals(('', 1, u'Connection refused'),
+                          (email.worker, email.attempts, email.error))
+        self.assertEquals((1, 0), send_outbox_emails('test'))
+
+    def testReclaimedEmailsNotSent(self):
+        for i in xrange(2):
+            self.create_activity(assigned_to=self.user)
+        run_notifications()
+        old_backend = settings.EMAIL_BACKEND
+        settings.EMAIL_BACKEND = '%s.SlowEmailBackend' % __name__
+        try:
+            self.assertEquals((1, 0), send_outbox_emails('test'))
+        finally:
+            settings.EMAIL_BACKEND = old_backend
+        self.assertEquals(1, len(mail.outbox))
+        reclaimed = OutboxEmail.objects.get(sent_at__isnull=True)
+        self.assertEquals((u'other', 0),
+                          (reclaimed.worker, reclaimed.attempts))
@@ -0,0 +1,214 @@
+import os
+import random
+import shutil
+import tempfile
+import threading
+from decimal import Decimal
+
+from django.core.management.color import no_style
+from django.db import connection
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.test import TestCase
+
+from djangoffice.models import (Invoice, Job, NumberAllocator, NumberRange,
+    NumberSequence)
+from timesheettest import create_job
+
+def legacy_next_free_number(model):
+    """
+    The self-join lookup the allocator replaced.
+    """
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    cursor.execute("""
+    SELECT t1.number + 1
+    FROM %(table)s AS t1
+    LEFT JOIN %(table)s AS t2
+        ON t2.number = t1.number + 1
+    WHERE t2.number IS NULL
+    ORDER BY t1.number LIMIT 1""" % {'table': qn(model._meta.db_table)})
+    result = cursor.fetchall()
+    return result and result[0][0] or 1
+
+class NumberAllocatorTest(TestCase):
+    """
+    Tests for allocation of Job and Invoice numbers.
+    """
+    fixtures = ['initial_test_data']
+
+    def setUp(self):
+        self.job = create_job(u'Test Job')
+
+    def create_invoice(self, number):
+        return Invoice.objects.create(job=self.job, number=number,
+            type=Invoice.WHOLE_JOB_TYPE, amount_invoiced=Decimal(0))
+
+    def testFillsGapsLikeSelfJoin(self):
+        random.seed(1)
+        invoices = {}
+        for i in xrange(200):
+            if invoices and random.random() < 0.3:
+                number = random.choice(invoices.keys())
+                invoices.pop(number).delete()
+            elif random.random() < 0.2:
+                number = random.randint(1, 60)
+                if number not in invoices:
+                    invoices[number] = self.create_invoice(number)
+            else:
+                expected = legacy_next_free_number(Invoice)
+                self.assertEquals(expected,
+                                  Invoice.objects.get_next_free_number())
+                number = NumberAllocator(Invoice).allocate()[0]
+                self.assertEquals(expected, number)
+                invoices[number] = self.create_invoice(number)
+
+    def testBlock(self):
+        for number in (1, 2, 4, 7):
+            self.create_invoice(number)
+        self.assertEquals([3, 5, 6, 8, 9], NumberAllocator(Invoice).allocate(5))
+        self.assertEquals([10], NumberAllocator(Invoice).allocate())
+
+    def testClaimAndRelease(self):
+        allocator = NumberAllocator(Invoice)
+        self.assertEquals([1], allocator.allocate())
+        self.create_invoice(1)
+        allocator.claim(5)
+        self.create_invoice(5)
+        self.assertEquals([2, 3, 4, 6], allocator.allocate(4))
+        # Changing a number frees the old one
+        invoice = self.create_invoice(10)
+        invoice.number = 11
+        invoice.save()
+        self.assertEquals([7, 8, 9, 10, 12], allocator.allocate(5))
+        # Numbers below the lowest in use aren't reused
+        Invoice.objects.get(number=1).delete()
+        Invoice.objects.get(number=11).delete()
+        self.assertEquals(11, Invoice.objects.get_next_free_number())
+        Invoice.objects.all().delete()
+        self.assertEquals(1, Invoice.objects.get_next_free_number())
+
+    def testNextFreeNumberDoesNotCreateSequence(self):
+        for number in (1, 2, 4):
+            self.create_invoice(number)
+        NumberAllocator(Invoice).reset()
+        self.assertEquals(3, Invoice.objects.get_next_free_number())
+        self.assertEquals(0, NumberSequence.objects.filter(
+            name=Invoice._meta.db_table).count())
+        Invoice.objects.all().delete()
+        NumberAllocator(Invoice).reset()
+        self.assertEquals(1, Invoice.objects.get_next_free_number())
+
+    def testJobNumbers(self):
+        expected = legacy_next_free_number(Job)
+        self.assertEquals(expected, create_job(u'Another Job').number)
+        self.assertEquals(
+            [(Job._meta.db_table, expected + 1, None)],
+            list(NumberRange.objects.values_list('sequence', 'first_number',
+                                                 'last_number')))
+
+class RowLockingCursor(object):
+    """
+    Emulates PostgreSQL's row locking on top of a SQLite cursor in
+    autocommit mode - updating a ``NumberSequence`` row takes a lock on it
+    which is held until the transaction commits, while every statement
+    sees the latest committed data, as under READ COMMITTED.
+    """
+    def __init__(self, cursor, wrapper):
+        self.cursor = cursor
+        self.wrapper = wrapper
+
+    def execute(self, query, params=()):
+        if query.strip().startswith('UPDATE') and \
+           NumberSequence._meta.db_table in query:
+            self.wrapper.lock_row(params[-1])
+        return self.cursor.execute(query, params)
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+class RowLockingDatabaseWrapper(DatabaseWrapper):
+    row_locks = {}
+    row_locks_lock = threading.Lock()
+
+    def __init__(self, *args, **kwargs):
+        super(RowLockingDatabaseWrapper, self).__init__(*args, **kwargs)
+        self.held_locks = []
+
+    def lock_row(self, key):
+        self.row_locks_lock.acquire()
+        try:
+            lock = self.row_locks.setdefault(key, threading.Lock())
+        finally:
+            self.row_locks_lock.release()
+        if lock not in self.held_locks:
+            lock.acquire()
+            self.held_locks.append(lock)
+
+    def _cursor(self):
+        cursor = super(RowLockingDatabaseWrapper, self)._cursor()
+        self.connection.isolation_level = None
+        return RowLockingCursor(cursor, self)
+
+    def _commit(self):
+        while self.held_locks:
+            self.held_locks.pop().release()
+
+class ConcurrentAllocationTest(TestCase):
+    """
+    Tests for allocation of numbers by concurrent transactions, each
+    using its own connection to a database file.
+    """
+    THREADS = 8
+    ALLOCATIONS = 10
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings_dict = dict(connection.settings_dict,
+            NAME=os.path.join(self.directory, 'numbers.db'),
+            OPTIONS={'timeout': 30})
+        wrapper = DatabaseWrapper(self.settings_dict)
+        cursor = wrapper.cursor()
+        for model in (NumberSequence, NumberRange, Invoice):
+            sql, references = wrapper.creation.sql_create_model(model,
+                no_style(), set())
+            for statement in sql:
+                cursor.execute(statement)
+        cursor.execute('INSERT INTO %s (job_id, number, date, type, '
+                       'amount_invoiced, comment, pdf) VALUES '
+                       '(1, 3, %%s, %%s, 0, %%s, %%s)'
+                       % Invoice._meta.db_table, ['2007-01-01', 'W', '', ''])
+        wrapper._commit()
+        wrapper.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def allocate_concurrently(self, wrapper_class):
+        numbers = []
+        errors = []
+        def allocate():
+            wrapper = wrapper_class(self.settings_dict)
+            try:
+                allocator = NumberAllocator(Invoice, wrapper)
+                for i in xrange(self.ALLOCATIONS):
+                    numbers.extend(allocator.allocate(random.randint(1, 3)))
+                    wrapper._commit()
+            except Exception, e:
+                errors.append(e)
+            wrapper.close()
+        threads = [threading.Thread(target=allocate) \
+                   for i in xrange(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals([], errors)
+        numbers.sort()
+        # Every number from the first gap upwards was handed out once
+        self.assertEquals(range(4, 4 + len(numbers)), numbers)
+
+    def testSQLite(self):
+        self.allocate_concurrently(DatabaseWrapper)
+
+    def testRowLocking(self):
+        self.allocate_concurrently(RowLockingDatabaseWrapper)
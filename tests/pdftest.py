@@ -0,0 +1,81 @@
+import shutil
+import tempfile
+from decimal import Decimal
+
+from django.core.files.storage import FileSystemStorage
+from django.test import TestCase
+from reportlab import rl_config
+
+from djangoffice.models import Invoice
+from djangoffice.pdf import render_invoice, render_invoices
+from djangoffice.utils.invoice import InvoiceBatch
+from invoicebatchtest import INVOICE_DATE, InvoiceFixtureMixin
+
+class InvoicePDFTest(InvoiceFixtureMixin, TestCase):
+    """
+    Tests for rendering of Invoice PDFs.
+    """
+    def setUp(self):
+        InvoiceFixtureMixin.setUp(self)
+        self.pdf_field = Invoice._meta.get_field('pdf')
+        self.old_storage = self.pdf_field.storage
+        self.media_root = tempfile.mkdtemp()
+        self.pdf_field.storage = FileSystemStorage(self.media_root)
+
+    def tearDown(self):
+        self.pdf_field.storage = self.old_storage
+        shutil.rmtree(self.media_root)
+
+    def get_data(self, rows):
+        return {
+            'company_name': u'Company & Co.', 'number': u'00001',
+            'date': INVOICE_DATE, 'job': u'00001 - Job', 'client': u'Client',
+            'contact': u'Contact', 'currency_symbol': u'\xa3',
+            'start_period': None, 'end_period': None,
+            'by_task': [(u'Task %s' % i, Decimal(1), Decimal(10)) \
+                        for i in xrange(rows)],
+            'by_user': [(u'User <1>', [(u'Task', Decimal(1), Decimal(10))])],
+            'by_date': [(INVOICE_DATE, u'User', Decimal(1), Decimal(10))],
+            'total_hours': Decimal(rows), 'total_cost': Decimal(rows * 10),
+            'expenses_total': Decimal(0), 'amount': Decimal(rows * 10),
+        }
+
+    def testRenderInvoice(self):
+        content, pages = render_invoice(self.get_data(1))
+        self.assertTrue(content.startswith('%PDF'))
+        self.assertEquals(1, pages)
+        content, pages = render_invoice(self.get_data(200))
+        self.assertTrue(pages > 1)
+
+    def testMoneyFormatted(self):
+        data = self.get_data(1)
+        data['currency_symbol'] = u'$'
+        data['amount'] = Decimal('1234567.895')
+        # Uncompressed, so the PDF's text can be searched
+        old_compression = rl_config.pageCompression
+        rl_config.pageCompression = 0
+        try:
+            content, pages = render_invoice(data)
+        finally:
+            rl_config.pageCompression = old_compression
+        self.assertTrue('$1,234,567.90' in content)
+
+    def testRenderInvoices(self):
+        data = [self.get_data(i) for i in xrange(1, 5)]
+        in_process = render_invoices(data, processes=1)
+        self.assertEquals([pages for content, pages in in_process],
+                          [pages for content, pages in \
+                           render_invoices(data, processes=2)])
+
+    def testBatchPDFs(self):
+        self.create_entry(self.tasks[0], mon=Decimal(7), tue=Decimal(2))
+        self.create_expense(self.jobs[1], Decimal('20.00'))
+        batch = InvoiceBatch(self.jobs, Invoice.WHOLE_JOB_TYPE, INVOICE_DATE)
+        batch.run()
+        batch.render_pdfs(processes=2)
+        self.assertEquals(u'Rendering PDFs', batch.timings[-1][0])
+        for invoice in Invoice.objects.filter(pk__in=[invoice.pk for invoice \
+                                                      in batch.invoices]):
+            self.assertEquals(u'invoices/invoice%s.pdf' % invoice.formatted_number,
+                              invoice.pdf.name)
+            self.assertTrue(invoice.pdf.read().startswith('%PDF'))
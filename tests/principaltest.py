@@ -0,0 +1,85 @@
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.db import connection
+from django.test import TestCase
+
+from djangoffice.auth import (get_accessible_users, get_principal,
+    is_admin_or_manager, user_can_access_user)
+from djangoffice.menu import build_menu_items
+from djangoffice.models import UserProfile
+
+class PrincipalTest(TestCase):
+    """
+    Tests for role-based authorisation using Principals.
+    """
+    fixtures = ['initial_test_data']
+
+    def setUp(self):
+        self.user = User.objects.get(username='testuser')
+        self.manager = User.objects.get(username='testmanager')
+        self.pm = User.objects.create(username='testpm')
+        UserProfile.objects.create(user=self.pm, role=UserProfile.PM_ROLE)
+
+    def count_queries(self, func, *args):
+        old_debug = settings.DEBUG
+        settings.DEBUG = True
+        connection.queries = []
+        try:
+            result = func(*args)
+            return result, len(connection.queries)
+        finally:
+            settings.DEBUG = old_debug
+
+    def testAnonymous(self):
+        principal = get_principal(AnonymousUser())
+        self.assertEquals(None, principal.role)
+        self.assertFalse(is_admin_or_manager(AnonymousUser()))
+
+    def testAccessToUsers(self):
+        self.assertTrue(user_can_access_user(self.user, self.user))
+        self.assertFalse(user_can_access_user(self.user, self.manager))
+        self.assertFalse(user_can_access_user(self.pm, self.user))
+        self.pm.get_profile().managed_users.add(self.user)
+        pm = User.objects.get(pk=self.pm.pk)
+        self.assertTrue(user_can_access_user(pm, self.user))
+        self.assertEquals(set([self.pm.pk, self.user.pk]),
+            set(get_accessible_users(pm).values_list('pk', flat=True)))
+        # Managed Users are only loaded once
+        result, queries = self.count_queries(user_can_access_user, pm,
+                                             self.manager)
+        self.assertFalse(result)
+        self.assertEquals(0, queries)
+
+    def testMenuTestsPerformedOnce(self):
+        manager = User.objects.get(pk=self.manager.pk)
+        items, first_queries = self.count_queries(build_menu_items, manager,
+                                                  'manage')
+        items, queries = self.count_queries(build_menu_items, manager,
+                                            'invoices')
+        self.assertEquals(1, first_queries)
+        self.assertEquals(0, queries)
+
+class PrincipalMiddlewareTest(TestCase):
+    """
+    Tests for loading of the logged-in User's Principal.
+    """
+    fixtures = ['initial_test_data']
+
+    def testProfileLoadedOnce(self):
+        user = User.objects.get(username='testmanager')
+        user.set_password('testmanager')
+        user.save()
+        self.client.login(username='testmanager', password='testmanager')
+        profile_table = UserProfile._meta.db_table
+        old_debug = settings.DEBUG
+        settings.DEBUG = True
+        connection.queries = []
+        try:
+            response = self.client.get('/jobs/')
+            profile_queries = [query for query in connection.queries \
+                               if query['sql'].startswith(
+                                   'SELECT "%s"' % profile_table)]
+        finally:
+            settings.DEBUG = old_debug
+        self.assertEquals(200, response.status_code)
+        self.assertEquals(1, len(profile_queries))
@@ -0,0 +1,87 @@
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from djangoffice.utils.query_stats import (QueryTrace, fingerprint,
+    get_url_name, query_stats)
+
+class QueryStatsTest(TestCase):
+    """
+    Tests for recording the queries executed by each view.
+    """
+    fixtures = ['initial_test_data']
+
+    def setUp(self):
+        for username in ('admin', 'testuser'):
+            user = User.objects.get(username=username)
+            user.set_password(username)
+            user.save()
+        query_stats.clear()
+
+    def get_view_stats(self, name):
+        for view in query_stats.ranking():
+            if view.name == name:
+                return view
+
+    def testFingerprint(self):
+        self.assertEquals(
+            'SELECT "a" FROM "t" WHERE "t"."id" IN (...) AND "b" = ?',
+            fingerprint('SELECT "a" FROM "t"\n WHERE "t"."id" IN (%s, %s) '
+                        'AND "b" = \'it\'\'s\''))
+        self.assertEquals(fingerprint('SELECT 1 FROM t WHERE id = 10'),
+                          fingerprint('SELECT 2 FROM t WHERE id = 20'))
+
+    def testTrace(self):
+        trace = QueryTrace()
+        for params in ([1], [2], [1]):
+            trace.add('SELECT * FROM t WHERE id = %s', params, 0.001)
+        trace.add('SELECT * FROM u', [], 0.001)
+        self.assertEquals(4, trace.count)
+        self.assertEquals(1, trace.duplicates)
+        self.assertEquals({'SELECT * FROM t WHERE id = ?': 3},
+                          trace.repeated())
+
+    def testGetUrlName(self):
+        self.assertEquals('sql_report_detail',
+                          get_url_name('/sql_reports/1/'))
+        self.assertEquals(None, get_url_name('/nowhere/'))
+
+    def testRecordedByUrlName(self):
+        self.client.login(username='testuser', password='testuser')
+        for i in xrange(2):
+            self.client.get(reverse('sql_report_list'))
+        view = self.get_view_stats('sql_report_list')
+        self.assertEquals(2, view.request_count)
+        self.assertTrue(view.max_queries > 0)
+
+    def testTraceHeader(self):
+        self.client.login(username='testuser', password='testuser')
+        response = self.client.get(reverse('sql_report_list'),
+                                   HTTP_X_SQL_TRACE='1')
+        self.assertFalse(response.has_header('X-SQL-Queries'))
+        self.assertFalse('sql-trace' in response.content)
+
+        self.client.login(username='admin', password='admin')
+        response = self.client.get(reverse('sql_report_list'),
+                                   HTTP_X_SQL_TRACE='1')
+        self.assertTrue(int(response['X-SQL-Queries']) > 0)
+        self.assertTrue('SQL trace for GET /sql_reports/' in response.content)
+        self.assertTrue(response.content.index('sql-trace') < \
+                        response.content.lower().rindex('</body>'))
+
+    def testView(self):
+        self.client.login(username='testuser', password='testuser')
+        response = self.client.get(reverse('query_stats'))
+        self.assertEquals('permission_denied.html',
+                          response.template[0].name)
+
+        self.client.login(username='admin', password='admin')
+        self.client.get(reverse('sql_report_list'))
+        response = self.client.get(reverse('query_stats'))
+        self.assertEquals(200, response.status_code)
+        self.assertTrue('sql_report_list' in \
+                        [view.name for view in response.context['views']])
+
+        response = self.client.post(reverse('query_stats'), {'clear': '1'})
+        self.assertEquals(302, response.status_code)
+        self.assertEquals(None, self.get_view_stats('sql_report_list'))
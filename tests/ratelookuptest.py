@@ -0,0 +1,69 @@
+import datetime
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from djangoffice.models import UserRate
+from djangoffice.utils.rates import RateLookup
+
+class RateLookupTest(TestCase):
+    """
+    Tests for lookup of rates applicable on given dates.
+    """
+    fixtures = ['initial_test_data']
+
+    def setUp(self):
+        self.user = User.objects.get(username='testuser')
+        self.other_user = User.objects.get(username='testmanager')
+        self.rates = [self.create_rate(self.user, datetime.date(2007, month, 1),
+                                       editable=month != 1)
+                      for month in (1, 4, 7, 10)]
+        self.other_rate = self.create_rate(self.other_user,
+                                           datetime.date(2007, 1, 1))
+
+    def create_rate(self, user, effective_from, editable=True):
+        return UserRate.objects.create(user=user, effective_from=effective_from,
+            standard_rate=Decimal('10.00'), overtime_rate=Decimal('15.00'),
+            editable=editable)
+
+    def testApplicableRate(self):
+        lookup = RateLookup(UserRate, 'user')
+        get = lambda date: lookup.get_applicable_rate(self.user.pk, date)
+        self.assertEquals(None, get(datetime.date(2006, 12, 31)))
+        self.assertEquals(self.rates[0], get(datetime.date(2007, 1, 1)))
+        self.assertEquals(self.rates[0], get(datetime.date(2007, 3, 31)))
+        self.assertEquals(self.rates[1], get(datetime.date(2007, 4, 1)))
+        self.assertEquals(self.rates[1], get(datetime.date(2007, 4, 2)))
+        self.assertEquals(self.rates[0], get(datetime.date(2007, 2, 1)))
+        self.assertEquals(self.rates[3], get(datetime.date(2010, 1, 1)))
+        self.assertEquals(self.other_rate, lookup.get_applicable_rate(
+            self.other_user.pk, datetime.date(2007, 4, 2)))
+        self.assertEquals(None, lookup.get_applicable_rate(
+            0, datetime.date(2007, 4, 2)))
+
+    def testEditableRatesUsed(self):
+        lookup = RateLookup(UserRate, 'user')
+        for month in (2, 4, 5, 4):
+            lookup.get_applicable_rate(self.user.pk, datetime.date(2007, month, 1))
+        self.assertEquals([self.rates[1]], lookup.editable_rates_used)
+        lookup.reset()
+        self.assertEquals([], lookup.editable_rates_used)
+
+    def testRestricted(self):
+        lookup = RateLookup(UserRate, 'user', rated_ids=[self.user.pk],
+                            start_date=datetime.date(2007, 5, 1),
+                            end_date=datetime.date(2007, 7, 31))
+        dates, rates = lookup._lookup[self.user.pk]
+        self.assertEquals(self.rates[1:3], rates)
+        self.assertEquals([self.user.pk], lookup._lookup.keys())
+        self.assertEquals(self.rates[1], lookup.get_applicable_rate(
+            self.user.pk, datetime.date(2007, 5, 1)))
+        self.assertEquals(self.rates[2], lookup.get_applicable_rate(
+            self.user.pk, datetime.date(2007, 7, 31)))
+        # Dates outside the window can't be looked up, even when they
+        # fall in the last interval hit.
+        self.assertRaises(ValueError, lookup.get_applicable_rate,
+                          self.user.pk, datetime.date(2007, 8, 1))
+        self.assertRaises(ValueError, lookup.get_applicable_rate,
+                          self.user.pk, datetime.date(2007, 4, 30))
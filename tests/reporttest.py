@@ -0,0 +1,310 @@
+import datetime
+import shutil
+import tempfile
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import TestCase
+
+from djangoffice.models import (Client, Expense, ExpenseType, Invoice, Job,
+    Task, TaskType, Timesheet, UserRate)
+from djangoffice.utils.reports import units_sql
+from djangoffice.utils.sql_reports import execution_slots
+from timesheettest import QueryCountMixin, create_entry, create_job
+
+WEEK_COMMENCING = datetime.date(2007, 7, 23)
+
+class JobStatusReportTest(QueryCountMixin, TestCase):
+    """
+    Tests for the Job Status report.
+    """
+    fixtures = ['initial_test_data']
+
+    def setUp(self):
+        self.user = User.objects.get(username='testuser')
+        self.manager = User.objects.get(username='testmanager')
+        self.manager.set_password('testmanager')
+        self.manager.save()
+        self.client.login(username='testmanager', password='testmanager')
+        UserRate.objects.create(user=self.user,
+            effective_from=datetime.date(2007, 1, 1),
+            standard_rate=Decimal('10.00'), overtime_rate=Decimal('15.00'))
+        self.timesheet = Timesheet.objects.create(user=self.user,
+            week_commencing=WEEK_COMMENCING)
+        self.design = TaskType.objects.create(name=u'Design')
+        self.build = TaskType.objects.create(name=u'Build')
+        self.url = reverse('job_status_report')
+
+    def add_job(self, name, status=Job.LIVE_STATUS):
+        job = create_job(name, status=status)
+        design = Task.objects.create(job=job, task_type=self.design,
+                                     estimate_hours=Decimal(10))
+        build = Task.objects.create(job=job, task_type=self.build,
+                                    estimate_hours=Decimal(20))
+        create_entry(self.timesheet, design, mon=Decimal(4),
+                     overtime=Decimal(2))
+        return job, design, build
+
+    def testReport(self):
+        job, design, build = self.add_job(u'Live Job')
+        build.remaining = Decimal(25)
+        build.remaining_overridden = True
+        build.save()
+        self.add_job(u'Completed Job', Job.COMPLETED_STATUS)
+
+        response = self.client.get(self.url)
+        self.assertEquals(200, response.status_code)
+        job_statuses = response.context['job_statuses']
+        self.assertEquals([job.pk], [j.id for j in job_statuses])
+        self.assertEquals([u'Build', u'Design'],
+                          [t.task_type_name for t in job_statuses[0].tasks])
+        build_status, design_status = job_statuses[0].tasks
+        self.assertEquals((Decimal(10), Decimal(6), Decimal(4), Decimal(70)),
+            (design_status.estimate_hours, design_status.booked_hours,
+             design_status.remaining_hours, design_status.booked_cost))
+        self.assertEquals((Decimal(20), Decimal(0), Decimal(25), Decimal(5)),
+            (build_status.estimate_hours, build_status.booked_hours,
+             build_status.remaining_hours, build_status.variance))
+
+        totals = response.context['totals']
+        self.assertEquals((Decimal(30), Decimal(6), Decimal(29), Decimal(70)),
+            (totals.estimate_hours, totals.booked_hours,
+             totals.remaining_hours, totals.booked_cost))
+
+    def testQueryCountIndependentOfJobCount(self):
+        self.add_job(u'Job 0')
+        # Settings are cached once they've been loaded
+        self.client.get(self.url)
+        response, single_job_queries = self.get_with_query_count(self.url)
+        for i in xrange(1, 6):
+            self.add_job(u'Job %s' % i)
+        response, many_job_queries = self.get_with_query_count(self.url)
+        self.assertEquals(200, response.status_code)
+        self.assertEquals(6, len(response.context['job_statuses']))
+        self.assertEquals(single_job_queries, many_job_queries)
+
+    def testUsersDenied(self):
+        self.user.set_password('testuser')
+        self.user.save()
+        self.client.login(username='testuser', password='testuser')
+        response = self.client.get(self.url)
+        self.assertEquals('permission_denied.html',
+                          response.template[0].name)
+
+    def testUnitsCastPerDatabase(self):
+        self.assertEquals('CAST(ROUND(hours * 100) AS INTEGER)',
+                          units_sql('hours', connection))
+        class MySQLConnection:
+            settings_dict = {'ENGINE': 'django.db.backends.mysql'}
+        self.assertEquals('CAST(ROUND(hours * 100) AS SIGNED)',
+                          units_sql('hours', MySQLConnection()))
+
+class UninvoicedWorkReportTest(QueryCountMixin, TestCase):
+    """
+    Tests for the Uninvoiced Work report.
+    """
+    fixtures = ['initial_test_data']
+
+    def setUp(self):
+        self.user = User.objects.get(username='testuser')
+        self.manager = User.objects.get(username='testmanager')
+        self.manager.set_password('testmanager')
+        self.manager.save()
+        self.client.login(username='testmanager', password='testmanager')
+        self.rate = UserRate.objects.create(user=self.user,
+            effective_from=datetime.date(2007, 1, 1),
+            standard_rate=Decimal('10.00'), overtime_rate=Decimal('15.00'))
+        self.timesheet = Timesheet.objects.create(user=self.user,
+            week_commencing=WEEK_COMMENCING)
+        self.expense_type = ExpenseType.objects.create(name=u'Travel')
+        self.task_type = TaskType.objects.create(name=u'Design')
+        self.url = reverse('uninvoiced_work_report')
+
+    def add_job(self, name, **kwargs):
+        job = create_job(name, **kwargs)
+        task = Task.objects.create(job=job, task_type=self.task_type,
+                                   estimate_hours=Decimal(40))
+        create_entry(self.timesheet, task, mon=Decimal(4),
+                     overtime=Decimal(2), approved_by=self.manager)
+        Expense.objects.create(timesheet=self.timesheet, user=self.user,
+            job=job, type=self.expense_type, date=WEEK_COMMENCING,
+            amount=Decimal('12.50'), approved_by=self.manager)
+        return job, task
+
+    def testReport(self):
+        other_client = Client.objects.create(name=u'AAA Client')
+        job, task = self.add_job(u'Job')
+        other_job, other_task = self.add_job(u'Other Job',
+                                             client_id=other_client.pk)
+        # Unapproved and invoiced items are excluded
+        create_entry(self.timesheet, task, tue=Decimal(8))
+        invoice = Invoice.objects.create(job=job, number=1,
+            type=Invoice.WHOLE_JOB_TYPE, amount_invoiced=Decimal(0))
+        Expense.objects.create(timesheet=self.timesheet, user=self.user,
+            job=job, type=self.expense_type, date=WEEK_COMMENCING,
+            amount=Decimal('100.00'), approved_by=self.manager,
+            invoice=invoice)
+        # Jobs with nothing to invoice are left out
+        create_job(u'Idle Job')
+
+        response = self.client.get(self.url)
+        self.assertEquals(200, response.status_code)
+        clients = response.context['clients']
+        self.assertEquals([other_client.pk, 1],
+                          [c.client.pk for c in clients])
+        result = clients[1].results[0]
+        self.assertEquals(job.pk, result.job.pk)
+        self.assertEquals((1, 1), (result.time_entry_count,
+                                   result.expense_count))
+        self.assertEquals((Decimal(6), Decimal(70), Decimal('82.50')),
+            (result.calculation.total_hours, result.calculation.total_cost,
+             result.amount))
+        self.assertEquals([(u'GBP', Decimal('165.00'))],
+                          response.context['totals'])
+
+    def testMissingRate(self):
+        job, task = self.add_job(u'Job')
+        self.rate.delete()
+        response = self.client.get(self.url)
+        result = response.context['clients'][0].results[0]
+        self.assertEquals(None, result.calculation)
+        self.assertTrue(result.error)
+        self.assertEquals([], response.context['totals'])
+
+    def testQueryCountIndependentOfJobCount(self):
+        self.add_job(u'Job 0')
+        # Settings are cached once they've been loaded
+        self.client.get(self.url)
+        response, single_job_queries = self.get_with_query_count(self.url)
+        for i in xrange(1, 6):
+            self.add_job(u'Job %s' % i)
+        response, many_job_queries = self.get_with_query_count(self.url)
+        self.assertEquals(200, response.status_code)
+        self.assertEquals(6, len(response.context['clients'][0].results))
+        self.assertEquals(single_job_queries, many_job_queries)
+
+class TimesheetStatusReportTest(QueryCountMixin, TestCase):
+    """
+    Tests for the Timesheet Status report.
+    """
+    fixtures = ['initial_test_data']
+
+    def setUp(self):
+        self.user = User.objects.get(username='testuser')
+        self.manager = User.objects.get(username='testmanager')
+        self.manager.set_password('testmanager')
+        self.manager.save()
+        self.client.login(username='testmanager', password='testmanager')
+        Timesheet.options.hours_per_full_week = Decimal('37.50')
+        self.task = Task.objects.create(job=create_job(u'Job'),
+            task_type=TaskType.objects.create(name=u'Design'),
+            estimate_hours=Decimal(100))
+        self.url = reverse('timesheet_status_report')
+        self.old_max_rows = settings.SQL_REPORT_MAX_ROWS
+        self.old_queue_timeout = settings.SQL_REPORT_QUEUE_TIMEOUT
+        self.old_lock_dir = execution_slots.directory
+        execution_slots.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        settings.SQL_REPORT_MAX_ROWS = self.old_max_rows
+        settings.SQL_REPORT_QUEUE_TIMEOUT = self.old_queue_timeout
+        shutil.rmtree(execution_slots.directory)
+        execution_slots.directory = self.old_lock_dir
+
+    def book(self, user, week_commencing, **hours):
+        timesheet, created = Timesheet.objects.get_or_create(user=user,
+            week_commencing=week_commencing)
+        create_entry(timesheet, self.task, **hours)
+
+    def get_report(self, start_date, end_date, format=None):
+        url = '%s?start_date=%s&end_date=%s' % (self.url,
+            start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+        if format is not None:
+            url += '&format=%s' % format
+        return self.client.get(url)
+
+    def testForm(self):
+        response = self.client.get(self.url)
+        self.assertEquals(200, response.status_code)
+        self.assertEquals('reports/timesheet_status_report.html',
+                          response.template[0].name)
+
+    def testInvalidRange(self):
+        response = self.get_report(WEEK_COMMENCING,
+            WEEK_COMMENCING - datetime.timedelta(weeks=1))
+        self.assertTrue(response.context['form'].errors['end_date'])
+        response = self.get_report(WEEK_COMMENCING,
+            WEEK_COMMENCING + datetime.timedelta(weeks=260))
+        self.assertTrue(response.context['form'].errors['end_date'])
+
+    def testCSV(self):
+        next_week = WEEK_COMMENCING + datetime.timedelta(weeks=1)
+        week_after = WEEK_COMMENCING + datetime.timedelta(weeks=2)
+        # A full week across two entries, an incomplete week and a week
+        # without a Timesheet; the range is given as mid-week dates.
+        self.book(self.user, WEEK_COMMENCING, mon=Decimal(20))
+        self.book(self.user, WEEK_COMMENCING, tue=Decimal('17.50'))
+        self.book(self.user, next_week, mon=Decimal('7.25'))
+        self.book(self.manager, WEEK_COMMENCING, mon=Decimal(40))
+        self.book(self.manager, next_week, mon=Decimal(40))
+        self.book(self.manager, week_after, mon=Decimal(40))
+        response = self.get_report(WEEK_COMMENCING + datetime.timedelta(days=2),
+                                   week_after + datetime.timedelta(days=3),
+                                   'csv')
+        self.assertEquals(200, response.status_code)
+        self.assertEquals('text/csv', response['Content-Type'])
+        self.assertEquals([
+            'Username,First Name,Last Name,Week Commencing,Hours,Status',
+            'testuser,Test,User,2007-07-30,7.25,Incomplete',
+            'testuser,Test,User,2007-08-06,0.00,Missing',
+        ], [line for line in response.content.splitlines() \
+            if not line.startswith('admin') \
+               and not line.startswith('testmanager')])
+
+    def testHTML(self):
+        self.book(self.user, WEEK_COMMENCING, mon=Decimal(8))
+        response = self.get_report(WEEK_COMMENCING, WEEK_COMMENCING)
+        self.assertEquals(200, response.status_code)
+        content = response.content
+        self.assertTrue('<td>testuser</td>' in content)
+        self.assertTrue('<td>8.00</td><td>Incomplete</td>' in content)
+        self.assertTrue(content.rstrip().endswith('</html>'))
+
+    def testMaxRows(self):
+        settings.SQL_REPORT_MAX_ROWS = 1
+        content = self.get_report(WEEK_COMMENCING, WEEK_COMMENCING).content
+        self.assertEquals(1, content.count('>Missing</td>'))
+        self.assertTrue('Only the first 1 rows are displayed.' in content)
+
+    def testBusy(self):
+        settings.SQL_REPORT_QUEUE_TIMEOUT = 0
+        slots = [execution_slots.acquire() \
+                 for i in xrange(execution_slots.count)]
+        try:
+            response = self.get_report(WEEK_COMMENCING, WEEK_COMMENCING)
+            self.assertTrue('Too many reports are being executed'
+                            in response.content)
+        finally:
+            for slot in slots:
+                slot.release()
+        # Slots are released once results have been streamed
+        for i in xrange(execution_slots.count + 1):
+            content = self.get_report(WEEK_COMMENCING, WEEK_COMMENCING).content
+            self.assertTrue('Missing' in content)
+
+    def testInactiveUsersExcluded(self):
+        self.user.is_active = False
+        self.user.save()
+        response = self.get_report(WEEK_COMMENCING, WEEK_COMMENCING, 'csv')
+        self.assertFalse('testuser' in response.content)
+
+    def testUsersDenied(self):
+        self.user.set_password('testuser')
+        self.user.save()
+        self.client.login(username='testuser', password='testuser')
+        response = self.client.get(self.url)
+        self.assertEquals('permission_denied.html',
+                          response.template[0].name)
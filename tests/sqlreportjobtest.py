@@ -0,0 +1,178 @@
+import csv
+import datetime
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+
+from djangoffice.models import SQLReport, SQLReportJob
+from djangoffice.utils.sql_reports import (StoredResults, StoredResultsWriter,
+    run_sql_report_job)
+
+class SQLReportJobTest(TestCase):
+    """
+    Tests for background execution of SQL Reports.
+    """
+    fixtures = ['initial_test_data']
+
+    def setUp(self):
+        self.old_results_dir = settings.SQL_REPORT_JOB_RESULTS_DIR
+        settings.SQL_REPORT_JOB_RESULTS_DIR = tempfile.mkdtemp()
+        self.user = User.objects.get(username='testuser')
+        self.sql_report = SQLReport.objects.create(name=u'Users', access='U',
+            query=u"SELECT username AS 'Username' FROM auth_user "
+                  u"WHERE username <> '::exclude' ORDER BY id")
+
+    def tearDown(self):
+        shutil.rmtree(settings.SQL_REPORT_JOB_RESULTS_DIR)
+        settings.SQL_REPORT_JOB_RESULTS_DIR = self.old_results_dir
+
+    def create_job(self, sql_report=None, **params):
+        job = SQLReportJob(sql_report=sql_report or self.sql_report,
+                           user=self.user)
+        job.set_params(params)
+        job.save()
+        return job
+
+    def testClaimNext(self):
+        first = self.create_job(exclude=u'admin')
+        second = self.create_job(exclude=u'testuser')
+        job = SQLReportJob.objects.claim_next('worker1')
+        self.assertEquals(first.pk, job.pk)
+        self.assertEquals(SQLReportJob.RUNNING_STATUS, job.status)
+        self.assertEquals(u'worker1', job.worker)
+        self.assertNotEquals(None, job.started_at)
+        self.assertEquals(second.pk,
+                          SQLReportJob.objects.claim_next('worker2').pk)
+        self.assertEquals(None, SQLReportJob.objects.claim_next('worker1'))
+
+    def testRun(self):
+        job = run_sql_report_job(self.create_job(exclude=u'admin'))
+        self.assertEquals(SQLReportJob.COMPLETE_STATUS, job.status)
+        self.assertEquals(2, job.row_count)
+        self.assertFalse(job.truncated)
+        results = StoredResults(job.get_results_path())
+        try:
+            self.assertEquals([u'Username'], results.headings)
+            self.assertEquals([(u'testuser',), (u'testmanager',)],
+                              results.get_page(1))
+        finally:
+            results.close()
+
+    def testFailure(self):
+        sql_report = SQLReport.objects.create(name=u'Broken', access='U',
+            query=u'SELECT missing FROM auth_user')
+        job = run_sql_report_job(self.create_job(sql_report))
+        self.assertEquals(SQLReportJob.FAILED_STATUS, job.status)
+        self.assertTrue(u'missing' in job.error)
+        self.assertFalse(os.path.exists(job.get_results_path()))
+
+    def testResultsWriteFailure(self):
+        job = self.create_job(exclude=u'admin')
+        # A directory is in the way of the temporary results file
+        os.mkdir('%s.tmp' % job.get_results_path())
+        job = run_sql_report_job(job)
+        self.assertEquals(SQLReportJob.FAILED_STATUS, job.status)
+        self.assertNotEquals(u'', job.error)
+        self.assertEquals(SQLReportJob.FAILED_STATUS,
+                          SQLReportJob.objects.get(pk=job.pk).status)
+
+    def testAbandonedJobsFailed(self):
+        self.create_job(exclude=u'admin')
+        job = SQLReportJob.objects.claim_next('worker1')
+        self.assertEquals(0, SQLReportJob.objects.fail_abandoned())
+        SQLReportJob.objects.filter(pk=job.pk).update(
+            started_at=job.started_at - datetime.timedelta(
+                seconds=settings.SQL_REPORT_JOB_TIMEOUT + 1))
+        self.assertEquals(1, SQLReportJob.objects.fail_abandoned())
+        abandoned = SQLReportJob.objects.get(pk=job.pk)
+        self.assertEquals(SQLReportJob.FAILED_STATUS, abandoned.status)
+        self.assertNotEquals(None, abandoned.completed_at)
+        # The worker finishing late doesn't overwrite the failure
+        run_sql_report_job(job)
+        self.assertEquals(SQLReportJob.FAILED_STATUS,
+                          SQLReportJob.objects.get(pk=job.pk).status)
+
+    def testPages(self):
+        path = os.path.join(settings.SQL_REPORT_JOB_RESULTS_DIR, 'pages')
+        writer = StoredResultsWriter(path, [u'Number'], 5, page_size=2)
+        writer.write_rows([(1,), (2,), (3,)])
+        writer.write_rows([(4,), (5,)])
+        writer.finish(True)
+        results = StoredResults(path)
+        self.assertEquals(5, results.row_count)
+        self.assertTrue(results.truncated)
+        self.assertEquals(3, results.page_count)
+        self.assertEquals([(3,), (4,)], results.get_page(2))
+        self.assertEquals([(5,)], results.get_page(3))
+        self.assertRaises(IndexError, results.get_page, 4)
+        stream = results.stream()
+        self.assertEquals(range(1, 6), [row[0] for row in stream])
+        self.assertEquals(5, stream.row_count)
+
+    def testExpiry(self):
+        job = run_sql_report_job(self.create_job(exclude=u'admin'))
+        self.assertEquals([], list(SQLReportJob.objects.expired()))
+        job.completed_at -= datetime.timedelta(
+            seconds=settings.SQL_REPORT_JOB_LIFETIME + 1)
+        job.save()
+        self.assertEquals([job], list(SQLReportJob.objects.expired()))
+        # Results are removed with their job
+        path = job.get_results_path()
+        job.delete()
+        self.assertFalse(os.path.exists(path))
+
+    def testCommand(self):
+        job = self.create_job(exclude=u'admin')
+        call_command('run_sql_report_jobs', once=True, verbosity=0)
+        job = SQLReportJob.objects.get(pk=job.pk)
+        self.assertEquals(SQLReportJob.COMPLETE_STATUS, job.status)
+
+    def testViews(self):
+        self.user.set_password('testuser')
+        self.user.save()
+        self.client.login(username='testuser', password='testuser')
+        response = self.client.post(
+            '/sql_reports/%s/execute/' % self.sql_report.pk,
+            {'exclude': 'admin', 'background': '1'})
+        job = SQLReportJob.objects.get()
+        self.assertEquals({u'exclude': u'admin'}, job.get_params())
+        self.assertRedirects(response, job.get_absolute_url())
+
+        response = self.client.get(job.get_absolute_url())
+        self.assertTrue('<meta http-equiv="refresh"' in response.content)
+        self.assertTrue('Queued' in response.content)
+
+        run_sql_report_job(SQLReportJob.objects.claim_next('worker'))
+        response = self.client.get(job.get_absolute_url())
+        self.assertFalse('<meta http-equiv="refresh"' in response.content)
+        self.assertTrue('<td>testmanager</td>' in response.content)
+
+        response = self.client.get('/sql_reports/jobs/')
+        self.assertEquals([job], list(response.context['job_list']))
+
+        response = self.client.get('/sql_reports/jobs/%s/csv/' % job.pk)
+        self.assertEquals([['Username'], ['testuser'], ['testmanager']],
+                          list(csv.reader(response.content.splitlines())))
+
+        # Jobs are only queued by submitting the form
+        sql_report = SQLReport.objects.create(name=u'All Users', access='U',
+            query=u"SELECT username AS 'Username' FROM auth_user")
+        url = '/sql_reports/%s/execute/' % sql_report.pk
+        response = self.client.get(url, {'background': '1'})
+        self.assertEquals('sql_reports/execute_sql_report.html',
+                          response.template[0].name)
+        self.client.post(url, {'background': '1'})
+        self.assertEquals(1, sql_report.jobs.count())
+
+        # Other Users' jobs can't be viewed
+        manager = User.objects.get(username='testmanager')
+        manager.set_password('testmanager')
+        manager.save()
+        self.client.login(username='testmanager', password='testmanager')
+        response = self.client.get(job.get_absolute_url())
+        self.assertEquals('permission_denied.html', response.template[0].name)
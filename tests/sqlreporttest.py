@@ -0,0 +1,361 @@
+import csv
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DatabaseError, connection, connections
+from django.test import TestCase
+
+from djangoffice.models import SQLReport
+from djangoffice.utils.sql_reports import (ExecutionSlots, SQLReportStream,
+    estimate_query, execute_sql_report, execution_slots, result_cache)
+
+# Counts the rows of a cross join of Users with themselves, which takes
+# far longer than any test should.
+ENDLESS_QUERY = "SELECT COUNT(*) AS 'Count' FROM %s" % ', '.join(
+    ['auth_user u%s' % i for i in xrange(20)])
+
+class SQLReportStreamTest(TestCase):
+    """
+    Tests for streaming execution of SQL Reports.
+    """
+    fixtures = ['initial_test_data']
+
+    QUERY = """
+    SELECT username AS 'Username', id AS 'Id'
+    FROM auth_user
+    ORDER BY id"""
+
+    def testFetchInBatches(self):
+        stream = SQLReportStream(self.QUERY, fetch_size=2).execute()
+        self.assertEquals([u'Username', u'Id'], stream.headings)
+        self.assertEquals([(u'admin', 1), (u'testuser', 2),
+                           (u'testmanager', 3)], list(stream))
+        self.assertFalse(stream.truncated)
+
+    def testMaxRows(self):
+        stream = SQLReportStream(self.QUERY, max_rows=2,
+                                 fetch_size=1).execute()
+        self.assertEquals([(u'admin', 1), (u'testuser', 2)], list(stream))
+        self.assertTrue(stream.truncated)
+
+class SQLReportQueryTest(TestCase):
+    """
+    Tests for compiling SQL Report queries for execution with bound
+    parameters.
+    """
+    fixtures = ['initial_test_data']
+
+    def testBoundQuery(self):
+        sql_report = SQLReport(query=u"SELECT * FROM t "
+            u"WHERE d <= '::UpToDate' AND id = ::Id AND n LIKE 'a%' "
+            u"AND d >= '::UpToDate'")
+        self.assertEquals((u"SELECT * FROM t WHERE d <= %s AND id = %s "
+                           u"AND n LIKE 'a%%' AND d >= %s",
+                           [u'2007-07-29', u'1', u'2007-07-29']),
+                          sql_report.get_bound_query({u'UpToDate': u'2007-07-29',
+                                                      u'Id': u'1'}))
+
+    def testEmbeddedPlaceholders(self):
+        sql_report = SQLReport(query=u"SELECT * FROM t "
+            u"WHERE n LIKE '%::Name%' AND o = 'It''s ::Name'")
+        self.assertEquals((u"SELECT * FROM t WHERE n LIKE ('%%' || %s || '%%') "
+                           u"AND o = ('It''s ' || %s)", [u"O'Neil", u"O'Neil"]),
+                          sql_report.get_bound_query({u'Name': u"O'Neil"}))
+        class MySQLConnection:
+            settings_dict = {'ENGINE': 'django.db.backends.mysql'}
+        self.assertEquals((u"SELECT * FROM t WHERE n LIKE CONCAT('%%', %s, '%%') "
+                           u"AND o = CONCAT('It''s ', %s)", [u"O'Neil", u"O'Neil"]),
+                          sql_report.get_bound_query({u'Name': u"O'Neil"},
+                                                     MySQLConnection()))
+
+    def testEmbeddedPlaceholdersExecuted(self):
+        sql_report = SQLReport(query=u"SELECT username FROM auth_user "
+            u"WHERE username LIKE '%::Name%' ORDER BY username")
+        query, params = sql_report.get_bound_query({u'Name': u"user' OR 'a"})
+        cursor = connection.cursor()
+        cursor.execute(query, params)
+        self.assertEquals([], cursor.fetchall())
+        query, params = sql_report.get_bound_query({u'Name': u'user'})
+        cursor.execute(query, params)
+        self.assertEquals([(u'testuser',)], cursor.fetchall())
+
+    def testCompiledOnce(self):
+        sql_report = SQLReport(query=u"SELECT * FROM t WHERE id = ::Id")
+        compiled = sql_report.get_compiled_query()
+        self.assertTrue(compiled is SQLReport(
+            query=sql_report.query).get_compiled_query())
+        sql_report.query += u' ORDER BY id'
+        self.assertFalse(compiled is sql_report.get_compiled_query())
+
+class SQLReportRestrictionTest(TestCase):
+    """
+    Tests for restrictions on SQL Report execution.
+    """
+    fixtures = ['initial_test_data']
+
+    def setUp(self):
+        # A file database, which reports get a connection of their own to
+        self.temp_dir = tempfile.mkdtemp()
+        database = sqlite3.connect(os.path.join(self.temp_dir, 'reports.db'))
+        database.execute('CREATE TABLE report_test (id integer PRIMARY KEY)')
+        database.executemany('INSERT INTO report_test VALUES (?)',
+                             [(i,) for i in xrange(10)])
+        database.commit()
+        database.close()
+        connections.databases['reports'] = dict(connection.settings_dict,
+            NAME=os.path.join(self.temp_dir, 'reports.db'))
+
+    def tearDown(self):
+        connections['reports'].close()
+        del connections.databases['reports']
+        del connections._connections['reports']
+        shutil.rmtree(self.temp_dir)
+
+    def testReadOnly(self):
+        stream = SQLReportStream('SELECT id FROM report_test', using='reports')
+        self.assertEquals(10, len(list(stream.execute())))
+        stream = SQLReportStream('DELETE FROM report_test', using='reports')
+        self.assertRaises(DatabaseError, stream.execute)
+
+    def testTimeout(self):
+        stream = SQLReportStream("SELECT COUNT(*) FROM %s" % ', '.join(
+            ['report_test t%s' % i for i in xrange(20)]), timeout=0.1,
+            using='reports')
+        start = time.time()
+        self.assertRaises(DatabaseError, stream.execute)
+        self.assertTrue(time.time() - start < 5)
+
+    def testSharedConnectionTimeout(self):
+        stream = SQLReportStream(ENDLESS_QUERY, timeout=0.1)
+        self.assertRaises(DatabaseError, stream.execute)
+        # The shared connection's timeout is removed
+        time.sleep(0.2)
+        self.assertEquals(3, User.objects.count())
+
+    def testExecutionSlots(self):
+        slots = ExecutionSlots(self.temp_dir, 2)
+        first = slots.acquire()
+        second = slots.acquire()
+        self.assertFalse(None in (first, second))
+        self.assertEquals(None, slots.acquire())
+        start = time.time()
+        self.assertEquals(None, slots.acquire(0.2))
+        self.assertTrue(time.time() - start >= 0.2)
+        first.release()
+        third = slots.acquire()
+        self.assertNotEquals(None, third)
+        second.release()
+        third.release()
+
+    def testEstimate(self):
+        estimate = estimate_query('SELECT id FROM report_test WHERE id = %s',
+                                  [1], using='reports')
+        self.assertTrue('report_test' in estimate.plan[0])
+        # SQLite doesn't estimate costs
+        self.assertEquals(None, estimate.cost)
+        self.assertEquals(None, estimate.rows)
+
+class ExecuteSQLReportTest(TestCase):
+    """
+    Tests for the execute SQL Report view.
+    """
+    fixtures = ['initial_test_data']
+
+    def setUp(self):
+        user = User.objects.get(username='testuser')
+        user.set_password('testuser')
+        user.save()
+        self.client.login(username='testuser', password='testuser')
+        self.sql_report = SQLReport.objects.create(name=u'Users', access='U',
+            query=u"SELECT username AS 'Username' FROM auth_user "
+                  u"WHERE username <> '::exclude' ORDER BY id")
+        self.url = '/sql_reports/%s/execute/' % self.sql_report.pk
+        self.old_max_rows = settings.SQL_REPORT_MAX_ROWS
+        self.old_queue_timeout = settings.SQL_REPORT_QUEUE_TIMEOUT
+        self.old_lock_dir = execution_slots.directory
+        execution_slots.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        settings.SQL_REPORT_MAX_ROWS = self.old_max_rows
+        settings.SQL_REPORT_QUEUE_TIMEOUT = self.old_queue_timeout
+        shutil.rmtree(execution_slots.directory)
+        execution_slots.directory = self.old_lock_dir
+
+    def testHTML(self):
+        # Streamed content can only be read once
+        response = self.client.post(self.url, {'exclude': 'admin'})
+        content = response.content
+        self.assertEquals(200, response.status_code)
+        self.assertTrue('<th scope="col">Username</th>' in content)
+        self.assertTrue('<tr class="odd"><td>testuser</td></tr>\n'
+                        '<tr class="even"><td>testmanager</td></tr>' in content)
+        self.assertTrue('?exclude=admin&amp;format=csv' in content)
+
+        # Parameter values are bound, not interpolated
+        content = self.client.post(self.url,
+                                   {'exclude': "' OR '1'='1"}).content
+        self.assertTrue('<td>admin</td>' in content)
+
+        settings.SQL_REPORT_MAX_ROWS = 1
+        content = self.client.post(self.url, {'exclude': 'admin'}).content
+        self.assertFalse('testmanager' in content)
+        self.assertTrue('Only the first 1 rows are displayed.' in content)
+
+    def testCSV(self):
+        response = self.client.get(self.url, {'exclude': 'admin',
+                                              'format': 'csv'})
+        self.assertEquals('text/csv', response['Content-Type'])
+        self.assertEquals([['Username'], ['testuser'], ['testmanager']],
+                          list(csv.reader(response.content.splitlines())))
+
+    def testEstimate(self):
+        response = self.client.post(self.url, {'exclude': 'admin',
+                                               'estimate': '1'})
+        self.assertEquals('sql_reports/estimate_sql_report.html',
+                          response.template[0].name)
+        self.assertTrue('Query Plan' in response.content)
+        # Plans aren't available for in-memory SQLite databases
+        self.assertTrue('Not available' in response.content)
+        self.assertTrue('href="?exclude=admin"' in response.content)
+
+    def testBusy(self):
+        settings.SQL_REPORT_QUEUE_TIMEOUT = 0
+        slots = [execution_slots.acquire() \
+                 for i in xrange(execution_slots.count)]
+        try:
+            response = self.client.post(self.url, {'exclude': 'admin'})
+            self.assertTrue('Too many SQL Reports are being executed'
+                            in response.content)
+        finally:
+            for slot in slots:
+                slot.release()
+        # Slots are released once results have been streamed
+        for i in xrange(execution_slots.count + 1):
+            content = self.client.post(self.url, {'exclude': 'admin'}).content
+            self.assertTrue('testmanager' in content)
+
+    def testTimeout(self):
+        sql_report = SQLReport.objects.create(name=u'Endless', access='U',
+            query=ENDLESS_QUERY, timeout=1)
+        response = self.client.get('/sql_reports/%s/execute/' % sql_report.pk)
+        self.assertTrue('The SQL Report could not be executed: interrupted'
+                        in response.content)
+
+class SQLReportResultCacheTest(TestCase):
+    """
+    Tests for caching of SQL Report results.
+    """
+    fixtures = ['initial_test_data']
+
+    def setUp(self):
+        self.old_directory = result_cache.directory
+        result_cache.directory = tempfile.mkdtemp()
+        self.old_lock_dir = execution_slots.directory
+        execution_slots.directory = tempfile.mkdtemp()
+        self.sql_report = SQLReport.objects.create(name=u'Users', access='U',
+            query=u"SELECT username AS 'Username' FROM auth_user "
+                  u"WHERE username <> '::exclude' ORDER BY id",
+            cache_results=True)
+
+    def tearDown(self):
+        shutil.rmtree(result_cache.directory)
+        result_cache.directory = self.old_directory
+        shutil.rmtree(execution_slots.directory)
+        execution_slots.directory = self.old_lock_dir
+
+    def execute(self, role='U', refresh=False, **params):
+        params = params or {'exclude': 'admin'}
+        stream = execute_sql_report(self.sql_report, params, role, refresh)
+        return stream, list(stream)
+
+    def cached_files(self):
+        return len(os.listdir(result_cache.directory))
+
+    def assertCacheUse(self, hits, misses):
+        sql_report = SQLReport.objects.get(pk=self.sql_report.pk)
+        self.assertEquals((hits, misses),
+                          (sql_report.cache_hits, sql_report.cache_misses))
+
+    def testHitsAndMisses(self):
+        stream, rows = self.execute()
+        self.assertTrue(isinstance(stream, SQLReportStream))
+        self.assertEquals(1, self.cached_files())
+
+        cached, cached_rows = self.execute()
+        self.assertFalse(isinstance(cached, SQLReportStream))
+        self.assertEquals(stream.headings, cached.headings)
+        self.assertEquals(rows, cached_rows)
+        self.assertEquals(2, cached.row_count)
+        self.assertCacheUse(1, 1)
+
+        # Results are cached per parameters and role
+        self.execute(exclude='testuser')
+        self.execute(role='M')
+        self.assertCacheUse(1, 3)
+        self.assertEquals(3, self.cached_files())
+
+        # Refreshing replaces cached results without counting a lookup
+        stream, rows = self.execute(refresh=True)
+        self.assertTrue(isinstance(stream, SQLReportStream))
+        self.assertCacheUse(1, 3)
+        self.assertEquals(3, self.cached_files())
+
+    def testTruncatedResults(self):
+        old_max_rows = settings.SQL_REPORT_MAX_ROWS
+        settings.SQL_REPORT_MAX_ROWS = 1
+        try:
+            self.execute()
+            cached, rows = self.execute()
+        finally:
+            settings.SQL_REPORT_MAX_ROWS = old_max_rows
+        self.assertEquals([(u'testuser',)], rows)
+        self.assertTrue(cached.truncated)
+        self.assertEquals(1, cached.max_rows)
+
+    def testIncompleteResultsNotCached(self):
+        stream = execute_sql_report(self.sql_report, {'exclude': 'admin'}, 'U')
+        iterator = iter(stream)
+        iterator.next()
+        iterator.close()
+        self.assertEquals(0, self.cached_files())
+
+    def testExpiry(self):
+        self.sql_report.cache_ttl = 0
+        self.execute()
+        stream, rows = self.execute()
+        self.assertTrue(isinstance(stream, SQLReportStream))
+        self.assertCacheUse(0, 2)
+
+    def testInvalidatedOnChange(self):
+        self.execute()
+        self.sql_report.query += u' DESC'
+        self.sql_report.save()
+        self.assertEquals(0, self.cached_files())
+
+    def testView(self):
+        user = User.objects.get(username='testuser')
+        user.set_password('testuser')
+        user.save()
+        self.client.login(username='testuser', password='testuser')
+        url = '/sql_reports/%s/execute/' % self.sql_report.pk
+        content = self.client.get(url, {'exclude': 'admin'}).content
+        self.assertFalse('Refresh now' in content)
+        content = self.client.get(url, {'exclude': 'admin'}).content
+        self.assertTrue('testmanager' in content)
+        self.assertTrue('?exclude=admin&amp;refresh=1">Refresh now' in content)
+        content = self.client.get(url, {'exclude': 'admin',
+                                        'refresh': '1'}).content
+        self.assertFalse('Refresh now' in content)
+        self.assertCacheUse(1, 1)
+
+    def testNotCachedUnlessEnabled(self):
+        self.sql_report.cache_results = False
+        self.execute()
+        self.execute()
+        self.assertEquals(0, self.cached_files())
+        self.assertCacheUse(0, 0)
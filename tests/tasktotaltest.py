@@ -0,0 +1,192 @@
+import datetime
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db.models import signals
+from django.test import TestCase
+
+from djangoffice.models import (BulkApproval, Task, TaskTotal, TaskType,
+    TimeEntry, Timesheet, UserRate)
+from timesheettest import create_entry, create_job
+
+class TaskTotalTest(TestCase):
+    """
+    Tests for maintenance of booked hours totals for Tasks.
+    """
+    fixtures = ['initial_test_data']
+
+    def setUp(self):
+        self.user = User.objects.get(username='testuser')
+        self.approver = User.objects.get(username='testmanager')
+        job = create_job(u'Test Job')
+        self.task = Task.objects.create(job=job,
+            task_type=TaskType.objects.create(name=u'Design'),
+            estimate_hours=Decimal(40))
+        self.other_task = Task.objects.create(job=job,
+            task_type=TaskType.objects.create(name=u'Build'),
+            estimate_hours=Decimal(40))
+        self.timesheet = Timesheet.objects.create(user=self.user,
+            week_commencing=datetime.date(2007, 7, 23))
+        UserRate.objects.create(user=self.user,
+            effective_from=datetime.date(2007, 1, 1),
+            standard_rate=Decimal('10.00'), overtime_rate=Decimal('15.00'))
+
+    def create_entry(self, task, timesheet=None, **hours):
+        return create_entry(timesheet or self.timesheet, task, **hours)
+
+    def totals(self, task):
+        total = TaskTotal.objects.get(task=task)
+        return (total.hours, total.approved)
+
+    def cost(self, task):
+        return TaskTotal.objects.get(task=task).cost
+
+    def testSaveAndDelete(self):
+        entry = self.create_entry(self.task, mon=Decimal('7.5'),
+                                  overtime=Decimal(2))
+        self.assertEquals((Decimal('9.5'), Decimal(0)), self.totals(self.task))
+
+        entry.tue = Decimal(3)
+        entry.save()
+        self.assertEquals((Decimal('12.5'), Decimal(0)), self.totals(self.task))
+
+        # Moving an entry to another Task moves its hours
+        entry.task = self.other_task
+        entry.save()
+        self.assertEquals((Decimal(0), Decimal(0)), self.totals(self.task))
+        self.assertEquals((Decimal('12.5'), Decimal(0)),
+                          self.totals(self.other_task))
+
+        entry.delete()
+        self.assertEquals((Decimal(0), Decimal(0)),
+                          self.totals(self.other_task))
+
+    def testDeletedWithTimesheet(self):
+        self.create_entry(self.task, mon=Decimal(4))
+        self.timesheet.delete()
+        self.assertEquals((Decimal(0), Decimal(0)), self.totals(self.task))
+
+    def testDeletedWithTask(self):
+        entry = self.create_entry(self.task, mon=Decimal(4))
+        # The Task's totals may be deleted before its Time Entries
+        TaskTotal.objects.filter(task=self.task).delete()
+        entry.delete()
+        self.assertEquals(0, TaskTotal.objects.filter(task=self.task).count())
+
+        task_id = self.other_task.pk
+        self.create_entry(self.other_task, mon=Decimal(4))
+        self.other_task.delete()
+        self.assertEquals(0, TaskTotal.objects.filter(task=task_id).count())
+
+    def testTotalsCreatedConcurrently(self):
+        def created_concurrently(sender, instance, **kwargs):
+            signals.pre_save.disconnect(created_concurrently, sender=TaskTotal)
+            TaskTotal.objects.create(task_id=instance.task_id,
+                                     hours=Decimal(2))
+        signals.pre_save.connect(created_concurrently, sender=TaskTotal)
+        try:
+            self.create_entry(self.task, mon=Decimal(4))
+        finally:
+            signals.pre_save.disconnect(created_concurrently, sender=TaskTotal)
+        self.assertEquals((Decimal(6), Decimal(0)), self.totals(self.task))
+
+    def testApproval(self):
+        entry = self.create_entry(self.task, mon=Decimal(4))
+        self.create_entry(self.other_task, wed=Decimal(2))
+        self.assertEquals((2, 0), self.timesheet.approve(self.approver))
+        self.assertEquals((Decimal(4), Decimal(4)), self.totals(self.task))
+        self.assertEquals((Decimal(2), Decimal(2)),
+                          self.totals(self.other_task))
+
+        # Unapproving
+        entry = TimeEntry.objects.get(pk=entry.pk)
+        entry.approved_by = None
+        entry.save()
+        self.assertEquals((Decimal(4), Decimal(0)), self.totals(self.task))
+
+    def testBulkApproval(self):
+        self.create_entry(self.task, mon=Decimal(4))
+        later = Timesheet.objects.create(user=self.user,
+            week_commencing=datetime.date(2007, 8, 6))
+        self.create_entry(self.task, later, fri=Decimal(6))
+        bulk_approval = BulkApproval.objects.create(approved_by=self.approver,
+            start_date=datetime.date(2007, 7, 23),
+            end_date=datetime.date(2007, 7, 29))
+        bulk_approval.run()
+        self.assertEquals(1, bulk_approval.time_entries)
+        self.assertEquals((Decimal(10), Decimal(4)), self.totals(self.task))
+
+    def testHoursBookedForTasks(self):
+        self.create_entry(self.task, mon=Decimal(4))
+        self.assertEquals({self.task.pk: Decimal(4),
+                           self.other_task.pk: Decimal(0)},
+            TimeEntry.objects.hours_booked_for_tasks([self.task.pk,
+                                                      self.other_task.pk]))
+
+    def testRebuildAndVerify(self):
+        self.create_entry(self.task, mon=Decimal(4))
+        self.assertEquals([], TaskTotal.objects.verify())
+        TaskTotal.objects.filter(task=self.task).update(hours=Decimal(1))
+        self.assertEquals([(self.task.pk,
+            (Decimal('1.00'), Decimal('0.00'), Decimal('40.00')),
+            (Decimal('4.00'), Decimal('0.00'), Decimal('40.00')))],
+            TaskTotal.objects.verify())
+        TaskTotal.objects.rebuild()
+        self.assertEquals([], TaskTotal.objects.verify())
+        self.assertEquals((Decimal(4), Decimal(0)), self.totals(self.task))
+
+    def testCost(self):
+        entry = self.create_entry(self.task, mon=Decimal('7.5'),
+                                  overtime=Decimal(2))
+        self.assertEquals(Decimal('105.00'), self.cost(self.task))
+
+        entry.mon = Decimal(1)
+        entry.save()
+        self.assertEquals(Decimal('40.00'), self.cost(self.task))
+
+        entry.task = self.other_task
+        entry.save()
+        self.assertEquals(Decimal(0), self.cost(self.task))
+        self.assertEquals(Decimal('40.00'), self.cost(self.other_task))
+
+        entry.delete()
+        self.assertEquals(Decimal(0), self.cost(self.other_task))
+
+    def testCostUpdatedWhenRatesChange(self):
+        self.create_entry(self.task, mon=Decimal(4), fri=Decimal(2),
+                          overtime=Decimal(1))
+        self.assertEquals(Decimal('75.00'), self.cost(self.task))
+
+        # A rate taking effect part way through the week
+        rate = UserRate.objects.create(user=self.user,
+            effective_from=datetime.date(2007, 7, 25),
+            standard_rate=Decimal('20.00'), overtime_rate=Decimal('30.00'))
+        self.assertEquals(Decimal('95.00'), self.cost(self.task))
+
+        rate.effective_from = datetime.date(2007, 7, 23)
+        rate.save()
+        self.assertEquals(Decimal('150.00'), self.cost(self.task))
+
+        rate.delete()
+        self.assertEquals(Decimal('75.00'), self.cost(self.task))
+        self.assertEquals([], TaskTotal.objects.verify())
+
+    def testCostUpdatedWhenRateMovedLater(self):
+        self.create_entry(self.task, mon=Decimal(4), fri=Decimal(2),
+                          overtime=Decimal(1))
+        rate = UserRate.objects.create(user=self.user,
+            effective_from=datetime.date(2007, 7, 23),
+            standard_rate=Decimal('20.00'), overtime_rate=Decimal('30.00'))
+        self.assertEquals(Decimal('150.00'), self.cost(self.task))
+
+        rate.effective_from = datetime.date(2007, 9, 3)
+        rate.save()
+        self.assertEquals(Decimal('75.00'), self.cost(self.task))
+        self.assertEquals([], TaskTotal.objects.verify())
+
+    def testRatesForOtherUsersIgnored(self):
+        self.create_entry(self.task, mon=Decimal(4))
+        UserRate.objects.create(user=self.approver,
+            effective_from=datetime.date(2007, 1, 1),
+            standard_rate=Decimal('50.00'), overtime_rate=Decimal('50.00'))
+        self.assertEquals(Decimal('40.00'), self.cost(self.task))
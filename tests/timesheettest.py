@@ -0,0 +1,95 @@
+import datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+
+from djangoffice.models import (Expense, ExpenseType, Job, Task, TaskType,
+    TimeEntry, Timesheet)
+
+WEEK_COMMENCING = datetime.date(2007, 7, 23)
+
+def create_job(name, **kwargs):
+    """
+    Creates a Job for the test fixture's Client, Contact and Manager.
+    """
+    fields = dict(client_id=1, name=name, status=Job.LIVE_STATUS,
+                  director_id=3, project_manager_id=3, architect_id=3,
+                  primary_contact_id=1, billing_contact_id=1,
+                  fee_currency=Job.GBP_CURRENCY)
+    fields.update(kwargs)
+    return Job.objects.create(**fields)
+
+def create_entry(timesheet, task, **kwargs):
+    """
+    Creates a Time Entry against the given Task on the given Timesheet,
+    for its User and week.
+    """
+    return TimeEntry.objects.create(timesheet=timesheet,
+        user_id=timesheet.user_id, task=task,
+        week_commencing=timesheet.week_commencing, **kwargs)
+
+class QueryCountMixin:
+    """
+    Counts the queries executed while performing a request.
+    """
+    def get_with_query_count(self, url):
+        old_debug = settings.DEBUG
+        settings.DEBUG = True
+        connection.queries = []
+        try:
+            response = self.client.get(url)
+            return response, len(connection.queries)
+        finally:
+            settings.DEBUG = old_debug
+
+class EditTimesheetTest(QueryCountMixin, TestCase):
+    """
+    Tests for the edit Timesheet view.
+    """
+    fixtures = ['initial_test_data']
+
+    # Queries allowed for a full page load, including session and
+    # authentication lookups.
+    QUERY_BUDGET = 9
+
+    def setUp(self):
+        self.user = User.objects.get(username='testuser')
+        self.user.set_password('testuser')
+        self.user.save()
+        self.client.login(username='testuser', password='testuser')
+        self.timesheet = Timesheet.objects.create(user=self.user,
+            week_commencing=WEEK_COMMENCING)
+        self.expense_type = ExpenseType.objects.create(name=u'Travel')
+        self.url = self.timesheet.get_absolute_url()
+
+    def add_rows(self, count):
+        start = Job.objects.count()
+        for i in xrange(start, start + count):
+            job = create_job(u'Job %s' % i)
+            task = Task.objects.create(job=job,
+                task_type=TaskType.objects.create(name=u'Task Type %s' % i),
+                estimate_hours=Decimal(40))
+            task.assigned_users.add(self.user)
+            create_entry(self.timesheet, task, mon=Decimal(7))
+            Expense.objects.create(timesheet=self.timesheet, user=self.user,
+                job=job, type=self.expense_type, date=WEEK_COMMENCING,
+                amount=Decimal('12.50'))
+
+    def testQueryBudget(self):
+        self.add_rows(1)
+        response, queries = self.get_with_query_count(self.url)
+        self.assertEquals(200, response.status_code)
+        self.assertTrue(queries <= self.QUERY_BUDGET,
+            u'Editing a Timesheet took %s queries' % queries)
+
+    def testQueryCountIndependentOfContents(self):
+        self.add_rows(1)
+        response, single_row_queries = self.get_with_query_count(self.url)
+        self.add_rows(5)
+        response, many_row_queries = self.get_with_query_count(self.url)
+        self.assertEquals(200, response.status_code)
+        self.assertEquals(6, len(response.context['time_entries']))
+        self.assertEquals(single_row_queries, many_row_queries)
@@ -0,0 +1,172 @@
+import datetime
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.db.models import signals
+from django.test import TestCase
+
+from djangoffice.models import (Task, TaskType, Timesheet, Vacation,
+    VacationBalance)
+from timesheettest import QueryCountMixin, create_entry, create_job
+
+class VacationBalanceTest(TestCase):
+    """
+    Tests for maintenance of leave taken by Users each year.
+    """
+    fixtures = ['initial_test_data']
+
+    def setUp(self):
+        self.user = User.objects.get(username='testuser')
+        # The fixture's Administration Job has a Vacation Task
+        self.vacation_task = Task.objects.get(task_type__name=u'Vacation')
+        self.other_task = Task.objects.create(job=create_job(u'Test Job'),
+            task_type=TaskType.objects.create(name=u'Design'),
+            estimate_hours=Decimal(40))
+        self.old_vacation_task_id = Task.options.vacation_task_id
+        Task.options.vacation_task_id = self.vacation_task.pk
+        self.timesheet = Timesheet.objects.create(user=self.user,
+            week_commencing=datetime.date(2007, 7, 23))
+
+    def tearDown(self):
+        Task.options.vacation_task_id = self.old_vacation_task_id
+
+    def create_entry(self, task, timesheet=None, **hours):
+        return create_entry(timesheet or self.timesheet, task, **hours)
+
+    def taken(self, year):
+        try:
+            return VacationBalance.objects.get(user=self.user, year=year).taken
+        except VacationBalance.DoesNotExist:
+            return Decimal(0)
+
+    def testSaveAndDelete(self):
+        entry = self.create_entry(self.vacation_task, mon=Decimal('7.5'),
+                                  overtime=Decimal(2))
+        # Overtime isn't leave
+        self.assertEquals(Decimal('7.5'), self.taken(2007))
+
+        entry.tue = Decimal('7.5')
+        entry.save()
+        self.assertEquals(Decimal(15), self.taken(2007))
+
+        # Moving an entry to another Task removes its leave
+        entry.task = self.other_task
+        entry.save()
+        self.assertEquals(Decimal(0), self.taken(2007))
+
+        entry.task = self.vacation_task
+        entry.save()
+        entry.delete()
+        self.assertEquals(Decimal(0), self.taken(2007))
+
+    def testDeletedWithTimesheet(self):
+        self.create_entry(self.vacation_task, mon=Decimal(8))
+        self.timesheet.delete()
+        self.assertEquals(Decimal(0), self.taken(2007))
+
+    def testDeletedWithUser(self):
+        entry = self.create_entry(self.vacation_task, mon=Decimal(8))
+        # The User's balances may be deleted before their Time Entries
+        VacationBalance.objects.filter(user=self.user).delete()
+        entry.delete()
+        self.assertEquals(0,
+            VacationBalance.objects.filter(user=self.user).count())
+
+        user_id = self.user.pk
+        self.create_entry(self.vacation_task, mon=Decimal(8))
+        self.user.delete()
+        self.assertEquals(0, VacationBalance.objects.filter(user=user_id).count())
+
+    def testBalanceCreatedConcurrently(self):
+        def created_concurrently(sender, instance, **kwargs):
+            signals.pre_save.disconnect(created_concurrently,
+                                        sender=VacationBalance)
+            VacationBalance.objects.create(user=self.user, year=instance.year,
+                                           taken=Decimal(15))
+        signals.pre_save.connect(created_concurrently, sender=VacationBalance)
+        try:
+            self.create_entry(self.vacation_task, mon=Decimal('7.5'))
+        finally:
+            signals.pre_save.disconnect(created_concurrently,
+                                        sender=VacationBalance)
+        self.assertEquals(Decimal('22.5'), self.taken(2007))
+
+    def testWeekSpanningYears(self):
+        timesheet = Timesheet.objects.create(user=self.user,
+            week_commencing=datetime.date(2007, 12, 31))
+        self.create_entry(self.vacation_task, timesheet, mon=Decimal(8),
+                          tue=Decimal(8), wed=Decimal(4))
+        self.assertEquals(Decimal(8), self.taken(2007))
+        self.assertEquals(Decimal(12), self.taken(2008))
+
+    def testRebuildAndVerify(self):
+        self.create_entry(self.vacation_task, mon=Decimal(8))
+        self.create_entry(self.other_task, tue=Decimal(8))
+        self.assertEquals([], VacationBalance.objects.verify())
+
+        VacationBalance.objects.filter(user=self.user).update(taken=Decimal(1))
+        self.assertEquals([(self.user.pk, 2007, Decimal(1), Decimal(8))],
+                          VacationBalance.objects.verify())
+        self.assertEquals(1, VacationBalance.objects.rebuild())
+        self.assertEquals([], VacationBalance.objects.verify())
+        self.assertEquals(Decimal(8), self.taken(2007))
+
+class AnnualLeaveReportTest(QueryCountMixin, TestCase):
+    """
+    Tests for the Annual Leave report and leave on the User detail page.
+    """
+    fixtures = ['initial_test_data']
+
+    def setUp(self):
+        self.user = User.objects.get(username='testuser')
+        self.manager = User.objects.get(username='testmanager')
+        self.manager.set_password('testmanager')
+        self.manager.save()
+        self.client.login(username='testmanager', password='testmanager')
+        self.vacation_task = Task.objects.get(task_type__name=u'Vacation')
+        self.old_vacation_task_id = Task.options.vacation_task_id
+        Task.options.vacation_task_id = self.vacation_task.pk
+        Vacation.objects.create(user=self.user, year=2007,
+            entitlement=Decimal('187.50'), carry_over=Decimal('7.50'))
+        timesheet = Timesheet.objects.create(user=self.user,
+            week_commencing=datetime.date(2007, 7, 23))
+        create_entry(timesheet, self.vacation_task, mon=Decimal('7.50'),
+                     tue=Decimal('7.50'))
+        self.url = '%s?year=2007' % reverse('annual_leave_report')
+
+    def tearDown(self):
+        Task.options.vacation_task_id = self.old_vacation_task_id
+
+    def testReport(self):
+        response = self.client.get(self.url)
+        self.assertEquals(200, response.status_code)
+        users = dict([(u.username, u) for u in response.context['users']])
+        leave = users['testuser']
+        self.assertEquals((Decimal('187.50'), Decimal('7.50'), Decimal(15),
+                           Decimal(180)),
+                          (leave.entitlement, leave.carry_over, leave.taken,
+                           leave.remaining))
+        leave = users['testmanager']
+        self.assertEquals((Decimal(0), Decimal(0)),
+                          (leave.taken, leave.remaining))
+
+    def testQueryCountIndependentOfUserCount(self):
+        # Settings are cached once they've been loaded
+        self.client.get(self.url)
+        response, few_user_queries = self.get_with_query_count(self.url)
+        for i in xrange(5):
+            user = User.objects.create(username='user%s' % i)
+            Vacation.objects.create(user=user, year=2007,
+                                    entitlement=Decimal(150))
+        response, many_user_queries = self.get_with_query_count(self.url)
+        self.assertEquals(200, response.status_code)
+        self.assertEquals(few_user_queries, many_user_queries)
+
+    def testUserDetail(self):
+        response = self.client.get(reverse('user_detail',
+                                           args=[self.user.username]))
+        self.assertEquals(200, response.status_code)
+        leave = response.context['leave']
+        self.assertEquals([2007], [year.year for year in leave])
+        self.assertEquals(Decimal(180), leave[0].remaining)